@@ -0,0 +1,231 @@
+"""
+Конвертация аудио в памяти v1.0
+Голосовые сообщения декодируются без временных файлов и без блокировки event loop
+
+- ffmpeg запускается асинхронно (asyncio.create_subprocess_exec), OGG/Opus
+  подаётся в stdin, PCM читается из stdout - на диск ничего не пишется
+- Пул конвертаций: не больше AUDIO_CONVERT_CONCURRENCY процессов ffmpeg
+  одновременно, остальные ждут в очереди (время ожидания в статистике)
+- Потоковое декодирование (iter_pcm): PCM отдаётся кусками по мере декодирования,
+  распознавание может начинаться до конца файла
+- Процесс, не уложившийся в AUDIO_CONVERT_TIMEOUT, завершается (kill)
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# Сколько ffmpeg процессов одновременно (по умолчанию - число ядер)
+AUDIO_CONVERT_CONCURRENCY = int(os.getenv("AUDIO_CONVERT_CONCURRENCY", str(os.cpu_count() or 2)))
+
+# Таймаут одной конвертации (секунды)
+AUDIO_CONVERT_TIMEOUT = float(os.getenv("AUDIO_CONVERT_TIMEOUT", "30"))
+
+# Формат PCM для распознавания: 16 кГц, моно, 16 бит
+PCM_SAMPLE_RATE = 16000
+PCM_SAMPLE_WIDTH = 2
+
+# Размер куска при потоковом чтении stdout (0.25 с PCM)
+PCM_CHUNK_BYTES = PCM_SAMPLE_RATE * PCM_SAMPLE_WIDTH // 4
+
+FFMPEG_AVAILABLE = shutil.which(FFMPEG_BINARY) is not None
+
+
+class AudioConversionError(Exception):
+    """ffmpeg не запустился, завершился с ошибкой или по таймауту"""
+
+
+def pcm_args(sample_rate: int = PCM_SAMPLE_RATE) -> List[str]:
+    """Аргументы ffmpeg: любой вход из stdin -> s16le моно в stdout"""
+    return [
+        "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1"
+    ]
+
+
+def pcm_duration(pcm: bytes, sample_rate: int = PCM_SAMPLE_RATE) -> float:
+    """Длительность PCM s16le моно (секунды)"""
+    return len(pcm) / (sample_rate * PCM_SAMPLE_WIDTH)
+
+
+class AudioConverter:
+    """Пул асинхронных процессов ffmpeg с вводом и выводом через pipe"""
+
+    def __init__(
+        self,
+        concurrency: int = AUDIO_CONVERT_CONCURRENCY,
+        timeout: float = AUDIO_CONVERT_TIMEOUT,
+        command: Sequence[str] = (FFMPEG_BINARY,)
+    ):
+        """
+        Args:
+            concurrency: Максимум одновременно работающих процессов
+            timeout: Таймаут одной конвертации (секунды)
+            command: Команда запуска ffmpeg (аргументы конвертации добавляются в конец)
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.command = list(command)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._durations_ms: deque = deque(maxlen=500)
+        self._waits_ms: deque = deque(maxlen=500)
+        self.active = 0
+        self.stats = {"conversions": 0, "failures": 0, "timeouts": 0, "max_active": 0,
+                      "bytes_in": 0, "bytes_out": 0}
+
+    async def _spawn(self, args: Sequence[str]) -> asyncio.subprocess.Process:
+        try:
+            return await asyncio.create_subprocess_exec(
+                *self.command, *args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError as e:
+            raise AudioConversionError("ffmpeg не установлен") from e
+
+    async def _acquire(self):
+        queued_at = time.perf_counter()
+        await self._semaphore.acquire()
+        self._waits_ms.append((time.perf_counter() - queued_at) * 1000)
+        self.active += 1
+        self.stats["max_active"] = max(self.stats["max_active"], self.active)
+
+    def _release(self, started: float, ok: bool):
+        self.active -= 1
+        self._semaphore.release()
+        if ok:
+            self.stats["conversions"] += 1
+            self._durations_ms.append((time.perf_counter() - started) * 1000)
+        else:
+            self.stats["failures"] += 1
+
+    @staticmethod
+    async def _kill(process: asyncio.subprocess.Process):
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    async def convert(self, data: bytes, args: Sequence[str]) -> bytes:
+        """Прогнать данные через ffmpeg целиком (stdin -> stdout)"""
+        await self._acquire()
+        started = time.perf_counter()
+        ok = False
+        process = None
+        try:
+            process = await self._spawn(args)
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(data), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise AudioConversionError(f"ffmpeg не уложился в {self.timeout:g} с")
+            if process.returncode != 0:
+                raise AudioConversionError(stderr.decode("utf-8", "replace").strip()[-300:] or
+                                           f"ffmpeg код {process.returncode}")
+            self.stats["bytes_in"] += len(data)
+            self.stats["bytes_out"] += len(stdout)
+            ok = True
+            return stdout
+        finally:
+            if process is not None:
+                await self._kill(process)
+            self._release(started, ok)
+
+    async def ogg_to_pcm(self, data: bytes, sample_rate: int = PCM_SAMPLE_RATE) -> bytes:
+        """OGG/Opus (или любой формат ffmpeg) -> PCM s16le моно"""
+        return await self.convert(data, pcm_args(sample_rate))
+
+    async def iter_pcm(
+        self,
+        data: bytes,
+        sample_rate: int = PCM_SAMPLE_RATE,
+        chunk_bytes: int = PCM_CHUNK_BYTES
+    ) -> AsyncIterator[bytes]:
+        """
+        Потоковое декодирование: PCM кусками по мере готовности
+
+        Вход пишется в stdin отдельной задачей, чтобы запись большого файла
+        и чтение результата не блокировали друг друга.
+        """
+        await self._acquire()
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        ok = False
+        process = None
+        writer = None
+        produced = 0
+        try:
+            process = await self._spawn(pcm_args(sample_rate))
+
+            async def feed():
+                try:
+                    process.stdin.write(data)
+                    await process.stdin.drain()
+                finally:
+                    process.stdin.close()
+
+            writer = asyncio.create_task(feed())
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["timeouts"] += 1
+                    raise AudioConversionError(f"ffmpeg не уложился в {self.timeout:g} с")
+                try:
+                    chunk = await asyncio.wait_for(process.stdout.read(chunk_bytes), remaining)
+                except asyncio.TimeoutError:
+                    self.stats["timeouts"] += 1
+                    raise AudioConversionError(f"ffmpeg не уложился в {self.timeout:g} с")
+                if not chunk:
+                    break
+                produced += len(chunk)
+                yield chunk
+
+            await writer
+            stderr = await process.stderr.read()
+            if await process.wait() != 0:
+                raise AudioConversionError(stderr.decode("utf-8", "replace").strip()[-300:] or
+                                           f"ffmpeg код {process.returncode}")
+            self.stats["bytes_in"] += len(data)
+            self.stats["bytes_out"] += produced
+            ok = True
+        finally:
+            if writer is not None and not writer.done():
+                writer.cancel()
+            if process is not None:
+                await self._kill(process)
+            self._release(started, ok)
+
+    def get_stats(self) -> dict:
+        durations = sorted(self._durations_ms)
+        waits = sorted(self._waits_ms)
+        return {
+            **self.stats,
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "avg_ms": round(sum(durations) / len(durations), 1) if durations else 0.0,
+            "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 1) if durations else 0.0,
+            "avg_wait_ms": round(sum(waits) / len(waits), 1) if waits else 0.0
+        }
+
+
+_converter: Optional[AudioConverter] = None
+
+
+def get_audio_converter() -> AudioConverter:
+    """Общий пул конвертаций"""
+    global _converter
+    if _converter is None:
+        _converter = AudioConverter()
+    return _converter
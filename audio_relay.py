@@ -0,0 +1,389 @@
+"""
+Передача аудио между клиентом и Gemini Live API v1.0
+Общий путь для websocket_proxy.py и backend/server.py
+
+- Клиент <-> прокси: аудио бинарными кадрами WebSocket (PCM s16le),
+  без base64 и JSON
+- Прокси -> Gemini: протокол требует base64 в JSON. Кадры клиента
+  накапливаются в заранее выделенном буфере (RELAY_BATCH_MS) и кодируются
+  одним вызовом binascii прямо из буфера; JSON собирается из готовых
+  префикса и суффикса без json.dumps
+- Gemini -> клиент: base64 декодируется один раз, PCM идёт через буфер
+  джиттера: предзаполнение RELAY_PREBUFFER_MS, кадры одинакового размера
+  RELAY_FRAME_MS, отправка не больше чем на RELAY_LEAD_MS впереди реального
+  времени. Служебные сообщения (turn_complete) уходят после своего аудио,
+  при прерывании неотправленное аудио сбрасывается
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import binascii
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Формат аудио Live API: от клиента 16 кГц, от Gemini 24 кГц (PCM s16le моно)
+INPUT_SAMPLE_RATE = 16000
+OUTPUT_SAMPLE_RATE = 24000
+SAMPLE_WIDTH = 2
+
+# Сколько аудио клиента накапливать перед отправкой в Gemini (мс)
+RELAY_BATCH_MS = int(os.getenv("RELAY_BATCH_MS", "100"))
+
+# Размер кадра к клиенту, предзаполнение и опережение реального времени (мс)
+RELAY_FRAME_MS = int(os.getenv("RELAY_FRAME_MS", "40"))
+RELAY_PREBUFFER_MS = int(os.getenv("RELAY_PREBUFFER_MS", "120"))
+RELAY_LEAD_MS = int(os.getenv("RELAY_LEAD_MS", "300"))
+
+# Сообщение realtime_input без данных: {"realtime_input": {"media_chunks": [...]}}
+REALTIME_PREFIX = '{"realtime_input":{"media_chunks":[{"mime_type":"audio/pcm","data":"'
+REALTIME_SUFFIX = '"}]}}'
+
+# Аудио или служебное сообщение (уже сериализованный JSON) для клиента
+ClientItem = Union[bytes, str]
+
+
+def ms_to_bytes(ms: float, sample_rate: int) -> int:
+    """Длительность -> байты PCM s16le моно (кратно сэмплу)"""
+    return int(sample_rate * ms / 1000) * SAMPLE_WIDTH
+
+
+class RelayStats:
+    """Счётчики всех сессий процесса"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.active = 0
+
+    def get_stats(self) -> dict:
+        c = self.counters
+        return {
+            "active_sessions": self.active,
+            **dict(c),
+            "avg_batch_bytes": round(c["bytes_up"] / c["batches_up"]) if c["batches_up"] else 0,
+        }
+
+
+RELAY_STATS = RelayStats()
+
+
+# ========================================
+# КЛИЕНТ -> GEMINI
+# ========================================
+
+class UplinkBatcher:
+    """Кадры клиента -> realtime_input пачками по RELAY_BATCH_MS"""
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[Any]],
+        batch_ms: int = RELAY_BATCH_MS,
+        sample_rate: int = INPUT_SAMPLE_RATE
+    ):
+        """
+        Args:
+            send: Отправка текстового сообщения в Gemini
+            batch_ms: Аудио в одной пачке (мс); 0 - без накопления
+            sample_rate: Частота PCM клиента
+        """
+        self.send = send
+        self.batch_ms = batch_ms
+        self._buffer = bytearray(max(ms_to_bytes(batch_ms, sample_rate), SAMPLE_WIDTH))
+        self._view = memoryview(self._buffer)
+        self._fill = 0
+        self._first_at = 0.0
+
+    @property
+    def pending(self) -> int:
+        return self._fill
+
+    async def push(self, pcm: bytes):
+        """Добавить кадр PCM; полные пачки отправляются сразу"""
+        RELAY_STATS.counters["frames_in"] += 1
+        if self.batch_ms <= 0:
+            await self._send(binascii.b2a_base64(pcm, newline=False).decode("ascii"), len(pcm))
+            return
+        data = memoryview(pcm)
+        capacity = len(self._buffer)
+        while data:
+            if self._fill == 0:
+                self._first_at = time.monotonic()
+            take = min(capacity - self._fill, len(data))
+            self._view[self._fill:self._fill + take] = data[:take]
+            self._fill += take
+            data = data[take:]
+            if self._fill == capacity:
+                await self.flush()
+
+    async def push_encoded(self, audio_b64: str):
+        """Кадр, уже закодированный клиентом (старый JSON-протокол) - без перекодирования"""
+        RELAY_STATS.counters["frames_in"] += 1
+        await self.flush()
+        await self._send(audio_b64, (len(audio_b64) * 3) // 4)
+
+    async def flush(self):
+        """Отправить накопленное (конец реплики, таймер, прерывание)"""
+        if not self._fill:
+            return
+        encoded = binascii.b2a_base64(self._view[:self._fill], newline=False).decode("ascii")
+        size, self._fill = self._fill, 0
+        await self._send(encoded, size)
+
+    async def flush_stale(self, now: Optional[float] = None):
+        """Отправить пачку, ждущую дольше batch_ms (клиент шлёт редко или замолчал)"""
+        now = time.monotonic() if now is None else now
+        if self._fill and now - self._first_at >= self.batch_ms / 1000:
+            await self.flush()
+
+    async def _send(self, encoded: str, size: int):
+        RELAY_STATS.counters["batches_up"] += 1
+        RELAY_STATS.counters["bytes_up"] += size
+        await self.send(REALTIME_PREFIX + encoded + REALTIME_SUFFIX)
+
+
+# ========================================
+# GEMINI -> КЛИЕНТ
+# ========================================
+
+def parse_server_message(raw: Union[str, bytes]) -> Tuple[dict, List[bytes]]:
+    """
+    Сообщение Gemini -> (данные, аудио PCM)
+
+    base64 частей inlineData декодируется один раз и удаляется из данных,
+    чтобы дальше по коду не ходили большие строки.
+    """
+    data = json.loads(raw)
+    audio: List[bytes] = []
+    turn = (data.get("serverContent") or {}).get("modelTurn")
+    if turn:
+        for part in turn.get("parts", ()):
+            inline = part.get("inlineData")
+            if inline and "data" in inline:
+                audio.append(binascii.a2b_base64(inline.pop("data")))
+    return data, audio
+
+
+class JitterBuffer:
+    """
+    Буфер воспроизведения к клиенту
+
+    Кадры одинакового размера выдаются после предзаполнения и не больше чем
+    на lead_ms впереди воспроизведения у клиента: всплески Gemini сглаживаются,
+    а при прерывании сбрасывается только ещё не отправленное.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = OUTPUT_SAMPLE_RATE,
+        frame_ms: int = RELAY_FRAME_MS,
+        prebuffer_ms: int = RELAY_PREBUFFER_MS,
+        lead_ms: int = RELAY_LEAD_MS,
+        clock=time.monotonic
+    ):
+        self.frame_bytes = ms_to_bytes(frame_ms, sample_rate)
+        self.prebuffer_bytes = ms_to_bytes(prebuffer_ms, sample_rate)
+        self.bytes_per_second = sample_rate * SAMPLE_WIDTH
+        self.lead = lead_ms / 1000
+        self.clock = clock
+        self._buffer = bytearray()
+        self._read = 0
+        # Служебные сообщения: (позиция в потоке аудио, сообщение)
+        self._marks: Deque[Tuple[int, str]] = deque()
+        self._position = 0  # всего байт принято
+        self._draining = False
+        # Когда клиент доиграет всё отправленное
+        self._play_end = 0.0
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer) - self._read
+
+    def push(self, pcm: bytes):
+        self._buffer += pcm
+        self._position += len(pcm)
+
+    def mark(self, message: str):
+        """Служебное сообщение - после всего аудио, принятого до него"""
+        self._marks.append((self._position, message))
+
+    def end_turn(self):
+        """Конец ответа: остаток меньше кадра и меньше предзаполнения тоже выдаётся"""
+        self._draining = True
+
+    def clear(self) -> int:
+        """Прерывание: сбросить неотправленное аудио (служебные сообщения остаются)"""
+        dropped = self.buffered
+        self._buffer.clear()
+        self._read = 0
+        self._position -= dropped
+        self._marks = deque((min(pos, self._position), msg) for pos, msg in self._marks)
+        return dropped
+
+    def _can_play(self, now: float) -> bool:
+        # Клиент ещё играет - продолжаем без предзаполнения; иначе копим запас
+        return self._play_end > now or self._draining or self.buffered >= self.prebuffer_bytes
+
+    def _frame_size(self) -> int:
+        if self.buffered >= self.frame_bytes:
+            return self.frame_bytes
+        return self.buffered if self._draining else 0
+
+    def _take(self, size: int) -> bytes:
+        frame = bytes(self._buffer[self._read:self._read + size])
+        self._read += size
+        if self._read > 65536 and self._read * 2 > len(self._buffer):
+            del self._buffer[:self._read]
+            self._read = 0
+        return frame
+
+    def ready(self) -> List[ClientItem]:
+        """Кадры и служебные сообщения, которые пора отправить"""
+        now = self.clock()
+        items: List[ClientItem] = []
+        sent = self._position - self.buffered
+
+        playing = self._can_play(now)
+        while True:
+            while self._marks and self._marks[0][0] <= sent:
+                items.append(self._marks.popleft()[1])
+            size = self._frame_size() if playing else 0
+            # После отправки кадра клиент не должен опережать нас больше чем на lead
+            if not size or max(self._play_end, now) - now + size / self.bytes_per_second > self.lead + 1e-9:
+                break
+            items.append(self._take(size))
+            sent += size
+            self._play_end = max(self._play_end, now) + size / self.bytes_per_second
+
+        if self._draining and not self.buffered:
+            self._draining = False
+        return items
+
+    def next_due(self) -> Optional[float]:
+        """Через сколько секунд можно выдать следующий кадр (None - ждать данных)"""
+        now = self.clock()
+        if not self._frame_size() or not self._can_play(now):
+            return None
+        return max(0.0, self._play_end + self._frame_size() / self.bytes_per_second - self.lead - now)
+
+
+def legacy_audio_message(pcm: bytes, mime_type: str = "audio/pcm;rate=24000") -> str:
+    """Аудио для клиентов старого JSON-протокола: {"type": "audio", "data": base64}"""
+    encoded = binascii.b2a_base64(pcm, newline=False).decode("ascii")
+    return '{"type":"audio","mime_type":"' + mime_type + '","data":"' + encoded + '"}'
+
+
+# ========================================
+# СЕССИЯ
+# ========================================
+
+class AudioRelay:
+    """Одна сессия: пачки в Gemini, буфер джиттера к клиенту"""
+
+    def __init__(
+        self,
+        send_upstream: Callable[[str], Awaitable[Any]],
+        send_audio: Callable[[bytes], Awaitable[Any]],
+        send_text: Callable[[str], Awaitable[Any]],
+        batch_ms: int = RELAY_BATCH_MS,
+        jitter: Optional[JitterBuffer] = None,
+        on_audio: Optional[Callable[[int], Any]] = None
+    ):
+        """
+        Args:
+            send_upstream: Текстовое сообщение в Gemini
+            send_audio: PCM клиенту (бинарный кадр или JSON со base64 для старых клиентов)
+            send_text: Служебное JSON-сообщение клиенту
+            on_audio: Вызывается с числом байт PCM, полученных от Gemini (метрики сессии)
+        """
+        self.uplink = UplinkBatcher(send_upstream, batch_ms)
+        self.jitter = jitter or JitterBuffer()
+        self.send_audio = send_audio
+        self.send_text = send_text
+        self.on_audio = on_audio
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def __aenter__(self):
+        RELAY_STATS.active += 1
+        self._tasks = [asyncio.create_task(self._downlink()), asyncio.create_task(self._stale_flusher())]
+        return self
+
+    async def __aexit__(self, *exc):
+        RELAY_STATS.active -= 1
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # --- клиент -> Gemini ---
+
+    async def client_audio(self, pcm: bytes):
+        await self.uplink.push(pcm)
+
+    async def client_audio_b64(self, audio_b64: str):
+        await self.uplink.push_encoded(audio_b64)
+
+    async def end_of_speech(self):
+        await self.uplink.flush()
+
+    async def _stale_flusher(self):
+        interval = max(self.uplink.batch_ms, 10) / 1000
+        while True:
+            await asyncio.sleep(interval)
+            await self.uplink.flush_stale()
+
+    # --- Gemini -> клиент ---
+
+    def server_message(self, raw: Union[str, bytes]) -> dict:
+        """Разобрать сообщение Gemini; аудио уходит в буфер джиттера"""
+        data, audio = parse_server_message(raw)
+        for pcm in audio:
+            RELAY_STATS.counters["bytes_down"] += len(pcm)
+            self.jitter.push(pcm)
+        content = data.get("serverContent") or {}
+        if content.get("interrupted"):
+            self.interrupt()
+        if audio:
+            if self.on_audio:
+                self.on_audio(sum(len(pcm) for pcm in audio))
+            self._wakeup.set()
+        return data
+
+    def client_event(self, message: dict):
+        """Служебное сообщение клиенту - после уже принятого аудио"""
+        self.jitter.mark(json.dumps(message, ensure_ascii=False))
+        if message.get("type") == "turn_complete":
+            self.jitter.end_turn()
+        self._wakeup.set()
+
+    def interrupt(self) -> int:
+        dropped = self.jitter.clear()
+        RELAY_STATS.counters["bytes_dropped"] += dropped
+        self._wakeup.set()
+        return dropped
+
+    async def _downlink(self):
+        while True:
+            # Сброс до выборки: данные, пришедшие во время отправки, не теряются
+            self._wakeup.clear()
+            for item in self.jitter.ready():
+                if isinstance(item, bytes):
+                    RELAY_STATS.counters["frames_down"] += 1
+                    await self.send_audio(item)
+                else:
+                    await self.send_text(item)
+            due = self.jitter.next_due()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), due)
+            except asyncio.TimeoutError:
+                pass
+
+
+def get_relay_stats() -> dict:
+    return RELAY_STATS.get_stats()
@@ -5,7 +5,13 @@ import asyncio
 import websockets
 import json
 import os
+import sys
 import logging
+from pathlib import Path
+
+# audio_relay.py - в корне репозитория (общий с websocket_proxy.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from audio_relay import AudioRelay, get_relay_stats, legacy_audio_message
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -36,7 +42,7 @@ SYSTEM_INSTRUCTION = """Ты — голосовой AI-ассистент "Ст
 
 @app.get("/api/health")
 def health():
-    return {"status": "ok", "gemini_available": bool(GEMINI_API_KEY)}
+    return {"status": "ok", "gemini_available": bool(GEMINI_API_KEY), "audio_relay": get_relay_stats()}
 
 
 @app.get("/api/voice-assistant")
@@ -50,9 +56,15 @@ async def voice_assistant_page():
 
 @app.websocket("/api/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint для голосового ассистента"""
+    """
+    WebSocket endpoint для голосового ассистента
+
+    Аудио от клиента - бинарные кадры PCM 16 кГц (или JSON со base64 у старых
+    клиентов). К клиенту - бинарные кадры при ?audio=binary, иначе JSON.
+    """
     await websocket.accept()
-    logger.info("🔌 Клиент подключился к WebSocket")
+    binary_audio = websocket.query_params.get("audio") == "binary"
+    logger.info(f"🔌 Клиент подключился к WebSocket (аудио: {'binary' if binary_audio else 'base64'})")
     
     gemini_ws = None
     is_active = True
@@ -112,6 +124,19 @@ async def websocket_endpoint(websocket: WebSocket):
             })
             return
         
+        # Аудио к клиенту: бинарные кадры (?audio=binary) или JSON со base64
+        if binary_audio:
+            send_audio = websocket.send_bytes
+        else:
+            async def send_audio(pcm: bytes):
+                await websocket.send_text(legacy_audio_message(pcm))
+
+        relay = AudioRelay(
+            send_upstream=gemini_ws.send,
+            send_audio=send_audio,
+            send_text=websocket.send_text
+        )
+
         # Задача для прослушивания Gemini
         async def listen_gemini():
             nonlocal is_active
@@ -119,7 +144,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 async for message in gemini_ws:
                     if not is_active:
                         break
-                    response = json.loads(message)
+                    # base64 аудио декодируется один раз, PCM - в буфер джиттера
+                    response = relay.server_message(message)
                     
                     server_content = response.get("serverContent")
                     if not server_content:
@@ -128,72 +154,71 @@ async def websocket_endpoint(websocket: WebSocket):
                     model_turn = server_content.get("modelTurn")
                     if model_turn:
                         for part in model_turn.get("parts", []):
-                            if "inlineData" in part:
-                                # Аудио
-                                await websocket.send_json({
-                                    "type": "audio",
-                                    "data": part["inlineData"]["data"],
-                                    "mime_type": part["inlineData"].get("mimeType", "audio/pcm")
-                                })
-                            elif "text" in part:
-                                # Текст
-                                await websocket.send_json({
+                            if "text" in part:
+                                # Текст - вслед за аудио, принятым до него
+                                relay.client_event({
                                     "type": "text",
                                     "text": part["text"]
                                 })
                     
                     if server_content.get("turnComplete"):
-                        await websocket.send_json({"type": "turn_complete"})
+                        relay.client_event({"type": "turn_complete"})
                         
             except Exception as e:
                 logger.error(f"Gemini listen error: {e}")
         
-        # Запускаем прослушивание Gemini
-        gemini_task = asyncio.create_task(listen_gemini())
-        
-        # Обрабатываем сообщения от клиента
-        while is_active:
-            try:
-                data = await websocket.receive_json()
-                msg_type = data.get("type", "audio")
-                
-                if msg_type == "audio":
-                    # Аудио данные
-                    gemini_msg = {
-                        "realtime_input": {
-                            "media_chunks": [{
-                                "mime_type": "audio/pcm",
-                                "data": data.get("data", "")
-                            }]
-                        }
-                    }
-                    await gemini_ws.send(json.dumps(gemini_msg))
+        async with relay:
+            # Запускаем прослушивание Gemini
+            gemini_task = asyncio.create_task(listen_gemini())
+            
+            # Обрабатываем сообщения от клиента
+            while is_active:
+                try:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        break
                     
-                elif msg_type == "text":
-                    # Текст
-                    gemini_msg = {
-                        "client_content": {
-                            "turns": [{
-                                "role": "user",
-                                "parts": [{"text": data.get("text", "")}]
-                            }],
-                            "turn_complete": True
-                        }
-                    }
-                    await gemini_ws.send(json.dumps(gemini_msg))
+                    if message.get("bytes") is not None:
+                        # Аудио бинарным кадром (PCM 16 кГц)
+                        await relay.client_audio(message["bytes"])
+                        continue
                     
-                elif msg_type == "end_turn":
-                    gemini_msg = {"client_content": {"turn_complete": True}}
-                    await gemini_ws.send(json.dumps(gemini_msg))
+                    data = json.loads(message.get("text") or "{}")
+                    msg_type = data.get("type", "audio")
                     
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                logger.error(f"Client message error: {e}")
-                break
-        
-        is_active = False
-        gemini_task.cancel()
+                    if msg_type == "audio":
+                        # Аудио в base64 (старый протокол) - без перекодирования
+                        await relay.client_audio_b64(data.get("data", ""))
+                        
+                    elif msg_type == "text":
+                        # Текст
+                        gemini_msg = {
+                            "client_content": {
+                                "turns": [{
+                                    "role": "user",
+                                    "parts": [{"text": data.get("text", "")}]
+                                }],
+                                "turn_complete": True
+                            }
+                        }
+                        await gemini_ws.send(json.dumps(gemini_msg))
+                        
+                    elif msg_type == "end_turn":
+                        await relay.end_of_speech()
+                        gemini_msg = {"client_content": {"turn_complete": True}}
+                        await gemini_ws.send(json.dumps(gemini_msg))
+                    
+                    elif msg_type == "interrupt":
+                        relay.interrupt()
+                        
+                except WebSocketDisconnect:
+                    break
+                except Exception as e:
+                    logger.error(f"Client message error: {e}")
+                    break
+            
+            is_active = False
+            gemini_task.cancel()
         
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
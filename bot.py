@@ -5,12 +5,10 @@ Telegram бот СтройНадзорAI - AI консультант по стр
 
 import os
 import logging
-import base64
-import json
 import re
 from io import BytesIO
 from datetime import datetime, timedelta
-from collections import defaultdict, Counter
+from collections import Counter
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -102,7 +100,7 @@ except ImportError:
 # ОПТИМИЗАЦИЯ: Умный выбор моделей AI
 # ============================================================================
 try:
-    from model_selector import ModelSelector, should_use_web_search, extract_regulation_codes
+    from model_selector import should_use_web_search, extract_regulation_codes
     MODEL_SELECTOR_AVAILABLE = True
     logger.info("✅ ModelSelector загружен - умный выбор AI моделей активен")
 except ImportError:
@@ -157,6 +155,15 @@ except ImportError:
     BUILDER_REFERENCE_AVAILABLE = False
     logger.warning("⚠️ Файл builder_reference.py не найден")
 
+# Быстрые ответы из FAQ и баз знаний без AI v1.0
+try:
+    from knowledge_fast_path import FAST_PATH
+    FAST_PATH_AVAILABLE = True
+    logger.info("✅ Быстрые ответы без AI загружены")
+except ImportError:
+    FAST_PATH_AVAILABLE = False
+    logger.warning("⚠️ Модуль knowledge_fast_path.py не найден")
+
 # PDF/Word экспорт
 try:
     from reportlab.lib.pagesizes import A4
@@ -301,7 +308,7 @@ except ImportError as e:
 
 # Модуль веб-поиска нормативов
 try:
-    from web_search import perform_web_search, should_perform_web_search
+    from web_search import should_perform_web_search  # noqa: F401 - проверка доступности модуля
     WEB_SEARCH_AVAILABLE = True
     logger.info("✅ Модуль веб-поиска нормативов загружен (docs.cntd.ru, minstroyrf.gov.ru)")
 except ImportError as e:
@@ -335,7 +342,7 @@ try:
     from gemini_vision import (
         initialize_gemini_vision,
         is_gemini_available,
-        analyze_construction_image
+        GEMINI_VISION_MODEL
     )
     gemini_vision_analyzer = initialize_gemini_vision()
     GEMINI_VISION_AVAILABLE = is_gemini_available()
@@ -386,7 +393,9 @@ except ImportError as e:
 
 # Обработчик голосовых сообщений v3.9
 try:
-    from voice_handler import process_voice_message
+    from voice_handler import process_voice_message, start_vosk_pool
+    from audio_pipeline import get_audio_converter
+    from vosk_pool import get_vosk_pool
     VOICE_HANDLER_AVAILABLE = True
     logger.info("✅ Обработчик голосовых сообщений v3.9 загружен")
 except ImportError:
@@ -433,7 +442,8 @@ try:
         search_command,
         export_command,
         clear_history_command,
-        handle_history_callback
+        handle_history_callback,
+        dialog_store
     )
     HISTORY_MANAGER_AVAILABLE = True
     logger.info("✅ Управление историей v3.5 загружено (поиск + экспорт)")
@@ -475,7 +485,9 @@ try:
         get_cached_answer,
         set_cached_answer,
         find_similar_cached_question,
-        get_cache_stats
+        get_cache_stats,
+        purge_expired_memory,
+        MEMORY_CACHE
     )
     CACHE_AVAILABLE = True
     logger.info("✅ Cache manager v3.8 загружен")
@@ -519,9 +531,9 @@ try:
         GEMINI_VISION_PROMPT_DEFECTS,
         WEB_SEARCH_DECISION_PROMPT
     )
-    from model_selector import ModelSelector
+    from model_selector import get_model_selector
     OPTIMIZED_PROMPTS_AVAILABLE = True
-    model_selector = ModelSelector()
+    model_selector = get_model_selector()
     logger.info("✅ Оптимизированные промпты и селектор моделей v5.0 загружены")
 except ImportError as e:
     OPTIMIZED_PROMPTS_AVAILABLE = False
@@ -561,7 +573,20 @@ except ImportError:
     logger.warning("⚠️ Модуль context_hints.py не найден")
 
 # Импорт xAI клиента
-from xai_client import XAIClient, call_xai_with_retry
+from xai_client import get_shared_xai_client
+
+# Append-only хранилище истории диалогов
+from conversation_store import ConversationStore
+
+# Ограниченное состояние пользователей в памяти (LRU + выгрузка по простою)
+from state_store import BoundedState, STATE_REGISTRY, format_bytes
+from live_sessions import LIVE_SESSIONS
+from photo_pipeline import get_photo_pipeline, select_photo_size
+
+# Поиск кодов нормативов (одно regex-дерево по словарю кодов)
+from regulation_matcher import get_regulation_matcher, register_regulation_codes
+from regulation_index import register_regulations
+from intent_classifier import INTENT_ROUTER, INTENTS, DEFAULT_INTENT
 
 # Импорт Gemini Live API (голосовой ассистент)
 try:
@@ -587,7 +612,8 @@ try:
         LLMCouncil,
         get_llm_council,
         is_council_available,
-        is_complex_question
+        is_complex_question,
+        get_council_stats
     )
     LLM_COUNCIL_AVAILABLE = is_council_available()
     if LLM_COUNCIL_AVAILABLE:
@@ -615,10 +641,10 @@ if not ANTHROPIC_API_KEY:
 grok_client = None
 
 def get_grok_client():
-    """Получить xAI Grok клиент (ленивая инициализация)"""
+    """Получить xAI Grok клиент (ленивая инициализация, общий пул соединений)"""
     global grok_client
     if grok_client is None:
-        grok_client = XAIClient(api_key=XAI_API_KEY)
+        grok_client = get_shared_xai_client(XAI_API_KEY)
     return grok_client
 
 # Инициализация Gemini генератора
@@ -634,17 +660,16 @@ def get_gemini_generator():
 
 # === RATE LIMITING СИСТЕМА ===
 
-# Хранилище времени запросов пользователей
-user_request_times = defaultdict(list)
-
-# Настройки rate limiting
-RATE_LIMIT_MAX_REQUESTS = 10  # Максимум запросов
-RATE_LIMIT_WINDOW_SECONDS = 60  # За 60 секунд
+# GCRA со стоимостью функций (rate_limiter.py): одно число на пользователя,
+# в Redis - общий лимит для всех реплик бота
+from rate_limiter import RATE_LIMITER, RATE_LIMIT_MAX_REQUESTS, RateLimitResult, format_retry_after
+STATE_REGISTRY.register("Rate limit", RATE_LIMITER.memory.tats)
 
 # 🎯 НАСТРОЙКА STREAMING РЕЖИМА
-# True = ответы появляются постепенно (как в ChatGPT)
+# True = ответы появляются постепенно (как в ChatGPT), правки - по лимитам Telegram (stream_renderer.py);
+#        генерация идёт через run_user_request - новое сообщение пользователя её отменяет
 # False = ответы приходят сразу целиком (классический режим)
-STREAMING_ENABLED = False  # По умолчанию ВЫКЛЮЧЕН
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "true").lower() == "true"
 
 # 🤖 КОНФИГУРАЦИЯ AI МОДЕЛЕЙ (xAI Grok)
 # Основная модель: grok-4-1-fast
@@ -656,114 +681,61 @@ STREAMING_ENABLED = False  # По умолчанию ВЫКЛЮЧЕН
 #   - Быстрая генерация ответов
 # Fallback: Claude Sonnet 4.5 (при недоступности Grok)
 
-def check_rate_limit(user_id: int) -> bool:
+async def check_rate_limit(user_id: int, feature: str = "text") -> RateLimitResult:
     """
     Проверка rate limit для пользователя
-    Returns: True если запрос разрешен, False если превышен лимит
+    Returns: результат (истинный, если запрос разрешен); стоимость зависит от функции
     """
-    now = datetime.now()
-    cutoff = now - timedelta(seconds=RATE_LIMIT_WINDOW_SECONDS)
+    return await RATE_LIMITER.check(user_id, feature)
 
-    # Очистка старых запросов
-    user_request_times[user_id] = [
-        t for t in user_request_times[user_id] if t > cutoff
-    ]
 
-    # Проверка лимита
-    if len(user_request_times[user_id]) >= RATE_LIMIT_MAX_REQUESTS:
-        logger.warning(f"Rate limit exceeded for user {user_id}")
-        return False
-
-    # Добавляем новый запрос
-    user_request_times[user_id].append(now)
-    return True
+def rate_limit_text(result: RateLimitResult) -> str:
+    """Сообщение пользователю о превышении лимита"""
+    return (
+        "⏱️ Слишком много запросов!\n\n"
+        f"Вы можете отправлять до {RATE_LIMIT_MAX_REQUESTS} запросов в минуту "
+        "(анализ фото и Совет AI считаются за несколько).\n"
+        f"Попробуйте снова {format_retry_after(result.retry_after)}."
+    )
 
 
-# === УЛУЧШЕННАЯ ОБРАБОТКА AI API С FALLBACK НА CLAUDE ===
+# === УЛУЧШЕННАЯ ОБРАБОТКА AI API С FALLBACK (Grok → Claude → Gemini) ===
 
 import time
-from anthropic import Anthropic
-
-# Инициализация Claude клиента (резервный)
-claude_client = None
-
-def get_claude_client():
-    """Получить Claude клиент (ленивая инициализация)"""
-    global claude_client
-    if claude_client is None and ANTHROPIC_API_KEY:
-        claude_client = Anthropic(api_key=ANTHROPIC_API_KEY)
-    return claude_client
-
-def call_grok_with_retry(client, model, messages, max_tokens, temperature, search_parameters=None):
+from llm_providers import get_provider_chain, run_user_request, cancel_user_request
+from user_actors import USER_ACTORS, PerUserUpdateProcessor
+from single_flight import LLM_SINGLE_FLIGHT, make_flight_key
+from stream_renderer import StreamRenderer, get_edit_limiter, get_stream_stats
+from context_builder import CONTEXT_BUILDER, CONTEXT_HISTORY_LIMIT
+from prompt_cache import get_prompt_cache_stats
+
+async def call_grok_with_retry(client, model, messages, max_tokens, temperature, search_parameters=None):
     """
-    Вызов xAI Grok API с автоматическим fallback на Claude при сбое
+    Вызов xAI Grok API с автоматическим fallback на Claude и Gemini при сбое
 
-    Логика:
-    1. Пытается использовать xAI Grok (основной)
-    2. Если ошибка - автоматически переключается на Claude (резерв)
-    3. Логирует какой API был использован
+    Логика (полностью асинхронная, без потоков executor):
+    1. Пытается использовать xAI Grok (основной, async backoff при rate limit)
+    2. Если ошибка - сразу переключается на Claude, затем на Gemini
+    3. Если Grok долго не отвечает - параллельно запускает резерв (hedging)
+    4. Логирует какой API был использован
 
     Args:
+        client: XAIClient (цепочка использует общий пул соединений того же ключа)
         search_parameters: Параметры поиска {"mode": "auto", "return_citations": True, "sources": [{"type": "web"}, {"type": "news"}, {"type": "x"}]}]
     """
-    # Сначала пытаемся Grok
     try:
-        response = call_xai_with_retry(
-            client=client,
-            model=model,
+        return await get_provider_chain().complete(
             messages=messages,
+            model=model,
             max_tokens=max_tokens,
             temperature=temperature,
             search_parameters=search_parameters
         )
-        logger.info("✅ Ответ получен от xAI Grok")
-        return response
-    except Exception as grok_error:
-        logger.warning(f"⚠️ xAI Grok недоступен: {str(grok_error)}")
-
-        # Fallback на Claude
-        if not ANTHROPIC_API_KEY:
-            logger.error("❌ Claude API также недоступен (нет ключа)")
-            raise Exception("⚠️ AI сервисы временно недоступны. Попробуйте позже.")
-
-        try:
-            logger.info("🔄 Переключение на Claude Sonnet 4.5 (резерв)...")
-            claude = get_claude_client()
-
-            # Преобразуем формат messages для Claude
-            claude_messages = []
-            system_prompt = None
-
-            for msg in messages:
-                if msg.get("role") == "system":
-                    system_prompt = msg.get("content")
-                else:
-                    claude_messages.append(msg)
-
-            # Вызываем Claude
-            claude_response = claude.messages.create(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system=system_prompt if system_prompt else "Вы — эксперт по строительным нормативам РФ.",
-                messages=claude_messages
-            )
-
-            # Преобразуем ответ Claude в формат совместимый с Grok
-            response = {
-                "choices": [{
-                    "message": {
-                        "content": claude_response.content[0].text
-                    }
-                }]
-            }
-
-            logger.info("✅ Ответ получен от Claude Sonnet 4.5 (резерв)")
-            return response
-
-        except Exception as claude_error:
-            logger.error(f"❌ Claude также недоступен: {str(claude_error)}")
-            raise Exception("⚠️ Оба AI сервиса (Grok и Claude) временно недоступны. Попробуйте позже.")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Все AI провайдеры недоступны: {e}")
+        raise Exception("⚠️ AI сервисы (Grok, Claude, Gemini) временно недоступны. Попробуйте позже.")
 
 
 async def call_grok_with_streaming(client, model, messages, max_tokens, temperature, search_parameters=None):
@@ -797,7 +769,7 @@ async def call_grok_with_streaming(client, model, messages, max_tokens, temperat
 
         # Fallback на обычный режим без streaming
         logger.info("🔄 Переключение на обычный режим без streaming...")
-        response = call_grok_with_retry(
+        response = await call_grok_with_retry(
             client=client,
             model=model,
             messages=messages,
@@ -811,17 +783,8 @@ async def call_grok_with_streaming(client, model, messages, max_tokens, temperat
 
 # === СИСТЕМА КЛАССИФИКАЦИИ НАМЕРЕНИЙ (INTENT CLASSIFICATION) ===
 
-def classify_user_intent(user_message: str) -> dict:
-    """
-    Быстрая классификация намерения пользователя с помощью Haiku.
-    Возвращает тип запроса для выбора оптимальной модели.
-
-    Типы:
-    - simple_save: сохранение, подтверждение, простая фиксация
-    - simple_question: простой вопрос, требующий краткого ответа
-    - technical_question: технический вопрос, требующий экспертизы
-    - complex_analysis: сложный анализ, расчеты, детальная экспертиза
-    """
+async def _classify_intent_with_grok(user_message: str) -> str:
+    """Классификация намерения запросом к Grok (только при низкой уверенности локальной модели); None при ошибке"""
     try:
         client = get_grok_client()
 
@@ -837,7 +800,7 @@ def classify_user_intent(user_message: str) -> dict:
 
 Ответь ТОЛЬКО одним словом из списка выше:"""
 
-        response = call_grok_with_retry(
+        response = await call_grok_with_retry(
             client,
             model="grok-4-1-fast",  # Быстрая модель для классификации
             max_tokens=50,
@@ -846,40 +809,82 @@ def classify_user_intent(user_message: str) -> dict:
         )
 
         intent_type = response["choices"][0]["message"]["content"].strip().lower()
+        return intent_type if intent_type in INTENTS else None
+
+    except Exception as e:
+        logger.error(f"Error in intent classification: {e}")
+        return None
+
+
+# Фоновые сверки с Grok: ссылки держатся до завершения (иначе задачу может собрать GC)
+_intent_audits = set()
+
+
+async def _audit_intent(user_message: str, prediction):
+    """Фоновая сверка уверенного локального решения с Grok (метрика согласия)"""
+    teacher = await _classify_intent_with_grok(user_message)
+    INTENT_ROUTER.record_teacher(user_message, prediction, teacher, audit=True)
+
+
+def _intent_audit_done(task: asyncio.Task):
+    _intent_audits.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"⚠️ Сверка намерения с Grok: {task.exception()}")
 
-        # Валидация ответа
-        valid_types = ["simple_save", "simple_question", "technical_question", "complex_analysis"]
-        if intent_type not in valid_types:
-            # По умолчанию считаем технический вопрос
-            intent_type = "technical_question"
-
-        # Выбор модели на основе типа запроса
-        if intent_type == "simple_save" or intent_type == "simple_question":
-            model = "grok-4-1-fast"  # Быстрая модель для простых запросов
-            max_tokens = 1000
-        elif intent_type == "technical_question":
-            model = "grok-4-1-fast"  # Reasoning модель для технических вопросов
-            max_tokens = 5000
-        else:  # complex_analysis
-            model = "grok-4-1-fast"  # Reasoning модель для сложного анализа
-            max_tokens = 8000
-
-        logger.info(f"📊 Intent: {intent_type} → Model: {model}")
-
-        return {
-            "intent": intent_type,
-            "model": model,
-            "max_tokens": max_tokens
-        }
 
+async def classify_user_intent(user_message: str) -> dict:
+    """
+    Быстрая классификация намерения пользователя.
+    Возвращает тип запроса для выбора оптимальной модели.
+
+    Решает локальный классификатор (intent_classifier.py, микросекунды);
+    Grok спрашивается только при низкой уверенности.
+
+    Типы:
+    - simple_save: сохранение, подтверждение, простая фиксация
+    - simple_question: простой вопрос, требующий краткого ответа
+    - technical_question: технический вопрос, требующий экспертизы
+    - complex_analysis: сложный анализ, расчеты, детальная экспертиза
+    """
+    try:
+        prediction = INTENT_ROUTER.predict(user_message)
+        intent_type = prediction.intent
+        source = "local"
+
+        if INTENT_ROUTER.needs_teacher(prediction):
+            teacher = await _classify_intent_with_grok(user_message)
+            INTENT_ROUTER.record_teacher(user_message, prediction, teacher)
+            if teacher:
+                intent_type = teacher
+                source = "grok"
+        elif INTENT_ROUTER.should_audit():
+            task = asyncio.create_task(_audit_intent(user_message, prediction))
+            _intent_audits.add(task)
+            task.add_done_callback(_intent_audit_done)
     except Exception as e:
         logger.error(f"Error in intent classification: {e}")
-        # При ошибке используем Grok Reasoning для надежности
-        return {
-            "intent": "technical_question",
-            "model": "grok-4-1-fast",
-            "max_tokens": 5000
-        }
+        # При ошибке считаем технический вопрос
+        intent_type = DEFAULT_INTENT
+        source = "default"
+
+    # Выбор модели на основе типа запроса
+    if intent_type == "simple_save" or intent_type == "simple_question":
+        model = "grok-4-1-fast"  # Быстрая модель для простых запросов
+        max_tokens = 1000
+    elif intent_type == "technical_question":
+        model = "grok-4-1-fast"  # Reasoning модель для технических вопросов
+        max_tokens = 5000
+    else:  # complex_analysis
+        model = "grok-4-1-fast"  # Reasoning модель для сложного анализа
+        max_tokens = 8000
+
+    logger.info(f"📊 Intent: {intent_type} ({source}) → Model: {model}")
+
+    return {
+        "intent": intent_type,
+        "model": model,
+        "max_tokens": max_tokens
+    }
 
 
 # === СИСТЕМА ХРАНЕНИЯ ИСТОРИИ ДИАЛОГОВ ===
@@ -888,41 +893,53 @@ def classify_user_intent(user_message: str) -> dict:
 HISTORY_DIR = Path("user_conversations")
 HISTORY_DIR.mkdir(exist_ok=True)
 
-# In-memory хранилище истории (для быстрого доступа)
-user_conversations = defaultdict(list)
-
 # Максимальное количество сообщений в истории для контекста
 MAX_CONTEXT_MESSAGES = 10
 
+def _read_legacy_history(data) -> list:
+    """Извлечь сообщения из старого формата user_<id>.json"""
+    if isinstance(data, dict):
+        return data.get('messages', [])
+    return []
+
+
+# Append-only хранилище истории (user_<id>.jsonl) с отложенной записью
+history_store = ConversationStore(
+    HISTORY_DIR,
+    prefix="user",
+    max_records=50,
+    legacy_prefix="user",
+    legacy_reader=_read_legacy_history
+)
+
+# In-memory хранилище истории (для быстрого доступа): отсутствующий пользователь
+# читается из history_store, давно неактивный выгружается (история уже на диске)
+user_conversations = BoundedState(
+    "user_conversations",
+    loader=history_store.load,
+    on_evict=lambda user_id, _: history_store.evict(user_id)
+)
+STATE_REGISTRY.register("Истории диалогов", user_conversations)
+
 def load_user_history(user_id: int):
-    """Загрузить историю диалога пользователя из файла"""
-    history_file = HISTORY_DIR / f"user_{user_id}.json"
-    if history_file.exists():
-        try:
-            with open(history_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                user_conversations[user_id] = data.get('messages', [])
-                logger.info(f"Loaded {len(user_conversations[user_id])} messages for user {user_id}")
-        except Exception as e:
-            logger.error(f"Error loading history for user {user_id}: {e}")
-            user_conversations[user_id] = []
-    else:
-        user_conversations[user_id] = []
+    """Загрузить историю диалога пользователя (файл читается один раз, дальше из памяти)"""
+    user_conversations[user_id] = history_store.load(user_id)
 
 def save_user_history(user_id: int):
-    """Сохранить историю диалога пользователя в файл"""
-    history_file = HISTORY_DIR / f"user_{user_id}.json"
+    """Сохранить историю диалога пользователя (полная перезапись сегмента)"""
     try:
-        data = {
-            'user_id': user_id,
-            'last_updated': datetime.now().isoformat(),
-            'messages': user_conversations[user_id]
-        }
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Saved history for user {user_id}")
+        history_store.replace(user_id, user_conversations[user_id])
+        user_conversations[user_id] = history_store.load(user_id)
+    except Exception as e:
+        logger.error(f"Error saving history for user {user_id}: {e}")
+
+def _append_history_message(user_id: int, message: dict):
+    """Дописать сообщение в историю (в память сразу, на диск - фоновой задачей)"""
+    try:
+        history_store.append(user_id, message)
     except Exception as e:
         logger.error(f"Error saving history for user {user_id}: {e}")
+    user_conversations[user_id] = history_store.load(user_id)
 
 async def add_message_to_history_async(user_id: int, role: str, content: str, image_analyzed: bool = False):
     """Добавить сообщение в историю (PostgreSQL с fallback на JSON)"""
@@ -934,7 +951,6 @@ async def add_message_to_history_async(user_id: int, role: str, content: str, im
         try:
             await save_message(user_id, role, content, image_analyzed, tags)
             # Обновляем in-memory кеш
-            load_user_history(user_id)
             message = {
                 'role': role,
                 'content': content,
@@ -942,15 +958,12 @@ async def add_message_to_history_async(user_id: int, role: str, content: str, im
                 'image_analyzed': image_analyzed,
                 'tags': tags
             }
-            user_conversations[user_id].append(message)
-            if len(user_conversations[user_id]) > 50:
-                user_conversations[user_id] = user_conversations[user_id][-50:]
+            _append_history_message(user_id, message)
             return
         except Exception as e:
             logger.error(f"PostgreSQL save failed, falling back to JSON: {e}")
 
-    # Fallback на JSON
-    load_user_history(user_id)
+    # Fallback на JSONL
     message = {
         'role': role,
         'content': content,
@@ -958,14 +971,10 @@ async def add_message_to_history_async(user_id: int, role: str, content: str, im
         'image_analyzed': image_analyzed,
         'tags': tags
     }
-    user_conversations[user_id].append(message)
-    if len(user_conversations[user_id]) > 50:
-        user_conversations[user_id] = user_conversations[user_id][-50:]
-    save_user_history(user_id)
+    _append_history_message(user_id, message)
 
 def add_message_to_history(user_id: int, role: str, content: str, image_analyzed: bool = False):
     """Синхронная обертка для совместимости"""
-    load_user_history(user_id)
     tags = extract_tags_from_message(content)
     message = {
         'role': role,
@@ -974,10 +983,7 @@ def add_message_to_history(user_id: int, role: str, content: str, image_analyzed
         'image_analyzed': image_analyzed,
         'tags': tags
     }
-    user_conversations[user_id].append(message)
-    if len(user_conversations[user_id]) > 50:
-        user_conversations[user_id] = user_conversations[user_id][-50:]
-    save_user_history(user_id)
+    _append_history_message(user_id, message)
 
 def get_conversation_context(user_id: int) -> list:
     """Получить контекст диалога для Claude API (последние N сообщений)"""
@@ -998,10 +1004,22 @@ def get_conversation_context(user_id: int) -> list:
 
     return grok_messages
 
+def get_council_context(user_id: int, question: str) -> str:
+    """
+    Контекст для Совета AI: последние 3 сообщения (по 200 символов)
+
+    Текущий вопрос в контекст не входит - он передаётся отдельно, и с ним
+    отпечаток контекста в ключе кэша Совета менялся бы на каждый вопрос
+    """
+    recent = get_conversation_context(user_id)
+    if recent and recent[-1]['role'] == 'user' and recent[-1]['content'] == question:
+        recent = recent[:-1]
+    return "\n".join([f"{m['role']}: {m['content'][:200]}" for m in recent[-3:]])
+
 def clear_user_history(user_id: int):
     """Очистить историю диалога пользователя"""
-    user_conversations[user_id] = []
-    save_user_history(user_id)
+    history_store.clear(user_id)
+    user_conversations[user_id] = history_store.load(user_id)
 
 def get_user_stats(user_id: int) -> dict:
     """Получить статистику диалога пользователя"""
@@ -1027,9 +1045,8 @@ def extract_tags_from_message(content: str) -> list:
     tags = []
 
     # Извлекаем упоминания нормативов
-    for reg_code in REGULATIONS.keys():
-        if reg_code in content:
-            tags.append(f"норматив:{reg_code}")
+    for reg_code in find_mentioned_regulations(content):
+        tags.append(f"норматив:{reg_code}")
 
     # Извлекаем ключевые слова
     keywords = {
@@ -1050,8 +1067,6 @@ def extract_tags_from_message(content: str) -> list:
 
 def add_message_to_history_with_tags(user_id: int, role: str, content: str, image_analyzed: bool = False):
     """Добавить сообщение в историю с автоматическим тегированием"""
-    load_user_history(user_id)
-
     # Извлекаем теги
     tags = extract_tags_from_message(content)
 
@@ -1063,13 +1078,8 @@ def add_message_to_history_with_tags(user_id: int, role: str, content: str, imag
         'tags': tags
     }
 
-    user_conversations[user_id].append(message)
-
-    # Ограничиваем размер истории
-    if len(user_conversations[user_id]) > 50:
-        user_conversations[user_id] = user_conversations[user_id][-50:]
-
-    save_user_history(user_id)
+    # Размер истории ограничивает хранилище (max_records)
+    _append_history_message(user_id, message)
 
 
 # === СИСТЕМА ПОИСКА ПО ИСТОРИИ ===
@@ -1771,6 +1781,18 @@ REGULATIONS = {
     }
 }
 
+# Коды REGULATIONS попадают в общий автомат поиска нормативов и в индекс нормативов
+register_regulation_codes(REGULATIONS.keys())
+register_regulations(REGULATIONS, source="bot")
+
+
+def find_mentioned_regulations(text: str) -> list:
+    """Коды из REGULATIONS, упомянутые в тексте (один проход автомата)"""
+    return [
+        code for code in get_regulation_matcher().find_codes(text, known_only=True)
+        if code in REGULATIONS
+    ]
+
 
 # === ПОСТОЯННАЯ КЛАВИАТУРА ===
 
@@ -2008,7 +2030,7 @@ async def council_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "`/council Ваш сложный технический вопрос`\n\n"
             "**Пример:**\n"
             "`/council Как правильно армировать плиту перекрытия по СП 63.13330?`\n\n"
-            "⏱️ Время ответа: 30-60 сек (опрос 3 моделей)\n"
+            "⏱️ Ответ начинает появляться, как только ответят 2 модели из 3\n"
             "🎯 Качество: максимальное (консенсус экспертов)",
             parse_mode="Markdown"
         )
@@ -2016,6 +2038,11 @@ async def council_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     question = " ".join(args)
     user_id = update.effective_user.id
+
+    limit = await check_rate_limit(user_id, "council")
+    if not limit:
+        await update.message.reply_text(rate_limit_text(limit))
+        return
     
     # Добавляем вопрос в историю
     await add_message_to_history_async(user_id, 'user', f"[COUNCIL] {question}")
@@ -2027,10 +2054,11 @@ async def council_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Grok — технический анализ\n"
         "• Claude — детальная экспертиза\n"
         "• Gemini — практические рекомендации\n\n"
-        "_Это займёт 30-60 секунд..._",
+        "_Ответ появится здесь, как только ответят 2 эксперта из 3..._",
         parse_mode="Markdown"
     )
     
+    renderer = None
     try:
         council = get_llm_council()
         if not council:
@@ -2040,52 +2068,43 @@ async def council_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # Получаем контекст диалога
-        conversation_history = get_conversation_context(user_id)
-        context_text = ""
-        if conversation_history:
-            # Берём последние 3 сообщения как контекст
-            recent = conversation_history[-3:]
-            context_text = "\n".join([f"{m['role']}: {m['content'][:200]}" for m in recent])
+        # Получаем контекст диалога (без самого вопроса)
+        context_text = get_council_context(user_id, question)
         
-        # Запускаем полную консультацию
-        result = await council.consult(question, context=context_text, skip_review=False)
+        # Запускаем полную консультацию, синтез Председателя - потоком в то же сообщение
+        renderer = StreamRenderer(update.message, parse_mode="Markdown")
+        await renderer.start(message=council_msg)
+        result = await council.consult(question, context=context_text, skip_review=False, on_chunk=renderer.feed)
         
         if result["success"]:
-            # Обновляем сообщение с результатом
             final_answer = result["final_answer"]
             duration = result["duration_seconds"]
             models = result["models_used"]
             
-            # Добавляем метаинформацию
-            footer = f"\n\n---\n⏱️ _Время: {duration:.1f} сек | Модели: {', '.join(models)}_"
-            
-            # Ограничиваем длину сообщения для Telegram (4096 символов)
-            max_len = 4000 - len(footer)
-            if len(final_answer) > max_len:
-                final_answer = final_answer[:max_len] + "..."
-            
-            await council_msg.edit_text(
-                final_answer + footer,
-                parse_mode="Markdown"
-            )
+            # Добавляем метаинформацию (длинный ответ продолжается в новых сообщениях)
+            await renderer.feed(f"\n\n---\n⏱️ _Время: {duration:.1f} сек | Модели: {', '.join(models)}_")
+            await renderer.finish()
             
             # Сохраняем ответ в историю
             await add_message_to_history_async(user_id, 'assistant', final_answer)
             
             logger.info(f"✅ LLM Council: ответ за {duration:.1f} сек для user {user_id}")
         else:
-            await council_msg.edit_text(
+            # Частичный синтез (в т.ч. продолжения в новых сообщениях) удаляется вместе с заглушкой
+            await renderer.abort()
+            await update.message.reply_text(
                 f"❌ **Ошибка Совета AI**\n\n{result.get('final_answer', 'Неизвестная ошибка')}",
                 parse_mode="Markdown"
             )
     
     except Exception as e:
         logger.error(f"Council command error: {e}")
-        await council_msg.edit_text(
-            f"❌ **Ошибка при работе Совета AI**\n\n`{str(e)}`",
-            parse_mode="Markdown"
-        )
+        error_text = f"❌ **Ошибка при работе Совета AI**\n\n`{str(e)}`"
+        if renderer is not None:
+            await renderer.abort()
+            await update.message.reply_text(error_text, parse_mode="Markdown")
+        else:
+            await council_msg.edit_text(error_text, parse_mode="Markdown")
 
 
 async def examples_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -2266,10 +2285,9 @@ async def handle_photo_with_visualization(update: Update, context: ContextTypes.
         )
         return True
 
-    # Получаем фото
-    photo = update.message.photo[-1]
-    photo_file = await photo.get_file()
-    photo_bytes = await photo_file.download_as_bytearray()
+    # Получаем фото (подходящий размер, подготовленное, из кэша при повторе)
+    prepared = await get_photo_pipeline().load_message_photo(context.bot, update.message.photo)
+    photo_bytes = prepared.data
 
     await update.message.reply_text("🎨 Анализирую изображение для визуализации...")
 
@@ -2371,6 +2389,29 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(stats_text, parse_mode='Markdown')
 
 
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /memory - состояние в памяти по структурам (только для разработчика)"""
+    if not is_developer(update.effective_user.id):
+        await update.message.reply_text("❌ Команда доступна только разработчику")
+        return
+
+    rows = STATE_REGISTRY.report()
+    total = sum(row['bytes'] for row in rows)
+    lines = ["🧠 **Состояние в памяти:**", ""]
+    for row in rows:
+        entries = row['entries'] if row['entries'] is not None else "—"
+        lines.append(f"• {row['name']}: {entries} записей, ~{format_bytes(row['bytes'])}")
+    lines.append("")
+    lines.append(f"Всего: ~{format_bytes(total)}")
+
+    stats = STATE_REGISTRY.get_stats()
+    lines.append(f"Очисток: {stats['sweeps']}, выгружено записей: {stats['evicted']}")
+    history = history_store.get_stats()
+    lines.append(f"История в кэше: {history['users_cached']} польз., выгружено {history['evictions']}")
+
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+
 async def clear_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /clear - очистить историю диалогов"""
     user_id = update.effective_user.id
@@ -3096,12 +3137,9 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     # Проверка rate limit
-    if not check_rate_limit(user_id):
-        await update.message.reply_text(
-            "⏱️ Слишком много запросов!\n\n"
-            f"Вы можете отправлять до {RATE_LIMIT_MAX_REQUESTS} запросов в минуту.\n"
-            "Пожалуйста, подождите немного и попробуйте снова."
-        )
+    limit = await check_rate_limit(user_id, "photo")
+    if not limit:
+        await update.message.reply_text(rate_limit_text(limit))
         return
 
     # Проверяем, нужна ли визуализация через Gemini
@@ -3112,8 +3150,8 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     thinking_message = await update.message.reply_text("📸 Анализирую фотографию...\n\nВы можете не ждать, я пришлю уведомление 😉")
 
     try:
-        # Получаем фото (самое большое разрешение)
-        photo = update.message.photo[-1]
+        # Получаем фото: наименьший размер, которого хватает моделям
+        photo = select_photo_size(update.message.photo)
         caption_text = update.message.caption or "Проанализируй это фото"
 
         # ============================================================================
@@ -3124,7 +3162,8 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 question=caption_text,
                 photo_file_id=photo.file_id,
                 update=update,
-                context=context
+                context=context,
+                photo_unique_id=photo.file_unique_id
             )
 
             # Если умный выбор обработал фото - выходим
@@ -3147,13 +3186,11 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        photo_file = await photo.get_file()
-
-        # Скачиваем фото
-        photo_bytes = await photo_file.download_as_bytearray()
+        # Скачиваем и подготавливаем фото (поворот, уменьшение, JPEG - в пуле потоков)
+        prepared = await get_photo_pipeline().load(context.bot, photo.file_id, photo.file_unique_id)
 
         # Кодируем в base64
-        photo_base64 = base64.b64encode(photo_bytes).decode('utf-8')
+        photo_base64 = prepared.to_base64()
 
         # Получаем подпись (если есть)
         caption = update.message.caption or ""
@@ -3161,17 +3198,17 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ============================================
         # ВЫБОР AI ДВИЖКА ДЛЯ АНАЛИЗА ФОТО
         # ============================================
-        # Приоритет: 1) Gemini 2.5 Flash (быстрее, дешевле)
+        # Приоритет: 1) Gemini (GEMINI_VISION_MODEL, быстрее, дешевле)
         #            2) xAI Grok (fallback)
 
         # Пробуем Gemini Vision сначала
         if GEMINI_VISION_AVAILABLE and gemini_vision_analyzer:
             try:
-                logger.info("📸 Используем Gemini 2.5 Flash для анализа фото")
+                logger.info(f"📸 Используем {GEMINI_VISION_MODEL} для анализа фото")
 
-                # Анализируем через Gemini
+                # Анализируем через Gemini: фото уже подготовлено, метрики пишет gemini_vision
                 analysis_result = await gemini_vision_analyzer.analyze_defect_photo(
-                    image_data=bytes(photo_bytes),
+                    image_data=prepared,
                     user_prompt=caption if caption else None
                 )
 
@@ -3183,7 +3220,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         logger.warning(f"Could not delete thinking message: {e}")
 
                     # Формируем ответ
-                    result = f"🔍 **Анализ фотографии (Gemini 2.5 Flash):**\n\n{analysis_result}\n\n"
+                    result = f"🔍 **Анализ фотографии (Gemini):**\n\n{analysis_result}\n\n"
                     result += f"⏰ {datetime.now().strftime('%d.%m.%Y %H:%M:%S')}"
 
                     # Разбиваем длинные сообщения на части
@@ -3218,7 +3255,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             message_type="photo",
                             content=caption if caption else "Фото без подписи",
                             response=analysis_result,
-                            metadata={"ai_model": "gemini-2.5-flash"}
+                            metadata={"ai_model": GEMINI_VISION_MODEL}
                         )
 
                     logger.info(f"✅ Фото проанализировано через Gemini для пользователя {user_id}")
@@ -3290,45 +3327,43 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # Вызываем xAI Grok API для анализа изображения с retry logic
         client = get_grok_client()
-        loop = asyncio.get_event_loop()
 
         # Включаем web_search для анализа фото (поиск информации о дефектах)
         search_params = {
             "mode": "auto", "return_citations": True, "sources": [{"type": "web"}, {"type": "news"}, {"type": "x"}]}
 
-        response = await loop.run_in_executor(
-            None,
-            lambda: call_grok_with_retry(
-                client,
-                model="grok-4-1-fast",  # Reasoning модель для анализа изображений
-                max_tokens=6000,
-                temperature=0.7,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": photo_base64
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": user_message
+        vision_started = time.perf_counter()
+        response = await call_grok_with_retry(
+            client,
+            model="grok-4-1-fast",  # Reasoning модель для анализа изображений
+            max_tokens=6000,
+            temperature=0.7,
+            messages=[
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": prepared.mime_type,
+                                "data": photo_base64
                             }
-                        ]
-                    }
-                ],
-                search_parameters=search_params
-            )
+                        },
+                        {
+                            "type": "text",
+                            "text": user_message
+                        }
+                    ]
+                }
+            ],
+            search_parameters=search_params
         )
+        get_photo_pipeline().report(prepared, time.perf_counter() - vision_started, "grok-4-1-fast")
         analysis = response["choices"][0]["message"]["content"]
 
         # Удаляем сообщение "анализирую фотографию"
@@ -3397,12 +3432,26 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     thinking_msg = await update.message.reply_text("🎤 Распознаю голосовое сообщение...")
 
+    chat_id = update.effective_chat.id
+    edit_limiter = get_edit_limiter()
+
+    async def show_partial(text: str):
+        # Длинное голосовое: показываем текст по мере распознавания (Vosk),
+        # правки - только в пределах лимита Telegram на чат
+        if not edit_limiter.try_acquire(chat_id):
+            return
+        try:
+            await thinking_msg.edit_text(f"🎤 Распознаю...\n\n{text[-3500:]} ▊")
+        except Exception as e:
+            logger.debug(f"Partial voice edit skipped: {e}")
+
     try:
         voice_file_id = update.message.voice.file_id
         result = await process_voice_message(
             bot=context.bot,
             voice_file_id=voice_file_id,
-            user_id=user_id
+            user_id=user_id,
+            on_partial=show_partial
         )
 
         if result["success"]:
@@ -3456,6 +3505,11 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Проект не найден")
         return
 
+    limit = await check_rate_limit(user_id, "document")
+    if not limit:
+        await update.message.reply_text(rate_limit_text(limit))
+        return
+
     try:
         # Проверяем размер файла
         file_size = update.message.document.file_size
@@ -3555,25 +3609,21 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                     # Отправляем на анализ Grok
                     client = get_grok_client()
-                    loop = asyncio.get_event_loop()
 
                     # Включаем web_search для анализа документов (поиск нормативов)
                     search_params = {
                         "mode": "auto", "return_citations": True, "sources": [{"type": "web"}, {"type": "news"}, {"type": "x"}]}
 
-                    response = await loop.run_in_executor(
-                        None,
-                        lambda: call_grok_with_retry(
-                            client,
-                            model="grok-4-1-fast",  # Reasoning модель для анализа документов
-                            max_tokens=6000,
-                            temperature=0.3,
-                            messages=[
-                                {"role": "system", "content": "Вы — эксперт по строительным нормативам РФ. Даёте профессиональные заключения по документам."},
-                                {"role": "user", "content": analysis_prompt}
-                            ],
-                            search_parameters=search_params
-                        )
+                    response = await call_grok_with_retry(
+                        client,
+                        model="grok-4-1-fast",  # Reasoning модель для анализа документов
+                        max_tokens=6000,
+                        temperature=0.3,
+                        messages=[
+                            {"role": "system", "content": "Вы — эксперт по строительным нормативам РФ. Даёте профессиональные заключения по документам."},
+                            {"role": "user", "content": analysis_prompt}
+                        ],
+                        search_parameters=search_params
                     )
                     expert_opinion = response["choices"][0]["message"]["content"]
 
@@ -3660,11 +3710,41 @@ async def handle_project_creation(update: Update, context: ContextTypes.DEFAULT_
             await update.message.reply_text(f"❌ Ошибка создания проекта: {result.get('error', '')}")
 
 
+async def send_fast_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, question: str, fast_answer):
+    """Отправить ответ из локальной базы с кнопкой уточнения у AI"""
+    user_id = update.effective_user.id
+    footer = f"\n\n---\n⚡ _{fast_answer.label} · {fast_answer.elapsed_ms:.1f} мс_"
+
+    answer = fast_answer.text
+    max_len = 4000 - len(footer)
+    if len(answer) > max_len:
+        answer = answer[:max_len] + "..."
+
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🤖 Уточнить у AI", callback_data="fast_refine")]
+    ])
+    context.user_data["fast_path_question"] = question
+    context.user_data["last_answer"] = answer
+    context.user_data["last_question"] = question
+
+    try:
+        await update.message.reply_text(answer + footer, reply_markup=keyboard, parse_mode="Markdown")
+    except Exception as e:
+        # Разметка базы не всегда валидна для Telegram - отправляем без неё
+        logger.warning(f"Fast answer markdown failed: {e}")
+        await update.message.reply_text(answer + footer, reply_markup=keyboard)
+
+    await add_message_to_history_async(user_id, 'assistant', answer)
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка текстовых сообщений с контекстом истории"""
     user_id = update.effective_user.id
     # Проверяем, есть ли распознанный текст из голосового сообщения
-    question = context.user_data.pop('_voice_recognized_text', None) or update.message.text
+    voice_text = context.user_data.pop('_voice_recognized_text', None)
+    question = voice_text or update.message.text
+    # Повторный вопрос по кнопке "Уточнить у AI" - без быстрого ответа
+    skip_fast_path = context.user_data.pop('_skip_fast_path', False)
 
     # Обработка кнопки "🎤 Real-time чат"
     if question and question.strip() == "🎤 Real-time чат":
@@ -3720,22 +3800,33 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #     ... (старый код удалён)
 
     # Проверка rate limit
-    if not check_rate_limit(user_id):
-        await update.message.reply_text(
-            "⏱️ Слишком много запросов!\n\n"
-            f"Вы можете отправлять до {RATE_LIMIT_MAX_REQUESTS} запросов в минуту.\n"
-            "Пожалуйста, подождите немного и попробуйте снова."
-        )
+    limit = await check_rate_limit(user_id, "voice" if voice_text else "text")
+    if not limit:
+        await update.message.reply_text(rate_limit_text(limit))
         return
 
     # Добавляем вопрос пользователя в историю
     await add_message_to_history_async(user_id, 'user', question)
 
+    # ============================================================================
+    # БЫСТРЫЙ ОТВЕТ: вопрос уже есть в FAQ / базе знаний - отвечаем без AI
+    # ============================================================================
+    if FAST_PATH_AVAILABLE and not skip_fast_path:
+        fast_answer = FAST_PATH.find_answer(question)
+        if fast_answer:
+            await send_fast_answer(update, context, question, fast_answer)
+            return
+
     # ============================================================================
     # LLM COUNCIL: Автоматическое определение сложных вопросов
     # ============================================================================
     if LLM_COUNCIL_AVAILABLE:
         is_complex, complexity_reason = is_complex_question(question)
+
+        # Совет дороже обычного ответа: сверх лимита отвечает одна модель
+        if is_complex and not await check_rate_limit(user_id, "council"):
+            logger.info(f"🏛️ LLM Council: лимит Совета для user {user_id}, отвечает одна модель")
+            is_complex = False
         
         if is_complex:
             logger.info(f"🏛️ LLM Council: Сложный вопрос обнаружен - {complexity_reason}")
@@ -3748,53 +3839,50 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "• Grok — технический анализ\n"
                 "• Claude — детальная экспертиза\n"
                 "• Gemini — практические рекомендации\n\n"
-                "_Это займёт 30-60 секунд для максимального качества..._",
+                "_Ответ появится здесь, как только ответят 2 эксперта из 3..._",
                 parse_mode="Markdown"
             )
             
+            renderer = None
             try:
                 council = get_llm_council()
                 if council:
-                    # Получаем контекст диалога
-                    conversation_history = get_conversation_context(user_id)
-                    context_text = ""
-                    if conversation_history:
-                        recent = conversation_history[-3:]
-                        context_text = "\n".join([f"{m['role']}: {m['content'][:200]}" for m in recent])
+                    # Получаем контекст диалога (без самого вопроса)
+                    context_text = get_council_context(user_id, question)
                     
-                    # Запускаем консультацию (skip_review=True для ускорения)
-                    result = await council.consult(question, context=context_text, skip_review=True)
+                    # Запускаем консультацию (skip_review=True для ускорения), синтез - потоком
+                    renderer = StreamRenderer(update.message, parse_mode="Markdown")
+                    await renderer.start(message=council_thinking)
+                    result = await council.consult(
+                        question, context=context_text, skip_review=True, on_chunk=renderer.feed
+                    )
                     
                     if result["success"]:
                         final_answer = result["final_answer"]
                         duration = result["duration_seconds"]
                         models = result["models_used"]
                         
-                        footer = f"\n\n---\n🏛️ _Совет AI: {', '.join(models)} | {duration:.1f} сек_"
-                        
-                        max_len = 4000 - len(footer)
-                        if len(final_answer) > max_len:
-                            final_answer = final_answer[:max_len] + "..."
-                        
-                        await council_thinking.edit_text(
-                            final_answer + footer,
-                            parse_mode="Markdown"
-                        )
+                        await renderer.feed(f"\n\n---\n🏛️ _Совет AI: {', '.join(models)} | {duration:.1f} сек_")
+                        await renderer.finish()
                         
                         await add_message_to_history_async(user_id, 'assistant', final_answer)
                         logger.info(f"✅ LLM Council auto: ответ за {duration:.1f} сек для user {user_id}")
                         return  # Ответ от Совета отправлен
                     else:
-                        # Совет не смог ответить - продолжаем обычную обработку
-                        await council_thinking.delete()
+                        # Совет не смог ответить - частичный синтез (и продолжения) удаляется,
+                        # продолжаем обычную обработку
+                        await renderer.abort()
                         logger.warning("LLM Council: не удалось получить ответ, fallback to single model")
                 else:
                     await council_thinking.delete()
             except Exception as e:
                 logger.error(f"LLM Council auto error: {e}")
                 try:
-                    await council_thinking.delete()
-                except:
+                    if renderer is not None:
+                        await renderer.abort()
+                    else:
+                        await council_thinking.delete()
+                except Exception:
                     pass
                 # Продолжаем обычную обработку
 
@@ -4192,21 +4280,15 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **ГЛАВНОЕ ПРАВИЛО: Анализируйте намерение пользователя и отвечайте соразмерно запросу!**
 """
 
-        # Получаем контекст предыдущих сообщений
-        conversation_history = get_conversation_context(user_id)
-
-        # Добавляем текущий вопрос
-        conversation_history.append({"role": "user", "content": question})
+        # История диалога (упаковывается в бюджет токенов модели перед вызовом)
+        load_user_history(user_id)
+        conversation_history = user_conversations[user_id][-CONTEXT_HISTORY_LIMIT:]
 
         # 🤖 УМНЫЙ ВЫБОР МОДЕЛИ: Определяем намерение пользователя
-        intent_info = await asyncio.get_event_loop().run_in_executor(
-            None,
-            lambda: classify_user_intent(question)
-        )
+        intent_info = await classify_user_intent(question)
 
         selected_model = intent_info["model"]
         selected_max_tokens = intent_info["max_tokens"]
-        intent_type = intent_info.get("intent_type", "technical_question")
 
         # 🌐 ИНСТРУМЕНТЫ ПОИСКА: Включаем для ВСЕХ запросов (всегда проверяем актуальность в интернете)
         search_params = {
@@ -4373,66 +4455,47 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         # 🎯 ГЕНЕРАЦИЯ ОТВЕТА (с выбором режима)
         client = get_grok_client()
-        loop = asyncio.get_event_loop()
-        # Добавляем system prompt в начало истории
-        messages_with_system = [{"role": "system", "content": system_prompt}] + conversation_history
+        # Контекст по бюджету токенов модели: свежие реплики целиком, старые - кратко в system prompt
+        context_result = CONTEXT_BUILDER.build(
+            conversation_history, system_prompts=[system_prompt], model=selected_model, question=question
+        )
+        messages_with_system = context_result.messages
+
+        # Одинаковые одновременные запросы (тот же промпт, история, роль) идут к провайдеру один раз
+        user_role = get_user_role(context) if ROLES_AVAILABLE else None
+        flight_key = make_flight_key(
+            question, user_role, messages_with_system,
+            model=selected_model, max_tokens=selected_max_tokens, search=search_params
+        )
 
         answer = ""
 
         # === STREAMING РЕЖИМ (постепенное появление текста) ===
+        stream_renderer = None
         if STREAMING_ENABLED:
-            streaming_msg = await update.message.reply_text("⏳ Генерирую ответ...")
+            # Правки сообщения по лимитам Telegram, длинный ответ продолжается в новых сообщениях
+            stream_renderer = StreamRenderer(update.message)
+            await stream_renderer.start()
 
-            try:
-                # Удаляем thinking message
-                try:
-                    await thinking_message.delete()
-                except:
-                    pass
-
-                # Переменные для streaming
-                last_update_time = 0
-                last_update_length = 0
-                update_interval = 0.15  # Обновляем каждые 0.15 секунды - быстро и плавно
-                chars_threshold = 8  # Или каждые 8 новых символов
-                typing_action_interval = 3  # Индикатор "печатает" раз в 3 секунды
-                last_typing_action = 0
-
-                logger.info("🚀 Начинаем двухфазную генерацию...")
+            async def stream_answer() -> str:
+                """Двухфазная генерация с выводом в stream_renderer; возвращает весь текст"""
+                streamed = ""
 
                 # ФАЗА 1: Быстрое начало (первые 300-500 токенов от быстрой модели)
                 first_phase_answer = ""
                 logger.info("📝 Фаза 1: Быстрая модель для начала ответа...")
 
-                async for chunk in call_grok_with_streaming(
+                async for chunk in LLM_SINGLE_FLIGHT.stream(f"{flight_key}:phase1", lambda: call_grok_with_streaming(
                     client,
                     model="grok-4-1-fast",  # Быстрая модель
                     messages=messages_with_system,
                     max_tokens=500,  # Только начало
                     temperature=0.7,
                     search_parameters=search_params
-                ):
+                )):
                     first_phase_answer += chunk
-                    answer += chunk
-
-                    # Обновляем сообщение часто для видимости печатания
-                    import time
-                    current_time = time.time()
-                    chars_diff = len(answer) - last_update_length
-
-                    if current_time - last_update_time >= update_interval or chars_diff >= chars_threshold:
-                        try:
-                            display_text = f"{answer}▊"  # Курсор печатания
-                            await streaming_msg.edit_text(display_text[:4096])
-                            last_update_time = current_time
-                            last_update_length = len(answer)
-
-                            # Показываем индикатор печатания редко (не замедляет)
-                            if current_time - last_typing_action >= typing_action_interval:
-                                await update.message.chat.send_action("typing")
-                                last_typing_action = current_time
-                        except Exception:
-                            pass
+                    streamed += chunk
+                    await stream_renderer.feed(chunk)
 
                 logger.info(f"✅ Фаза 1 завершена: {len(first_phase_answer)} символов")
 
@@ -4447,81 +4510,68 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         {"role": "user", "content": "Продолжи ответ, добавь детали, примеры и ссылки на нормативы."}
                     ]
 
-                    async for chunk in call_grok_with_streaming(
+                    phase2_key = make_flight_key(
+                        question, user_role, continuation_messages,
+                        model=selected_model, max_tokens=selected_max_tokens - 500, search=search_params
+                    )
+                    async for chunk in LLM_SINGLE_FLIGHT.stream(phase2_key, lambda: call_grok_with_streaming(
                         client,
                         model=selected_model,  # Основная модель
                         messages=continuation_messages,
                         max_tokens=selected_max_tokens - 500,
                         temperature=0.7,
                         search_parameters=search_params
-                    ):
-                        answer += chunk
-
-                        # Обновляем сообщение часто
-                        import time
-                        current_time = time.time()
-                        chars_diff = len(answer) - last_update_length
-
-                        if current_time - last_update_time >= update_interval or chars_diff >= chars_threshold:
-                            try:
-                                display_text = f"{answer}▊"
-                                await streaming_msg.edit_text(display_text[:4096])
-                                last_update_time = current_time
-                                last_update_length = len(answer)
-
-                                # Показываем индикатор печатания редко (не замедляет)
-                                if current_time - last_typing_action >= typing_action_interval:
-                                    await update.message.chat.send_action("typing")
-                                    last_typing_action = current_time
-                            except Exception:
-                                pass
+                    )):
+                        streamed += chunk
+                        await stream_renderer.feed(chunk)
 
                     logger.info("✅ Фаза 2 завершена")
 
-                # Финальное обновление без курсора
+                return streamed
+
+            try:
+                # Удаляем thinking message
                 try:
-                    # Если ответ короче 4096 символов - обновляем сообщение
-                    if len(answer) <= 4096:
-                        await streaming_msg.edit_text(answer)
-                    else:
-                        # Если ответ длинный - отправляем полную версию в новом сообщении
-                        await streaming_msg.edit_text(f"{answer[:4000]}...\n\n⚠️ Ответ был слишком длинным. Полная версия ниже:")
-                        # Отправляем полный ответ в отдельном сообщении
-                        chunks = [answer[i:i+4000] for i in range(0, len(answer), 4000)]
-                        for chunk in chunks:
-                            await update.message.reply_text(chunk)
-                except Exception as e:
-                    logger.error(f"Ошибка финального обновления streaming: {e}")
-                    # Fallback: отправляем полный ответ в любом случае
-                    try:
-                        chunks = [answer[i:i+4000] for i in range(0, len(answer), 4000)]
-                        for chunk in chunks:
-                            await update.message.reply_text(chunk)
-                    except:
-                        pass
+                    await thinking_message.delete()
+                except:
+                    pass
+
+                logger.info("🚀 Начинаем двухфазную генерацию...")
+
+                # Новое сообщение пользователя отменит генерацию (как в обычном режиме)
+                answer = await run_user_request(user_id, stream_answer())
 
+                # Финальный текст без курсора (кнопки добавляются после генерации подсказок)
+                await stream_renderer.finish()
+
+            except asyncio.CancelledError:
+                await stream_renderer.abort()
+                logger.info(f"🛑 Ответ для user {user_id} отменён - пользователь задал новый вопрос")
+                return
             except Exception as stream_error:
                 logger.error(f"❌ Ошибка streaming: {stream_error}")
                 # Fallback на обычный режим
-                try:
-                    await streaming_msg.delete()
-                except:
-                    pass
+                await stream_renderer.abort()
+                stream_renderer = None
 
                 thinking_message = await update.message.reply_text("🤔 Думаю над вашим вопросом...")
 
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: call_grok_with_retry(
+                try:
+                    response = await run_user_request(user_id, call_grok_with_retry(
                         client,
                         model=selected_model,
                         max_tokens=selected_max_tokens,
                         temperature=0.7,
                         messages=messages_with_system,
                         search_parameters=search_params
-                    )
-                )
+                    ))
+                except asyncio.CancelledError:
+                    try:
+                        await thinking_message.delete()
+                    except:
+                        pass
+                    logger.info(f"🛑 Ответ для user {user_id} отменён - пользователь задал новый вопрос")
+                    return
                 answer = response["choices"][0]["message"]["content"]
 
                 try:
@@ -4530,20 +4580,26 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     pass
 
         # === ОБЫЧНЫЙ РЕЖИМ (классический - ответ приходит сразу целиком) ===
-        else:
+        if not STREAMING_ENABLED:
             logger.info("📝 Обычный режим: генерация ответа без streaming...")
 
-            response = await loop.run_in_executor(
-                None,
-                lambda: call_grok_with_retry(
+            # Новое сообщение пользователя отменит этот запрос (не тратим токены на устаревший вопрос)
+            try:
+                response = await run_user_request(user_id, LLM_SINGLE_FLIGHT.do(flight_key, lambda: call_grok_with_retry(
                     client,
                     model=selected_model,
                     max_tokens=selected_max_tokens,
                     temperature=0.7,
                     messages=messages_with_system,
                     search_parameters=search_params
-                )
-            )
+                )))
+            except asyncio.CancelledError:
+                try:
+                    await thinking_message.delete()
+                except:
+                    pass
+                logger.info(f"🛑 Ответ для user {user_id} отменён - пользователь задал новый вопрос")
+                return
             answer = response["choices"][0]["message"]["content"]
 
             try:
@@ -4562,16 +4618,12 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 related_q_prompt = generate_smart_related_questions_prompt(question, answer)
 
                 # Генерируем вопросы используя тот же API
-                loop = asyncio.get_event_loop()
-                related_response = await loop.run_in_executor(
-                    None,
-                    lambda: call_grok_with_retry(
-                        client,
-                        model="grok-4-1-fast",  # Используем быструю модель
-                        max_tokens=300,
-                        temperature=0.8,
-                        messages=[{"role": "user", "content": related_q_prompt}]
-                    )
+                related_response = await call_grok_with_retry(
+                    client,
+                    model="grok-4-1-fast",  # Используем быструю модель
+                    max_tokens=300,
+                    temperature=0.8,
+                    messages=[{"role": "user", "content": related_q_prompt}]
                 )
                 related_q_text = related_response["choices"][0]["message"]["content"]
 
@@ -4604,10 +4656,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     logger.error(f"❌ Ошибка сохранения в проект: {e}")
 
         # Определяем упомянутые нормативы
-        mentioned_regs = []
-        for reg_code in REGULATIONS.keys():
-            if reg_code in answer:
-                mentioned_regs.append(reg_code)
+        mentioned_regs = find_mentioned_regulations(answer)
 
         # Формируем финальный ответ
         # По умолчанию показываем только ответ (как в примере: всё остальное можно раскрыть/скрыть кнопками)
@@ -4634,15 +4683,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if AUTO_APPLY_AVAILABLE and should_show_apply_button(answer) and is_developer(user_id):
             reply_markup = add_apply_button(reply_markup)
 
-        # Обновляем streaming сообщение финальным ответом с кнопками
+        # Ответ уже показан потоком - остаются только кнопки
         max_length = 4000  # Лимит Telegram
-        if len(result) > max_length:
-            # Если сообщение слишком длинное, удаляем streaming_msg и отправляем по частям
-            try:
-                await streaming_msg.delete()
-            except:
-                pass
-
+        if stream_renderer is not None:
+            await stream_renderer.attach_markup(reply_markup)
+        elif len(result) > max_length:
             parts = []
             current_part = ""
             for line in result.split('\n'):
@@ -4668,17 +4713,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         reply_markup=part_reply_markup
                     )
         else:
-            # Обновляем streaming сообщение финальным ответом с кнопками
-            try:
-                await streaming_msg.edit_text(result, reply_markup=reply_markup)
-            except Exception as e:
-                # Если не удалось отредактировать, отправляем новое сообщение
-                logger.warning(f"Could not edit streaming message: {e}")
-                try:
-                    await streaming_msg.delete()
-                except:
-                    pass
-                await update.message.reply_text(result, reply_markup=reply_markup)
+            await update.message.reply_text(result, reply_markup=reply_markup)
 
         logger.info(f"Question answered for user {update.effective_user.id} by Claude")
 
@@ -4691,10 +4726,10 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
-        # Удаляем streaming_msg если он существует
+        # Удаляем незавершённый потоковый ответ (завершённый остаётся)
         try:
-            if 'streaming_msg' in locals():
-                await streaming_msg.delete()
+            if 'stream_renderer' in locals() and stream_renderer is not None:
+                await stream_renderer.abort()
         except:
             pass
 
@@ -4746,6 +4781,40 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Обработка realtime_chat_start теперь в ConversationHandler (openai_realtime_bot_integration.py)
 
+    if query.data == "fast_refine":
+        # Быстрый ответ из базы не подошёл - тот же вопрос уходит модели
+        original_q = context.user_data.pop("fast_path_question", None)
+        if not original_q:
+            await query.answer("⚠️ Не найден исходный вопрос", show_alert=True)
+            return
+
+        # Сначала ответ на нажатие - иначе кнопка "крутится" всё время генерации
+        await query.answer("🤖 Уточняю у AI...")
+        FAST_PATH.record_refine()
+        try:
+            await query.edit_message_reply_markup(reply_markup=None)
+        except Exception:
+            pass
+
+        try:
+            from telegram import Message
+            fake_message = Message(
+                message_id=0,
+                date=datetime.now(),
+                chat=query.message.chat,
+                from_user=query.from_user,
+                text=original_q,
+            )
+            fake_update = Update(update_id=0, message=fake_message)
+            context.user_data["_skip_fast_path"] = True
+            # Нажатие уже обрабатывается в очереди пользователя (PerUserUpdateProcessor),
+            # и supersede_previous_request отменил его незавершённый AI запрос
+            await handle_text(fake_update, context)
+        except Exception as e:
+            logger.error(f"❌ Ошибка fast_refine: {e}")
+            await query.message.reply_text("⚠️ Не удалось отправить вопрос AI")
+        return
+
     await query.answer()
 
     if query.data == "regulations":
@@ -6040,6 +6109,93 @@ async def setup_bot_menu(application):
     logger.info("✅ Меню команд бота установлено")
 
 
+async def post_init(application):
+    """Запуск фоновых задач после старта приложения"""
+    # Процессы Vosk (forkserver) - сразу, чтобы модель загрузилась до первого голосового
+    if VOICE_HANDLER_AVAILABLE:
+        start_vosk_pool()
+
+    # Пул соединений xAI (keep-alive/HTTP2 на всё время работы бота)
+    await get_grok_client().start()
+
+    # Фоновая запись истории диалогов (write-behind)
+    history_store.start()
+    if HISTORY_MANAGER_AVAILABLE:
+        dialog_store.start()
+
+    # Кэш ответов: Redis-зеркало прогревает семантический индекс
+    if CACHE_AVAILABLE:
+        await init_cache()
+
+    # Лимиты запросов в Redis - общие для всех реплик и переживают перезапуск
+    await RATE_LIMITER.init_redis()
+
+    # Индексы быстрых ответов строятся при старте, а не на первом вопросе
+    if FAST_PATH_AVAILABLE:
+        await asyncio.get_running_loop().run_in_executor(None, FAST_PATH.warm_up)
+
+    # Фоновая выгрузка простаивающего состояния пользователей
+    if CACHE_AVAILABLE:
+        STATE_REGISTRY.register("Кэш ответов", MEMORY_CACHE, sweep=purge_expired_memory)
+    STATE_REGISTRY.register("Голосовые сессии", LIVE_SESSIONS.sessions)
+    STATE_REGISTRY.register("Фото для анализа", get_photo_pipeline().cache)
+    STATE_REGISTRY.start()
+
+    # Простой голосовых сессий всех бэкендов - колесо таймеров менеджера
+    LIVE_SESSIONS.start()
+
+
+async def post_shutdown(application):
+    """Остановка фоновых задач и сброс буферов при завершении"""
+    await STATE_REGISTRY.stop()
+    logger.info(f"📊 Голосовые сессии: {LIVE_SESSIONS.get_stats()}")
+    await LIVE_SESSIONS.stop()
+    await history_store.stop()
+    if HISTORY_MANAGER_AVAILABLE:
+        await dialog_store.stop()
+
+    if CACHE_AVAILABLE:
+        logger.info(f"📊 Кэш ответов: {get_cache_stats()}")
+        await close_cache()
+
+    await RATE_LIMITER.close()
+    logger.info(f"📊 Rate limit: {RATE_LIMITER.get_stats()}")
+
+    await get_grok_client().aclose()
+    logger.info(f"📊 xAI метрики: {get_grok_client().get_metrics()}")
+    logger.info(f"📊 Single-flight: {LLM_SINGLE_FLIGHT.get_stats()}")
+    logger.info(f"📊 Потоковые ответы: {get_stream_stats()}")
+    logger.info(f"📊 Контекст диалога: {CONTEXT_BUILDER.get_stats()}")
+    logger.info(f"📊 Кэш промптов: {get_prompt_cache_stats()}")
+    logger.info(f"📊 Очереди пользователей: {USER_ACTORS.get_stats()}")
+    logger.info(f"📊 Состояние в памяти: {STATE_REGISTRY.get_stats()}")
+    logger.info(f"📊 Подготовка фото: {get_photo_pipeline().get_stats()}")
+    get_photo_pipeline().close()
+    if VOICE_HANDLER_AVAILABLE:
+        logger.info(f"📊 Конвертация аудио: {get_audio_converter().get_stats()}")
+        if get_vosk_pool().started:
+            logger.info(f"📊 Распознавание Vosk: {get_vosk_pool().get_stats()}")
+            get_vosk_pool().close()
+    if LLM_COUNCIL_AVAILABLE:
+        logger.info(f"📊 Совет AI: {get_council_stats()}")
+    if FAST_PATH_AVAILABLE:
+        logger.info(f"📊 Быстрые ответы: {FAST_PATH.get_stats()}")
+    logger.info(f"📊 Классификация намерений: {INTENT_ROUTER.get_stats()}")
+    if model_selector is not None:
+        logger.info(f"📊 Выбор моделей: {model_selector.get_stats()}")
+    logger.info("✅ История диалогов сохранена на диск")
+
+
+def supersede_previous_request(user_id: int, update: Update):
+    """Новый вопрос встал в очередь за незавершённым - предыдущий AI запрос не ждём"""
+    message = update.message
+    if message is not None and message.text and not message.text.startswith("/"):
+        cancel_user_request(user_id)
+    elif update.callback_query is not None and update.callback_query.data == "fast_refine":
+        # "Уточнить у AI" - тоже новый вопрос модели
+        cancel_user_request(user_id)
+
+
 def main():
     """Запуск бота"""
     import asyncio
@@ -6062,7 +6218,15 @@ def main():
     logger.info("✅ Бот СтройНадзорAI запущен успешно!")
 
     # Создаем приложение
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        # Разные пользователи - параллельно, обновления одного пользователя - по очереди
+        .concurrent_updates(PerUserUpdateProcessor(on_queued=supersede_previous_request))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
@@ -6072,6 +6236,7 @@ def main():
     application.add_handler(CommandHandler("history", history_command))
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler("clear", clear_command))
+    application.add_handler(CommandHandler("memory", memory_command))
     # Новые команды v2.1
     application.add_handler(CommandHandler("export", export_command))
     application.add_handler(CommandHandler("search", search_command))
@@ -2,15 +2,26 @@
 Модуль кэширования ответов v3.8
 Redis для хранения популярных вопросов и ответов
 Экономия API токенов на повторяющихся вопросах
+
+v3.9: семантический кэш - хэшированные TF-IDF векторы (основы слов + символьные
+триграммы) в инвертированном индексе на NumPy, top-k поиск за доли миллисекунды,
+LRU/TTL вытеснение в памяти и Redis как постоянное зеркало.
 """
 
 import os
 import json
+import math
+import time
+import zlib
 import hashlib
 import logging
-from typing import Optional, Dict, Any
+from array import array
+from collections import OrderedDict, Counter, deque
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import timedelta
 
+from russian_text import stem_tokens, char_ngrams
+
 logger = logging.getLogger(__name__)
 
 # Попробуем импортировать Redis
@@ -21,18 +32,291 @@ except ImportError:
     REDIS_AVAILABLE = False
     logger.warning("⚠️ Redis не установлен. Кэширование будет работать в памяти.")
 
-# Локальный кэш в памяти (фолбэк если Redis недоступен)
-MEMORY_CACHE: Dict[str, Any] = {}
+# NumPy ускоряет подсчёт похожести (без него - чистый Python)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    logger.warning("⚠️ NumPy не установлен. Семантический поиск в кэше будет медленнее.")
+
+# Лимиты кэша в памяти
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+DEFAULT_TTL_HOURS = 168  # 7 дней
+
+# Локальный кэш в памяти (LRU: самые старые в начале). В режиме Redis - L1 перед Redis.
+MEMORY_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
 CACHE_STATS = {
     'hits': 0,
     'misses': 0,
-    'total_saved_tokens': 0
+    'total_saved_tokens': 0,
+    'semantic_lookups': 0,
+    'semantic_hits': 0,
+    'semantic_time_us': 0.0,
+    'evictions': 0,
+    'expired': 0
 }
+# Последние задержки семантического поиска (мкс) для p95
+SEMANTIC_LATENCIES = deque(maxlen=1000)
 
 # Redis клиент (тип указывается условно)
 redis_client = None  # type: Optional[Any]
 
 
+# ========================================
+# СЕМАНТИЧЕСКИЙ ИНДЕКС
+# ========================================
+
+# Размер пространства хэшированных признаков (2^20)
+FEATURE_MASK = (1 << 20) - 1
+# Вес символьных триграмм относительно целых основ
+NGRAM_WEIGHT = 0.3
+
+
+def _feature_id(feature: str) -> int:
+    """Стабильный хэш признака (не зависит от PYTHONHASHSEED)"""
+    return zlib.crc32(feature.encode("utf-8")) & FEATURE_MASK
+
+
+def extract_features(text: str) -> Dict[int, float]:
+    """
+    Хэшированные признаки текста: основы слов и их символьные триграммы
+
+    Returns:
+        {id признака: сублинейная частота}
+    """
+    counts: Counter = Counter()
+    for token in stem_tokens(text):
+        counts[_feature_id(token)] += 1.0
+        for gram in char_ngrams(token):
+            counts[_feature_id("#" + gram)] += NGRAM_WEIGHT
+
+    return {fid: 1.0 + math.log(tf) if tf >= 1.0 else tf for fid, tf in counts.items()}
+
+
+class SemanticIndex:
+    """
+    Инвертированный индекс хэшированных TF-IDF векторов
+
+    Каждый признак хранит список (строка, вес) в компактных массивах. Запрос
+    читает списки самых редких (информативных) своих признаков в пределах
+    бюджета POSTINGS_BUDGET, набирает кандидатов через np.bincount и
+    пересчитывает для них точный косинус по сохранённым векторам строк.
+    Время поиска зависит от бюджета, а не от размера кэша.
+    """
+
+    # Сколько записей списков читать на запрос
+    POSTINGS_BUDGET = 16384
+    # Кандидатов на точный пересчёт (на один результат top_k)
+    CANDIDATES_PER_RESULT = 4
+
+    def __init__(self):
+        self._postings: Dict[int, Tuple[array, array]] = {}
+        self._row_keys: List[Optional[str]] = []
+        self._key_rows: Dict[str, int] = {}
+        self._dead_rows = 0
+        # Векторы строк подряд: признаки строки r лежат в [_row_offsets[r], _row_offsets[r + 1])
+        self._row_fids = array('i')
+        self._row_weights = array('f')
+        self._row_offsets = array('q', [0])
+        self._tiebreak_cache = None
+
+    def __len__(self) -> int:
+        return len(self._key_rows)
+
+    def _idf(self, fid: int) -> float:
+        postings = self._postings.get(fid)
+        df = len(postings[0]) if postings else 0
+        return math.log((len(self._row_keys) + 1) / (df + 1)) + 1.0
+
+    def _weighted(self, features: Dict[int, float]) -> Dict[int, float]:
+        """TF-IDF вектор с L2 нормировкой"""
+        vector = {fid: tf * self._idf(fid) for fid, tf in features.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {fid: w / norm for fid, w in vector.items()}
+
+    def add(self, key: str, text: str):
+        """Добавить (или заменить) текст под ключом"""
+        if key in self._key_rows:
+            self.remove(key)
+
+        row = len(self._row_keys)
+        self._row_keys.append(key)
+        self._key_rows[key] = row
+
+        for fid, weight in self._weighted(extract_features(text)).items():
+            postings = self._postings.get(fid)
+            if postings is None:
+                postings = self._postings[fid] = (array('i'), array('f'))
+            postings[0].append(row)
+            postings[1].append(weight)
+            self._row_fids.append(fid)
+            self._row_weights.append(weight)
+        self._row_offsets.append(len(self._row_fids))
+
+    def remove(self, key: str):
+        """Пометить ключ удалённым (место освобождается при перестроении)"""
+        row = self._key_rows.pop(key, None)
+        if row is not None:
+            self._row_keys[row] = None
+            self._dead_rows += 1
+
+    def needs_rebuild(self) -> bool:
+        """Удалённых строк больше, чем живых"""
+        return self._dead_rows > 1000 and self._dead_rows > len(self._key_rows)
+
+    def rebuild(self, items: List[Tuple[str, str]]):
+        """Перестроить индекс с нуля по парам (ключ, текст)"""
+        self.__init__()
+        for key, text in items:
+            self.add(key, text)
+
+    def _exact_score(self, row: int, query: Dict[int, float]) -> float:
+        """Точный косинус строки и запроса"""
+        start, end = self._row_offsets[row], self._row_offsets[row + 1]
+        return sum(
+            query.get(fid, 0.0) * w
+            for fid, w in zip(self._row_fids[start:end], self._row_weights[start:end])
+        )
+
+    def _tiebreak(self, n_rows: int):
+        """Убывающая по номеру строки поправка ~1e-9 (кэшируется)"""
+        if self._tiebreak_cache is None or len(self._tiebreak_cache) < n_rows:
+            self._tiebreak_cache = np.linspace(1e-9, 0.0, max(n_rows * 2, 1024))
+        return self._tiebreak_cache[:n_rows]
+
+    def _exact_scores_np(self, rows, query: Dict[int, float]):
+        """Точный косинус сразу для нескольких строк (NumPy)"""
+        offsets = np.frombuffer(self._row_offsets, dtype=np.int64)
+        starts, ends = offsets[rows], offsets[rows + 1]
+        lengths = ends - starts
+        segment_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        positions = np.repeat(starts - segment_starts, lengths) + np.arange(lengths.sum())
+
+        fids = np.frombuffer(self._row_fids, dtype=np.int32)[positions]
+        weights = np.frombuffer(self._row_weights, dtype=np.float32)[positions]
+
+        query_fids = np.fromiter(sorted(query), dtype=np.int32, count=len(query))
+        query_weights = np.array([query[fid] for fid in query_fids.tolist()])
+        idx = np.minimum(np.searchsorted(query_fids, fids), len(query_fids) - 1)
+        contrib = np.where(query_fids[idx] == fids, query_weights[idx] * weights, 0.0)
+        return np.add.reduceat(contrib, segment_starts)
+
+    def search(self, text: str, top_k: int = 5) -> List[Tuple[float, str]]:
+        """
+        Найти top_k ближайших текстов
+
+        Returns:
+            [(косинусная похожесть 0..1, ключ)] по убыванию похожести
+        """
+        if not self._key_rows:
+            return []
+
+        query = self._weighted(extract_features(text))
+
+        # Самые весомые (редкие) признаки запроса - первыми, пока хватает бюджета
+        hits = sorted(
+            ((self._postings[fid], w) for fid, w in query.items() if fid in self._postings),
+            key=lambda item: item[1],
+            reverse=True
+        )
+        if not hits:
+            return []
+
+        selected, budget = [], self.POSTINGS_BUDGET
+        for postings, w in hits:
+            if selected and len(postings[0]) > budget:
+                continue
+            selected.append((postings, w))
+            budget -= len(postings[0])
+        exact = len(selected) == len(hits)
+
+        n_candidates = max(top_k * self.CANDIDATES_PER_RESULT, 16)
+        if NUMPY_AVAILABLE:
+            rows = np.concatenate([np.frombuffer(p[0], dtype=np.int32) for p, _ in selected])
+            weights = np.concatenate([np.frombuffer(p[1], dtype=np.float32) * w for p, w in selected])
+            scores = np.bincount(rows, weights=weights, minlength=len(self._row_keys))
+
+            if len(scores) > n_candidates:
+                # Разводим равные счёты: на массовых ничьих argpartition деградирует
+                ranked = scores + self._tiebreak(len(scores))
+                top = np.argpartition(ranked, len(scores) - n_candidates)[-n_candidates:]
+            else:
+                top = np.arange(len(scores))
+            top = top[scores[top] > 0]
+            # Частичные суммы - только для отбора, итоговый счёт считаем точно
+            top_scores = scores[top] if exact else self._exact_scores_np(top, query)
+            candidates = [(float(score), int(row)) for score, row in zip(top_scores, top)]
+        else:
+            acc: Dict[int, float] = {}
+            for (rows, weights), w in selected:
+                for r, dw in zip(rows, weights):
+                    acc[r] = acc.get(r, 0.0) + dw * w
+            candidates = sorted(((score, r) for r, score in acc.items()), reverse=True)[:n_candidates]
+            if not exact:
+                candidates = [(self._exact_score(row, query), row) for _, row in candidates]
+
+        candidates = [(score, row) for score, row in candidates if self._row_keys[row] is not None]
+        candidates.sort(reverse=True)
+        return [(min(score, 1.0), self._row_keys[row]) for score, row in candidates[:top_k]]
+
+
+# Индекс вопросов из MEMORY_CACHE
+SEMANTIC_INDEX = SemanticIndex()
+
+
+def _memory_put(cache_key: str, question: str, answer: str, ttl_hours: float,
+                user_context: Optional[str] = None, count: int = 0):
+    """Положить ответ в память (LRU) и в семантический индекс"""
+    MEMORY_CACHE[cache_key] = {
+        'answer': answer,
+        'question': question,
+        'context': user_context,
+        'count': count,
+        'expires_at': time.time() + ttl_hours * 3600
+    }
+    MEMORY_CACHE.move_to_end(cache_key)
+    SEMANTIC_INDEX.add(cache_key, question)
+
+    # Вытесняем самые давно использованные записи
+    while len(MEMORY_CACHE) > CACHE_MAX_ENTRIES:
+        oldest_key, _ = MEMORY_CACHE.popitem(last=False)
+        SEMANTIC_INDEX.remove(oldest_key)
+        CACHE_STATS['evictions'] += 1
+
+    if SEMANTIC_INDEX.needs_rebuild():
+        SEMANTIC_INDEX.rebuild([(k, v['question']) for k, v in MEMORY_CACHE.items()])
+
+
+def _memory_get(cache_key: str) -> Optional[Dict[str, Any]]:
+    """Получить запись из памяти с проверкой TTL и обновлением LRU"""
+    entry = MEMORY_CACHE.get(cache_key)
+    if entry is None:
+        return None
+
+    if entry['expires_at'] < time.time():
+        del MEMORY_CACHE[cache_key]
+        SEMANTIC_INDEX.remove(cache_key)
+        CACHE_STATS['expired'] += 1
+        return None
+
+    MEMORY_CACHE.move_to_end(cache_key)
+    return entry
+
+
+def purge_expired_memory() -> int:
+    """Удалить из памяти записи с истёкшим TTL (фоновая очистка)"""
+    now = time.time()
+    expired = [key for key, entry in MEMORY_CACHE.items() if entry['expires_at'] < now]
+    for key in expired:
+        del MEMORY_CACHE[key]
+        SEMANTIC_INDEX.remove(key)
+    CACHE_STATS['expired'] += len(expired)
+    if SEMANTIC_INDEX.needs_rebuild():
+        SEMANTIC_INDEX.rebuild([(k, v['question']) for k, v in MEMORY_CACHE.items()])
+    return len(expired)
+
+
 # ========================================
 # ИНИЦИАЛИЗАЦИЯ
 # ========================================
@@ -64,6 +348,9 @@ async def init_cache():
         # Проверяем соединение
         await redis_client.ping()
         logger.info("✅ Redis подключен успешно")
+
+        # Прогреваем семантический индекс из постоянного зеркала
+        await warm_memory_cache_from_redis()
         return True
 
     except Exception as e:
@@ -73,6 +360,44 @@ async def init_cache():
         return True
 
 
+async def warm_memory_cache_from_redis(limit: int = CACHE_MAX_ENTRIES) -> int:
+    """
+    Загрузить вопросы и ответы из Redis в память и семантический индекс
+
+    Returns:
+        Количество загруженных записей
+    """
+    if not redis_client:
+        return 0
+
+    loaded = 0
+    try:
+        cursor = "0"
+        while loaded < limit:
+            cursor, keys = await redis_client.scan(cursor, match="qa:q:*", count=500)
+            if keys:
+                cache_keys = [f"qa:{key[len('qa:q:'):]}" for key in keys]
+                questions = await redis_client.mget(keys)
+                answers = await redis_client.mget(cache_keys)
+                ttls = [await redis_client.ttl(key) for key in cache_keys]
+
+                for cache_key, meta, answer, ttl in zip(cache_keys, questions, answers, ttls):
+                    if not meta or not answer or ttl is None or ttl <= 0:
+                        continue
+                    meta = json.loads(meta)
+                    _memory_put(cache_key, meta['question'], answer, ttl / 3600, meta.get('context'))
+                    loaded += 1
+
+            if cursor in ("0", 0):
+                break
+
+        logger.info(f"🔍 Семантический индекс прогрет из Redis: {loaded} вопросов")
+    except Exception as e:
+        logger.error(f"Ошибка прогрева кэша из Redis: {e}")
+
+    return loaded
+
+
 async def close_cache():
     """Закрыть соединение с Redis"""
     global redis_client
@@ -125,7 +450,17 @@ async def get_cached_answer(question: str, user_context: Optional[str] = None) -
     cache_key = f"qa:{generate_cache_key(question, user_context)}"
 
     try:
-        # Пробуем Redis
+        # Сначала память (L1)
+        entry = _memory_get(cache_key)
+        if entry:
+            CACHE_STATS['hits'] += 1
+            entry['count'] += 1
+            logger.info(f"✅ Memory cache HIT: {cache_key[:16]}...")
+            if redis_client:
+                await redis_client.incr(f"{cache_key}:count")
+            return entry['answer']
+
+        # Затем Redis
         if redis_client:
             answer = await redis_client.get(cache_key)
 
@@ -136,13 +471,12 @@ async def get_cached_answer(question: str, user_context: Optional[str] = None) -
                 # Увеличиваем счётчик использований
                 await redis_client.incr(f"{cache_key}:count")
 
-                return answer
+                # Поднимаем в память, чтобы вопрос находился и семантически
+                ttl = await redis_client.ttl(cache_key)
+                if ttl and ttl > 0:
+                    _memory_put(cache_key, question, answer, ttl / 3600, user_context)
 
-        # Локальный кэш
-        elif cache_key in MEMORY_CACHE:
-            CACHE_STATS['hits'] += 1
-            logger.info(f"✅ Memory cache HIT: {cache_key[:16]}...")
-            return MEMORY_CACHE[cache_key]['answer']
+                return answer
 
         # Кэш мисс
         CACHE_STATS['misses'] += 1
@@ -157,7 +491,7 @@ async def set_cached_answer(
     question: str,
     answer: str,
     user_context: Optional[str] = None,
-    ttl_hours: int = 168  # 7 дней по умолчанию
+    ttl_hours: int = DEFAULT_TTL_HOURS
 ) -> bool:
     """
     Сохранить ответ в кэш
@@ -174,44 +508,31 @@ async def set_cached_answer(
     cache_key = f"qa:{generate_cache_key(question, user_context)}"
 
     try:
-        # Сохраняем в Redis
+        # Память + семантический индекс (всегда)
+        _memory_put(cache_key, question, answer, ttl_hours, user_context)
+
+        # Постоянное зеркало в Redis
         if redis_client:
-            ttl = timedelta(hours=ttl_hours)
+            ttl = int(timedelta(hours=ttl_hours).total_seconds())
 
             # Сохраняем ответ
-            await redis_client.setex(
-                cache_key,
-                int(ttl.total_seconds()),
-                answer
-            )
+            await redis_client.setex(cache_key, ttl, answer)
 
             # Инициализируем счётчик
-            count_key = f"{cache_key}:count"
+            await redis_client.setex(f"{cache_key}:count", ttl, "0")
+
+            # Вопрос нужен для восстановления семантического индекса после рестарта
             await redis_client.setex(
-                count_key,
-                int(ttl.total_seconds()),
-                "0"
+                f"qa:q:{cache_key[len('qa:'):]}",
+                ttl,
+                json.dumps({'question': question, 'context': user_context}, ensure_ascii=False)
             )
 
             logger.info(f"💾 Ответ сохранён в Redis: {cache_key[:16]}... (TTL: {ttl_hours}h)")
             return True
 
-        # Локальный кэш
-        else:
-            MEMORY_CACHE[cache_key] = {
-                'answer': answer,
-                'question': question,
-                'count': 0
-            }
-
-            # Ограничиваем размер кэша в памяти
-            if len(MEMORY_CACHE) > 1000:
-                # Удаляем самый старый элемент
-                oldest_key = next(iter(MEMORY_CACHE))
-                del MEMORY_CACHE[oldest_key]
-
-            logger.info(f"💾 Ответ сохранён в памяти: {cache_key[:16]}...")
-            return True
+        logger.info(f"💾 Ответ сохранён в памяти: {cache_key[:16]}...")
+        return True
 
     except Exception as e:
         logger.error(f"Ошибка сохранения в кэш: {e}")
@@ -308,9 +629,9 @@ async def clear_cache():
                     break
 
             logger.info("✅ Redis кэш очищен")
-        else:
-            MEMORY_CACHE.clear()
-            logger.info("✅ Локальный кэш очищен")
+        MEMORY_CACHE.clear()
+        SEMANTIC_INDEX.rebuild([])
+        logger.info("✅ Локальный кэш очищен")
 
         return True
 
@@ -325,12 +646,28 @@ def get_cache_stats() -> dict:
     if CACHE_STATS['hits'] + CACHE_STATS['misses'] > 0:
         hit_rate = CACHE_STATS['hits'] / (CACHE_STATS['hits'] + CACHE_STATS['misses']) * 100
 
+    semantic_hit_rate = 0
+    avg_semantic_us = 0.0
+    if CACHE_STATS['semantic_lookups'] > 0:
+        semantic_hit_rate = CACHE_STATS['semantic_hits'] / CACHE_STATS['semantic_lookups'] * 100
+        avg_semantic_us = CACHE_STATS['semantic_time_us'] / CACHE_STATS['semantic_lookups']
+
+    latencies = sorted(SEMANTIC_LATENCIES)
+    p95_semantic_us = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+
     return {
         'hits': CACHE_STATS['hits'],
         'misses': CACHE_STATS['misses'],
         'hit_rate': f"{hit_rate:.1f}%",
         'cache_type': 'Redis' if redis_client else 'Memory',
-        'memory_cache_size': len(MEMORY_CACHE) if not redis_client else 0
+        'memory_cache_size': len(MEMORY_CACHE),
+        'semantic_index_size': len(SEMANTIC_INDEX),
+        'semantic_lookups': CACHE_STATS['semantic_lookups'],
+        'semantic_hit_rate': f"{semantic_hit_rate:.1f}%",
+        'semantic_avg_us': round(avg_semantic_us, 1),
+        'semantic_p95_us': round(p95_semantic_us, 1),
+        'evictions': CACHE_STATS['evictions'],
+        'expired': CACHE_STATS['expired']
     }
 
 
@@ -364,38 +701,72 @@ def calculate_similarity(text1: str, text2: str) -> float:
     return intersection / union
 
 
-async def find_similar_cached_question(question: str, threshold: float = 0.7) -> Optional[str]:
+def find_similar_cached_questions(
+    question: str,
+    top_k: int = 5,
+    threshold: float = 0.0,
+    user_context: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Top-k похожих вопросов из кэша (семантический индекс)
+
+    Args:
+        question: Вопрос пользователя
+        top_k: Сколько результатов вернуть
+        threshold: Минимальная похожесть (0-1)
+        user_context: Если задан - только записи с тем же контекстом
+
+    Returns:
+        [{'question', 'answer', 'similarity'}] по убыванию похожести
+    """
+    started = time.perf_counter()
+    results = []
+
+    for similarity, cache_key in SEMANTIC_INDEX.search(question, top_k=top_k * 2 if user_context else top_k):
+        if similarity < threshold:
+            break
+        entry = _memory_get(cache_key)
+        if entry is None or (user_context and entry.get('context') != user_context):
+            continue
+        results.append({
+            'question': entry['question'],
+            'answer': entry['answer'],
+            'similarity': similarity
+        })
+        if len(results) >= top_k:
+            break
+
+    elapsed_us = (time.perf_counter() - started) * 1_000_000
+    CACHE_STATS['semantic_lookups'] += 1
+    CACHE_STATS['semantic_time_us'] += elapsed_us
+    SEMANTIC_LATENCIES.append(elapsed_us)
+    if results:
+        CACHE_STATS['semantic_hits'] += 1
+
+    return results
+
+
+async def find_similar_cached_question(
+    question: str,
+    threshold: float = 0.7,
+    user_context: Optional[str] = None
+) -> Optional[str]:
     """
     Найти похожий вопрос в кэше
 
     Args:
         question: Вопрос пользователя
         threshold: Порог похожести (0-1)
+        user_context: Контекст (роль пользователя и т.д.)
 
     Returns:
         Кэшированный ответ или None
     """
     try:
-        if not redis_client and not MEMORY_CACHE:
-            return None
-
-        # Ищем в локальном кэше
-        if MEMORY_CACHE:
-            best_similarity = 0
-            best_answer = None
-
-            for cache_key, data in MEMORY_CACHE.items():
-                cached_question = data.get('question', '')
-                similarity = calculate_similarity(question, cached_question)
-
-                if similarity > best_similarity and similarity >= threshold:
-                    best_similarity = similarity
-                    best_answer = data['answer']
-
-            if best_answer:
-                logger.info(f"🔍 Найден похожий вопрос (similarity: {best_similarity:.2f})")
-                return best_answer
-
+        matches = find_similar_cached_questions(question, top_k=1, threshold=threshold, user_context=user_context)
+        if matches:
+            logger.info(f"🔍 Найден похожий вопрос (similarity: {matches[0]['similarity']:.2f})")
+            return matches[0]['answer']
         return None
 
     except Exception as e:
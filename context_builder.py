@@ -0,0 +1,331 @@
+"""
+Сборка контекста диалога по бюджету токенов v1.0
+Замена "последних N сообщений" (bot.get_conversation_context,
+history_manager.get_user_history) на упаковку по числу токенов
+
+- Токены оцениваются приближённо (куски слов как у BPE: кириллица ~3 символа
+  на токен, латиница ~4), оценка кэшируется по тексту сообщения
+- Бюджет входного контекста свой для каждой модели (CONTEXT_TOKEN_BUDGETS)
+- Свежие сообщения берутся целиком, пока помещаются; более старые сжимаются
+  в краткое содержание (вопрос + первая фраза ответа + упомянутые нормативы).
+  Краткое содержание реплики кэшируется, поэтому при следующем вопросе
+  пересчитывается только то, что впервые вышло за бюджет
+- Системные промпты (optimized_prompts, role_modes, проект) собираются в одно
+  system-сообщение без повторов; system-сообщения из истории не дублируются
+- Повторы подряд (тот же вопрос в истории и в текущем запросе) удаляются
+- Статистика: сколько токенов отправлено и сэкономлено относительно прежнего
+  окна из последних MAX_CONTEXT_MESSAGES сообщений
+"""
+
+import os
+import re
+import math
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Бюджет входного контекста (system + история + вопрос) по умолчанию
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+
+# Бюджеты для моделей (остальные - CONTEXT_TOKEN_BUDGET)
+CONTEXT_TOKEN_BUDGETS = {
+    "grok-4-1-fast": CONTEXT_TOKEN_BUDGET,
+    "claude-sonnet-4-5-20250929": 8000,
+    "gemini-2.5-flash": 8000,
+}
+
+# Доля бюджета под краткое содержание старых реплик
+SUMMARY_SHARE = 0.15
+
+# Длина краткого содержания одной реплики (символов)
+SUMMARY_QUESTION_CHARS = 150
+SUMMARY_ANSWER_CHARS = 200
+
+# Прежнее окно контекста - для подсчёта экономии
+BASELINE_MESSAGES = 10
+
+# Сколько последних записей истории читать (больше в бюджет всё равно не войдёт)
+CONTEXT_HISTORY_LIMIT = 50
+
+SUMMARY_HEADER = "📋 РАНЕЕ В ДИАЛОГЕ (кратко):"
+
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d+|[^\w\s]", re.UNICODE)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s")
+
+
+# ========================================
+# ОЦЕНКА ТОКЕНОВ
+# ========================================
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """Приближённое число токенов (BPE): кириллица ~3 символа, латиница ~4, числа ~3 цифры"""
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece[0].isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        elif piece.isascii():
+            tokens += math.ceil(len(piece) / 4)
+        elif piece[0].isalpha():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+def message_tokens(message: dict) -> int:
+    """Токены сообщения (с накладными расходами на роль)"""
+    content = message.get("content")
+    if not isinstance(content, str):
+        return 0
+    return estimate_tokens(content) + 4
+
+
+# ========================================
+# КРАТКОЕ СОДЕРЖАНИЕ
+# ========================================
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+def summarize_message(message: dict) -> str:
+    """Одна строка о реплике: вопрос или первая фраза ответа и нормативы"""
+    content = message.get("content") or ""
+    if message.get("role") == "user":
+        return f"❓ {_clip(content, SUMMARY_QUESTION_CHARS)}"
+
+    plain = content.replace("*", "").replace("#", "").replace("_", " ")
+    first = _SENTENCE_END_RE.split(" ".join(plain.split()), maxsplit=1)[0]
+    line = f"🤖 {_clip(first, SUMMARY_ANSWER_CHARS)}"
+    try:
+        from regulation_matcher import extract_regulation_codes
+        codes = extract_regulation_codes(content)[:3]
+    except ImportError:
+        codes = []
+    if codes:
+        line += f" [{', '.join(codes)}]"
+    return line
+
+
+# ========================================
+# СБОРКА
+# ========================================
+
+@dataclass
+class ContextResult:
+    """Собранный контекст"""
+
+    system: str
+    history: List[dict]
+    question: Optional[str]
+    tokens: int
+    baseline_tokens: int
+    kept_messages: int
+    summarized_messages: int
+    dropped_messages: int = 0
+    duplicates_removed: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        """Экономия относительно прежнего окна (отрицательная - контекста стало больше)"""
+        return self.baseline_tokens - self.tokens
+
+    @property
+    def messages(self) -> List[dict]:
+        """Сообщения для API: system, история, текущий вопрос"""
+        messages = [{"role": "system", "content": self.system}] if self.system else []
+        messages.extend(self.history)
+        if self.question:
+            messages.append({"role": "user", "content": self.question})
+        return messages
+
+
+@dataclass
+class ContextStats:
+    requests: int = 0
+    tokens_sent: int = 0
+    baseline_tokens: int = 0
+    summarized_messages: int = 0
+    duplicates_removed: int = 0
+    budget_by_model: Dict[str, int] = field(default_factory=dict)
+
+
+class ContextBuilder:
+    """Упаковка истории диалога в бюджет токенов модели"""
+
+    def __init__(
+        self,
+        budgets: Optional[Dict[str, int]] = None,
+        default_budget: int = CONTEXT_TOKEN_BUDGET,
+        summary_share: float = SUMMARY_SHARE,
+        baseline_messages: int = BASELINE_MESSAGES,
+        summary_cache_size: int = 4096
+    ):
+        self.budgets = budgets if budgets is not None else CONTEXT_TOKEN_BUDGETS
+        self.default_budget = default_budget
+        self.summary_share = summary_share
+        self.baseline_messages = baseline_messages
+        self.summary_cache_size = summary_cache_size
+        self._summaries: "OrderedDict[tuple, str]" = OrderedDict()
+        self.stats = ContextStats()
+        self.summary_cache_hits = 0
+
+    def budget_for(self, model: Optional[str]) -> int:
+        return self.budgets.get(model, self.default_budget) if model else self.default_budget
+
+    def _summary(self, message: dict) -> str:
+        key = (message.get("role"), message.get("content"))
+        line = self._summaries.get(key)
+        if line is not None:
+            self._summaries.move_to_end(key)
+            self.summary_cache_hits += 1
+            return line
+        line = self._summaries[key] = summarize_message(message)
+        if len(self._summaries) > self.summary_cache_size:
+            self._summaries.popitem(last=False)
+        return line
+
+    @staticmethod
+    def merge_system_prompts(prompts: Iterable[str]) -> str:
+        """Одно system-сообщение: без пустых, повторов и промптов, вложенных в другие"""
+        unique = list(dict.fromkeys(p.strip() for p in prompts if p and p.strip()))
+        kept = [p for p in unique if not any(p != other and p in other for other in unique)]
+        return "\n\n".join(kept)
+
+    def build(
+        self,
+        history: List[dict],
+        system_prompts: Iterable[str] = (),
+        model: Optional[str] = None,
+        question: Optional[str] = None,
+        budget: Optional[int] = None
+    ) -> ContextResult:
+        """
+        Собрать контекст для модели
+
+        Args:
+            history: Сообщения [{"role", "content"}] от старых к новым (можно всю историю)
+            system_prompts: Системные промпты (повторы и вложенные удаляются)
+            model: Модель - определяет бюджет
+            question: Текущий вопрос (если он уже в конце истории - не дублируется)
+            budget: Явный бюджет токенов вместо бюджета модели
+        """
+        system_parts = list(system_prompts)
+        baseline_system = sum(estimate_tokens(p) for p in system_parts if p)
+
+        # Нормализация истории
+        messages: List[dict] = []
+        duplicates = 0
+        for message in history:
+            role, content = message.get("role"), message.get("content")
+            if message.get("image_analyzed") or not isinstance(content, str) or not content.strip():
+                continue
+            if role == "system":
+                system_parts.append(content)
+                continue
+            if messages and messages[-1]["role"] == role and messages[-1]["content"] == content:
+                duplicates += 1
+                continue
+            messages.append({"role": role, "content": content})
+
+        baseline_history = sum(message_tokens(m) for m in history[-self.baseline_messages:])
+        if question:
+            baseline_history += estimate_tokens(question) + 4
+            while messages and messages[-1]["role"] == "user" and messages[-1]["content"] == question:
+                messages.pop()
+                duplicates += 1
+
+        system = self.merge_system_prompts(system_parts)
+        total_budget = budget if budget is not None else self.budget_for(model)
+        used = estimate_tokens(system) + (estimate_tokens(question) + 4 if question else 0)
+        available = max(0, total_budget - used)
+
+        # Свежие сообщения целиком, пока помещаются
+        kept: List[dict] = []
+        for message in reversed(messages):
+            cost = message_tokens(message)
+            if cost > available:
+                break
+            kept.append(message)
+            available -= cost
+        kept.reverse()
+        # История для API начинается с вопроса пользователя
+        while kept and kept[0]["role"] == "assistant" and len(kept) < len(messages):
+            available += message_tokens(kept.pop(0))
+        older = messages[:len(messages) - len(kept)]
+
+        # Старые реплики - кратким содержанием в system
+        summary_lines: List[str] = []
+        if older:
+            summary_budget = min(available, int(total_budget * self.summary_share))
+            summary_budget -= estimate_tokens(SUMMARY_HEADER) + 2
+            for message in reversed(older):
+                line = self._summary(message)
+                cost = estimate_tokens(line) + 1
+                if cost > summary_budget:
+                    break
+                summary_lines.append(line)
+                summary_budget -= cost
+            summary_lines.reverse()
+        if summary_lines:
+            summary = SUMMARY_HEADER + "\n" + "\n".join(summary_lines)
+            system = f"{system}\n\n{summary}" if system else summary
+
+        tokens = estimate_tokens(system) + sum(message_tokens(m) for m in kept)
+        if question:
+            tokens += estimate_tokens(question) + 4
+
+        result = ContextResult(
+            system=system,
+            history=kept,
+            question=question,
+            tokens=tokens,
+            baseline_tokens=baseline_system + baseline_history,
+            kept_messages=len(kept),
+            summarized_messages=len(summary_lines),
+            dropped_messages=len(older) - len(summary_lines),
+            duplicates_removed=duplicates
+        )
+
+        self.stats.requests += 1
+        self.stats.tokens_sent += result.tokens
+        self.stats.baseline_tokens += result.baseline_tokens
+        self.stats.summarized_messages += result.summarized_messages
+        self.stats.duplicates_removed += duplicates
+        model_key = model or "default"
+        self.stats.budget_by_model[model_key] = total_budget
+
+        logger.info(
+            f"📊 Контекст: {result.tokens} токенов (бюджет {total_budget}), "
+            f"целиком {result.kept_messages}, кратко {result.summarized_messages}, "
+            f"сэкономлено {result.saved_tokens}"
+        )
+        return result
+
+    def get_stats(self) -> dict:
+        """Статистика сборки контекста"""
+        stats = self.stats
+        return {
+            "requests": stats.requests,
+            "tokens_sent": stats.tokens_sent,
+            "tokens_saved": stats.baseline_tokens - stats.tokens_sent,
+            "avg_tokens": round(stats.tokens_sent / stats.requests) if stats.requests else 0,
+            "summarized_messages": stats.summarized_messages,
+            "duplicates_removed": stats.duplicates_removed,
+            "summary_cache_hits": self.summary_cache_hits,
+            "budgets": dict(stats.budget_by_model)
+        }
+
+
+# Общий экземпляр для бота
+CONTEXT_BUILDER = ContextBuilder()
@@ -0,0 +1,356 @@
+"""
+Хранилище истории диалогов v1.0
+Append-only сегменты JSONL на пользователя + write-behind буфер в памяти
+
+Каждый пользователь хранится в отдельном файле `<prefix>_<user_id>.jsonl`,
+одна запись на строку. Новые сообщения дописываются в конец файла фоновой
+задачей, а не перезаписывают весь JSON на каждом сообщении. Когда файл
+разрастается, он периодически компактируется до последних max_records записей.
+Запись на диск идёт по снимку, взятому под блокировкой, - сама блокировка
+на время записи файлов не держится, чтение и дозапись в память не ждут диск.
+"""
+
+import os
+import json
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Служебные операции внутри сегмента (остальные строки - обычные записи)
+OP_KEY = "__op__"
+OP_REPLACE_LAST = "replace_last"
+
+
+class ConversationStore:
+    """
+    Append-only хранилище истории с отложенной записью на диск
+
+    Чтение идёт из кэша в памяти (файл читается один раз на пользователя),
+    запись - через буфер, который сбрасывается фоновой задачей раз в
+    flush_interval секунд. Без запущенной фоновой задачи запись синхронная.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str = "user",
+        max_records: int = 50,
+        flush_interval: float = 1.0,
+        compact_factor: float = 2.0,
+        legacy_prefix: Optional[str] = None,
+        legacy_reader: Optional[Callable[[Any], List[dict]]] = None
+    ):
+        """
+        Args:
+            directory: Папка для хранения сегментов
+            prefix: Префикс имени файла (`<prefix>_<user_id>.jsonl`)
+            max_records: Сколько последних записей держать в памяти и после компакции
+            flush_interval: Период фонового сброса буфера (секунды)
+            compact_factor: Компакция, когда строк в файле > max_records * compact_factor
+            legacy_prefix: Префикс старого JSON файла для миграции (`<prefix>_<user_id>.json`)
+            legacy_reader: Функция, извлекающая список записей из старого JSON
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.prefix = prefix
+        self.max_records = max_records
+        self.flush_interval = flush_interval
+        self.compact_threshold = int(max_records * compact_factor)
+        self.legacy_prefix = legacy_prefix
+        self.legacy_reader = legacy_reader
+
+        self._lock = threading.RLock()
+        # Сбросы на диск идут по очереди (порядок строк в сегменте)
+        self._write_lock = threading.Lock()
+        self._records: Dict[int, List[dict]] = {}
+        self._pending: Dict[int, List[dict]] = {}
+        self._disk_lines: Dict[int, int] = {}
+        self._needs_rewrite: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            'appends': 0,
+            'flushes': 0,
+            'lines_written': 0,
+            'compactions': 0,
+            'migrations': 0,
+            'evictions': 0
+        }
+
+    # ========================================
+    # ПУТИ И ЗАГРУЗКА
+    # ========================================
+
+    def segment_path(self, user_id: int) -> Path:
+        """Путь к сегменту пользователя"""
+        return self.directory / f"{self.prefix}_{user_id}.jsonl"
+
+    def legacy_path(self, user_id: int) -> Optional[Path]:
+        """Путь к старому JSON файлу пользователя (если миграция настроена)"""
+        if not self.legacy_prefix:
+            return None
+        return self.directory / f"{self.legacy_prefix}_{user_id}.json"
+
+    def _read_segment(self, path: Path) -> Tuple[List[dict], int]:
+        """Прочитать сегмент и применить служебные операции"""
+        records = []
+        lines = 0
+
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная строка после аварийной остановки
+                    logger.warning(f"Пропущена повреждённая строка в {path.name}")
+                    continue
+
+                op = item.get(OP_KEY) if isinstance(item, dict) else None
+                if op == OP_REPLACE_LAST:
+                    if records:
+                        records[-1] = item.get('record', {})
+                else:
+                    records.append(item)
+
+        return records[-self.max_records:], lines
+
+    def _read_legacy(self, user_id: int) -> Optional[List[dict]]:
+        """Прочитать старый JSON файл (полная перезапись на каждое сообщение)"""
+        path = self.legacy_path(user_id)
+        if path is None or not path.exists() or self.legacy_reader is None:
+            return None
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return self.legacy_reader(json.load(f))
+        except Exception as e:
+            logger.error(f"Ошибка чтения старой истории {path.name}: {e}")
+            return None
+
+    def load(self, user_id: int) -> List[dict]:
+        """
+        Получить историю пользователя
+
+        Файл читается только при первом обращении, дальше список отдаётся
+        из памяти. Возвращается живой список хранилища - изменять его
+        следует только через append/replace_last/replace/clear.
+        """
+        with self._lock:
+            records = self._records.get(user_id)
+            if records is not None:
+                return records
+
+            path = self.segment_path(user_id)
+            records = []
+            lines = 0
+
+            if path.exists():
+                try:
+                    records, lines = self._read_segment(path)
+                except Exception as e:
+                    logger.error(f"Ошибка загрузки истории пользователя {user_id}: {e}")
+            else:
+                legacy = self._read_legacy(user_id)
+                if legacy:
+                    records = legacy[-self.max_records:]
+                    self._needs_rewrite.add(user_id)
+                    self.stats['migrations'] += 1
+                    logger.info(f"История пользователя {user_id} будет перенесена в {path.name}")
+
+            self._records[user_id] = records
+            self._disk_lines[user_id] = lines
+
+        if user_id in self._needs_rewrite and self._flush_task is None:
+            self.flush()
+
+        return records
+
+    # ========================================
+    # ЗАПИСЬ
+    # ========================================
+
+    def _schedule(self, user_id: int):
+        """Синхронный сброс, если фоновая задача не запущена"""
+        if self._flush_task is None:
+            self.flush()
+
+    def append(self, user_id: int, record: dict):
+        """Добавить запись в конец истории"""
+        with self._lock:
+            records = self.load(user_id)
+            records.append(record)
+            if len(records) > self.max_records:
+                del records[:-self.max_records]
+            self._pending.setdefault(user_id, []).append(record)
+            self.stats['appends'] += 1
+
+        self._schedule(user_id)
+
+    def replace_last(self, user_id: int, record: dict):
+        """Заменить последнюю запись (например, дописать ответ к вопросу)"""
+        with self._lock:
+            records = self.load(user_id)
+            if records:
+                records[-1] = record
+                item = {OP_KEY: OP_REPLACE_LAST, 'record': record}
+            else:
+                records.append(record)
+                item = record
+            self._pending.setdefault(user_id, []).append(item)
+
+        self._schedule(user_id)
+
+    def replace(self, user_id: int, records: List[dict]):
+        """Полностью заменить историю (перезапись сегмента при следующем сбросе)"""
+        with self._lock:
+            current = self.load(user_id)
+            if records is not current:
+                current[:] = records[-self.max_records:]
+            elif len(current) > self.max_records:
+                del current[:-self.max_records]
+            self._pending.pop(user_id, None)
+            self._needs_rewrite.add(user_id)
+
+        self._schedule(user_id)
+
+    def clear(self, user_id: int) -> bool:
+        """
+        Очистить историю пользователя
+
+        Returns:
+            True если история была непустой
+        """
+        with self._lock:
+            had_history = bool(self.load(user_id))
+            self._records[user_id].clear()
+            self._pending.pop(user_id, None)
+            self._needs_rewrite.add(user_id)
+
+        self._schedule(user_id)
+        return had_history
+
+    def evict(self, user_id: int):
+        """
+        Выгрузить историю пользователя из памяти (несохранённое сначала
+        записывается на диск, следующий load прочитает сегмент заново)
+        """
+        if user_id in self._pending or user_id in self._needs_rewrite:
+            self.flush()
+        with self._lock:
+            if user_id in self._pending or user_id in self._needs_rewrite:
+                # Запись не удалась - держим в памяти до следующей попытки
+                return
+            self._records.pop(user_id, None)
+            self._disk_lines.pop(user_id, None)
+            self.stats['evictions'] += 1
+
+    def _rewrite(self, user_id: int, records: List[dict]):
+        """Атомарно перезаписать сегмент записями снимка"""
+        path = self.segment_path(user_id)
+        tmp_path = path.with_suffix('.jsonl.tmp')
+
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write('\n')
+        os.replace(tmp_path, path)
+
+    def flush(self):
+        """
+        Сбросить буфер на диск (дозапись строк + компакция разросшихся файлов)
+
+        Под блокировкой берётся только снимок буфера и записей для перезаписи,
+        файлы пишутся без неё
+        """
+        with self._write_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                rewrites = self._needs_rewrite
+                self._needs_rewrite = set()
+                snapshots = {user_id: list(self._records.get(user_id, [])) for user_id in rewrites}
+
+            appended: Dict[int, int] = {}
+            for user_id, items in pending.items():
+                if user_id in rewrites:
+                    continue
+                try:
+                    with open(self.segment_path(user_id), 'a', encoding='utf-8') as f:
+                        f.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items))
+                    appended[user_id] = len(items)
+                except Exception as e:
+                    logger.error(f"Ошибка записи истории пользователя {user_id}: {e}")
+                    with self._lock:
+                        self._pending.setdefault(user_id, [])[:0] = items
+
+            with self._lock:
+                for user_id, count in appended.items():
+                    self._disk_lines[user_id] = self._disk_lines.get(user_id, 0) + count
+                    self.stats['lines_written'] += count
+                    if self._disk_lines[user_id] > self.compact_threshold:
+                        # Снимок уже включает записи, пришедшие после начала сброса
+                        self._pending.pop(user_id, None)
+                        snapshots[user_id] = list(self._records.get(user_id, []))
+
+            for user_id, records in snapshots.items():
+                try:
+                    self._rewrite(user_id, records)
+                except Exception as e:
+                    logger.error(f"Ошибка компакции истории пользователя {user_id}: {e}")
+                    with self._lock:
+                        self._needs_rewrite.add(user_id)
+                    continue
+                with self._lock:
+                    self._disk_lines[user_id] = len(records)
+                    self.stats['lines_written'] += len(records)
+                    self.stats['compactions'] += 1
+
+            with self._lock:
+                self.stats['flushes'] += 1
+
+    # ========================================
+    # ФОНОВАЯ ЗАДАЧА
+    # ========================================
+
+    async def _flush_loop(self):
+        """Периодический сброс буфера в отдельном потоке"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._pending or self._needs_rewrite:
+                await asyncio.to_thread(self.flush)
+
+    def start(self):
+        """Запустить фоновый сброс (вызывать из работающего event loop)"""
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            logger.info(f"✅ Write-behind история запущена ({self.prefix}, каждые {self.flush_interval}с)")
+
+    async def stop(self):
+        """Остановить фоновую задачу и записать всё, что осталось в буфере"""
+        task = self._flush_task
+        self._flush_task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await asyncio.to_thread(self.flush)
+
+    def get_stats(self) -> dict:
+        """Статистика хранилища"""
+        with self._lock:
+            return {
+                **self.stats,
+                'users_cached': len(self._records),
+                'pending_records': sum(len(items) for items in self._pending.values()),
+                'write_behind': self._flush_task is not None
+            }
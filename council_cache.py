@@ -0,0 +1,237 @@
+"""
+Кэш результатов LLM Council v1.0
+Повторный сложный вопрос не оплачивает заново 3 мнения и синтез
+
+- Ключ вопроса - основы всех слов и числа со знаком (регистр, ё/е и
+  пунктуация не важны; "не", "ли", "можно" и "-10"/"+10" различаются)
+  + отпечаток контекста диалога без самого вопроса
+- Результаты этапов хранятся отдельно и адресуются по содержимому входа:
+  мнение - по вопросу и участнику, оценка - по набору мнений,
+  синтез - по набору мнений и оценок. При частичном попадании
+  пересчитываются только недостающие участники, а одинаковый вход
+  синтеза снова берётся из кэша
+- Версия - хэш шаблонов промптов и моделей этапа: после правки промпта
+  старые записи просто не находятся и удаляются по TTL
+- Память (LRU) перед дисковым хранилищем в COUNCIL_CACHE_DIR
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from russian_text import normalize_text, stem
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+COUNCIL_CACHE_ENABLED = os.getenv("COUNCIL_CACHE_ENABLED", "true").lower() == "true"
+COUNCIL_CACHE_DIR = os.getenv("COUNCIL_CACHE_DIR", "council_cache")
+COUNCIL_CACHE_TTL_HOURS = float(os.getenv("COUNCIL_CACHE_TTL_HOURS", "72"))
+
+# Записей в памяти
+COUNCIL_CACHE_MEMORY_ENTRIES = 512
+
+# Токены ключа: число со знаком (знак - только не после буквы/цифры: "52-01" без знака) или слово
+_KEY_TOKEN_RE = re.compile(r"(?<![0-9a-zа-я])[+\-]?\d+(?:[.,]\d+)*|\d+(?:[.,]\d+)*|[a-zа-я]+")
+_SIGNS = str.maketrans({"−": "-", "–": "-", "—": "-", "‒": "-"})
+
+
+def _digest(*parts: str) -> str:
+    """SHA-256 от частей (разделитель исключает склейку соседних частей)"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+def template_version(*templates: str) -> str:
+    """Версия этапа - хэш шаблонов промптов и идентификаторов моделей"""
+    return _digest(*templates)[:12]
+
+
+def question_key(question: str) -> str:
+    """
+    Нормализованный вопрос: основы слов и числа со знаком
+
+    Стоп-слова не выбрасываются: отрицания и модальные слова ("не нужно ли",
+    "можно ли") меняют смысл вопроса, а ответ Совета хранится 72 часа
+    """
+    text = normalize_text(question).translate(_SIGNS)
+    tokens = [
+        token if token[-1].isdigit() else stem(token)
+        for token in _KEY_TOKEN_RE.findall(text)
+    ]
+    return " ".join(tokens) if tokens else text
+
+
+def context_fingerprint(context: str) -> str:
+    """Отпечаток контекста диалога (пустой контекст - пустая строка)"""
+    normalized = normalize_text(context or "")
+    return _digest(normalized)[:16] if normalized else ""
+
+
+def answers_fingerprint(answers: Dict[str, Optional[str]]) -> str:
+    """Отпечаток набора ответов (мнений или оценок) - вход следующего этапа"""
+    return _digest(*(f"{name}={text}" for name, text in sorted(answers.items()) if text))[:16]
+
+
+class CouncilCache:
+    """Content-addressed кэш этапов Совета: память (LRU) + диск с TTL"""
+
+    def __init__(
+        self,
+        cache_dir: str = COUNCIL_CACHE_DIR,
+        ttl_hours: float = COUNCIL_CACHE_TTL_HOURS,
+        memory_entries: int = COUNCIL_CACHE_MEMORY_ENTRIES
+    ):
+        self.cache_dir = cache_dir
+        self.ttl = ttl_hours * 3600
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0}
+
+    # ========================================
+    # ХРАНИЛИЩЕ
+    # ========================================
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, entry: dict):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Значение по ключу или None (нет записи или истёк TTL)"""
+        entry = self._memory.get(key)
+        if entry is None:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+
+        if entry is not None and time.time() - entry["created_at"] > self.ttl:
+            self.stats["expired"] += 1
+            self._forget(key)
+            entry = None
+
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        self._remember(key, entry)
+        self.stats["hits"] += 1
+        return entry["value"]
+
+    def put(self, key: str, value: str, stage: str = ""):
+        """Сохранить значение (атомарная запись на диск)"""
+        entry = {"value": value, "stage": stage, "created_at": time.time()}
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Кэш Совета: не удалось записать {key[:12]}: {e}")
+        self._remember(key, entry)
+        self.stats["writes"] += 1
+
+    def _forget(self, key: str):
+        self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def purge_expired(self) -> int:
+        """Удалить с диска записи старше TTL"""
+        removed = 0
+        now = time.time()
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if now - os.path.getmtime(path) > self.ttl:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"🗑️ Кэш Совета: удалено устаревших записей: {removed}")
+        return removed
+
+    # ========================================
+    # КЛЮЧИ ЭТАПОВ
+    # ========================================
+
+    @staticmethod
+    def opinion_key(version: str, question: str, context: str, member: str) -> str:
+        return _digest("opinion", version, question_key(question), context_fingerprint(context), member)
+
+    @staticmethod
+    def review_key(version: str, question: str, opinions: Dict[str, Optional[str]], member: str) -> str:
+        return _digest("review", version, question_key(question), answers_fingerprint(opinions), member)
+
+    @staticmethod
+    def synthesis_key(
+        version: str,
+        question: str,
+        opinions: Dict[str, Optional[str]],
+        reviews: Dict[str, Optional[str]]
+    ) -> str:
+        return _digest(
+            "synthesis", version, question_key(question),
+            answers_fingerprint(opinions), answers_fingerprint(reviews)
+        )
+
+    def get_many(self, keys: Dict[str, str]) -> Dict[str, str]:
+        """Найденные значения для {участник: ключ}"""
+        found = {}
+        for member, key in keys.items():
+            value = self.get(key)
+            if value:
+                found[member] = value
+        return found
+
+    def put_many(self, keys: Dict[str, str], values: Dict[str, Optional[str]], stage: str, skip: Iterable[str] = ()):
+        """Сохранить новые непустые значения участников (кроме skip - уже из кэша)"""
+        skip = set(skip)
+        for member, value in values.items():
+            if value and member not in skip and member in keys:
+                self.put(keys[member], value, stage)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self._memory)
+        }
+
+
+_council_cache: Optional[CouncilCache] = None
+
+
+def get_council_cache() -> Optional[CouncilCache]:
+    """Общий кэш Совета (None, если отключён)"""
+    global _council_cache
+    if not COUNCIL_CACHE_ENABLED:
+        return None
+    if _council_cache is None:
+        _council_cache = CouncilCache()
+        _council_cache.purge_expired()
+    return _council_cache
@@ -7,6 +7,8 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import logging
 
+from search_index import SearchIndex
+
 logger = logging.getLogger(__name__)
 
 
@@ -448,28 +450,45 @@ FAQ_DATABASE = {
 # ФУНКЦИИ ДЛЯ РАБОТЫ С FAQ
 # ========================================
 
-def search_faq(query: str) -> list:
+# Слова вопроса и ключевые слова важнее текста ответа
+FAQ_FIELD_WEIGHTS = {"q": 3, "keywords": 3, "a": 1}
+
+_faq_index = None
+
+
+def get_faq_index() -> SearchIndex:
+    """Поисковый индекс FAQ (строится один раз при первом поиске)"""
+    global _faq_index
+    if _faq_index is None:
+        index = SearchIndex("FAQ", FAQ_FIELD_WEIGHTS, head_fields=("q", "keywords"))
+        for category_id, category_data in FAQ_DATABASE.items():
+            for q_id, q_data in category_data["questions"].items():
+                index.add((category_id, q_id), q_data, payload=(category_id, q_id, q_data))
+        index.build()
+        _faq_index = index
+    return _faq_index
+
+
+def search_faq_ranked(query: str, limit: int = 10) -> list:
     """
-    Поиск вопросов по ключевым словам
+    Ранжированный поиск по FAQ с оценками
 
     Returns:
-        Список найденных вопросов [(category, q_id, question_data), ...]
+        Список SearchHit: payload = (category, q_id, question_data),
+        score - BM25, coverage - доля слов запроса в вопросе и ключевых словах
     """
-    query_lower = query.lower()
-    results = []
+    return get_faq_index().search(query, limit=limit)
 
-    for category_id, category_data in FAQ_DATABASE.items():
-        for q_id, q_data in category_data["questions"].items():
-            # Поиск в вопросе
-            if query_lower in q_data["q"].lower():
-                results.append((category_id, q_id, q_data))
-                continue
 
-            # Поиск в ключевых словах
-            if any(query_lower in kw.lower() for kw in q_data["keywords"]):
-                results.append((category_id, q_id, q_data))
+def search_faq(query: str) -> list:
+    """
+    Поиск вопросов по ключевым словам (с учётом словоформ и опечаток)
 
-    return results[:10]  # Максимум 10 результатов
+    Returns:
+        Список найденных вопросов [(category, q_id, question_data), ...]
+        по убыванию релевантности
+    """
+    return [hit.payload for hit in search_faq_ranked(query, limit=10)]  # Максимум 10 результатов
 
 
 def get_category_questions(category_id: str) -> list:
@@ -10,6 +10,8 @@ Gemini Live API - Голосовой ассистент в реальном вр
 - Возможность прерывать бота
 - Потоковая передача аудио
 - Мультимодальность (можно отправлять фото во время разговора)
+- Сессии пользователей - в общем менеджере live_sessions (лимит, простой,
+  очередь отправки, ограниченная транскрипция)
 """
 
 import asyncio
@@ -23,6 +25,8 @@ import websockets
 from datetime import datetime
 from dotenv import load_dotenv
 
+from live_sessions import LIVE_SESSIONS, SessionTranscript
+
 # Загрузка переменных окружения из .env
 load_dotenv()
 
@@ -48,7 +52,8 @@ class GeminiLiveSession:
         system_instruction: Optional[str] = None,
         on_text_received: Optional[Callable] = None,
         on_audio_received: Optional[Callable] = None,
-        on_error: Optional[Callable] = None
+        on_error: Optional[Callable] = None,
+        on_disconnect: Optional[Callable[[], Any]] = None
     ):
         """
         Инициализация Live сессии
@@ -61,6 +66,7 @@ class GeminiLiveSession:
             on_text_received: Callback для текстовых ответов
             on_audio_received: Callback для аудио ответов
             on_error: Callback для ошибок
+            on_disconnect: Вызывается, когда сервер закрыл соединение
         """
         self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
@@ -74,9 +80,11 @@ class GeminiLiveSession:
         self.on_text_received = on_text_received
         self.on_audio_received = on_audio_received
         self.on_error = on_error
+        self.on_disconnect = on_disconnect
 
         # WebSocket соединение
         self.ws = None
+        self._receive_task: Optional[asyncio.Task] = None
         self.is_connected = False
         self.session_id = None
 
@@ -90,10 +98,8 @@ class GeminiLiveSession:
             "latency_ms": []
         }
 
-        # Транскрипция разговора (для сохранения в чат)
-        self.conversation_transcript = []
-        self.current_user_text = ""
-        self.current_bot_text = ""
+        # Транскрипция разговора (для сохранения в чат), ограничена по объёму
+        self.conversation_transcript = SessionTranscript()
 
         logger.info(f"🎤 Gemini Live Session инициализирована (модель: {model}, голос: {voice})")
 
@@ -175,7 +181,7 @@ class GeminiLiveSession:
             logger.info(f"✅ Live сессия запущена (ID: {self.session_id})")
 
             # Запускаем цикл получения сообщений
-            asyncio.create_task(self._receive_loop())
+            self._receive_task = asyncio.create_task(self._receive_loop())
 
             return True
 
@@ -224,7 +230,7 @@ class GeminiLiveSession:
 
             # Добавляем в транскрипцию
             if user_message:
-                self.current_user_text = user_message
+                self.conversation_transcript.set_user(user_message)
 
             logger.debug(f"🎤 Отправлено аудио: {len(audio_bytes)} байт")
             return True
@@ -268,7 +274,7 @@ class GeminiLiveSession:
             self.stats["messages_sent"] += 1
 
             # Сохраняем в транскрипцию
-            self.current_user_text = text
+            self.conversation_transcript.set_user(text)
 
             logger.debug(f"💬 Отправлен текст: {text[:50]}...")
             return True
@@ -365,6 +371,10 @@ class GeminiLiveSession:
             self.is_connected = False
             if self.on_error:
                 await self.on_error(str(e))
+        finally:
+            self.is_connected = False
+            if self.on_disconnect:
+                self.on_disconnect()
 
     async def _handle_message(self, message: str):
         """Обработка входящего сообщения"""
@@ -390,7 +400,7 @@ class GeminiLiveSession:
                             logger.info(f"💬 Получен текст: {text[:100]}...")
 
                             # Собираем текст бота для транскрипции
-                            self.current_bot_text += text
+                            self.conversation_transcript.add_bot(text)
 
                             if self.on_text_received:
                                 await self.on_text_received(text)
@@ -411,17 +421,8 @@ class GeminiLiveSession:
                     logger.debug("✅ Turn complete")
 
                     # Сохраняем полную пару вопрос-ответ в транскрипцию
-                    if self.current_user_text or self.current_bot_text:
-                        self.conversation_transcript.append({
-                            "user": self.current_user_text,
-                            "bot": self.current_bot_text.strip(),
-                            "timestamp": datetime.now().isoformat()
-                        })
-                        logger.info(f"📝 Добавлено в транскрипт: User: '{self.current_user_text[:50]}...' -> Bot: '{self.current_bot_text[:50]}...'")
-
-                        # Очищаем для следующего обмена
-                        self.current_user_text = ""
-                        self.current_bot_text = ""
+                    if self.conversation_transcript.commit():
+                        logger.info(f"📝 Добавлено в транскрипт (обменов: {self.conversation_transcript.total})")
 
             # Обработка ошибок
             if "error" in data:
@@ -441,11 +442,15 @@ class GeminiLiveSession:
         try:
             if self.ws:
                 await self.ws.close()
+            if self._receive_task is not None:
+                self._receive_task.cancel()
+                await asyncio.gather(self._receive_task, return_exceptions=True)
+                self._receive_task = None
 
             self.is_connected = False
             logger.info(f"🛑 Live сессия остановлена (ID: {self.session_id})")
             logger.info(f"📊 Статистика: {self.stats}")
-            logger.info(f"📝 Транскрипция: {len(self.conversation_transcript)} обменов")
+            logger.info(f"📝 Транскрипция: {self.conversation_transcript.total} обменов")
 
         except Exception as e:
             logger.error(f"❌ Ошибка остановки сессии: {e}")
@@ -459,8 +464,8 @@ class GeminiLiveSession:
         }
 
     def get_transcript(self) -> List[Dict[str, str]]:
-        """Получить полную транскрипцию разговора"""
-        return self.conversation_transcript
+        """Получить сохранённую транскрипцию разговора"""
+        return list(self.conversation_transcript)
 
     def format_transcript(self) -> str:
         """Форматировать транскрипцию для отправки в чат"""
@@ -468,8 +473,10 @@ class GeminiLiveSession:
             return "📝 Транскрипция пуста"
 
         lines = ["📝 **ТРАНСКРИПЦИЯ ГОЛОСОВОГО РАЗГОВОРА**\n"]
+        if self.conversation_transcript.dropped:
+            lines.append(f"_Ранние обмены не сохранены: {self.conversation_transcript.dropped}_\n")
 
-        for i, turn in enumerate(self.conversation_transcript, 1):
+        for i, turn in enumerate(self.conversation_transcript, self.conversation_transcript.dropped + 1):
             user_text = turn.get("user", "").strip()
             bot_text = turn.get("bot", "").strip()
 
@@ -481,7 +488,7 @@ class GeminiLiveSession:
                 lines.append(f"**🤖 Бот #{i}:**")
                 lines.append(f"{bot_text}\n")
 
-        lines.append(f"\n_✨ Всего обменов: {len(self.conversation_transcript)}_")
+        lines.append(f"\n_✨ Всего обменов: {self.conversation_transcript.total}_")
 
         return "\n".join(lines)
 
@@ -494,16 +501,30 @@ class TelegramVoiceAssistant:
     """
     Голосовой ассистент для Telegram с Gemini Live API
 
+    Сессии хранятся в общем менеджере LIVE_SESSIONS (ключ ("gemini", user_id)):
+    он ограничивает их число, закрывает простаивающие и отправляет сообщения
+    через очередь сессии
+
     Использование:
         assistant = TelegramVoiceAssistant()
         await assistant.start_conversation(user_id)
         await assistant.process_voice(user_id, audio_bytes)
     """
 
+    BACKEND = "gemini"
+
     def __init__(self):
-        self.active_sessions: Dict[int, GeminiLiveSession] = {}
+        self.sessions = LIVE_SESSIONS
         logger.info("🎤 Telegram Voice Assistant инициализирован")
 
+    def _key(self, user_id: int):
+        return (self.BACKEND, user_id)
+
+    def get_session(self, user_id: int) -> Optional[GeminiLiveSession]:
+        """Активная сессия пользователя"""
+        live = self.sessions.get(self._key(user_id))
+        return live.session if live else None
+
     async def start_conversation(
         self,
         user_id: int,
@@ -519,19 +540,23 @@ class TelegramVoiceAssistant:
         Returns:
             True если сессия запущена
         """
-        # Если уже есть активная сессия, остановим её
-        if user_id in self.active_sessions:
-            await self.stop_conversation(user_id)
-
-        # Создаём новую сессию
-        session = GeminiLiveSession(
-            on_audio_received=on_audio_ready
-        )
-
-        success = await session.start()
+        key = self._key(user_id)
+
+        async def on_audio(audio_bytes: bytes):
+            live = self.sessions.get(key)
+            if live:
+                live.received(len(audio_bytes))
+            await on_audio_ready(audio_bytes)
+
+        async def create():
+            session = GeminiLiveSession(
+                on_audio_received=on_audio,
+                on_disconnect=lambda: self.sessions.check_soon(key)
+            )
+            return session if await session.start() else None
 
-        if success:
-            self.active_sessions[user_id] = session
+        # Прежняя сессия пользователя закрывается менеджером
+        if await self.sessions.open(key, self.BACKEND, create):
             logger.info(f"✅ Голосовая сессия запущена для пользователя {user_id}")
             return True
         else:
@@ -555,15 +580,28 @@ class TelegramVoiceAssistant:
             recognized_text: Распознанный текст (для транскрипции)
 
         Returns:
-            True если обработано успешно
+            True если сообщение принято к отправке
         """
-        session = self.active_sessions.get(user_id)
+        live = self.sessions.get(self._key(user_id))
 
-        if not session:
+        if not live:
             logger.warning(f"⚠️ Нет активной сессии для пользователя {user_id}")
             return False
 
-        return await session.send_audio(audio_bytes, mime_type, recognized_text)
+        return await live.send(
+            live.session.send_audio, audio_bytes, mime_type, recognized_text,
+            nbytes=len(audio_bytes), request=True
+        )
+
+    async def process_text(self, user_id: int, text: str) -> bool:
+        """Текстовое сообщение в Live режиме (ответ придёт голосом)"""
+        live = self.sessions.get(self._key(user_id))
+
+        if not live:
+            logger.warning(f"⚠️ Нет активной сессии для пользователя {user_id}")
+            return False
+
+        return await live.send(live.session.send_text, text, nbytes=len(text.encode()), request=True)
 
     async def process_image(
         self,
@@ -580,20 +618,22 @@ class TelegramVoiceAssistant:
             caption: Подпись к фото
 
         Returns:
-            True если обработано успешно
+            True если принято к отправке
         """
-        session = self.active_sessions.get(user_id)
+        live = self.sessions.get(self._key(user_id))
 
-        if not session:
+        if not live:
             logger.warning(f"⚠️ Нет активной сессии для пользователя {user_id}")
             return False
 
-        # Отправляем фото
-        success = await session.send_image(image_bytes)
+        # Отправляем фото, затем подпись - по порядку через очередь сессии
+        success = await live.send(
+            live.session.send_image, image_bytes,
+            nbytes=len(image_bytes), request=not caption
+        )
 
-        # Если есть подпись, отправляем её
         if success and caption:
-            await session.send_text(caption)
+            await live.send(live.session.send_text, caption, nbytes=len(caption.encode()), request=True)
 
         return success
 
@@ -607,11 +647,7 @@ class TelegramVoiceAssistant:
         Returns:
             True если остановлено успешно
         """
-        session = self.active_sessions.get(user_id)
-
-        if session:
-            await session.stop()
-            del self.active_sessions[user_id]
+        if await self.sessions.close(self._key(user_id)):
             logger.info(f"🛑 Сессия остановлена для пользователя {user_id}")
             return True
 
@@ -619,19 +655,14 @@ class TelegramVoiceAssistant:
 
     def get_session_stats(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получить статистику сессии пользователя"""
-        session = self.active_sessions.get(user_id)
+        session = self.get_session(user_id)
         return session.get_stats() if session else None
 
     def get_session_transcript(self, user_id: int) -> Optional[str]:
         """Получить форматированную транскрипцию разговора"""
-        session = self.active_sessions.get(user_id)
+        session = self.get_session(user_id)
         return session.format_transcript() if session else None
 
-    async def cleanup_inactive_sessions(self, max_idle_minutes: int = 5):
-        """Очистка неактивных сессий"""
-        # TODO: Реализовать отслеживание времени последней активности
-        pass
-
 
 # ============================================================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
@@ -4,7 +4,7 @@ Gemini Live API v2 - Официальный SDK от Google
 - google.genai.Client()
 - Gemini 2.5 Flash Native Audio (декабрь 2025)
 - Function Calling для калькуляторов
-- Улучшенная транскрипция
+- Улучшенная транскрипция (ограничена по объёму, live_sessions.SessionTranscript)
 """
 
 import asyncio
@@ -23,6 +23,8 @@ except ImportError:
     GENAI_AVAILABLE = False
     logging.warning("google-genai не установлен. Установите: pip install google-generativeai>=0.9.0")
 
+from live_sessions import SessionTranscript
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -188,7 +190,8 @@ class GeminiLiveSessionV2:
         voice: str = "Aoede",
         system_instruction: Optional[str] = None,
         on_audio_received: Optional[Callable] = None,
-        enable_function_calling: bool = True
+        enable_function_calling: bool = True,
+        on_disconnect: Optional[Callable[[], Any]] = None
     ):
         """
         Инициализация Live сессии v2
@@ -200,6 +203,7 @@ class GeminiLiveSessionV2:
             system_instruction: Системная инструкция
             on_audio_received: Callback для аудио ответов
             enable_function_calling: Включить вызов функций
+            on_disconnect: Вызывается, когда сервер закрыл соединение
         """
         if not GENAI_AVAILABLE:
             raise ImportError("google-genai не установлен")
@@ -213,17 +217,17 @@ class GeminiLiveSessionV2:
         self.system_instruction = system_instruction or self._get_default_system_instruction()
         self.on_audio_received = on_audio_received
         self.enable_function_calling = enable_function_calling
+        self.on_disconnect = on_disconnect
 
         # Клиент Google GenAI
         self.client = genai.Client(api_key=self.api_key)
         self.session = None
         self.is_connected = False
         self.session_id = None
+        self._receive_task: Optional[asyncio.Task] = None
 
         # Транскрипция разговора
-        self.conversation_transcript = []
-        self.current_user_text = ""
-        self.current_bot_text = ""
+        self.conversation_transcript = SessionTranscript()
 
         # Статистика
         self.stats = {
@@ -306,7 +310,7 @@ class GeminiLiveSessionV2:
             logger.info(f"✅ Live сессия V2 запущена (ID: {self.session_id})")
 
             # Запускаем цикл получения сообщений
-            asyncio.create_task(self._receive_loop())
+            self._receive_task = asyncio.create_task(self._receive_loop())
 
             return True
 
@@ -330,7 +334,7 @@ class GeminiLiveSessionV2:
 
             # Сохраняем текст для транскрипции
             if user_message:
-                self.current_user_text = user_message
+                self.conversation_transcript.set_user(user_message)
 
             logger.debug(f"🎤 Отправлено аудио: {len(audio_bytes)} байт")
             return True
@@ -351,7 +355,7 @@ class GeminiLiveSessionV2:
             await self.session.send(text)
 
             self.stats["messages_sent"] += 1
-            self.current_user_text = text
+            self.conversation_transcript.set_user(text)
 
             logger.debug(f"💬 Отправлен текст: {text[:50]}...")
             return True
@@ -369,7 +373,10 @@ class GeminiLiveSessionV2:
 
         except Exception as e:
             logger.error(f"❌ Ошибка в receive_loop: {e}")
+        finally:
             self.is_connected = False
+            if self.on_disconnect:
+                self.on_disconnect()
 
     async def _handle_response(self, response):
         """Обработка ответа от Gemini"""
@@ -388,7 +395,7 @@ class GeminiLiveSessionV2:
             # Обработка текста (для транскрипции)
             if hasattr(response, 'text') and response.text:
                 text = response.text
-                self.current_bot_text += text
+                self.conversation_transcript.add_bot(text)
                 logger.info(f"💬 Получен текст: {text[:100]}...")
 
             # Обработка вызова функций
@@ -423,42 +430,37 @@ class GeminiLiveSessionV2:
                 logger.info(f"✅ Результат функции: {result}")
 
                 # Добавляем в транскрипцию
-                self.current_bot_text += f"\n[Вызвана функция {func_name}: {result.get('recommendation', str(result))}]"
+                self.conversation_transcript.add_bot(f"\n[Вызвана функция {func_name}: {result.get('recommendation', str(result))}]")
 
         except Exception as e:
             logger.error(f"❌ Ошибка вызова функции {func_call.name}: {e}")
 
     def _save_to_transcript(self):
         """Сохранить оборот в транскрипцию"""
-        if self.current_user_text or self.current_bot_text:
-            self.conversation_transcript.append({
-                "user": self.current_user_text,
-                "bot": self.current_bot_text.strip(),
-                "timestamp": datetime.now().isoformat()
-            })
+        if self.conversation_transcript.commit():
             logger.info(f"📝 Добавлено в транскрипт")
 
-            # Очищаем для следующего оборота
-            self.current_user_text = ""
-            self.current_bot_text = ""
-
     async def stop(self):
         """Остановка сессии"""
         try:
             if self.session:
                 await self.session.close()
+            if self._receive_task is not None:
+                self._receive_task.cancel()
+                await asyncio.gather(self._receive_task, return_exceptions=True)
+                self._receive_task = None
 
             self.is_connected = False
             logger.info(f"🛑 Live сессия V2 остановлена (ID: {self.session_id})")
             logger.info(f"📊 Статистика: {self.stats}")
-            logger.info(f"📝 Транскрипция: {len(self.conversation_transcript)} обменов")
+            logger.info(f"📝 Транскрипция: {self.conversation_transcript.total} обменов")
 
         except Exception as e:
             logger.error(f"❌ Ошибка остановки сессии: {e}")
 
     def get_transcript(self) -> List[Dict[str, str]]:
-        """Получить транскрипцию"""
-        return self.conversation_transcript
+        """Получить сохранённую транскрипцию"""
+        return list(self.conversation_transcript)
 
     def format_transcript(self) -> str:
         """Форматировать транскрипцию для отправки в чат"""
@@ -466,8 +468,10 @@ class GeminiLiveSessionV2:
             return "📝 Транскрипция пуста"
 
         lines = ["📝 **ТРАНСКРИПЦИЯ ГОЛОСОВОГО РАЗГОВОРА** (SDK v2)\n"]
+        if self.conversation_transcript.dropped:
+            lines.append(f"_Ранние обмены не сохранены: {self.conversation_transcript.dropped}_\n")
 
-        for i, turn in enumerate(self.conversation_transcript, 1):
+        for i, turn in enumerate(self.conversation_transcript, self.conversation_transcript.dropped + 1):
             user_text = turn.get("user", "").strip()
             bot_text = turn.get("bot", "").strip()
 
@@ -479,7 +483,7 @@ class GeminiLiveSessionV2:
                 lines.append(f"**🤖 Бот #{i}:**")
                 lines.append(f"{bot_text}\n")
 
-        lines.append(f"\n_✨ Всего обменов: {len(self.conversation_transcript)}_")
+        lines.append(f"\n_✨ Всего обменов: {self.conversation_transcript.total}_")
         lines.append(f"_🔧 Функций вызвано: {self.stats['functions_called']}_")
 
         return "\n".join(lines)
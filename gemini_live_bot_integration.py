@@ -1,23 +1,25 @@
 """
 Интеграция Gemini Live API с Telegram ботом
 
-Позволяет прорабам общаться с ботом голосом в реальном времени
+Позволяет прорабам общаться с ботом голосом в реальном времени.
+Сессии, их простой и лимит - в общем менеджере live_sessions
 """
 
 import logging
-from typing import Dict, Optional
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from io import BytesIO
 import asyncio
 
 from gemini_live_api import TelegramVoiceAssistant, is_gemini_live_available
+from photo_pipeline import get_photo_pipeline
 
 logger = logging.getLogger(__name__)
 
 # Импортируем распознавание голоса
 try:
-    from voice_handler import transcribe_voice, download_voice_file
+    from voice_handler import transcribe_voice
     VOICE_RECOGNITION_AVAILABLE = True
 except ImportError:
     VOICE_RECOGNITION_AVAILABLE = False
@@ -87,18 +89,16 @@ async def start_voice_chat_command(update: Update, context: ContextTypes.DEFAULT
     )
 
     if success:
-        # Отправляем приветствие голосом
-        session = voice_assistant.active_sessions.get(user_id)
-        if session:
-            # Даём время на установку WebSocket соединения
-            await asyncio.sleep(1)
-
-            # Бот поздоровается голосом
-            await session.send_text(
-                "Привет! Я твой голосовой помощник по строительству. "
-                "Я готов ответить на вопросы по нормативам, безопасности и расчётам. "
-                "Что тебя интересует?"
-            )
+        # Даём время на установку WebSocket соединения
+        await asyncio.sleep(1)
+
+        # Бот поздоровается голосом
+        await voice_assistant.process_text(
+            user_id,
+            "Привет! Я твой голосовой помощник по строительству. "
+            "Я готов ответить на вопросы по нормативам, безопасности и расчётам. "
+            "Что тебя интересует?"
+        )
 
         # Показываем UI с кнопкой завершения
         keyboard = [
@@ -153,15 +153,8 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         recognized_text = None
         if VOICE_RECOGNITION_AVAILABLE:
             try:
-                # Скачиваем файл для распознавания
-                file_path = await download_voice_file(
-                    context.bot,
-                    voice.file_id,
-                    user_id
-                )
-
-                # Распознаём
-                result = await transcribe_voice(file_path)
+                # Распознаём уже скачанные байты (без повторной загрузки и файла на диске)
+                result = await transcribe_voice(bytes(audio_bytes))
                 if result.get("success"):
                     recognized_text = result.get("text")
                     logger.info(f"🎤 Распознано: {recognized_text[:100]}...")
@@ -207,13 +200,8 @@ async def handle_voice_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await update.message.chat.send_action("record_voice")
 
-        # Получаем активную сессию
-        session = voice_assistant.active_sessions.get(user_id)
-
-        if session:
-            # Отправляем текст в Live режиме
-            await session.send_text(text)
-
+        # Отправляем текст в Live режиме (нет сессии - False)
+        if await voice_assistant.process_text(user_id, text):
             # Ответ придёт голосом через callback
             logger.info(f"✅ Текст обработан для пользователя {user_id}")
         else:
@@ -243,10 +231,8 @@ async def handle_voice_photo(update: Update, context: ContextTypes.DEFAULT_TYPE)
     try:
         await update.message.chat.send_action("record_voice")
 
-        # Получаем фото
-        photo = update.message.photo[-1]  # Самое большое фото
-        photo_file = await photo.get_file()
-        image_bytes = await photo_file.download_as_bytearray()
+        # Получаем фото (подходящий размер, подготовленное в пуле потоков)
+        prepared = await get_photo_pipeline().load_message_photo(context.bot, update.message.photo)
 
         # Получаем подпись (если есть)
         caption = update.message.caption or "Что ты видишь на этом фото? Проверь на нарушения."
@@ -254,7 +240,7 @@ async def handle_voice_photo(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Отправляем в Live сессию
         success = await voice_assistant.process_image(
             user_id=user_id,
-            image_bytes=bytes(image_bytes),
+            image_bytes=prepared.data,
             caption=caption
         )
 
@@ -461,13 +447,3 @@ def register_voice_assistant_handlers(application):
     application.add_handler(CommandHandler("voice_help", voice_help_command))
 
     logger.info("✅ Обработчики голосового ассистента зарегистрированы")
-
-
-# ============================================================================
-# УТИЛИТЫ
-# ============================================================================
-
-async def cleanup_inactive_voice_sessions():
-    """Очистка неактивных голосовых сессий (запускать периодически)"""
-    if voice_assistant:
-        await voice_assistant.cleanup_inactive_sessions(max_idle_minutes=5)
@@ -5,6 +5,7 @@
 - Официальным SDK от Google
 - Function Calling для калькуляторов
 - Улучшенной транскрипцией
+- Сессиями в общем менеджере live_sessions (лимит, простой, очередь отправки)
 """
 
 import logging
@@ -15,19 +16,18 @@ from io import BytesIO
 import asyncio
 
 from gemini_live_api_v2 import GeminiLiveSessionV2, is_gemini_live_v2_available
+from live_sessions import LIVE_SESSIONS
+from photo_pipeline import get_photo_pipeline
 
 # Импортируем распознавание голоса
 try:
-    from voice_handler import transcribe_voice, download_voice_file
+    from voice_handler import transcribe_voice
     VOICE_RECOGNITION_AVAILABLE = True
 except ImportError:
     VOICE_RECOGNITION_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
-# Глобальные активные сессии
-active_sessions_v2: Dict[int, GeminiLiveSessionV2] = {}
-
 # Состояния разговора
 VOICE_CONVERSATION = 1
 
@@ -40,34 +40,49 @@ class TelegramVoiceAssistantV2:
     """
     Голосовой ассистент V2 для Telegram
 
-    Использует официальный SDK Google с Function Calling
+    Использует официальный SDK Google с Function Calling.
+    Сессии - в общем менеджере LIVE_SESSIONS (ключ ("gemini_v2", user_id))
     """
 
+    BACKEND = "gemini_v2"
+
     def __init__(self):
-        self.active_sessions: Dict[int, GeminiLiveSessionV2] = {}
+        self.sessions = LIVE_SESSIONS
         logger.info("🎤 Telegram Voice Assistant V2 инициализирован (SDK + Functions)")
 
+    def _key(self, user_id: int):
+        return (self.BACKEND, user_id)
+
+    def get_session(self, user_id: int) -> Optional[GeminiLiveSessionV2]:
+        """Активная сессия пользователя"""
+        live = self.sessions.get(self._key(user_id))
+        return live.session if live else None
+
     async def start_conversation(
         self,
         user_id: int,
         on_audio_ready: callable
     ) -> bool:
         """Начать голосовой разговор с Function Calling"""
+        key = self._key(user_id)
+
+        async def on_audio(audio_bytes: bytes):
+            live = self.sessions.get(key)
+            if live:
+                live.received(len(audio_bytes))
+            await on_audio_ready(audio_bytes)
+
+        async def create():
+            # Новая сессия V2 с Function Calling
+            session = GeminiLiveSessionV2(
+                on_audio_received=on_audio,
+                enable_function_calling=True,  # Включаем калькуляторы!
+                on_disconnect=lambda: self.sessions.check_soon(key)
+            )
+            return session if await session.start() else None
 
-        # Если уже есть активная сессия, остановим её
-        if user_id in self.active_sessions:
-            await self.stop_conversation(user_id)
-
-        # Создаём новую сессию V2 с Function Calling
-        session = GeminiLiveSessionV2(
-            on_audio_received=on_audio_ready,
-            enable_function_calling=True  # Включаем калькуляторы!
-        )
-
-        success = await session.start()
-
-        if success:
-            self.active_sessions[user_id] = session
+        # Прежняя сессия пользователя закрывается менеджером
+        if await self.sessions.open(key, self.BACKEND, create):
             logger.info(f"✅ Голосовая сессия V2 запущена для пользователя {user_id} (Functions: ON)")
             return True
         else:
@@ -81,13 +96,26 @@ class TelegramVoiceAssistantV2:
         recognized_text: Optional[str] = None
     ) -> bool:
         """Обработка голосового сообщения"""
-        session = self.active_sessions.get(user_id)
+        live = self.sessions.get(self._key(user_id))
+
+        if not live:
+            logger.warning(f"⚠️ Нет активной сессии для пользователя {user_id}")
+            return False
+
+        return await live.send(
+            live.session.send_audio, audio_bytes, recognized_text,
+            nbytes=len(audio_bytes), request=True
+        )
+
+    async def process_text(self, user_id: int, text: str) -> bool:
+        """Текстовое сообщение (ответ придёт голосом)"""
+        live = self.sessions.get(self._key(user_id))
 
-        if not session:
+        if not live:
             logger.warning(f"⚠️ Нет активной сессии для пользователя {user_id}")
             return False
 
-        return await session.send_audio(audio_bytes, user_message=recognized_text)
+        return await live.send(live.session.send_text, text, nbytes=len(text.encode()), request=True)
 
     async def process_image(
         self,
@@ -96,25 +124,19 @@ class TelegramVoiceAssistantV2:
         caption: Optional[str] = None
     ) -> bool:
         """Обработка фото во время разговора"""
-        session = self.active_sessions.get(user_id)
-
-        if not session:
+        if not self.get_session(user_id):
             logger.warning(f"⚠️ Нет активной сессии для пользователя {user_id}")
             return False
 
         # Отправляем подпись как текст
         if caption:
-            return await session.send_text(f"[ФОТО] {caption}")
+            return await self.process_text(user_id, f"[ФОТО] {caption}")
 
         return True
 
     async def stop_conversation(self, user_id: int) -> bool:
         """Остановить разговор"""
-        session = self.active_sessions.get(user_id)
-
-        if session:
-            await session.stop()
-            del self.active_sessions[user_id]
+        if await self.sessions.close(self._key(user_id)):
             logger.info(f"🛑 Сессия V2 остановлена для пользователя {user_id}")
             return True
 
@@ -122,12 +144,12 @@ class TelegramVoiceAssistantV2:
 
     def get_session_stats(self, user_id: int) -> Optional[Dict]:
         """Получить статистику сессии"""
-        session = self.active_sessions.get(user_id)
+        session = self.get_session(user_id)
         return session.get_stats() if session else None
 
     def get_session_transcript(self, user_id: int) -> Optional[str]:
         """Получить транскрипцию"""
-        session = self.active_sessions.get(user_id)
+        session = self.get_session(user_id)
         return session.format_transcript() if session else None
 
 
@@ -190,15 +212,14 @@ async def start_voice_chat_command_v2(update: Update, context: ContextTypes.DEFA
 
     if success:
         # Отправляем приветствие голосом
-        session = voice_assistant_v2.active_sessions.get(user_id)
-        if session:
-            await asyncio.sleep(1)
-
-            await session.send_text(
-                "Привет! Я твой голосовой помощник по строительству с улучшенными функциями. "
-                "Я могу рассчитать бетон и арматуру прямо во время разговора! "
-                "Например, спроси: сколько бетона на плиту 6 на 8 метров толщиной 20 сантиметров?"
-            )
+        await asyncio.sleep(1)
+
+        await voice_assistant_v2.process_text(
+            user_id,
+            "Привет! Я твой голосовой помощник по строительству с улучшенными функциями. "
+            "Я могу рассчитать бетон и арматуру прямо во время разговора! "
+            "Например, спроси: сколько бетона на плиту 6 на 8 метров толщиной 20 сантиметров?"
+        )
 
         keyboard = [
             [InlineKeyboardButton("🛑 Завершить разговор", callback_data="stop_voice_chat")]
@@ -256,12 +277,7 @@ async def handle_voice_message_v2(update: Update, context: ContextTypes.DEFAULT_
         recognized_text = None
         if VOICE_RECOGNITION_AVAILABLE:
             try:
-                file_path = await download_voice_file(
-                    context.bot,
-                    voice.file_id,
-                    user_id
-                )
-                result = await transcribe_voice(file_path)
+                result = await transcribe_voice(bytes(audio_bytes))
                 if result.get("success"):
                     recognized_text = result.get("text")
                     logger.info(f"🎤 Распознано: {recognized_text[:100]}...")
@@ -304,10 +320,7 @@ async def handle_voice_text_v2(update: Update, context: ContextTypes.DEFAULT_TYP
     try:
         await update.message.chat.send_action("record_voice")
 
-        session = voice_assistant_v2.active_sessions.get(user_id)
-
-        if session:
-            await session.send_text(text)
+        if await voice_assistant_v2.process_text(user_id, text):
             logger.info(f"✅ Текст обработан V2 для {user_id}")
         else:
             await update.message.reply_text(
@@ -335,15 +348,14 @@ async def handle_voice_photo_v2(update: Update, context: ContextTypes.DEFAULT_TY
     try:
         await update.message.chat.send_action("record_voice")
 
-        photo = update.message.photo[-1]
-        photo_file = await photo.get_file()
-        image_bytes = await photo_file.download_as_bytearray()
+        # Получаем фото (подходящий размер, подготовленное в пуле потоков)
+        prepared = await get_photo_pipeline().load_message_photo(context.bot, update.message.photo)
 
         caption = update.message.caption or "Проанализируй это фото на нарушения."
 
         success = await voice_assistant_v2.process_image(
             user_id=user_id,
-            image_bytes=bytes(image_bytes),
+            image_bytes=prepared.data,
             caption=caption
         )
 
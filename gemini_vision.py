@@ -2,17 +2,29 @@
 Модуль для работы с Google Gemini 2.5 Flash
 - Анализ изображений (дефекты, чертежи)
 - Генерация изображений через Imagen 3
+
+Фото перед анализом проходит photo_pipeline: поворот по EXIF, уменьшение
+и JPEG в пуле потоков, в Gemini уходят готовые байты. Уже подготовленное
+фото (PreparedPhoto из handle_photo) повторно не обрабатывается; метрики
+анализа пишутся один раз - здесь, с моделью, которая отвечала
 """
 
 import os
+import time
+import asyncio
 import logging
 import base64
 from io import BytesIO
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 from PIL import Image
 
+from photo_pipeline import PreparedPhoto, get_photo_pipeline
+
 logger = logging.getLogger(__name__)
 
+# Модель анализа фото (gemini-1.5-flash - стабильная версия с хорошими лимитами)
+GEMINI_VISION_MODEL = "gemini-1.5-flash"
+
 # Gemini клиент
 gemini_client = None
 GEMINI_AVAILABLE = False
@@ -54,7 +66,7 @@ init_gemini()
 # ========================================
 
 async def analyze_construction_image(
-    image_data: bytes,
+    image_data: Union[bytes, PreparedPhoto],
     prompt: str = None,
     analysis_type: str = "defect"
 ) -> Optional[Dict]:
@@ -62,7 +74,7 @@ async def analyze_construction_image(
     Анализ строительного изображения через Gemini 2.5 Flash
 
     Args:
-        image_data: Байты изображения
+        image_data: Байты изображения или уже подготовленное фото (PreparedPhoto)
         prompt: Дополнительный промпт (опционально)
         analysis_type: Тип анализа (defect, blueprint, material, quality)
 
@@ -74,8 +86,13 @@ async def analyze_construction_image(
         return None
 
     try:
-        # Загружаем изображение
-        image = Image.open(BytesIO(image_data))
+        # Подготавливаем изображение (в пуле потоков, не в event loop), если ещё не готово
+        pipeline = get_photo_pipeline()
+        if isinstance(image_data, PreparedPhoto):
+            prepared = image_data
+        else:
+            prepared = await pipeline.prepare(image_data)
+        image = {"mime_type": prepared.mime_type, "data": prepared.data}
 
         # Промпты для разных типов анализа
         analysis_prompts = {
@@ -174,18 +191,19 @@ async def analyze_construction_image(
         if prompt:
             system_prompt += f"\n\nДОПОЛНИТЕЛЬНО: {prompt}"
 
-        # Создаём модель (gemini-1.5-flash - стабильная версия с хорошими лимитами)
-        model = gemini_client.GenerativeModel('gemini-1.5-flash')
+        model = gemini_client.GenerativeModel(GEMINI_VISION_MODEL)
 
-        # Генерируем ответ
-        response = model.generate_content([system_prompt, image])
+        # Генерируем ответ (синхронный клиент - в отдельном потоке)
+        started = time.perf_counter()
+        response = await asyncio.to_thread(model.generate_content, [system_prompt, image])
+        pipeline.report(prepared, time.perf_counter() - started, GEMINI_VISION_MODEL)
 
         if response and response.text:
             logger.info(f"✅ Gemini проанализировал изображение ({analysis_type})")
 
             return {
                 "analysis": response.text,
-                "model": "gemini-1.5-flash",
+                "model": GEMINI_VISION_MODEL,
                 "analysis_type": analysis_type,
                 "success": True
             }
@@ -304,7 +322,7 @@ def format_analysis_result(result: Dict) -> str:
         return "❌ Не удалось проанализировать изображение"
 
     analysis_text = result.get("analysis", "")
-    model = result.get("model", "gemini-2.5-flash")
+    model = result.get("model", GEMINI_VISION_MODEL)
 
     footer = f"\n\n🤖 Анализ выполнен: {model}"
 
@@ -322,12 +340,16 @@ class GeminiVisionAnalyzer:
         self.available = GEMINI_AVAILABLE
         logger.info(f"GeminiVisionAnalyzer: {'✅ доступен' if self.available else '❌ недоступен'}")
 
-    async def analyze_defect_photo(self, image_data: bytes, user_prompt: str = None) -> Optional[str]:
+    async def analyze_defect_photo(
+        self,
+        image_data: Union[bytes, PreparedPhoto],
+        user_prompt: str = None
+    ) -> Optional[str]:
         """
         Анализ фото дефекта
 
         Args:
-            image_data: Байты изображения
+            image_data: Байты изображения или подготовленное фото (PreparedPhoto)
             user_prompt: Дополнительный вопрос пользователя
 
         Returns:
@@ -343,7 +365,7 @@ class GeminiVisionAnalyzer:
             return format_analysis_result(result)
         return None
 
-    async def analyze_blueprint(self, image_data: bytes) -> Optional[str]:
+    async def analyze_blueprint(self, image_data: Union[bytes, PreparedPhoto]) -> Optional[str]:
         """Анализ чертежа"""
         result = await analyze_construction_image(
             image_data=image_data,
@@ -354,7 +376,7 @@ class GeminiVisionAnalyzer:
             return format_analysis_result(result)
         return None
 
-    async def check_quality(self, image_data: bytes) -> Optional[str]:
+    async def check_quality(self, image_data: Union[bytes, PreparedPhoto]) -> Optional[str]:
         """Проверка качества работ"""
         result = await analyze_construction_image(
             image_data=image_data,
@@ -378,8 +400,6 @@ def initialize_gemini_vision() -> Optional[GeminiVisionAnalyzer]:
 # ========================================
 
 if __name__ == "__main__":
-    import asyncio
-
     async def test_gemini():
         """Тест модуля"""
         print("=== Тест Gemini Vision ===\n")
@@ -6,11 +6,12 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import logging
-import json
 from pathlib import Path
 from datetime import datetime
 import io
 
+from conversation_store import ConversationStore
+
 logger = logging.getLogger(__name__)
 
 # Папка для хранения истории
@@ -18,25 +19,34 @@ CONVERSATIONS_DIR = Path("user_conversations")
 CONVERSATIONS_DIR.mkdir(exist_ok=True)
 
 
+def _read_legacy_dialogs(data) -> list:
+    """Извлечь пары вопрос-ответ из старого формата user_<id>.json"""
+    return data if isinstance(data, list) else []
+
+
+# Append-only хранилище пар вопрос-ответ (dialog_<id>.jsonl)
+dialog_store = ConversationStore(
+    CONVERSATIONS_DIR,
+    prefix="dialog",
+    max_records=1000,
+    legacy_prefix="user",
+    legacy_reader=_read_legacy_dialogs
+)
+
+
 # ========================================
 # ФУНКЦИИ ДЛЯ РАБОТЫ С ИСТОРИЕЙ
 # ========================================
 
 def get_user_history_file(user_id: int) -> Path:
     """Получить путь к файлу истории пользователя"""
-    return CONVERSATIONS_DIR / f"user_{user_id}.json"
+    return dialog_store.segment_path(user_id)
 
 
 def load_user_history(user_id: int) -> list:
-    """Загрузить историю пользователя"""
-    history_file = get_user_history_file(user_id)
-
-    if not history_file.exists():
-        return []
-
+    """Загрузить историю пользователя (из памяти после первого чтения)"""
     try:
-        with open(history_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return dialog_store.load(user_id)
     except Exception as e:
         logger.error(f"Ошибка загрузки истории пользователя {user_id}: {e}")
         return []
@@ -244,11 +254,8 @@ def format_history_summary(user_id: int, limit: int = 5) -> str:
 
 def clear_user_history(user_id: int) -> bool:
     """Очистить историю пользователя"""
-    history_file = get_user_history_file(user_id)
-
     try:
-        if history_file.exists():
-            history_file.unlink()
+        if dialog_store.clear(user_id):
             logger.info(f"История пользователя {user_id} очищена")
             return True
         return False
@@ -581,7 +588,6 @@ async def add_message_to_history_async(user_id: int, role: str, content: str) ->
         True если сохранено успешно
     """
     try:
-        history_file = get_user_history_file(user_id)
         history = load_user_history(user_id)
 
         timestamp = datetime.now().strftime('%d.%m.%Y %H:%M')
@@ -590,25 +596,21 @@ async def add_message_to_history_async(user_id: int, role: str, content: str) ->
         if role == 'assistant' and history:
             # Если последнее сообщение только от user - добавляем assistant
             if 'assistant' not in history[-1]:
-                history[-1]['assistant'] = content
+                dialog_store.replace_last(user_id, {**history[-1], 'assistant': content})
             else:
                 # Иначе создаём новую запись
-                history.append({
+                dialog_store.append(user_id, {
                     'user': '',
                     'assistant': content,
                     'timestamp': timestamp
                 })
         elif role == 'user':
             # Создаём новую запись с вопросом
-            history.append({
+            dialog_store.append(user_id, {
                 'user': content,
                 'timestamp': timestamp
             })
 
-        # Сохраняем
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-
         return True
     except Exception as e:
         logger.error(f"Ошибка сохранения в историю: {e}")
@@ -628,24 +630,15 @@ def save_conversation(user_id: int, user_message: str, assistant_message: str) -
         True если сохранено успешно
     """
     try:
-        history_file = get_user_history_file(user_id)
-        history = load_user_history(user_id)
-
         timestamp = datetime.now().strftime('%d.%m.%Y %H:%M')
 
-        history.append({
+        # Хранилище само держит последние 1000 сообщений
+        dialog_store.append(user_id, {
             'user': user_message,
             'assistant': assistant_message,
             'timestamp': timestamp
         })
 
-        # Ограничиваем историю последними 1000 сообщениями
-        if len(history) > 1000:
-            history = history[-1000:]
-
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-
         return True
     except Exception as e:
         logger.error(f"Ошибка сохранения беседы: {e}")
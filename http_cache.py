@@ -0,0 +1,343 @@
+"""
+Асинхронный HTTP загрузчик с дисковым кэшем v1.0
+Используется для docs.cntd.ru и minstroyrf.gov.ru (web_search.py)
+
+- httpx.AsyncClient с keep-alive, ограничение одновременных запросов на хост
+- Тела ответов хранятся по SHA-256 содержимого (одинаковые страницы - один файл)
+- TTL: свежая запись отдаётся без сети
+- После TTL - условный GET (If-None-Match / If-Modified-Since), 304 продлевает запись
+- Одновременные запросы одного URL объединяются в один
+- При сетевой ошибке отдаётся устаревшая копия, если она есть
+- Чтение и запись диска - в потоке (asyncio.to_thread), event loop не ждёт файлы
+- Сборка мусора: записи старше HTTP_CACHE_MAX_AGE_DAYS и тела, на которые
+  не ссылается ни одна запись, удаляются (не чаще HTTP_CACHE_GC_INTERVAL_HOURS)
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", "http_cache")
+HTTP_CACHE_TTL_HOURS = float(os.getenv("HTTP_CACHE_TTL_HOURS", "24"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "4"))
+HTTP_CACHE_MAX_AGE_DAYS = float(os.getenv("HTTP_CACHE_MAX_AGE_DAYS", "30"))
+HTTP_CACHE_GC_INTERVAL_HOURS = float(os.getenv("HTTP_CACHE_GC_INTERVAL_HOURS", "6"))
+
+# Файлы моложе не удаляются сборкой мусора: ссылка на них может ещё записываться
+GC_GRACE_SECONDS = 600
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+@dataclass
+class CachedResponse:
+    """Ответ из кэша: тело читается с диска только при обращении к text"""
+
+    url: str
+    digest: str
+    path: str
+    from_network: bool
+
+    @property
+    def text(self) -> str:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+
+class CachedFetcher:
+    """HTTP GET с дисковым content-addressed кэшем и условной перепроверкой"""
+
+    def __init__(
+        self,
+        cache_dir: str = HTTP_CACHE_DIR,
+        ttl_hours: float = HTTP_CACHE_TTL_HOURS,
+        max_per_host: int = HTTP_MAX_PER_HOST,
+        timeout: float = 10.0,
+        max_age_days: float = HTTP_CACHE_MAX_AGE_DAYS,
+        gc_interval_hours: float = HTTP_CACHE_GC_INTERVAL_HOURS
+    ):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_age_seconds = max_age_days * 86400
+        self.gc_interval_seconds = gc_interval_hours * 3600
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+
+        self._blobs_dir = os.path.join(cache_dir, "blobs")
+        self._meta_dir = os.path.join(cache_dir, "meta")
+        os.makedirs(self._blobs_dir, exist_ok=True)
+        os.makedirs(self._meta_dir, exist_ok=True)
+
+        self._meta: Dict[str, dict] = {}
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        self._last_gc = 0.0
+        self._gc_task: Optional[asyncio.Future] = None
+
+        self.stats = {
+            "fresh_hits": 0,
+            "revalidated": 0,
+            "downloaded": 0,
+            "stale_served": 0,
+            "errors": 0,
+            "coalesced": 0,
+            "gc_expired": 0,
+            "gc_blobs_removed": 0
+        }
+
+    # ========================================
+    # КЛИЕНТ И ЛИМИТЫ
+    # ========================================
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """AsyncClient текущего event loop (пересоздаётся при смене loop)"""
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                headers=DEFAULT_HEADERS,
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_per_host * 4)
+            )
+            self._client_loop = loop
+            self._host_limits.clear()
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return limit
+
+    async def aclose(self):
+        """Закрыть HTTP клиент (и дождаться идущей сборки мусора)"""
+        if self._gc_task is not None:
+            await asyncio.gather(self._gc_task, return_exceptions=True)
+            self._gc_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ========================================
+    # ДИСКОВЫЙ КЭШ
+    # ========================================
+
+    def _meta_path(self, url: str) -> str:
+        return os.path.join(self._meta_dir, hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._blobs_dir, digest)
+
+    # Методы ниже работают с диском - из event loop вызываются через asyncio.to_thread
+
+    def _load_meta(self, url: str) -> Optional[dict]:
+        meta = self._meta.get(url)
+        if meta is None:
+            try:
+                with open(self._meta_path(url), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if not os.path.exists(self._blob_path(meta["digest"])):
+                return None
+            self._meta[url] = meta
+        return meta
+
+    def _save(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]) -> dict:
+        data = body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self._blob_path(digest)
+        if os.path.exists(blob):
+            # Свежая отметка времени: сборка мусора не удалит тело до записи ссылки
+            os.utime(blob)
+        else:
+            tmp = f"{blob}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, blob)
+
+        meta = {
+            "url": url,
+            "digest": digest,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time()
+        }
+        self._write_meta(url, meta)
+        return meta
+
+    def _write_meta(self, url: str, meta: dict):
+        path = self._meta_path(url)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._meta[url] = meta
+
+    def collect_garbage(self) -> dict:
+        """
+        Удалить записи старше max_age и тела страниц без ссылок
+
+        Returns:
+            {"expired": удалено записей, "blobs_removed": удалено тел}
+        """
+        now = time.time()
+        referenced = set()
+        expired = 0
+        for name in os.listdir(self._meta_dir):
+            path = os.path.join(self._meta_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if now - meta["fetched_at"] > self.max_age_seconds:
+                    os.remove(path)
+                    self._meta.pop(meta["url"], None)
+                    expired += 1
+                else:
+                    referenced.add(meta["digest"])
+            except (OSError, ValueError, KeyError):
+                continue
+        # Записи в памяти, которые могут быть ещё не на диске
+        referenced.update(meta["digest"] for meta in list(self._meta.values()))
+
+        removed = 0
+        for name in os.listdir(self._blobs_dir):
+            if name in referenced:
+                continue
+            path = os.path.join(self._blobs_dir, name)
+            try:
+                if now - os.path.getmtime(path) < GC_GRACE_SECONDS:
+                    continue
+                os.remove(path)
+                removed += 1
+            except OSError:
+                continue
+
+        self.stats["gc_expired"] += expired
+        self.stats["gc_blobs_removed"] += removed
+        if expired or removed:
+            logger.info(f"🧹 HTTP кэш: удалено записей {expired}, файлов страниц {removed}")
+        return {"expired": expired, "blobs_removed": removed}
+
+    def _schedule_gc(self):
+        """Запустить сборку мусора в потоке, если с прошлой прошло gc_interval"""
+        now = time.time()
+        if now - self._last_gc < self.gc_interval_seconds:
+            return
+        if self._gc_task is not None and not self._gc_task.done():
+            return
+        self._last_gc = now
+        self._gc_task = asyncio.ensure_future(asyncio.to_thread(self.collect_garbage))
+
+    def _response(self, meta: dict, from_network: bool) -> CachedResponse:
+        return CachedResponse(meta["url"], meta["digest"], self._blob_path(meta["digest"]), from_network)
+
+    # ========================================
+    # ЗАГРУЗКА
+    # ========================================
+
+    async def fetch(self, url: str) -> Optional[CachedResponse]:
+        """
+        Получить страницу (из кэша или сети)
+
+        Returns:
+            CachedResponse или None, если страница недоступна и копии нет
+        """
+        meta = self._meta.get(url)
+        if meta is None:
+            meta = await asyncio.to_thread(self._load_meta, url)
+        if meta and time.time() - meta["fetched_at"] < self.ttl_seconds:
+            self.stats["fresh_hits"] += 1
+            return self._response(meta, from_network=False)
+
+        # Одновременные запросы одного URL - один поход в сеть
+        pending = self._in_flight.get(url)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.ensure_future(self._download(url, meta))
+        self._in_flight[url] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if future.done():
+                self._in_flight.pop(url, None)
+            else:
+                future.add_done_callback(lambda _: self._in_flight.pop(url, None))
+
+    async def _download(self, url: str, meta: Optional[dict]) -> Optional[CachedResponse]:
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            client = self._get_client()
+            async with self._host_limit(url):
+                response = await client.get(url, headers=headers)
+
+            if response.status_code == 304 and meta:
+                meta = {**meta, "fetched_at": time.time()}
+                await asyncio.to_thread(self._write_meta, url, meta)
+                self.stats["revalidated"] += 1
+                return self._response(meta, from_network=False)
+
+            response.raise_for_status()
+            meta = await asyncio.to_thread(
+                self._save,
+                url,
+                response.text,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified")
+            )
+            self.stats["downloaded"] += 1
+            self._schedule_gc()
+            return self._response(meta, from_network=True)
+
+        except (httpx.HTTPError, OSError) as e:
+            self.stats["errors"] += 1
+            if meta:
+                self.stats["stale_served"] += 1
+                logger.warning(f"⚠️ {urlsplit(url).netloc} недоступен ({e}), используется сохранённая копия")
+                return self._response(meta, from_network=False)
+            logger.error(f"Ошибка запроса {url}: {e}")
+            return None
+
+    def get_stats(self) -> dict:
+        """Статистика кэша"""
+        return {**self.stats, "urls": len(self._meta)}
+
+
+# ========================================
+# ОБЩИЙ ЗАГРУЗЧИК
+# ========================================
+
+_fetcher: Optional[CachedFetcher] = None
+
+
+def get_fetcher() -> CachedFetcher:
+    """Общий загрузчик (ленивая инициализация)"""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = CachedFetcher()
+    return _fetcher
@@ -0,0 +1,472 @@
+"""
+Локальная классификация намерений v1.0
+Замена запроса к Grok перед каждым ответом (bot.classify_user_intent)
+
+- Логистическая регрессия (softmax) по хешированным признакам: основы слов,
+  биграммы, признаки списков ключевых слов ModelSelector (model_selector.py),
+  COMPLEX_QUESTION_KEYWORDS (llm_council.py), коротких вопросов и тем
+  (context_hints.py), число кодов нормативов, длина вопроса
+- Предсказание - сумма весов активных признаков, микросекунды
+- Модель: intent_model.json (обучается офлайн); без файла - обучение на
+  встроенных примерах при первом вызове
+- Grok спрашивается только при низкой уверенности; его ответы пишутся в
+  intent_log.jsonl для следующего офлайн-обучения
+- Метрики: доля локальных решений, согласие с Grok, матрица расхождений
+
+Обучение на журнале:
+    python intent_classifier.py train intent_log.jsonl
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import logging
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from russian_text import stem, tokenize
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+INTENT_LOG_PATH = os.getenv("INTENT_LOG_PATH", "intent_log.jsonl")
+# Ниже этой вероятности решение принимает Grok
+INTENT_CONFIDENCE_THRESHOLD = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.6"))
+# Доля уверенных решений, которые выборочно сверяются с Grok в фоне
+INTENT_AUDIT_RATE = float(os.getenv("INTENT_AUDIT_RATE", "0.02"))
+
+INTENTS = ["simple_save", "simple_question", "technical_question", "complex_analysis"]
+DEFAULT_INTENT = "technical_question"
+
+# Размер пространства хешей признаков
+HASH_BITS = 18
+_HASH_MASK = (1 << HASH_BITS) - 1
+
+# Обучение
+# Небольшой шаг и L2 держат вероятности откалиброванными: на спорных
+# вопросах уверенность падает ниже порога и решает Grok
+LEARNING_RATE = 0.1
+L2 = 1e-3
+EPOCHS = 15
+
+# Встроенные примеры (до появления журнала с ответами Grok)
+SEED_EXAMPLES = {
+    "simple_save": [
+        "да", "ок", "окей", "хорошо", "сохрани", "сохрани это", "запиши", "зафиксируй",
+        "да, сохрани в проект", "запомни это", "спасибо", "понял", "принято", "согласен",
+        "добавь в заметки", "сохрани ответ", "запиши в журнал", "отлично, сохрани", "да, верно", "подтверждаю",
+    ],
+    "simple_question": [
+        "что такое СРО", "что такое ППР", "кто такой технадзор", "что означает М350",
+        "расскажи про кирпич", "чем отличается ГИП от ГАП", "в чём разница между ППР и ПОС",
+        "объясни простыми словами что такое ЗОС", "что такое исполнительная документация",
+        "сколько стоит куб бетона", "какая погода завтра", "привет", "как дела",
+        "что такое КС-2", "кто подписывает акт скрытых работ", "где взять журнал работ",
+        "как тебя зовут", "что ты умеешь", "что такое опалубка", "что такое гидроизоляция",
+    ],
+    "technical_question": [
+        "какой защитный слой бетона для фундамента", "нахлест арматуры А500 диаметр 12",
+        "требования СП 70.13330.2012 к кладке", "допустимая ширина раскрытия трещин",
+        "какой класс бетона для плиты перекрытия", "шаг хомутов в колонне",
+        "минимальный уклон кровли из профнастила", "глубина заложения фундамента в Москве",
+        "какая прочность бетона через 7 суток", "по ГОСТ 10180 сколько образцов в серии",
+        "допуск отклонения колонн от вертикали", "какая толщина утеплителя для стены",
+        "требования к сварке арматуры", "как принять бетон на объекте",
+        "сколько дней выдерживать бетон зимой", "норма расхода цемента на куб",
+        "какая осадка конуса для П3", "требования к акту освидетельствования скрытых работ",
+        "испытание свай статической нагрузкой", "марка раствора для кладки",
+    ],
+    "complex_analysis": [
+        "рассчитай несущую способность сваи 30 см длиной 8 м в суглинке",
+        "рассчитать армирование плиты перекрытия 6 на 6 м нагрузка 400 кг",
+        "сравни требования СП 63.13330.2018 и СНиП 52-01-2003 к защитному слою",
+        "проанализируй почему появились трещины в фундаменте и что делать",
+        "оценка технического состояния здания после пожара, какие обследования нужны",
+        "как устранить дефект и какие нормативы нарушены если бетон не набрал прочность",
+        "рассчитай нагрузку на фундамент двухэтажного дома из газобетона",
+        "что делать если подрядчик нарушил технологию и отказывается переделывать, претензия и экспертиза",
+        "проверь расчет прогиба балки пролетом 6 м",
+        "проанализируй проект на соответствие СП 22.13330 и СП 24.13330",
+        "вычислить деформацию основания при слабом грунте и подтоплении",
+        "сложный грунт, карстовые пустоты - какой фундамент выбрать и как обосновать",
+        "сравни варианты утепления по теплопроводности и стоимости",
+        "подбери сечение арматуры для балки с изгибающим моментом 120 кН·м",
+        "оцени риски при зимнем бетонировании без прогрева и последствия для прочности",
+        "почему просела плита и как рассчитать усиление",
+        "проведи анализ сметы и найди завышение объемов",
+        "анализ причин разрушения кладки и рекомендации по усилению",
+        "рассчитай теплопотери стены из кирпича 510 мм с утеплителем",
+        "разбери ситуацию: приемка объекта, несоответствие проекту, штрафы и ответственность",
+    ],
+}
+
+
+@dataclass
+class IntentPrediction:
+    """Результат классификации"""
+
+    intent: str
+    confidence: float
+    probabilities: Dict[str, float]
+
+
+# ========================================
+# ПРИЗНАКИ
+# ========================================
+
+def _keyword_regex(keywords: Iterable[str]) -> Optional[re.Pattern]:
+    """Один regex для списка ключевых слов (подстроки, как в исходных списках)"""
+    keywords = sorted({k.lower() for k in keywords if k}, key=len, reverse=True)
+    if not keywords:
+        return None
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+
+def _load_keyword_groups() -> Dict[str, re.Pattern]:
+    """Списки ключевых слов из модулей бота (недоступные модули пропускаются)"""
+    groups: Dict[str, Iterable[str]] = {}
+
+    try:
+        from model_selector import get_model_selector
+        selector = get_model_selector()
+        groups.update({
+            "technical": selector.technical_keywords,
+            "simple": selector.simple_question_patterns,
+            "legal": selector.legal_keywords,
+            "drawing": selector.drawing_keywords,
+            "web": selector.web_search_keywords,
+            "defect": selector.defect_keywords,
+        })
+    except ImportError:
+        logger.warning("⚠️ model_selector.py не найден")
+
+    try:
+        from llm_council import COMPLEX_QUESTION_KEYWORDS
+        groups["complex"] = COMPLEX_QUESTION_KEYWORDS
+    except ImportError:
+        logger.warning("⚠️ llm_council.py не найден")
+
+    compiled = {}
+    for name, keywords in groups.items():
+        regex = _keyword_regex(keywords)
+        if regex is not None:
+            compiled[name] = regex
+    return compiled
+
+
+def _load_context_hints():
+    """Короткие вопросы и темы из context_hints.py"""
+    try:
+        from context_hints import detect_topic, is_short_question
+        return is_short_question, detect_topic
+    except ImportError:
+        return None, None
+
+
+def _bucket(count: int) -> str:
+    if count <= 2:
+        return str(count)
+    if count <= 5:
+        return "3-5"
+    if count <= 10:
+        return "6-10"
+    if count <= 20:
+        return "11-20"
+    return "21+"
+
+
+class FeatureExtractor:
+    """Текст → хеши признаков"""
+
+    def __init__(self):
+        self.keyword_groups = _load_keyword_groups()
+        self.is_short_question, self.detect_topic = _load_context_hints()
+        try:
+            from regulation_matcher import get_regulation_matcher
+            self._matcher = get_regulation_matcher()
+        except ImportError:
+            self._matcher = None
+
+    def features(self, text: str) -> List[str]:
+        """Имена признаков (до хеширования)"""
+        lowered = text.lower()
+        stems = [stem(token) for token in tokenize(text, drop_stop_words=False)]
+
+        features = ["bias", f"len:{_bucket(len(stems))}"]
+        features.extend(f"w:{s}" for s in stems)
+        features.extend(f"b:{a}_{b}" for a, b in zip(stems, stems[1:]))
+        if stems:
+            features.append(f"first:{stems[0]}")
+
+        for name, regex in self.keyword_groups.items():
+            hits = len(regex.findall(lowered))
+            if hits:
+                features.append(f"kw:{name}")
+                features.append(f"kw:{name}:{_bucket(hits)}")
+
+        if self._matcher is not None:
+            codes = len(self._matcher.find_all(text))
+            if codes:
+                features.append(f"reg:{_bucket(codes)}")
+
+        if self.is_short_question is not None and self.is_short_question(text):
+            features.append("short")
+        if self.detect_topic is not None:
+            topic = self.detect_topic(text)
+            if topic:
+                features.append(f"topic:{topic}")
+
+        if "?" in text:
+            features.append("qmark")
+        if any(ch.isdigit() for ch in text):
+            features.append("digits")
+        return features
+
+    def hashed(self, text: str) -> List[int]:
+        """Уникальные хеши признаков"""
+        return list({zlib.crc32(f.encode("utf-8")) & _HASH_MASK for f in self.features(text)})
+
+
+# ========================================
+# МОДЕЛЬ
+# ========================================
+
+class IntentClassifier:
+    """Softmax-регрессия по хешированным признакам"""
+
+    def __init__(self, extractor: FeatureExtractor = None):
+        self.extractor = extractor or FeatureExtractor()
+        # хеш признака → веса по классам
+        self.weights: Dict[int, List[float]] = {}
+
+    # ---------- предсказание ----------
+
+    def _probabilities(self, features: List[int]) -> List[float]:
+        scores = [0.0] * len(INTENTS)
+        weights = self.weights
+        for feature in features:
+            row = weights.get(feature)
+            if row is not None:
+                for i, w in enumerate(row):
+                    scores[i] += w
+        top = max(scores)
+        exps = [math.exp(s - top) for s in scores]
+        total = sum(exps)
+        return [e / total for e in exps]
+
+    def predict(self, text: str) -> IntentPrediction:
+        """Намерение и уверенность (вероятность лучшего класса)"""
+        probabilities = self._probabilities(self.extractor.hashed(text))
+        best = max(range(len(INTENTS)), key=probabilities.__getitem__)
+        return IntentPrediction(
+            intent=INTENTS[best],
+            confidence=probabilities[best],
+            probabilities=dict(zip(INTENTS, probabilities))
+        )
+
+    # ---------- обучение ----------
+
+    def train(self, samples: List[Tuple[str, str]], epochs: int = EPOCHS, seed: int = 0):
+        """
+        Обучение SGD с L2
+
+        Args:
+            samples: [(текст, намерение)]
+        """
+        data = [
+            (self.extractor.hashed(text), INTENTS.index(intent))
+            for text, intent in samples if intent in INTENTS
+        ]
+        rng = random.Random(seed)
+        self.weights = {}
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            rate = LEARNING_RATE / (1 + epoch * 0.1)
+            for features, label in data:
+                probabilities = self._probabilities(features)
+                for feature in features:
+                    row = self.weights.get(feature)
+                    if row is None:
+                        row = self.weights[feature] = [0.0] * len(INTENTS)
+                    for i in range(len(INTENTS)):
+                        gradient = probabilities[i] - (1.0 if i == label else 0.0)
+                        row[i] -= rate * (gradient + L2 * row[i])
+        logger.info(f"✅ Классификатор намерений: обучен на {len(data)} примерах, {len(self.weights)} признаков")
+
+    # ---------- файл модели ----------
+
+    def save(self, path: str = INTENT_MODEL_PATH):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "intents": INTENTS,
+                "hash_bits": HASH_BITS,
+                "weights": {str(k): [round(w, 5) for w in v] for k, v in self.weights.items()}
+            }, f)
+        os.replace(tmp, path)
+
+    def load(self, path: str = INTENT_MODEL_PATH) -> bool:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("intents") != INTENTS or data.get("hash_bits") != HASH_BITS:
+            logger.warning(f"⚠️ {path}: другая схема модели, используются встроенные примеры")
+            return False
+        self.weights = {int(k): v for k, v in data["weights"].items()}
+        return True
+
+
+def seed_samples() -> List[Tuple[str, str]]:
+    return [(text, intent) for intent, texts in SEED_EXAMPLES.items() for text in texts]
+
+
+def read_log(path: str = INTENT_LOG_PATH) -> List[Tuple[str, str]]:
+    """Примеры из журнала ответов Grok"""
+    samples = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("teacher") in INTENTS:
+                    samples.append((record["text"], record["teacher"]))
+    except OSError:
+        pass
+    return samples
+
+
+# ========================================
+# МЕТРИКИ И ЖУРНАЛ
+# ========================================
+
+class IntentRouter:
+    """Локальный классификатор + решение, когда спрашивать Grok, + метрики согласия"""
+
+    def __init__(
+        self,
+        classifier: IntentClassifier = None,
+        threshold: float = INTENT_CONFIDENCE_THRESHOLD,
+        audit_rate: float = INTENT_AUDIT_RATE,
+        log_path: Optional[str] = INTENT_LOG_PATH
+    ):
+        self._classifier = classifier
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.log_path = log_path
+        self._rng = random.Random()
+        self.confusion: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.stats = {
+            "predictions": 0,
+            "confident": 0,
+            "teacher_calls": 0,
+            "audits": 0,
+            "agreements": 0,
+            "disagreements": 0,
+            "teacher_errors": 0,
+            "predict_time_us": 0.0
+        }
+
+    @property
+    def classifier(self) -> IntentClassifier:
+        """Модель из файла или обученная на встроенных примерах (при первом обращении)"""
+        if self._classifier is None:
+            classifier = IntentClassifier()
+            if classifier.load():
+                logger.info(f"✅ Классификатор намерений загружен из {INTENT_MODEL_PATH}")
+            else:
+                classifier.train(seed_samples())
+            self._classifier = classifier
+        return self._classifier
+
+    def predict(self, text: str) -> IntentPrediction:
+        started = time.perf_counter()
+        prediction = self.classifier.predict(text)
+        self.stats["predict_time_us"] += (time.perf_counter() - started) * 1e6
+        self.stats["predictions"] += 1
+        if prediction.confidence >= self.threshold:
+            self.stats["confident"] += 1
+        return prediction
+
+    def needs_teacher(self, prediction: IntentPrediction) -> bool:
+        """Низкая уверенность - решает Grok"""
+        return prediction.confidence < self.threshold
+
+    def should_audit(self) -> bool:
+        """Выборочная фоновая сверка уверенного решения с Grok"""
+        return self.audit_rate > 0 and self._rng.random() < self.audit_rate
+
+    def record_teacher(self, text: str, prediction: IntentPrediction, teacher: Optional[str], audit: bool = False):
+        """Ответ Grok: метрики согласия и запись в журнал для офлайн-обучения"""
+        self.stats["audits" if audit else "teacher_calls"] += 1
+        if teacher not in INTENTS:
+            self.stats["teacher_errors"] += 1
+            return
+
+        self.confusion[prediction.intent][teacher] += 1
+        if teacher == prediction.intent:
+            self.stats["agreements"] += 1
+        else:
+            self.stats["disagreements"] += 1
+            logger.info(f"🔍 Intent: локально {prediction.intent} ({prediction.confidence:.2f}), Grok: {teacher}")
+
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({
+                        "text": text,
+                        "teacher": teacher,
+                        "local": prediction.intent,
+                        "confidence": round(prediction.confidence, 4),
+                        "audit": audit,
+                        "ts": int(time.time())
+                    }, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logger.warning(f"⚠️ Журнал намерений недоступен: {e}")
+
+    def get_stats(self) -> dict:
+        """Метрики классификации"""
+        predictions = self.stats["predictions"]
+        compared = self.stats["agreements"] + self.stats["disagreements"]
+        return {
+            **self.stats,
+            "predict_time_us": round(self.stats["predict_time_us"], 1),
+            "local_rate": round(self.stats["confident"] / predictions, 3) if predictions else 0.0,
+            "agreement_rate": round(self.stats["agreements"] / compared, 3) if compared else 0.0,
+            "avg_predict_us": round(self.stats["predict_time_us"] / predictions, 1) if predictions else 0.0,
+            "confusion": {local: dict(row) for local, row in self.confusion.items()}
+        }
+
+
+# Общий экземпляр для бота
+INTENT_ROUTER = IntentRouter()
+
+
+def main(argv: List[str]) -> int:
+    """Офлайн-обучение: встроенные примеры + журнал ответов Grok"""
+    if len(argv) < 2 or argv[0] != "train":
+        print("Использование: python intent_classifier.py train intent_log.jsonl [intent_model.json]")
+        return 1
+    logging.basicConfig(level=logging.INFO)
+    log_samples = read_log(argv[1])
+    classifier = IntentClassifier()
+    classifier.train(seed_samples() + log_samples)
+    out = argv[2] if len(argv) > 2 else INTENT_MODEL_PATH
+    classifier.save(out)
+    print(f"✅ Модель сохранена: {out} (журнал: {len(log_samples)} примеров)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
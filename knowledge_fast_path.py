@@ -0,0 +1,319 @@
+"""
+Быстрый ответ без AI v1.0
+Поиск вопроса в локальных базах до обращения к модели
+
+- Базы (по приоритету): FAQ (faq.py), practical_knowledge_2025,
+  practical_knowledge_advanced_2025, справочник строителя (builder_reference.txt)
+- Для каждой базы свой SearchIndex (search_index.py), строится один раз
+- Ответ отдаётся, только если уверенность высокая: слова вопроса найдены в
+  заголовке/вопросе записи (coverage), оценка BM25 выше порога и лучший
+  результат заметно отрывается от второго
+- Статистика: попадания по базам, промахи, запросы уточнения у AI
+"""
+
+import os
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from russian_text import stem_tokens
+from search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+
+# Длинные вопросы обычно про конкретную ситуацию - их отдаём модели
+FAST_PATH_MAX_TERMS = int(os.getenv("FAST_PATH_MAX_TERMS", "12"))
+FAST_PATH_MIN_TERMS = 2
+
+# Во сколько раз лучший результат должен опережать второй
+FAST_PATH_MIN_MARGIN = 1.25
+
+# Узлы вложенных баз крупнее этого разбиваются на дочерние записи
+MAX_DOCUMENT_CHARS = 1500
+
+# Справочник строителя: строк в одном фрагменте
+BUILDER_CHUNK_LINES = 15
+
+# Поля записей баз знаний: заголовок и ключи вложенных разделов важнее текста
+KNOWLEDGE_FIELD_WEIGHTS = {"title": 3, "keys": 2, "body": 1}
+
+
+@dataclass
+class Corpus:
+    """База знаний и пороги уверенности для неё"""
+
+    name: str
+    label: str
+    loader: Callable[[], Optional[SearchIndex]]
+    min_coverage: float
+    min_score: float
+
+
+@dataclass
+class FastAnswer:
+    """Найденный ответ"""
+
+    source: str
+    label: str
+    title: str
+    text: str
+    score: float
+    coverage: float
+    elapsed_ms: float
+
+
+# ========================================
+# ПОСТРОЕНИЕ ИНДЕКСОВ
+# ========================================
+
+def _humanize(key) -> str:
+    """Ключ словаря → текст ("набор_прочности" → "Набор прочности")"""
+    text = str(key).replace("_", " ").strip()
+    return text[:1].upper() + text[1:]
+
+
+def _render(value, indent: int = 0) -> List[str]:
+    """Вложенные dict/list → строки списка"""
+    pad = "  " * indent
+    lines = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(item, (dict, list)):
+                lines.append(f"{pad}• {_humanize(key)}:")
+                lines.extend(_render(item, indent + 1))
+            else:
+                lines.append(f"{pad}• {_humanize(key)}: {item}")
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)):
+                lines.extend(_render(item, indent))
+            else:
+                lines.append(f"{pad}• {item}")
+    else:
+        lines.append(f"{pad}{value}")
+    return lines
+
+
+def _nested_keys(value) -> List[str]:
+    """Все ключи вложенных разделов"""
+    keys = []
+    if isinstance(value, dict):
+        for key, item in value.items():
+            keys.append(_humanize(key))
+            keys.extend(_nested_keys(item))
+    elif isinstance(value, list):
+        for item in value:
+            keys.extend(_nested_keys(item))
+    return keys
+
+
+def _add_knowledge(index: SearchIndex, path: List[str], value):
+    """Узел базы → запись индекса (крупные узлы разбиваются по дочерним ключам)"""
+    lines = _render(value)
+    if isinstance(value, dict) and len("\n".join(lines)) > MAX_DOCUMENT_CHARS:
+        for key, item in value.items():
+            _add_knowledge(index, path + [_humanize(key)], item)
+        return
+
+    title = " › ".join(path)
+    body = "\n".join(lines)
+    index.add(
+        title,
+        {"title": title, "keys": _nested_keys(value), "body": body},
+        payload=(title, f"**{title}**\n\n{body}")
+    )
+
+
+def _knowledge_index(name: str, sections: Dict[str, dict]) -> SearchIndex:
+    index = SearchIndex(name, KNOWLEDGE_FIELD_WEIGHTS, head_fields=("title", "keys"))
+    for section in sections.values():
+        for key, value in section.items():
+            _add_knowledge(index, [_humanize(key)], value)
+    index.build()
+    return index
+
+
+def _load_faq() -> Optional[SearchIndex]:
+    try:
+        from faq import get_faq_index
+    except ImportError:
+        logger.warning("⚠️ faq.py недоступен для быстрых ответов")
+        return None
+    return get_faq_index()
+
+
+def _load_practical() -> Optional[SearchIndex]:
+    try:
+        from practical_knowledge_2025 import get_all_practical_knowledge
+    except ImportError:
+        logger.warning("⚠️ practical_knowledge_2025.py не найден")
+        return None
+    return _knowledge_index("практические знания", get_all_practical_knowledge())
+
+
+def _load_advanced() -> Optional[SearchIndex]:
+    try:
+        from practical_knowledge_advanced_2025 import get_all_advanced_knowledge
+    except ImportError:
+        logger.warning("⚠️ practical_knowledge_advanced_2025.py не найден")
+        return None
+    return _knowledge_index("расширенные знания", get_all_advanced_knowledge())
+
+
+def _load_builder_reference() -> Optional[SearchIndex]:
+    try:
+        from builder_reference import load_builder_reference
+    except ImportError:
+        logger.warning("⚠️ builder_reference.py не найден")
+        return None
+    content = load_builder_reference()
+    if not content:
+        return None
+
+    index = SearchIndex("справочник строителя", {"body": 1})
+    lines = [line for line in content.split("\n") if line.strip()]
+    for start in range(0, len(lines), BUILDER_CHUNK_LINES):
+        chunk = "\n".join(lines[start:start + BUILDER_CHUNK_LINES])
+        title = f"Справочник строителя (фрагмент {start // BUILDER_CHUNK_LINES + 1})"
+        index.add(start, {"body": chunk}, payload=(title, chunk))
+    index.build()
+    return index
+
+
+# Порядок - приоритет: первая база с уверенным ответом побеждает
+CORPORA = [
+    Corpus("faq", "FAQ", _load_faq, min_coverage=0.75, min_score=3.0),
+    Corpus("practical", "Практические знания 2025", _load_practical, min_coverage=0.8, min_score=4.0),
+    Corpus("advanced", "Расширенные практические знания", _load_advanced, min_coverage=0.8, min_score=4.0),
+    # Фрагменты книги без заголовков - только при полном совпадении слов
+    Corpus("builder_reference", "Справочник строителя", _load_builder_reference, min_coverage=1.0, min_score=12.0),
+]
+
+
+# ========================================
+# ПОИСК ОТВЕТА
+# ========================================
+
+class KnowledgeFastPath:
+    """Быстрые ответы из локальных баз со статистикой"""
+
+    def __init__(self, corpora: List[Corpus] = None):
+        self.corpora = corpora if corpora is not None else CORPORA
+        self._indexes: Optional[Dict[str, SearchIndex]] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "skipped": 0,
+            "refine_requests": 0,
+            "hits_by_source": {corpus.name: 0 for corpus in self.corpora},
+            "lookup_time_ms": 0.0
+        }
+
+    def warm_up(self):
+        """Построить индексы всех баз (при старте бота, а не на первом вопросе)"""
+        if self._indexes is not None:
+            return
+        started = time.perf_counter()
+        indexes = {}
+        for corpus in self.corpora:
+            try:
+                index = corpus.loader()
+            except Exception as e:
+                logger.error(f"❌ Быстрые ответы: база {corpus.name} не загружена: {e}")
+                index = None
+            if index is not None:
+                indexes[corpus.name] = index
+        self._indexes = indexes
+        logger.info(
+            f"✅ Быстрые ответы: {len(indexes)} баз, "
+            f"{sum(len(index) for index in indexes.values())} записей "
+            f"({(time.perf_counter() - started) * 1000:.0f} мс)"
+        )
+
+    def find_answer(self, question: str) -> Optional[FastAnswer]:
+        """
+        Найти уверенный ответ в локальных базах
+
+        Returns:
+            FastAnswer или None (вопрос уходит модели)
+        """
+        terms = len(stem_tokens(question))
+        if not FAST_PATH_ENABLED or not (FAST_PATH_MIN_TERMS <= terms <= FAST_PATH_MAX_TERMS):
+            self.stats["skipped"] += 1
+            return None
+
+        self.warm_up()
+        started = time.perf_counter()
+        answer = None
+        for corpus in self.corpora:
+            index = self._indexes.get(corpus.name)
+            if index is None:
+                continue
+            hits = index.search(question, limit=2)
+            if not hits:
+                continue
+            best = hits[0]
+            if best.coverage < corpus.min_coverage or best.score < corpus.min_score:
+                continue
+            if len(hits) > 1 and best.score < hits[1].score * FAST_PATH_MIN_MARGIN:
+                continue
+
+            title, text = self._answer_text(corpus, best.payload)
+            answer = FastAnswer(
+                source=corpus.name,
+                label=corpus.label,
+                title=title,
+                text=text,
+                score=best.score,
+                coverage=best.coverage,
+                elapsed_ms=0.0
+            )
+            break
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats["lookup_time_ms"] += elapsed_ms
+        if answer is None:
+            self.stats["misses"] += 1
+            return None
+
+        answer.elapsed_ms = elapsed_ms
+        self.stats["hits"] += 1
+        self.stats["hits_by_source"][answer.source] += 1
+        logger.info(
+            f"⚡ Быстрый ответ ({answer.source}): '{answer.title[:50]}' "
+            f"score={answer.score:.1f} coverage={answer.coverage:.2f} за {elapsed_ms:.2f} мс"
+        )
+        return answer
+
+    @staticmethod
+    def _answer_text(corpus: Corpus, payload) -> tuple:
+        """(заголовок, текст ответа) из записи индекса"""
+        if corpus.name == "faq":
+            _, _, q_data = payload
+            return q_data["q"], f"**{q_data['q']}**\n\n{q_data['a']}"
+        return payload
+
+    def record_refine(self):
+        """Пользователь попросил уточнить быстрый ответ у AI"""
+        self.stats["refine_requests"] += 1
+
+    def get_stats(self) -> dict:
+        """Статистика быстрых ответов"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hits_by_source": dict(self.stats["hits_by_source"]),
+            "lookup_time_ms": round(self.stats["lookup_time_ms"], 1),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+            "avg_lookup_ms": round(self.stats["lookup_time_ms"] / lookups, 3) if lookups else 0.0,
+            "refine_rate": round(self.stats["refine_requests"] / self.stats["hits"], 3) if self.stats["hits"] else 0.0
+        }
+
+
+# Общий экземпляр для бота
+FAST_PATH = KnowledgeFastPath()
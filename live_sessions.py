@@ -0,0 +1,564 @@
+"""
+Общий менеджер живых голосовых сессий v1.0
+Одно место для сессий всех голосовых бэкендов (Gemini Live, Gemini Live v2,
+OpenAI Whisper+TTS, WebSocket прокси Mini App)
+
+- LiveSessionManager: не больше LIVE_MAX_SESSIONS одновременных сессий;
+  при заполнении вытесняется самая давно простаивающая (если простаивает
+  дольше LIVE_PREEMPT_IDLE_SECONDS), иначе новая сессия отклоняется
+- Простаивающие и отключившиеся сессии закрываются по колесу таймеров:
+  одна фоновая задача, отметка активности - O(1) без перестановок
+- Отправка наверх идёт через очередь сессии, ограниченную по байтам
+  (LIVE_SEND_BUFFER_BYTES): если сервер модели не успевает, отправитель
+  ждёт место до LIVE_SEND_TIMEOUT секунд, затем сообщение отбрасывается
+- SessionTranscript: транскрипция с лимитом обменов и символов -
+  старые обмены вытесняются, длинный ответ обрезается
+- Метрики: активные сессии по бэкендам, байт/с в обе стороны, задержка
+  от запроса пользователя до первого аудио ответа (p50/p95)
+"""
+
+import os
+import math
+import time
+import asyncio
+import inspect
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Максимум одновременных голосовых сессий (все бэкенды вместе)
+LIVE_MAX_SESSIONS = int(os.getenv("LIVE_MAX_SESSIONS", "100"))
+
+# Сессия без активности дольше этого времени закрывается
+# (VOICE_SESSION_IDLE_MINUTES - прежняя настройка, действует по умолчанию)
+LIVE_IDLE_SECONDS = float(os.getenv(
+    "LIVE_IDLE_SECONDS",
+    str(float(os.getenv("VOICE_SESSION_IDLE_MINUTES", "10")) * 60)
+))
+
+# При заполнении можно вытеснить сессию, простаивающую хотя бы столько секунд
+LIVE_PREEMPT_IDLE_SECONDS = float(os.getenv("LIVE_PREEMPT_IDLE_SECONDS", "60"))
+
+# Шаг колеса таймеров (секунды)
+LIVE_WHEEL_TICK = float(os.getenv("LIVE_WHEEL_TICK", "1"))
+
+# Очередь отправки сессии: байт в ожидании и сколько ждать места (секунды)
+LIVE_SEND_BUFFER_BYTES = int(os.getenv("LIVE_SEND_BUFFER_BYTES", str(2 * 1024 * 1024)))
+LIVE_SEND_TIMEOUT = float(os.getenv("LIVE_SEND_TIMEOUT", "5"))
+
+# Транскрипция сессии: максимум обменов и символов
+LIVE_TRANSCRIPT_MAX_TURNS = int(os.getenv("LIVE_TRANSCRIPT_MAX_TURNS", "50"))
+LIVE_TRANSCRIPT_MAX_CHARS = int(os.getenv("LIVE_TRANSCRIPT_MAX_CHARS", "20000"))
+
+# Окно скорости (секунды) и число замеров задержки для перцентилей
+RATE_WINDOW_SECONDS = 10
+LATENCY_SAMPLES = 500
+
+
+class LiveSessionError(Exception):
+    """Сервер модели не принял сообщение - сессия закрывается"""
+
+
+# ========================================
+# ТРАНСКРИПЦИЯ
+# ========================================
+
+class SessionTranscript:
+    """
+    Транскрипция разговора с ограничением объёма
+
+    Текущий обмен копится в user_text/bot_text, commit() сохраняет его.
+    Хранятся последние max_turns обменов и не больше max_chars символов;
+    dropped - сколько ранних обменов вытеснено
+    """
+
+    def __init__(
+        self,
+        max_turns: int = LIVE_TRANSCRIPT_MAX_TURNS,
+        max_chars: int = LIVE_TRANSCRIPT_MAX_CHARS
+    ):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.turns: Deque[Dict[str, str]] = deque()
+        self.chars = 0
+        self.dropped = 0
+        self.user_text = ""
+        self.bot_text = ""
+
+    def set_user(self, text: str):
+        self.user_text = text[:self.max_chars]
+
+    def add_bot(self, text: str):
+        room = self.max_chars - len(self.bot_text)
+        if room > 0:
+            self.bot_text += text[:room]
+
+    def commit(self) -> bool:
+        """Сохранить текущий обмен; False - сохранять нечего"""
+        if not self.user_text and not self.bot_text:
+            return False
+        turn = {
+            "user": self.user_text,
+            "bot": self.bot_text.strip(),
+            "timestamp": datetime.now().isoformat()
+        }
+        self.turns.append(turn)
+        self.chars += len(turn["user"]) + len(turn["bot"])
+        self.user_text = ""
+        self.bot_text = ""
+
+        while len(self.turns) > 1 and (len(self.turns) > self.max_turns or self.chars > self.max_chars):
+            old = self.turns.popleft()
+            self.chars -= len(old["user"]) + len(old["bot"])
+            self.dropped += 1
+        return True
+
+    @property
+    def total(self) -> int:
+        """Всего обменов за сессию, включая вытесненные"""
+        return self.dropped + len(self.turns)
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def __iter__(self):
+        return iter(self.turns)
+
+
+# ========================================
+# МЕТРИКИ
+# ========================================
+
+class RateMeter:
+    """Байт в секунду за последние RATE_WINDOW_SECONDS (корзины по секунде)"""
+
+    def __init__(self, window: int = RATE_WINDOW_SECONDS):
+        self.window = window
+        self._buckets: Deque[List[float]] = deque()
+
+    def add(self, amount: int, now: float):
+        second = int(now)
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += amount
+        else:
+            self._buckets.append([second, amount])
+        self._trim(second)
+
+    def _trim(self, second: int):
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            self._buckets.popleft()
+
+    def rate(self, now: float) -> float:
+        self._trim(int(now))
+        return sum(amount for _, amount in self._buckets) / self.window
+
+
+def _percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+# ========================================
+# КОЛЕСО ТАЙМЕРОВ
+# ========================================
+
+class TimerWheel:
+    """
+    Хешированное колесо таймеров: ключ попадает в слот своего срока
+
+    advance(now) возвращает ключи из пройденных слотов. Срок не уточняется
+    при каждой активности - владелец проверяет его при срабатывании и
+    при необходимости планирует ключ заново
+    """
+
+    def __init__(self, horizon: float, tick: float = LIVE_WHEEL_TICK, now: float = 0.0):
+        self.tick = tick
+        self.slots: List[set] = [set() for _ in range(int(math.ceil(horizon / tick)) + 2)]
+        self._index = int(now // tick)
+
+    def schedule(self, key: Hashable, deadline: float):
+        index = max(int(deadline // self.tick), self._index + 1)
+        index = min(index, self._index + len(self.slots) - 1)
+        self.slots[index % len(self.slots)].add(key)
+
+    def advance(self, now: float) -> List[Hashable]:
+        target = int(now // self.tick)
+        due = []
+        for step in range(1, min(target - self._index, len(self.slots)) + 1):
+            slot = self.slots[(self._index + step) % len(self.slots)]
+            due.extend(slot)
+            slot.clear()
+        self._index = max(self._index, target)
+        return due
+
+    def __len__(self) -> int:
+        return sum(len(slot) for slot in self.slots)
+
+
+# ========================================
+# СЕССИЯ
+# ========================================
+
+class LiveSession:
+    """
+    Запись менеджера: сессия бэкенда, активность, очередь отправки, метрики
+
+    session - объект бэкенда (GeminiLiveSession, прокси и т.п.); менеджер
+    вызывает у него stop() при закрытии и смотрит is_connected
+    """
+
+    def __init__(self, manager: "LiveSessionManager", key: Hashable, backend: str, session: Any):
+        self.manager = manager
+        self.key = key
+        self.backend = backend
+        self.session = session
+        self.opened_at = self.last_activity = manager.clock()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.closed = False
+
+        self._outbox: Deque[tuple] = deque()
+        self._buffered = 0
+        self._wake = asyncio.Event()
+        self._space = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._request_at: Optional[float] = None
+
+    @property
+    def connected(self) -> bool:
+        return not self.closed and getattr(self.session, "is_connected", True) is not False
+
+    @property
+    def buffered(self) -> int:
+        """Байт в очереди отправки"""
+        return self._buffered
+
+    def touch(self):
+        self.last_activity = self.manager.clock()
+
+    def mark_request(self):
+        """Пользователь закончил запрос - отсюда считается задержка до ответа"""
+        self._request_at = self.manager.clock()
+
+    def sent(self, nbytes: int):
+        """Учесть отправленное наверх (для бэкендов без очереди отправки)"""
+        self.bytes_out += nbytes
+        self.touch()
+        self.manager._bytes_out.add(nbytes, self.last_activity)
+
+    def received(self, nbytes: int, audio: bool = True):
+        """Учесть ответ сервера модели; первое аудио после запроса - замер задержки"""
+        self.bytes_in += nbytes
+        self.touch()
+        self.manager._bytes_in.add(nbytes, self.last_activity)
+        if audio and self._request_at is not None:
+            self.manager._latency.append(self.last_activity - self._request_at)
+            self._request_at = None
+
+    async def send(
+        self,
+        fn: Callable[..., Awaitable[Any]],
+        *args,
+        nbytes: int = 0,
+        request: bool = False,
+        timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Поставить отправку в очередь сессии (сообщения уходят по порядку)
+
+        Args:
+            fn: Корутина отправки бэкенда (session.send_audio, ws.send...);
+                результат False считается ошибкой и закрывает сессию
+            nbytes: Объём сообщения - для лимита очереди и метрик
+            request: Сообщение завершает запрос пользователя (замер задержки)
+            timeout: Сколько ждать места в очереди (по умолчанию LIVE_SEND_TIMEOUT)
+
+        Returns:
+            False - сессия закрыта или очередь не освободилась (сообщение отброшено)
+        """
+        if not self.connected:
+            return False
+
+        limit = self.manager.buffer_bytes
+        if self._buffered and self._buffered + nbytes > limit:
+            self.manager.stats["backpressure_waits"] += 1
+            try:
+                await asyncio.wait_for(self._wait_space(nbytes, limit), timeout or self.manager.send_timeout)
+            except asyncio.TimeoutError:
+                self.manager.stats["backpressure_drops"] += 1
+                logger.warning(f"⚠️ Сервер модели не успевает: сообщение сессии {self.key} отброшено "
+                               f"({self._buffered} байт в очереди)")
+                return False
+            if not self.connected:
+                return False
+
+        self._outbox.append((fn, args, nbytes))
+        self._buffered += nbytes
+        self.touch()
+        if request:
+            self.mark_request()
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+        self._wake.set()
+        return True
+
+    async def _wait_space(self, nbytes: int, limit: int):
+        while self._buffered and self._buffered + nbytes > limit and not self.closed:
+            self._space.clear()
+            await self._space.wait()
+
+    async def _write_loop(self):
+        while True:
+            while not self._outbox:
+                self._wake.clear()
+                await self._wake.wait()
+            fn, args, nbytes = self._outbox.popleft()
+            try:
+                result = await fn(*args)
+                if result is False:
+                    raise LiveSessionError("сообщение не отправлено")
+                self.sent(nbytes)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.manager.stats["send_errors"] += 1
+                logger.error(f"❌ Отправка в сессии {self.key}: {e}")
+                # Закрытие отменяет эту задачу - отдельно от неё
+                asyncio.get_running_loop().create_task(self.manager.release(self, "error"))
+                return
+            finally:
+                self._buffered -= nbytes
+                self._space.set()
+
+    async def _shutdown(self):
+        self.closed = True
+        self._outbox.clear()
+        self._buffered = 0
+        self._space.set()
+        writer, self._writer = self._writer, None
+        if writer is not None and writer is not asyncio.current_task():
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = self.manager.clock()
+        return {
+            "backend": self.backend,
+            "age_s": round(now - self.opened_at, 1),
+            "idle_s": round(now - self.last_activity, 1),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "buffered": self._buffered
+        }
+
+
+# ========================================
+# МЕНЕДЖЕР
+# ========================================
+
+class LiveSessionManager:
+    """Сессии всех голосовых бэкендов: лимит, простой, очередь отправки, метрики"""
+
+    def __init__(
+        self,
+        max_sessions: int = LIVE_MAX_SESSIONS,
+        idle_seconds: float = LIVE_IDLE_SECONDS,
+        preempt_idle_seconds: float = LIVE_PREEMPT_IDLE_SECONDS,
+        tick: float = LIVE_WHEEL_TICK,
+        buffer_bytes: int = LIVE_SEND_BUFFER_BYTES,
+        send_timeout: float = LIVE_SEND_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.preempt_idle_seconds = preempt_idle_seconds
+        self.buffer_bytes = buffer_bytes
+        self.send_timeout = send_timeout
+        self.clock = clock
+
+        self.sessions: Dict[Hashable, LiveSession] = {}
+        self.wheel = TimerWheel(idle_seconds, tick, clock())
+        self._opening = 0
+        self._task: Optional[asyncio.Task] = None
+
+        self._bytes_in = RateMeter()
+        self._bytes_out = RateMeter()
+        self._latency: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.stats = {
+            "opened": 0,
+            "failed": 0,
+            "rejected": 0,
+            "backpressure_waits": 0,
+            "backpressure_drops": 0,
+            "send_errors": 0
+        }
+        self.closed: Dict[str, int] = {}
+
+    def get(self, key: Hashable) -> Optional[LiveSession]:
+        return self.sessions.get(key)
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    async def open(
+        self,
+        key: Hashable,
+        backend: str,
+        factory: Callable[[], Any]
+    ) -> Optional[LiveSession]:
+        """
+        Открыть сессию (прежняя сессия с тем же ключом закрывается)
+
+        Args:
+            key: Ключ сессии, например ("gemini", user_id)
+            backend: Имя бэкенда для метрик
+            factory: Создаёт и запускает сессию бэкенда (можно корутину);
+                None - запустить не удалось
+
+        Returns:
+            LiveSession или None (лимит сессий или ошибка запуска)
+        """
+        if key in self.sessions:
+            await self.close(key, "replaced")
+
+        if len(self.sessions) + self._opening >= self.max_sessions and not await self._preempt():
+            self.stats["rejected"] += 1
+            logger.warning(f"⚠️ Лимит голосовых сессий ({self.max_sessions}): {key} отклонена")
+            return None
+
+        self._opening += 1
+        try:
+            session = factory()
+            if inspect.isawaitable(session):
+                session = await session
+        except Exception as e:
+            logger.error(f"❌ Запуск голосовой сессии {key}: {e}")
+            session = None
+        finally:
+            self._opening -= 1
+
+        if session is None:
+            self.stats["failed"] += 1
+            return None
+
+        live = LiveSession(self, key, backend, session)
+        self.sessions[key] = live
+        self.wheel.schedule(key, live.last_activity + self.idle_seconds)
+        self.stats["opened"] += 1
+        return live
+
+    async def _preempt(self) -> bool:
+        """Освободить место: закрыть самую давно простаивающую сессию"""
+        if not self.sessions:
+            return False
+        oldest = min(self.sessions.values(), key=lambda live: live.last_activity)
+        if self.clock() - oldest.last_activity < self.preempt_idle_seconds:
+            return False
+        await self.close(oldest.key, "preempted")
+        return True
+
+    async def close(self, key: Hashable, reason: str = "stopped") -> Optional[LiveSession]:
+        """Закрыть сессию и остановить её бэкенд"""
+        live = self.sessions.pop(key, None)
+        if live is None:
+            return None
+        await live._shutdown()
+        try:
+            result = getattr(live.session, "stop", lambda: None)()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"❌ Остановка голосовой сессии {key}: {e}")
+        self.closed[reason] = self.closed.get(reason, 0) + 1
+        logger.info(f"🛑 Голосовая сессия {key} закрыта ({reason})")
+        return live
+
+    async def release(self, live: LiveSession, reason: str = "stopped") -> bool:
+        """Закрыть именно эту сессию (если ключ уже занят новой - ничего не делать)"""
+        if self.sessions.get(live.key) is not live:
+            return False
+        await self.close(live.key, reason)
+        return True
+
+    async def expire(self, now: Optional[float] = None) -> int:
+        """Закрыть сессии из сработавших слотов колеса: простой или разрыв соединения"""
+        now = self.clock() if now is None else now
+        closed = 0
+        for key in self.wheel.advance(now):
+            live = self.sessions.get(key)
+            if live is None:
+                continue
+            deadline = live.last_activity + self.idle_seconds
+            if not live.connected:
+                await self.close(key, "disconnected")
+                closed += 1
+            elif deadline <= now:
+                await self.close(key, "idle")
+                closed += 1
+            else:
+                self.wheel.schedule(key, deadline)
+        if closed:
+            logger.info(f"🗑️ Закрыто голосовых сессий: {closed}")
+        return closed
+
+    def check_soon(self, key: Hashable):
+        """Бэкенд потерял соединение - проверить сессию на ближайшем шаге колеса"""
+        if key in self.sessions:
+            self.wheel.schedule(key, self.clock())
+
+    def start(self):
+        """Запустить колесо таймеров (вызывать из работающего event loop)"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._wheel_loop())
+            logger.info(f"✅ Менеджер голосовых сессий запущен (до {self.max_sessions}, "
+                        f"простой {self.idle_seconds:g}с)")
+
+    async def stop(self):
+        """Остановить колесо и закрыть все сессии"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        for key in list(self.sessions):
+            await self.close(key, "shutdown")
+
+    async def _wheel_loop(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            try:
+                await self.expire()
+            except Exception as e:
+                logger.error(f"❌ Колесо голосовых сессий: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = self.clock()
+        backends: Dict[str, int] = {}
+        for live in self.sessions.values():
+            backends[live.backend] = backends.get(live.backend, 0) + 1
+        return {
+            "active": len(self.sessions),
+            "max_sessions": self.max_sessions,
+            "backends": backends,
+            **self.stats,
+            "closed": dict(self.closed),
+            "bytes_in_per_s": round(self._bytes_in.rate(now)),
+            "bytes_out_per_s": round(self._bytes_out.rate(now)),
+            "buffered": sum(live.buffered for live in self.sessions.values()),
+            "latency_p50_ms": round(_percentile(self._latency, 0.5) * 1000),
+            "latency_p95_ms": round(_percentile(self._latency, 0.95) * 1000)
+        }
+
+
+# Общий менеджер всех голосовых бэкендов процесса
+LIVE_SESSIONS = LiveSessionManager()
+
+
+def get_live_sessions() -> LiveSessionManager:
+    return LIVE_SESSIONS
@@ -7,6 +7,14 @@ LLM Council - Совет AI моделей для СтройНадзорAI
 2. Stage 2: Перекрёстная оценка ответов (peer-review)
 3. Stage 3: Синтез финального ответа "Председателем"
 
+Планировщик: у каждого участника свой дедлайн, после кворума (2 из 3 мнений)
+отстающие отменяются; ответ Председателя идёт потоком (on_chunk), время этапов
+и участников - в трассировке result["trace"] и get_council_stats()
+
+Кэш (council_cache.py): мнения, оценки и синтез сохраняются по нормализованному
+вопросу и отпечатку контекста; повторный вопрос отвечается из кэша, при
+частичном попадании опрашиваются только недостающие участники
+
 Модели:
 - Grok (xAI) - технический анализ
 - Claude (Anthropic) - экспертиза и нюансы
@@ -14,11 +22,18 @@ LLM Council - Совет AI моделей для СтройНадзорAI
 """
 
 import os
+import time
 import asyncio
 import logging
-import re
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
+from functools import lru_cache
+
+from council_cache import CouncilCache, get_council_cache, template_version
+from prompt_cache import PROMPT_CACHE_STATS, anthropic_system, normalize_prompt
+from regulation_matcher import get_regulation_matcher
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +64,18 @@ COUNCIL_MODELS = {
 # Председатель совета (формирует финальный ответ)
 CHAIRMAN_MODEL = "claude"  # Claude лучше всего синтезирует информацию
 
+# Сколько непустых мнений достаточно, чтобы не ждать остальных участников
+COUNCIL_QUORUM = int(os.getenv("COUNCIL_QUORUM", "2"))
+
+# Сколько ещё ждать отстающих после кворума (секунд, 0 - сразу к синтезу)
+COUNCIL_QUORUM_GRACE = float(os.getenv("COUNCIL_QUORUM_GRACE", "0"))
+
+# Дедлайн ответа участника по умолчанию, секунд (свой - ключ "deadline" в COUNCIL_MODELS)
+COUNCIL_MEMBER_DEADLINE = float(os.getenv("COUNCIL_MEMBER_DEADLINE", "25"))
+
+# Предел на синтез Председателем (секунд)
+COUNCIL_SYNTHESIS_TIMEOUT = float(os.getenv("COUNCIL_SYNTHESIS_TIMEOUT", "90"))
+
 # Ключевые слова для определения сложных вопросов
 COMPLEX_QUESTION_KEYWORDS = [
     # Технические термины
@@ -85,10 +112,8 @@ MIN_COMPLEX_QUESTION_LENGTH = 15
 def get_xai_client():
     """Получить xAI клиент"""
     try:
-        from xai_client import XAIClient
-        api_key = os.getenv("XAI_API_KEY")
-        if api_key:
-            return XAIClient(api_key=api_key)
+        from xai_client import get_shared_xai_client
+        return get_shared_xai_client()
     except Exception as e:
         logger.error(f"Ошибка инициализации xAI: {e}")
     return None
@@ -97,10 +122,10 @@ def get_xai_client():
 def get_claude_client():
     """Получить Claude клиент"""
     try:
-        from anthropic import Anthropic
+        from anthropic import AsyncAnthropic
         api_key = os.getenv("ANTHROPIC_API_KEY")
         if api_key:
-            return Anthropic(api_key=api_key)
+            return AsyncAnthropic(api_key=api_key)
     except Exception as e:
         logger.error(f"Ошибка инициализации Claude: {e}")
     return None
@@ -164,8 +189,7 @@ def is_complex_question(question: str) -> Tuple[bool, str]:
         reason = "Вопрос требует экспертного сравнения"
     
     # 4. Упоминание нескольких нормативов
-    normative_pattern = r'(СП|ГОСТ|СНиП)\s*[\d\.\-]+'
-    normatives = re.findall(normative_pattern, question, re.IGNORECASE)
+    normatives = get_regulation_matcher().find_all(question)
     if len(normatives) >= 2:
         is_complex = True
         reason = f"Упоминание нескольких нормативов ({len(normatives)} шт.)"
@@ -271,6 +295,114 @@ _Использован метод LLM Council для повышения кач
 СТИЛЬ: Профессиональный, но понятный. Без лишней воды."""
 
 
+@lru_cache(maxsize=None)
+def council_system_prompt(model_name: str) -> str:
+    """Промпт эксперта этапа 1 - один и тот же текст для модели (кэш префикса у провайдера)"""
+    return normalize_prompt(COUNCIL_SYSTEM_PROMPT.format(
+        specialty=COUNCIL_MODELS[model_name]["specialty"]
+    ))
+
+
+@lru_cache(maxsize=None)
+def stage_version(stage: str, model_name: str) -> str:
+    """Версия записей кэша этапа: хэш шаблона промпта и модели"""
+    model = COUNCIL_MODELS.get(model_name, {})
+    template = {
+        "opinion": COUNCIL_SYSTEM_PROMPT,
+        "review": REVIEW_SYSTEM_PROMPT,
+        "synthesis": CHAIRMAN_SYSTEM_PROMPT
+    }[stage]
+    return template_version(template, model_name, model.get("model_id", ""), model.get("specialty", ""))
+
+
+# === ТРАССИРОВКА ===
+
+@dataclass
+class CouncilTrace:
+    """Время этапов и участников одной консультации"""
+
+    started: float = field(default_factory=time.perf_counter)
+    stages: Dict[str, float] = field(default_factory=dict)
+    members: Dict[str, Dict] = field(default_factory=dict)
+    early_exit: bool = False
+    first_token_ms: Optional[float] = None
+    total_ms: Optional[float] = None
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    def member(self, stage: str, name: str, status: str, stage_started: float):
+        """Итог участника этапа: ok / empty / timeout / cancelled / error"""
+        self.members[f"{stage}:{name}"] = {
+            "status": status,
+            "ms": round((time.perf_counter() - stage_started) * 1000, 1)
+        }
+
+    @property
+    def fully_cached(self) -> bool:
+        """Все этапы взяты из кэша"""
+        return bool(self.members) and all(m["status"] == "cached" for m in self.members.values())
+
+    def to_dict(self) -> dict:
+        return {
+            "stages_ms": dict(self.stages),
+            "members": dict(self.members),
+            "early_exit": self.early_exit,
+            "fully_cached": self.fully_cached,
+            "first_token_ms": self.first_token_ms,
+            "total_ms": self.total_ms
+        }
+
+
+class CouncilStats:
+    """Сводка по последним консультациям"""
+
+    def __init__(self, size: int = 200):
+        self.traces: deque = deque(maxlen=size)
+
+    def record(self, trace: CouncilTrace):
+        self.traces.append(trace)
+
+    @staticmethod
+    def _percentile(values: List[float], share: float) -> Optional[float]:
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * share))]
+
+    def get_stats(self) -> dict:
+        traces = list(self.traces)
+        totals = [t.total_ms for t in traces if t.total_ms is not None]
+        first_tokens = [t.first_token_ms for t in traces if t.first_token_ms is not None]
+        statuses: Dict[str, int] = {}
+        for trace in traces:
+            for key, info in trace.members.items():
+                if info["status"] not in ("ok", "empty", "cached"):
+                    name = key.split(":", 1)[1]
+                    statuses[f"{name}_{info['status']}"] = statuses.get(f"{name}_{info['status']}", 0) + 1
+        return {
+            "consults": len(traces),
+            "early_exits": sum(1 for t in traces if t.early_exit),
+            "cache_hits": sum(1 for t in traces if t.fully_cached),
+            "p50_total_ms": self._percentile(totals, 0.5),
+            "p95_total_ms": self._percentile(totals, 0.95),
+            "p50_first_token_ms": self._percentile(first_tokens, 0.5),
+            "member_misses": statuses
+        }
+
+
+COUNCIL_STATS = CouncilStats()
+
+
+def get_council_stats() -> dict:
+    """Статистика времени консультаций Совета и кэша этапов"""
+    stats = COUNCIL_STATS.get_stats()
+    cache = get_council_cache()
+    if cache is not None:
+        stats["cache"] = cache.get_stats()
+    return stats
+
+
 # === КЛАСС LLM COUNCIL ===
 
 class LLMCouncil:
@@ -278,15 +410,17 @@ class LLMCouncil:
     Совет AI моделей для ответов на сложные вопросы
     
     Этапы работы:
-    1. Параллельный опрос всех моделей
-    2. Перекрёстная оценка ответов
-    3. Синтез финального ответа председателем
+    1. Параллельный опрос всех моделей (у каждой свой дедлайн,
+       после кворума COUNCIL_QUORUM отстающие отменяются)
+    2. Перекрёстная оценка ответов (по тем же правилам)
+    3. Синтез финального ответа председателем - потоком
     """
     
-    def __init__(self):
+    def __init__(self, cache: Optional[CouncilCache] = None):
         self.xai_client = get_xai_client()
         self.claude_client = get_claude_client()
         self.gemini_model = get_gemini_model()
+        self.cache = cache if cache is not None else get_council_cache()
         
         # Проверяем доступность моделей
         self.available_models = []
@@ -308,12 +442,12 @@ class LLMCouncil:
             logger.warning("⚠️ LLM Council недоступен (нужно минимум 2 модели)")
     
     async def _call_grok(self, messages: List[Dict], max_tokens: int = 2000) -> Optional[str]:
-        """Вызов Grok API"""
+        """Вызов Grok API (асинхронный пул xai_client)"""
         if not self.xai_client:
             return None
         
         try:
-            response = self.xai_client.chat_completions_create(
+            response = await self.xai_client.chat_completions_create_async(
                 model=COUNCIL_MODELS["grok"]["model_id"],
                 messages=messages,
                 max_tokens=max_tokens,
@@ -325,7 +459,7 @@ class LLMCouncil:
             return None
     
     async def _call_claude(self, system: str, messages: List[Dict], max_tokens: int = 2000) -> Optional[str]:
-        """Вызов Claude API"""
+        """Вызов Claude API (AsyncAnthropic)"""
         if not self.claude_client:
             return None
         
@@ -333,103 +467,196 @@ class LLMCouncil:
             # Фильтруем сообщения для Claude формата
             claude_messages = [m for m in messages if m["role"] != "system"]
             
-            response = self.claude_client.messages.create(
+            started = time.perf_counter()
+            response = await self.claude_client.messages.create(
                 model=COUNCIL_MODELS["claude"]["model_id"],
                 max_tokens=max_tokens,
                 temperature=0.7,
-                system=system,
+                system=anthropic_system(system),
                 messages=claude_messages
             )
+            PROMPT_CACHE_STATS.record_anthropic(
+                COUNCIL_MODELS["claude"]["model_id"], response.usage, (time.perf_counter() - started) * 1000
+            )
             return response.content[0].text
         except Exception as e:
             logger.error(f"Claude error: {e}")
             return None
     
     async def _call_gemini(self, prompt: str) -> Optional[str]:
-        """Вызов Gemini API"""
+        """Вызов Gemini API (generate_content_async)"""
         if not self.gemini_model:
             return None
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            response = await self.gemini_model.generate_content_async(prompt)
             return response.text
         except Exception as e:
             logger.error(f"Gemini error: {e}")
             return None
     
-    async def stage1_get_opinions(self, question: str, context: str = "") -> Dict[str, str]:
+    # ========================================
+    # ПЛАНИРОВЩИК УЧАСТНИКОВ
+    # ========================================
+    
+    async def _run_members(
+        self,
+        stage: str,
+        calls: Dict[str, Callable[[], Awaitable]],
+        trace: CouncilTrace,
+        quorum: int = COUNCIL_QUORUM,
+        ready: Optional[Dict[str, str]] = None
+    ) -> Dict[str, Optional[str]]:
+        """
+        Запустить участников параллельно: у каждого свой дедлайн,
+        после quorum непустых ответов (и COUNCIL_QUORUM_GRACE) остальные отменяются
+        
+        Args:
+            calls: {участник: функция, возвращающая корутину вызова}
+            ready: Готовые ответы (из кэша) - засчитываются в кворум, не вызываются
+        
+        Returns:
+            Dict ответов (None - нет ответа, таймаут или отменён)
+        """
+        stage_started = time.perf_counter()
+        ready = ready or {}
+        for name in ready:
+            trace.member(stage, name, "cached", stage_started)
+        
+        async def member(name: str, call: Awaitable) -> Optional[str]:
+            deadline = COUNCIL_MODELS.get(name, {}).get("deadline", COUNCIL_MEMBER_DEADLINE)
+            try:
+                result = await asyncio.wait_for(call, deadline)
+            except asyncio.TimeoutError:
+                trace.member(stage, name, "timeout", stage_started)
+                logger.warning(f"⚠️ Council {stage}: {name} не уложился в {deadline:.0f} с")
+                return None
+            except asyncio.CancelledError:
+                trace.member(stage, name, "cancelled", stage_started)
+                raise
+            except Exception as e:
+                trace.member(stage, name, "error", stage_started)
+                logger.error(f"Council {name} failed: {e}")
+                return None
+            trace.member(stage, name, "ok" if result else "empty", stage_started)
+            return result
+        
+        results: Dict[str, Optional[str]] = {name: None for name in calls}
+        results.update(ready)
+        needed = min(quorum, len(results))
+        if sum(1 for r in ready.values() if r) >= needed:
+            trace.early_exit = trace.early_exit or any(name not in ready for name in calls)
+            trace.stages[stage] = round((time.perf_counter() - stage_started) * 1000, 1)
+            return results
+        
+        tasks = {
+            asyncio.ensure_future(member(name, call())): name
+            for name, call in calls.items() if name not in ready
+        }
+        pending = set(tasks)
+        
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[tasks[task]] = task.result()
+                if pending and sum(1 for r in results.values() if r) >= needed:
+                    if COUNCIL_QUORUM_GRACE > 0:
+                        done, pending = await asyncio.wait(pending, timeout=COUNCIL_QUORUM_GRACE)
+                        for task in done:
+                            results[tasks[task]] = task.result()
+                    if pending:
+                        trace.early_exit = True
+                        logger.info(
+                            f"⚡ Council {stage}: кворум {needed}/{len(tasks)}, "
+                            f"не ждём {', '.join(tasks[t] for t in pending)}"
+                        )
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        trace.stages[stage] = round((time.perf_counter() - stage_started) * 1000, 1)
+        return results
+    
+    async def stage1_get_opinions(
+        self,
+        question: str,
+        context: str = "",
+        trace: Optional[CouncilTrace] = None
+    ) -> Dict[str, str]:
         """
         Этап 1: Получение мнений от всех моделей параллельно
         
         Args:
             question: Вопрос пользователя
             context: Дополнительный контекст (история диалога)
+            trace: Трассировка консультации (время участников)
         
         Returns:
             Dict с ответами от каждой модели
         """
-        opinions = {}
-        
         # Формируем промпты для каждой модели
         full_question = f"{context}\n\nВОПРОС: {question}" if context else f"ВОПРОС: {question}"
         
-        # Параллельные вызовы
-        tasks = []
+        calls = {}
         
         # Grok
         if "grok" in self.available_models:
             grok_messages = [
-                {"role": "system", "content": COUNCIL_SYSTEM_PROMPT.format(
-                    specialty=COUNCIL_MODELS["grok"]["specialty"]
-                )},
+                {"role": "system", "content": council_system_prompt("grok")},
                 {"role": "user", "content": full_question}
             ]
-            tasks.append(("grok", self._call_grok(grok_messages)))
+            calls["grok"] = lambda: self._call_grok(grok_messages)
         
         # Claude
         if "claude" in self.available_models:
-            claude_system = COUNCIL_SYSTEM_PROMPT.format(
-                specialty=COUNCIL_MODELS["claude"]["specialty"]
-            )
+            claude_system = council_system_prompt("claude")
             claude_messages = [{"role": "user", "content": full_question}]
-            tasks.append(("claude", self._call_claude(claude_system, claude_messages)))
+            calls["claude"] = lambda: self._call_claude(claude_system, claude_messages)
         
         # Gemini
         if "gemini" in self.available_models:
-            gemini_prompt = f"""{COUNCIL_SYSTEM_PROMPT.format(
-                specialty=COUNCIL_MODELS["gemini"]["specialty"]
-            )}
-
-{full_question}"""
-            tasks.append(("gemini", self._call_gemini(gemini_prompt)))
-        
-        # Выполняем параллельно
-        results = await asyncio.gather(*[t[1] for t in tasks], return_exceptions=True)
-        
-        for i, (model_name, _) in enumerate(tasks):
-            result = results[i]
-            if isinstance(result, Exception):
-                logger.error(f"Council {model_name} failed: {result}")
-                opinions[model_name] = None
-            else:
-                opinions[model_name] = result
-                logger.info(f"✅ Council получен ответ от {model_name}")
+            gemini_prompt = f"{council_system_prompt('gemini')}\n\n{full_question}"
+            calls["gemini"] = lambda: self._call_gemini(gemini_prompt)
+        
+        # Из кэша - готовые мнения, опрашиваются только недостающие участники
+        keys, cached = {}, {}
+        if self.cache is not None:
+            keys = {
+                name: CouncilCache.opinion_key(stage_version("opinion", name), question, context, name)
+                for name in calls
+            }
+            cached = self.cache.get_many(keys)
+        
+        opinions = await self._run_members("opinions", calls, trace or CouncilTrace(), ready=cached)
+        for model_name, opinion in opinions.items():
+            if opinion:
+                logger.info(f"✅ Council {'из кэша' if model_name in cached else 'получен'} ответ от {model_name}")
+        if self.cache is not None:
+            self.cache.put_many(keys, opinions, "opinion", skip=cached)
         
         return opinions
     
-    async def stage2_review(self, question: str, opinions: Dict[str, str]) -> Dict[str, str]:
+    async def stage2_review(
+        self,
+        question: str,
+        opinions: Dict[str, str],
+        trace: Optional[CouncilTrace] = None
+    ) -> Dict[str, str]:
         """
         Этап 2: Перекрёстная оценка ответов
         
         Args:
             question: Исходный вопрос
             opinions: Ответы от этапа 1
+            trace: Трассировка консультации (время участников)
         
         Returns:
             Dict с оценками от каждой модели
         """
-        reviews = {}
-        
         # Подготовка анонимизированных ответов
         valid_opinions = {k: v for k, v in opinions.items() if v}
         if len(valid_opinions) < 2:
@@ -448,55 +675,46 @@ class LLMCouncil:
             review_content += f"\n--- ЭКСПЕРТ {label} ---\n{answer}\n"
         
         # Получаем оценки от каждой доступной модели
-        tasks = []
+        calls = {}
         
         if "grok" in self.available_models:
             grok_messages = [
                 {"role": "system", "content": REVIEW_SYSTEM_PROMPT},
                 {"role": "user", "content": review_content}
             ]
-            tasks.append(("grok", self._call_grok(grok_messages, max_tokens=1000)))
+            calls["grok"] = lambda: self._call_grok(grok_messages, max_tokens=1000)
         
         if "claude" in self.available_models:
-            tasks.append(("claude", self._call_claude(
+            calls["claude"] = lambda: self._call_claude(
                 REVIEW_SYSTEM_PROMPT,
                 [{"role": "user", "content": review_content}],
                 max_tokens=1000
-            )))
+            )
         
         if "gemini" in self.available_models:
             gemini_prompt = f"{REVIEW_SYSTEM_PROMPT}\n\n{review_content}"
-            tasks.append(("gemini", self._call_gemini(gemini_prompt)))
-        
-        # Выполняем параллельно
-        results = await asyncio.gather(*[t[1] for t in tasks], return_exceptions=True)
-        
-        for i, (model_name, _) in enumerate(tasks):
-            result = results[i]
-            if not isinstance(result, Exception) and result:
-                reviews[model_name] = result
-                logger.info(f"✅ Council получена оценка от {model_name}")
+            calls["gemini"] = lambda: self._call_gemini(gemini_prompt)
+        
+        keys, cached = {}, {}
+        if self.cache is not None:
+            keys = {
+                name: CouncilCache.review_key(stage_version("review", name), question, valid_opinions, name)
+                for name in calls
+            }
+            cached = self.cache.get_many(keys)
+        
+        results = await self._run_members("review", calls, trace or CouncilTrace(), ready=cached)
+        reviews = {model_name: review for model_name, review in results.items() if review}
+        if self.cache is not None:
+            self.cache.put_many(keys, reviews, "review", skip=cached)
+        for model_name in reviews:
+            logger.info(f"✅ Council получена оценка от {model_name}")
         
         return reviews
     
-    async def stage3_synthesize(
-        self, 
-        question: str, 
-        opinions: Dict[str, str], 
-        reviews: Dict[str, str]
-    ) -> str:
-        """
-        Этап 3: Синтез финального ответа Председателем
-        
-        Args:
-            question: Исходный вопрос
-            opinions: Ответы от этапа 1
-            reviews: Оценки от этапа 2
-        
-        Returns:
-            Финальный синтезированный ответ
-        """
-        # Формируем контент для Председателя
+    @staticmethod
+    def _synthesis_content(question: str, opinions: Dict[str, str], reviews: Dict[str, str]) -> str:
+        """Контент для Председателя: вопрос, мнения, оценки"""
         synthesis_content = f"""ИСХОДНЫЙ ВОПРОС ПОЛЬЗОВАТЕЛЯ:
 {question}
 
@@ -518,36 +736,116 @@ class LLMCouncil:
 === ТВОЯ ЗАДАЧА ===
 Синтезируй финальный ответ, объединив лучшее из всех мнений.
 Следуй структуре из системного промпта."""
-        
-        # Вызываем Председателя (Claude по умолчанию)
+        return synthesis_content
+    
+    async def _stream_chairman(self, synthesis_content: str) -> AsyncIterator[str]:
+        """Потоковый ответ Председателя (Claude по умолчанию)"""
         chairman_model = CHAIRMAN_MODEL
         
         if chairman_model == "claude" and self.claude_client:
-            result = await self._call_claude(
-                CHAIRMAN_SYSTEM_PROMPT,
-                [{"role": "user", "content": synthesis_content}],
-                max_tokens=3000
-            )
+            model_id = COUNCIL_MODELS["claude"]["model_id"]
+            started = time.perf_counter()
+            async with self.claude_client.messages.stream(
+                model=model_id,
+                max_tokens=3000,
+                temperature=0.7,
+                system=anthropic_system(CHAIRMAN_SYSTEM_PROMPT),
+                messages=[{"role": "user", "content": synthesis_content}]
+            ) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                final = await stream.get_final_message()
+            PROMPT_CACHE_STATS.record_anthropic(model_id, final.usage, (time.perf_counter() - started) * 1000)
         elif chairman_model == "grok" and self.xai_client:
-            result = await self._call_grok([
-                {"role": "system", "content": CHAIRMAN_SYSTEM_PROMPT},
-                {"role": "user", "content": synthesis_content}
-            ], max_tokens=3000)
+            async for text in self.xai_client.chat_completions_create_stream(
+                model=COUNCIL_MODELS["grok"]["model_id"],
+                messages=[
+                    {"role": "system", "content": CHAIRMAN_SYSTEM_PROMPT},
+                    {"role": "user", "content": synthesis_content}
+                ],
+                max_tokens=3000
+            ):
+                yield text
         elif self.gemini_model:
-            result = await self._call_gemini(
-                f"{CHAIRMAN_SYSTEM_PROMPT}\n\n{synthesis_content}"
+            response = await self.gemini_model.generate_content_async(
+                f"{CHAIRMAN_SYSTEM_PROMPT}\n\n{synthesis_content}", stream=True
             )
-        else:
-            # Fallback: возвращаем лучший ответ из opinions
-            result = list(opinions.values())[0] if opinions else "Не удалось сформировать ответ"
+            async for chunk in response:
+                yield chunk.text
+    
+    async def stage3_synthesize(
+        self, 
+        question: str, 
+        opinions: Dict[str, str], 
+        reviews: Dict[str, str],
+        on_chunk: Optional[Callable[[str], Awaitable]] = None,
+        trace: Optional[CouncilTrace] = None
+    ) -> str:
+        """
+        Этап 3: Синтез финального ответа Председателем
         
-        return result or "Ошибка синтеза ответа"
+        Args:
+            question: Исходный вопрос
+            opinions: Ответы от этапа 1
+            reviews: Оценки от этапа 2
+            on_chunk: Корутина для частей ответа по мере генерации (StreamRenderer.feed)
+            trace: Трассировка консультации (время до первого токена)
+        
+        Returns:
+            Финальный синтезированный ответ
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = CouncilCache.synthesis_key(stage_version("synthesis", CHAIRMAN_MODEL), question, opinions, reviews)
+            cached = self.cache.get(cache_key)
+            if cached:
+                if trace is not None:
+                    trace.first_token_ms = trace.elapsed_ms()
+                    trace.members[f"synthesis:{CHAIRMAN_MODEL}"] = {"status": "cached", "ms": 0.0}
+                if on_chunk is not None:
+                    await on_chunk(cached)
+                return cached
+        
+        synthesis_content = self._synthesis_content(question, opinions, reviews)
+        parts: List[str] = []
+        
+        async def collect():
+            async for text in self._stream_chairman(synthesis_content):
+                if not text:
+                    continue
+                if not parts and trace is not None:
+                    trace.first_token_ms = trace.elapsed_ms()
+                parts.append(text)
+                if on_chunk is not None:
+                    await on_chunk(text)
+        
+        chairman_failed = False
+        try:
+            await asyncio.wait_for(collect(), COUNCIL_SYNTHESIS_TIMEOUT)
+        except Exception as e:
+            # Уже показанную часть оставляем, без текста - лучший ответ этапа 1
+            chairman_failed = True
+            logger.error(f"Council chairman error: {e!r}")
+        
+        if parts:
+            answer = "".join(parts)
+            if cache_key is not None and not chairman_failed:
+                self.cache.put(cache_key, answer, "synthesis")
+            return answer
+        
+        fallback = next((answer for answer in opinions.values() if answer), None)
+        if fallback is None:
+            return "Ошибка синтеза ответа"
+        if on_chunk is not None:
+            await on_chunk(fallback)
+        return fallback
     
     async def consult(
         self, 
         question: str, 
         context: str = "",
-        skip_review: bool = False
+        skip_review: bool = False,
+        on_chunk: Optional[Callable[[str], Awaitable]] = None
     ) -> Dict:
         """
         Полная консультация Совета
@@ -556,11 +854,13 @@ class LLMCouncil:
             question: Вопрос пользователя
             context: Контекст диалога
             skip_review: Пропустить этап оценки (быстрый режим)
+            on_chunk: Корутина для потокового вывода финального ответа
         
         Returns:
-            Dict с результатами всех этапов и финальным ответом
+            Dict с результатами всех этапов, финальным ответом и трассировкой времени
         """
         start_time = datetime.now()
+        trace = CouncilTrace()
         
         result = {
             "question": question,
@@ -575,24 +875,29 @@ class LLMCouncil:
         try:
             # Этап 1: Получение мнений
             logger.info("🏛️ LLM Council: Этап 1 - Сбор мнений...")
-            opinions = await self.stage1_get_opinions(question, context)
+            opinions = await self.stage1_get_opinions(question, context, trace=trace)
             result["opinions"] = opinions
             
             valid_opinions = {k: v for k, v in opinions.items() if v}
             if not valid_opinions:
                 result["final_answer"] = "❌ Не удалось получить ответы от AI моделей"
                 return result
+            result["models_used"] = list(valid_opinions)
             
             # Этап 2: Перекрёстная оценка (опционально)
             reviews = {}
             if not skip_review and len(valid_opinions) >= 2:
                 logger.info("🏛️ LLM Council: Этап 2 - Перекрёстная оценка...")
-                reviews = await self.stage2_review(question, valid_opinions)
+                reviews = await self.stage2_review(question, valid_opinions, trace=trace)
                 result["reviews"] = reviews
             
             # Этап 3: Синтез финального ответа
             logger.info("🏛️ LLM Council: Этап 3 - Синтез ответа...")
-            final_answer = await self.stage3_synthesize(question, valid_opinions, reviews)
+            synthesis_started = time.perf_counter()
+            final_answer = await self.stage3_synthesize(
+                question, valid_opinions, reviews, on_chunk=on_chunk, trace=trace
+            )
+            trace.stages["synthesis"] = round((time.perf_counter() - synthesis_started) * 1000, 1)
             result["final_answer"] = final_answer
             result["success"] = True
             
@@ -600,8 +905,15 @@ class LLMCouncil:
             logger.error(f"LLM Council error: {e}")
             result["final_answer"] = f"❌ Ошибка Совета AI: {str(e)}"
         
-        result["duration_seconds"] = (datetime.now() - start_time).total_seconds()
-        logger.info(f"🏛️ LLM Council завершён за {result['duration_seconds']:.1f} сек")
+        finally:
+            trace.total_ms = trace.elapsed_ms()
+            COUNCIL_STATS.record(trace)
+            result["trace"] = trace.to_dict()
+            result["duration_seconds"] = (datetime.now() - start_time).total_seconds()
+            logger.info(
+                f"🏛️ LLM Council завершён за {result['duration_seconds']:.1f} сек: "
+                f"{trace.stages}, первый токен {trace.first_token_ms} мс"
+            )
         
         return result
     
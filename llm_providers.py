@@ -0,0 +1,339 @@
+"""
+Асинхронная цепочка AI провайдеров v1.0
+xAI Grok → Claude → Gemini без блокирующих вызовов и потоков executor
+
+- Все провайдеры вызываются нативно через asyncio (httpx/AsyncAnthropic/generate_content_async)
+- Fallback: при ошибке провайдера сразу запускается следующий
+- Hedging: если провайдер не ответил за LLM_HEDGE_AFTER_SECONDS, параллельно
+  запускается следующий, побеждает первый успешный ответ
+- Конкурентность ограничена семафорами на провайдера, а не числом потоков
+- Новое сообщение пользователя отменяет его предыдущий незавершённый запрос
+"""
+
+import os
+import base64
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional
+
+from prompt_cache import PROMPT_CACHE_STATS, anthropic_system
+from xai_client import XAIClient, call_xai_with_retry_async, get_shared_xai_client
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Порядок провайдеров в цепочке
+PROVIDER_ORDER = ["xai", "claude", "gemini"]
+
+# Через сколько секунд без ответа запускать следующий провайдер параллельно (0 = без hedging)
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "20"))
+
+# Максимум одновременных запросов к одному провайдеру
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+CLAUDE_FALLBACK_MODEL = "claude-sonnet-4-5-20250929"
+GEMINI_FALLBACK_MODEL = os.getenv("LLM_GEMINI_MODEL", "gemini-2.5-flash")
+DEFAULT_SYSTEM_PROMPT = "Вы — эксперт по строительным нормативам РФ."
+
+PROVIDER_NAMES = {
+    "xai": "xAI Grok",
+    "claude": "Claude Sonnet 4.5",
+    "gemini": "Gemini"
+}
+
+
+def _split_system(messages: List[Dict[str, Any]]):
+    """Отделить system prompt от остальных сообщений"""
+    system_prompt = None
+    rest = []
+    for msg in messages:
+        if msg.get("role") == "system":
+            system_prompt = msg.get("content")
+        else:
+            rest.append(msg)
+    return system_prompt, rest
+
+
+def _to_gemini_parts(content: Any) -> List[Any]:
+    """Преобразовать content (строка или блоки в формате Claude) в parts Gemini"""
+    if isinstance(content, str):
+        return [content]
+
+    parts = []
+    for block in content or []:
+        if block.get("type") == "text":
+            parts.append(block.get("text", ""))
+        elif block.get("type") == "image" and block.get("source", {}).get("type") == "base64":
+            source = block["source"]
+            parts.append({
+                "mime_type": source.get("media_type", "image/jpeg"),
+                "data": base64.b64decode(source["data"])
+            })
+    return parts
+
+
+class ProviderChain:
+    """
+    Асинхронная цепочка провайдеров с fallback и hedged-запросами
+
+    Возвращает ответ в формате, совместимом с xAI:
+    {"choices": [{"message": {"content": "..."}}], "provider": "xai"}
+    """
+
+    def __init__(
+        self,
+        xai_client: Optional[XAIClient] = None,
+        anthropic_api_key: Optional[str] = None,
+        gemini_api_key: Optional[str] = None,
+        hedge_after: float = LLM_HEDGE_AFTER_SECONDS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY
+    ):
+        self.xai_client = xai_client
+        self.claude_client = None
+        self.gemini_available = False
+        self.hedge_after = hedge_after
+
+        if anthropic_api_key:
+            try:
+                from anthropic import AsyncAnthropic
+                self.claude_client = AsyncAnthropic(api_key=anthropic_api_key)
+            except ImportError:
+                logger.warning("⚠️ anthropic не установлен - Claude исключён из цепочки")
+
+        if gemini_api_key:
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=gemini_api_key)
+                self.gemini_available = True
+            except ImportError:
+                logger.warning("⚠️ google-generativeai не установлен - Gemini исключён из цепочки")
+
+        self.providers = [name for name in PROVIDER_ORDER if self._is_available(name)]
+        self._semaphores = {name: asyncio.Semaphore(max_concurrency) for name in PROVIDER_ORDER}
+
+        self.stats = {
+            "requests": 0,
+            "fallbacks": 0,
+            "hedges": 0,
+            "failures": 0,
+            "wins": {name: 0 for name in PROVIDER_ORDER}
+        }
+
+    def _is_available(self, name: str) -> bool:
+        """Доступен ли провайдер"""
+        if name == "xai":
+            return self.xai_client is not None
+        if name == "claude":
+            return self.claude_client is not None
+        if name == "gemini":
+            return self.gemini_available
+        return False
+
+    # ========================================
+    # ВЫЗОВЫ ПРОВАЙДЕРОВ
+    # ========================================
+
+    async def _call_xai(self, model, messages, max_tokens, temperature, search_parameters) -> str:
+        """xAI Grok (асинхронный пул + async backoff)"""
+        response = await call_xai_with_retry_async(
+            client=self.xai_client,
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            search_parameters=search_parameters
+        )
+        return response["choices"][0]["message"]["content"]
+
+    async def _call_claude(self, model, messages, max_tokens, temperature, search_parameters) -> str:
+        """Claude через AsyncAnthropic"""
+        system_prompt, claude_messages = _split_system(messages)
+        started = time.perf_counter()
+        response = await self.claude_client.messages.create(
+            model=CLAUDE_FALLBACK_MODEL,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=anthropic_system(system_prompt, default=DEFAULT_SYSTEM_PROMPT),
+            messages=claude_messages
+        )
+        PROMPT_CACHE_STATS.record_anthropic(
+            CLAUDE_FALLBACK_MODEL, getattr(response, "usage", None), (time.perf_counter() - started) * 1000
+        )
+        return response.content[0].text
+
+    async def _call_gemini(self, model, messages, max_tokens, temperature, search_parameters) -> str:
+        """Gemini через generate_content_async"""
+        import google.generativeai as genai
+
+        system_prompt, rest = _split_system(messages)
+        gemini_model = genai.GenerativeModel(
+            GEMINI_FALLBACK_MODEL,
+            system_instruction=system_prompt or DEFAULT_SYSTEM_PROMPT
+        )
+        contents = [
+            {
+                "role": "model" if msg.get("role") == "assistant" else "user",
+                "parts": _to_gemini_parts(msg.get("content"))
+            }
+            for msg in rest
+        ]
+        response = await gemini_model.generate_content_async(
+            contents,
+            generation_config={"max_output_tokens": max_tokens, "temperature": temperature}
+        )
+        return response.text
+
+    async def _run_provider(self, name: str, *args) -> str:
+        """Вызов провайдера под его семафором"""
+        call = getattr(self, f"_call_{name}")
+        async with self._semaphores[name]:
+            started = time.perf_counter()
+            text = await call(*args)
+            logger.info(f"✅ Ответ получен от {PROVIDER_NAMES[name]} за {time.perf_counter() - started:.1f}с")
+            return text
+
+    # ========================================
+    # ЦЕПОЧКА
+    # ========================================
+
+    async def complete(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        max_tokens: int,
+        temperature: float = 0.7,
+        search_parameters: Optional[Dict[str, Any]] = None,
+        hedge_after: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Получить ответ от первого успешного провайдера цепочки
+
+        Args:
+            messages: Сообщения в формате xAI/OpenAI
+            model: Модель xAI (Claude и Gemini используют свои модели)
+            max_tokens: Максимум токенов
+            temperature: Температура
+            search_parameters: Параметры live search xAI
+            hedge_after: Переопределить порог hedging (секунды, 0 = выключен)
+
+        Returns:
+            Ответ в формате xAI с дополнительным полем "provider"
+        """
+        if not self.providers:
+            raise Exception("⚠️ AI сервисы не настроены. Обратитесь к администратору.")
+
+        hedge_after = self.hedge_after if hedge_after is None else hedge_after
+        args = (model, messages, max_tokens, temperature, search_parameters)
+        self.stats["requests"] += 1
+
+        queue = list(self.providers)
+        running: Dict[asyncio.Task, str] = {}
+
+        def launch_next():
+            name = queue.pop(0)
+            task = asyncio.ensure_future(self._run_provider(name, *args))
+            running[task] = name
+
+        launch_next()
+        try:
+            while running:
+                timeout = hedge_after if queue and hedge_after > 0 else None
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Провайдер медлит - запускаем следующий параллельно
+                    self.stats["hedges"] += 1
+                    logger.info(f"⏱️ Hedging: {PROVIDER_NAMES[queue[0]]} запущен параллельно после {hedge_after}с")
+                    launch_next()
+                    continue
+
+                # done - множество без порядка: из завершившихся вместе побеждает
+                # провайдер выше по цепочке (running хранит порядок запуска)
+                for task in [t for t in running if t in done]:
+                    name = running.pop(task)
+                    if task.exception() is None:
+                        self.stats["wins"][name] += 1
+                        return {
+                            "choices": [{"message": {"content": task.result()}}],
+                            "provider": name
+                        }
+                    logger.warning(f"⚠️ {PROVIDER_NAMES[name]} недоступен: {task.exception()}")
+
+                if not running and queue:
+                    self.stats["fallbacks"] += 1
+                    logger.info(f"🔄 Переключение на {PROVIDER_NAMES[queue[0]]} (резерв)...")
+                    launch_next()
+        finally:
+            # Отменяем проигравшие/недождавшиеся запросы (в т.ч. при отмене пользователем)
+            for task in running:
+                task.cancel()
+
+        self.stats["failures"] += 1
+        raise Exception("⚠️ AI сервисы временно недоступны. Попробуйте позже.")
+
+    def get_stats(self) -> dict:
+        """Статистика цепочки"""
+        return {**self.stats, "providers": list(self.providers)}
+
+
+# ========================================
+# ОТМЕНА ПРИ НОВОМ СООБЩЕНИИ ПОЛЬЗОВАТЕЛЯ
+# ========================================
+
+_user_tasks: Dict[int, asyncio.Task] = {}
+CANCEL_STATS = {"cancelled": 0}
+
+
+def cancel_user_request(user_id: int) -> bool:
+    """
+    Отменить незавершённый AI запрос пользователя
+
+    Returns:
+        True если запрос был отменён
+    """
+    task = _user_tasks.get(user_id)
+    if task is not None and not task.done():
+        task.cancel()
+        CANCEL_STATS["cancelled"] += 1
+        logger.info(f"🛑 Отменён предыдущий запрос пользователя {user_id} (пришло новое сообщение)")
+        return True
+    return False
+
+
+async def run_user_request(user_id: int, coro: Awaitable) -> Any:
+    """
+    Выполнить AI запрос пользователя, отменив его предыдущий незавершённый запрос
+
+    Если во время ожидания придёт следующее сообщение, текущий вызов
+    завершится asyncio.CancelledError.
+    """
+    cancel_user_request(user_id)
+    task = asyncio.ensure_future(coro)
+    _user_tasks[user_id] = task
+    try:
+        return await task
+    finally:
+        if _user_tasks.get(user_id) is task:
+            del _user_tasks[user_id]
+
+
+# ========================================
+# ОБЩАЯ ЦЕПОЧКА
+# ========================================
+
+_chain: Optional[ProviderChain] = None
+
+
+def get_provider_chain() -> ProviderChain:
+    """Получить общую цепочку провайдеров (ленивая инициализация)"""
+    global _chain
+    if _chain is None:
+        _chain = ProviderChain(
+            xai_client=get_shared_xai_client(),
+            anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+            gemini_api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        )
+        logger.info(f"✅ Цепочка AI провайдеров: {' → '.join(PROVIDER_NAMES[p] for p in _chain.providers)}")
+    return _chain
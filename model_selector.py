@@ -1,21 +1,85 @@
 """
-Умный селектор моделей для StroiNadzorAI
+Умный селектор моделей для StroiNadzorAI v2.0
 Определяет оптимальную модель для каждого типа запроса
+
+- Все списки ключевых слов компилируются в один автомат (KeywordAutomaton):
+  один проход регулярного выражения по тексту вместо десятков any(kw in ...)
+- Общий экземпляр get_model_selector(): автомат строится один раз за процесс
+- LRU недавних решений: повторные вопросы ("да", "спасибо", кнопки FAQ)
+  маршрутизируются без анализа текста
+- classify_many() - пакетная классификация (повторы внутри пакета считаются один раз)
 """
 
+import os
+import time
 import logging
-from typing import Dict, Tuple, Optional
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Tuple, Optional
 import re
 
+from regulation_matcher import extract_regulation_codes, get_regulation_matcher
+from russian_text import trie_regex
+
 logger = logging.getLogger(__name__)
 
+# === КОНФИГУРАЦИЯ ===
+
+# Размер LRU недавних решений
+ROUTING_CACHE_SIZE = int(os.getenv("ROUTING_CACHE_SIZE", "4096"))
+
+# Ссылки на законы и постановления без кода норматива ("ФЗ №384", "ПП №87")
+_LAW_REFERENCE_RE = re.compile(r'(?:ФЗ|ПП)\s+№?\d+', re.IGNORECASE)
+
+# Группы, которые делают вопрос техническим
+_TECHNICAL_GROUPS = frozenset({"technical", "legal", "context"})
+
+
+# ========================================
+# АВТОМАТ КЛЮЧЕВЫХ СЛОВ
+# ========================================
+
+class KeywordAutomaton:
+    """
+    Поиск всех групп ключевых слов за один проход
+
+    В каждой позиции выражение находит самое длинное ключевое слово; группы
+    более коротких слов внутри него (в т.ч. из других списков: "момент" в
+    "на данный момент") заранее добавлены к найденному слову, поэтому
+    результат совпадает с проверкой any(kw in text) по каждому списку.
+    """
+
+    def __init__(self, groups: Dict[str, Iterable[str]]):
+        owners: Dict[str, set] = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                if keyword:
+                    owners.setdefault(keyword, set()).add(group)
+
+        self._groups: Dict[str, FrozenSet[str]] = {
+            keyword: frozenset().union(*(g for other, g in owners.items() if other in keyword))
+            for keyword in owners
+        }
+
+        self._regex = re.compile(trie_regex(owners))
+
+    def find_groups(self, text_lower: str) -> FrozenSet[str]:
+        """Группы, ключевые слова которых встречаются в тексте (текст - в нижнем регистре)"""
+        search = self._regex.search
+        found = frozenset()
+        match = search(text_lower)
+        while match is not None:
+            found |= self._groups[match.group()]
+            # Следующий поиск - со следующего символа: пересекающиеся слова не теряются
+            match = search(text_lower, match.start() + 1)
+        return found
+
 
 class ModelSelector:
     """
     Класс для выбора оптимальной AI модели на основе анализа запроса
     """
 
-    def __init__(self):
+    def __init__(self, cache_size: int = ROUTING_CACHE_SIZE):
         # Ключевые слова для классификации запросов
         self.technical_keywords = [
             "расчет", "расчёт", "рассчитать", "рассчитай", "прочность", "несущая способность",
@@ -58,6 +122,33 @@ class ModelSelector:
             "отслоение", "выкрашивание", "что с", "почему"
         ]
 
+        # Технический вопрос по контексту (без явных расчётных слов)
+        self.technical_context_keywords = [
+            "бетон", "фундамент", "перекрытие", "стена", "плита",
+            "арматура", "класс", "марка", "толщина", "конструкци",
+            "требования", "нормы", "стандарт", "правил",
+            "какой", "сколько", "как рассчитать", "нужно ли",
+            "можно ли", "допускается", "материал", "технология"
+        ]
+
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, bool], dict]" = OrderedDict()
+        self.stats = {"requests": 0, "cache_hits": 0, "routing_time_us": 0.0}
+        self.rebuild()
+
+    def rebuild(self):
+        """Перекомпилировать автомат после изменения списков ключевых слов"""
+        self._automaton = KeywordAutomaton({
+            "defect": self.defect_keywords,
+            "drawing": self.drawing_keywords,
+            "simple": self.simple_question_patterns,
+            "technical": self.technical_keywords,
+            "legal": self.legal_keywords,
+            "context": self.technical_context_keywords,
+            "web": self.web_search_keywords,
+        })
+        self._cache.clear()
+
     def classify_request(
         self,
         question: str,
@@ -83,13 +174,48 @@ class ModelSelector:
                 "estimated_cost": float (в центах)
             }
         """
-        question_lower = question.lower()
+        started = time.perf_counter()
+        self.stats["requests"] += 1
+        key = (question, has_photo)
+
+        decision = self._cache.get(key)
+        if decision is not None:
+            self._cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+        else:
+            decision = self._decide(question, has_photo)
+            if self.cache_size > 0:
+                self._cache[key] = decision
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        self.stats["routing_time_us"] += (time.perf_counter() - started) * 1e6
+        # Копия: вызывающий код может дополнять решение
+        return dict(decision)
+
+    def classify_many(self, questions: Iterable[str], has_photo: bool = False) -> List[Dict[str, any]]:
+        """
+        Классифицировать пакет вопросов
+
+        Returns:
+            Решения в порядке вопросов (одинаковые вопросы анализируются один раз)
+        """
+        decided: Dict[str, dict] = {}
+        results = []
+        for question in questions:
+            decision = decided.get(question)
+            if decision is None:
+                decision = decided[question] = self.classify_request(question, has_photo)
+            results.append(dict(decision))
+        return results
+
+    def _decide(self, question: str, has_photo: bool) -> Dict[str, any]:
+        """Решение по тексту вопроса (без кэша)"""
+        found = self._automaton.find_groups(question.lower())
 
         # 1. Анализ фото → Gemini Vision (дёшево + качественно)
         if has_photo:
-            is_defect = any(kw in question_lower for kw in self.defect_keywords)
-
-            if is_defect:
+            if "defect" in found:
                 return {
                     "model": "gemini_vision",
                     "reason": "Анализ дефекта на фото (Gemini Vision дешевле и качественнее)",
@@ -107,7 +233,7 @@ class ModelSelector:
                 }
 
         # 2. Генерация чертежей → Gemini 2.5 Flash Image (создаёт изображение)
-        if any(kw in question_lower for kw in self.drawing_keywords):
+        if "drawing" in found:
             return {
                 "model": "gemini_image",
                 "reason": "Генерация технического чертежа через Gemini 2.5 Flash Image",
@@ -116,19 +242,8 @@ class ModelSelector:
                 "estimated_cost": 0.039  # Gemini 2.5 Flash Image ($0.039 за изображение)
             }
 
-        # 3. Проверка на простые вопросы (даже если содержат технические слова)
-        is_simple = any(pattern in question_lower for pattern in self.simple_question_patterns)
-
-        # 4. Технические вопросы (расчёты, материалы, нормативы) → Claude
-        is_technical = (
-            any(kw in question_lower for kw in self.technical_keywords) or
-            any(kw in question_lower for kw in self.legal_keywords) or
-            self._mentions_regulations(question) or
-            self._is_technical_question(question)
-        )
-
-        # Если простой вопрос - используем Grok даже если есть технические слова
-        if is_simple:
+        # 3. Простые вопросы - Grok, даже если содержат технические слова
+        if "simple" in found:
             return {
                 "model": "grok_general",
                 "reason": "Простой вопрос (Grok бесплатно)",
@@ -137,17 +252,19 @@ class ModelSelector:
                 "estimated_cost": 0.0
             }
 
-        if is_technical:
+        # 4. Технические вопросы (расчёты, материалы, нормативы) → Claude
+        mentions_regulations = self._mentions_regulations(question)
+        if mentions_regulations or found & _TECHNICAL_GROUPS:
             return {
                 "model": "claude_technical",
                 "reason": "Технический вопрос (Claude Sonnet 4.5 для точного ответа)",
-                "needs_web_search": self._mentions_regulations(question),
+                "needs_web_search": mentions_regulations,
                 "priority": "high",
                 "estimated_cost": 3.0
             }
 
-        # 4. Актуальная информация или простые вопросы → Grok
-        needs_search = any(kw in question_lower for kw in self.web_search_keywords)
+        # 5. Актуальная информация или простые вопросы → Grok
+        needs_search = "web" in found
 
         return {
             "model": "grok_general",
@@ -164,16 +281,7 @@ class ModelSelector:
         Returns:
             True если вопрос технический
         """
-        technical_context_keywords = [
-            "бетон", "фундамент", "перекрытие", "стена", "плита",
-            "арматура", "класс", "марка", "толщина", "конструкци",
-            "требования", "нормы", "стандарт", "правил",
-            "какой", "сколько", "как рассчитать", "нужно ли",
-            "можно ли", "допускается", "материал", "технология"
-        ]
-
-        question_lower = question.lower()
-        return any(kw in question_lower for kw in technical_context_keywords)
+        return "context" in self._automaton.find_groups(question.lower())
 
     def _mentions_regulations(self, question: str) -> bool:
         """
@@ -182,22 +290,25 @@ class ModelSelector:
         Returns:
             True если есть упоминание СП, ГОСТ, СНиП и т.п.
         """
-        # Паттерны для нормативов
-        patterns = [
-            r'СП\s+[\d.]+',  # СП 63.13330.2018
-            r'ГОСТ\s+[РЕ\s]*[\d.-]+',  # ГОСТ 31937-2011
-            r'СНиП\s+[\d.-]+',  # СНиП 2.01.07-85
-            r'ППБ\s+[\d-]+',  # ППБ 01-03
-            r'ФЗ\s+№?\d+',  # ФЗ №384
-            r'ПП\s+№?\d+',  # ПП №87
-        ]
+        if get_regulation_matcher().find_all(question):
+            return True
 
-        for pattern in patterns:
-            if re.search(pattern, question, re.IGNORECASE):
-                return True
+        if _LAW_REFERENCE_RE.search(question):
+            return True
 
         return False
 
+    def get_stats(self) -> Dict:
+        """Статистика маршрутизации: запросы, попадания в LRU, среднее время"""
+        requests = self.stats["requests"]
+        return {
+            **self.stats,
+            "routing_time_us": round(self.stats["routing_time_us"], 1),
+            "cache_size": len(self._cache),
+            "cache_hit_rate": round(self.stats["cache_hits"] / requests, 3) if requests else 0.0,
+            "avg_routing_us": round(self.stats["routing_time_us"] / requests, 2) if requests else 0.0
+        }
+
     def get_statistics(self, decisions: list) -> Dict:
         """
         Получить статистику использования моделей
@@ -239,6 +350,17 @@ class ModelSelector:
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================================================
 
+_selector: Optional[ModelSelector] = None
+
+
+def get_model_selector() -> ModelSelector:
+    """Общий селектор моделей (автомат компилируется один раз)"""
+    global _selector
+    if _selector is None:
+        _selector = ModelSelector()
+    return _selector
+
+
 def should_use_web_search(question: str) -> bool:
     """
     Определить, нужен ли web search для вопроса
@@ -261,39 +383,13 @@ def should_use_web_search(question: str) -> bool:
     return any(trigger in question_lower for trigger in web_search_triggers)
 
 
-def extract_regulation_codes(text: str) -> list:
-    """
-    Извлечь коды нормативов из текста
-
-    Args:
-        text: Текст для анализа
-
-    Returns:
-        List кодов нормативов
-    """
-    patterns = [
-        r'СП\s+[\d.]+\.[\d.]+',  # СП 63.13330.2018
-        r'ГОСТ\s+[РЕ\s]*[\d.-]+',  # ГОСТ 31937-2011
-        r'СНиП\s+[\d.-]+',  # СНиП 2.01.07-85
-        r'ППБ\s+[\d-]+',  # ППБ 01-03
-    ]
-
-    codes = []
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        codes.extend(matches)
-
-    # Убираем дубликаты
-    return list(set(codes))
-
-
 # ============================================================================
 # ПРИМЕРЫ ИСПОЛЬЗОВАНИЯ
 # ============================================================================
 
 if __name__ == "__main__":
     # Инициализация селектора
-    selector = ModelSelector()
+    selector = get_model_selector()
 
     # Примеры вопросов
     test_questions = [
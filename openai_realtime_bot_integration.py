@@ -6,12 +6,12 @@
 2. GPT-4 - генерация ответа
 3. TTS - озвучка ответа
 
-Работает на любом OPENAI_API_KEY (не требует бета-доступа)
+Работает на любом OPENAI_API_KEY (не требует бета-доступа).
+Контекст разговора - сессия в общем менеджере live_sessions
+(лимит сессий, закрытие после простоя, ограниченная история)
 """
 
 import logging
-import subprocess
-import tempfile
 import os
 from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -21,6 +21,8 @@ import asyncio
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from live_sessions import LIVE_SESSIONS, LiveSession, SessionTranscript
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -43,6 +45,48 @@ VOICE_SYSTEM_PROMPT = """Вы — голосовой ассистент-эксп
 Вы помогаете прорабам на стройке - у них нет времени на длинные ответы.
 Язык: русский."""
 
+# Сколько последних обменов передавать GPT как контекст
+VOICE_CONTEXT_TURNS = 3
+
+BACKEND = "openai"
+
+
+class OpenAIVoiceSession:
+    """
+    Голосовой чат пользователя: соединения нет, только история для GPT
+
+    История ограничена SessionTranscript - старые обмены вытесняются
+    """
+
+    def __init__(self):
+        self.transcript = SessionTranscript()
+
+    def context_messages(self, turns: int = VOICE_CONTEXT_TURNS) -> list:
+        """Последние обмены в формате сообщений chat.completions"""
+        messages = []
+        for turn in list(self.transcript)[-turns:]:
+            messages.append({"role": "user", "content": turn["user"]})
+            messages.append({"role": "assistant", "content": turn["bot"]})
+        return messages
+
+    def add_exchange(self, user_text: str, bot_text: str):
+        self.transcript.set_user(user_text)
+        self.transcript.add_bot(bot_text)
+        self.transcript.commit()
+
+    def stop(self):
+        pass
+
+
+async def open_voice_session(user_id: int) -> Optional[LiveSession]:
+    """Новая сессия голосового чата (None - достигнут лимит сессий)"""
+    return await LIVE_SESSIONS.open((BACKEND, user_id), BACKEND, OpenAIVoiceSession)
+
+
+async def get_voice_session(user_id: int) -> Optional[LiveSession]:
+    """Сессия пользователя; закрытая по простою открывается заново"""
+    return LIVE_SESSIONS.get((BACKEND, user_id)) or await open_voice_session(user_id)
+
 
 def init_realtime_assistant() -> bool:
     """Инициализация голосового ассистента"""
@@ -69,65 +113,20 @@ def is_openai_realtime_available() -> bool:
     return openai_client is not None
 
 
-def convert_ogg_to_mp3(ogg_bytes: bytes) -> Optional[bytes]:
-    """Конвертирует OGG в MP3 для Whisper"""
-    try:
-        with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as ogg_file:
-            ogg_file.write(ogg_bytes)
-            ogg_path = ogg_file.name
-
-        mp3_path = ogg_path.replace('.ogg', '.mp3')
-
-        result = subprocess.run(
-            ['ffmpeg', '-y', '-i', ogg_path, '-acodec', 'libmp3lame', '-q:a', '4', mp3_path],
-            capture_output=True,
-            timeout=30
-        )
-
-        if result.returncode == 0 and os.path.exists(mp3_path):
-            with open(mp3_path, 'rb') as f:
-                mp3_bytes = f.read()
-            os.unlink(ogg_path)
-            os.unlink(mp3_path)
-            return mp3_bytes
-
-        os.unlink(ogg_path)
-        return None
-
-    except FileNotFoundError:
-        logger.warning("⚠️ ffmpeg не установлен")
-        return None
-    except Exception as e:
-        logger.error(f"❌ Ошибка конвертации: {e}")
-        return None
-
-
 async def transcribe_audio(audio_bytes: bytes) -> Optional[str]:
     """Распознавание речи через Whisper"""
     if not openai_client:
         return None
 
     try:
-        # Конвертируем в MP3
-        mp3_bytes = convert_ogg_to_mp3(audio_bytes)
-        if not mp3_bytes:
-            logger.error("Не удалось конвертировать аудио")
-            return None
-
-        # Создаём временный файл
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as f:
-            f.write(mp3_bytes)
-            temp_path = f.name
-
-        # Отправляем в Whisper
-        with open(temp_path, 'rb') as audio_file:
-            transcript = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                language="ru"
-            )
+        # Whisper принимает OGG/Opus напрямую: без ffmpeg и временных файлов
+        transcript = await asyncio.to_thread(
+            openai_client.audio.transcriptions.create,
+            model="whisper-1",
+            file=("voice.ogg", audio_bytes),
+            language="ru"
+        )
 
-        os.unlink(temp_path)
         return transcript.text
 
     except Exception as e:
@@ -149,7 +148,8 @@ async def generate_response(user_message: str, context_messages: list = None) ->
 
         messages.append({"role": "user", "content": user_message})
 
-        response = openai_client.chat.completions.create(
+        response = await asyncio.to_thread(
+            openai_client.chat.completions.create,
             model="gpt-4o-mini",  # Быстрая модель для голоса
             messages=messages,
             max_tokens=150,  # Короткие ответы для голоса
@@ -169,7 +169,8 @@ async def text_to_speech(text: str) -> Optional[bytes]:
         return None
 
     try:
-        response = openai_client.audio.speech.create(
+        response = await asyncio.to_thread(
+            openai_client.audio.speech.create,
             model="tts-1",
             voice="onyx",  # Мужской голос, подходит для строительства
             input=text,
@@ -199,8 +200,13 @@ async def start_realtime_chat_command(update: Update, context: ContextTypes.DEFA
 
     user_id = update.effective_user.id
 
-    # Очищаем контекст
-    context.user_data['voice_messages'] = []
+    # Новая сессия с пустым контекстом
+    if not await open_voice_session(user_id):
+        await update.message.reply_text(
+            "⚠️ Сейчас слишком много голосовых разговоров.\n"
+            "Попробуйте через пару минут."
+        )
+        return ConversationHandler.END
 
     keyboard = [
         [InlineKeyboardButton("🛑 Завершить", callback_data="stop_realtime_chat")]
@@ -233,8 +239,13 @@ async def start_realtime_chat_callback(update: Update, context: ContextTypes.DEF
         )
         return ConversationHandler.END
 
-    # Очищаем контекст
-    context.user_data['voice_messages'] = []
+    # Новая сессия с пустым контекстом
+    if not await open_voice_session(update.effective_user.id):
+        await query.edit_message_text(
+            "⚠️ Сейчас слишком много голосовых разговоров.\n"
+            "Попробуйте через пару минут."
+        )
+        return ConversationHandler.END
 
     keyboard = [
         [InlineKeyboardButton("🛑 Завершить", callback_data="stop_realtime_chat")]
@@ -263,6 +274,11 @@ async def handle_realtime_voice(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("❌ Ассистент недоступен")
         return VOICE_CONVERSATION
 
+    live = await get_voice_session(update.effective_user.id)
+    if not live:
+        await update.message.reply_text("⚠️ Сейчас слишком много голосовых разговоров. Попробуйте позже.")
+        return VOICE_CONVERSATION
+
     try:
         # Показываем что обрабатываем
         processing_msg = await update.message.reply_text("🎧 Слушаю...")
@@ -271,6 +287,8 @@ async def handle_realtime_voice(update: Update, context: ContextTypes.DEFAULT_TY
         voice = update.message.voice
         voice_file = await voice.get_file()
         ogg_bytes = await voice_file.download_as_bytearray()
+        live.mark_request()
+        live.sent(len(ogg_bytes))
 
         # 1. Распознаём речь
         await processing_msg.edit_text("🎤 Распознаю речь...")
@@ -284,21 +302,19 @@ async def handle_realtime_voice(update: Update, context: ContextTypes.DEFAULT_TY
         await processing_msg.edit_text(f"💬 Вы: _{user_text}_\n\n⏳ Думаю...", parse_mode="Markdown")
 
         # 2. Генерируем ответ
-        voice_messages = context.user_data.get('voice_messages', [])
-        bot_response = await generate_response(user_text, voice_messages)
+        bot_response = await generate_response(user_text, live.session.context_messages())
 
         if not bot_response:
             await processing_msg.edit_text("❌ Ошибка генерации ответа.")
             return VOICE_CONVERSATION
 
         # Сохраняем в контекст
-        voice_messages.append({"role": "user", "content": user_text})
-        voice_messages.append({"role": "assistant", "content": bot_response})
-        context.user_data['voice_messages'] = voice_messages
+        live.session.add_exchange(user_text, bot_response)
 
         # 3. Озвучиваем ответ
         await processing_msg.edit_text(f"💬 Вы: _{user_text}_\n\n🔊 Озвучиваю...", parse_mode="Markdown")
         audio_response = await text_to_speech(bot_response)
+        live.received(len(audio_response or b""), audio=bool(audio_response))
 
         # Удаляем сообщение о статусе
         await processing_msg.delete()
@@ -336,27 +352,32 @@ async def handle_realtime_text(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ Ассистент недоступен")
         return VOICE_CONVERSATION
 
+    live = await get_voice_session(update.effective_user.id)
+    if not live:
+        await update.message.reply_text("⚠️ Сейчас слишком много голосовых разговоров. Попробуйте позже.")
+        return VOICE_CONVERSATION
+
     try:
         user_text = update.message.text
+        live.mark_request()
+        live.sent(len(user_text.encode()))
 
         processing_msg = await update.message.reply_text("⏳ Думаю...")
 
         # Генерируем ответ
-        voice_messages = context.user_data.get('voice_messages', [])
-        bot_response = await generate_response(user_text, voice_messages)
+        bot_response = await generate_response(user_text, live.session.context_messages())
 
         if not bot_response:
             await processing_msg.edit_text("❌ Ошибка генерации ответа.")
             return VOICE_CONVERSATION
 
         # Сохраняем в контекст
-        voice_messages.append({"role": "user", "content": user_text})
-        voice_messages.append({"role": "assistant", "content": bot_response})
-        context.user_data['voice_messages'] = voice_messages
+        live.session.add_exchange(user_text, bot_response)
 
         # Озвучиваем
         await processing_msg.edit_text("🔊 Озвучиваю...")
         audio_response = await text_to_speech(bot_response)
+        live.received(len(audio_response or b""), audio=bool(audio_response))
 
         await processing_msg.delete()
 
@@ -383,10 +404,8 @@ async def handle_realtime_text(update: Update, context: ContextTypes.DEFAULT_TYP
 async def stop_realtime_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Завершение голосового чата"""
 
-    voice_messages = context.user_data.get('voice_messages', [])
-    exchanges = len(voice_messages) // 2
-
-    context.user_data['voice_messages'] = []
+    live = await LIVE_SESSIONS.close((BACKEND, update.effective_user.id))
+    exchanges = live.session.transcript.total if live else 0
 
     await update.effective_message.reply_text(
         f"🛑 **Голосовой чат завершён**\n\n"
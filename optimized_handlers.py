@@ -5,9 +5,13 @@
 
 import logging
 import asyncio
+import time
 from typing import Dict, Optional
 import os
 
+from prompt_cache import PROMPT_CACHE_STATS, anthropic_system
+from photo_pipeline import get_photo_pipeline
+
 logger = logging.getLogger(__name__)
 
 
@@ -38,9 +42,9 @@ async def handle_with_grok(
     logger.info(f"🟢 Используем Grok {'с web search' if needs_web_search else 'без web search'}")
 
     try:
-        from xai_client import XAIClient
+        from xai_client import get_shared_xai_client
 
-        xai_client = XAIClient(api_key=os.getenv("XAI_API_KEY"))
+        xai_client = get_shared_xai_client()
 
         # Формируем сообщения
         messages = [{"role": "system", "content": system_prompt}]
@@ -117,16 +121,22 @@ async def handle_with_claude_technical(
         loop = asyncio.get_event_loop()
 
         def _call_claude():
-            response = claude_client.messages.create(
+            # Статичный префикс system помечен для кэша Anthropic
+            return claude_client.messages.create(
                 model="claude-sonnet-4-5-20250929",
                 max_tokens=2500,
                 temperature=0.7,
-                system=system_prompt,
+                system=anthropic_system(system_prompt),
                 messages=messages
             )
-            return response.content[0].text
 
-        answer = await loop.run_in_executor(None, _call_claude)
+        started = time.perf_counter()
+        response = await loop.run_in_executor(None, _call_claude)
+        # Статистика кэша пишется в потоке event loop, как у остальных вызовов
+        PROMPT_CACHE_STATS.record_anthropic(
+            "claude-sonnet-4-5-20250929", response.usage, (time.perf_counter() - started) * 1000
+        )
+        answer = response.content[0].text
 
         logger.info(f"✅ Ответ получен от Claude ({len(answer)} символов)")
 
@@ -145,7 +155,8 @@ async def handle_with_gemini_vision(
     question: str,
     photo_file_id: str,
     bot,
-    system_prompt: str
+    system_prompt: str,
+    photo_unique_id: Optional[str] = None
 ) -> str:
     """
     Анализ фото дефектов через Gemini Vision
@@ -155,6 +166,7 @@ async def handle_with_gemini_vision(
         photo_file_id: ID фото в Telegram
         bot: Telegram bot instance
         system_prompt: Системный промпт
+        photo_unique_id: file_unique_id - ключ кэша подготовленных фото
 
     Returns:
         Экспертное заключение по дефектам
@@ -163,23 +175,15 @@ async def handle_with_gemini_vision(
 
     try:
         import google.generativeai as genai
-        import base64
-        from PIL import Image
-        from io import BytesIO
 
         # Конфигурируем Gemini
         genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
         model = genai.GenerativeModel('gemini-2.0-flash-exp')
 
-        # Скачиваем фото
-        file = await bot.get_file(photo_file_id)
-        photo_bytes = await file.download_as_bytearray()
-
-        # Конвертируем в base64
-        image = Image.open(BytesIO(photo_bytes))
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
+        # Скачиваем и подготавливаем фото (кэш, пул потоков)
+        pipeline = get_photo_pipeline()
+        photo = await pipeline.load(bot, photo_file_id, photo_unique_id)
+        img_base64 = photo.to_base64()
 
         # Формируем промпт
         full_prompt = f"{system_prompt}\n\nВОПРОС ПОЛЬЗОВАТЕЛЯ: {question}"
@@ -190,11 +194,13 @@ async def handle_with_gemini_vision(
         def _call_gemini():
             response = model.generate_content([
                 full_prompt,
-                {"mime_type": "image/jpeg", "data": img_base64}
+                {"mime_type": photo.mime_type, "data": img_base64}
             ])
             return response.text
 
+        started = time.perf_counter()
         analysis = await loop.run_in_executor(None, _call_gemini)
+        pipeline.report(photo, time.perf_counter() - started, "gemini-2.0-flash-exp")
 
         logger.info(f"✅ Анализ готов от Gemini ({len(analysis)} символов)")
 
@@ -0,0 +1,328 @@
+"""
+Подготовка фото для анализа моделями v1.0
+Фото уходит в модель в нужном ей разрешении, а не в самом большом
+
+- select_photo_size: из размеров Telegram (message.photo) выбирается
+  наименьший, длинная сторона которого не меньше PHOTO_MAX_SIDE -
+  меньше скачивать и отправлять
+- prepare_image: декодирование (JPEG - сразу с уменьшением через
+  Image.draft), поворот по EXIF, уменьшение до PHOTO_MAX_SIDE, JPEG.
+  Подходящий JPEG без поворота отправляется как есть, без перекодирования
+- Подготовка идёт в пуле потоков (PHOTO_WORKERS): Pillow отпускает GIL
+  при декодировании, масштабировании и сжатии - event loop не блокируется
+- Кэш по file_unique_id (BoundedState): повторный анализ того же фото не
+  скачивает и не обрабатывает его заново; одновременные запросы одного
+  фото ждут одну загрузку
+- Метрики на запрос (report): скачано и отправлено байт, время
+  скачивания, подготовки и ответа модели; сводка - get_stats()
+"""
+
+import os
+import time
+import base64
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from io import BytesIO
+from typing import Any, Deque, Dict, Hashable, Optional, Sequence
+
+from PIL import Image, ImageOps
+
+from state_store import BoundedState
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Длинная сторона фото для моделей (пиксели): Telegram-размер выбирается
+# не меньше неё, больший - уменьшается до неё
+PHOTO_MAX_SIDE = int(os.getenv("PHOTO_MAX_SIDE", "1280"))
+
+# Качество JPEG при перекодировании
+PHOTO_JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", "85"))
+
+# Потоков подготовки (по умолчанию - ядра, не больше 4)
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+# Кэш подготовленных фото: записей и минут без обращений
+PHOTO_CACHE_ENTRIES = int(os.getenv("PHOTO_CACHE_ENTRIES", "128"))
+PHOTO_CACHE_TTL_MINUTES = float(os.getenv("PHOTO_CACHE_TTL_MINUTES", "30"))
+
+# Тег EXIF с ориентацией снимка
+EXIF_ORIENTATION = 0x0112
+
+# Замеров времени для перцентилей
+TIMING_SAMPLES = 500
+
+
+@dataclass
+class PreparedPhoto:
+    """Фото, готовое к отправке в модель"""
+
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    source_bytes: int
+    reencoded: bool
+    download_ms: float = 0.0
+    prepare_ms: float = 0.0
+    cached: bool = False
+
+    @property
+    def upload_bytes(self) -> int:
+        return len(self.data)
+
+    def to_base64(self) -> str:
+        return base64.b64encode(self.data).decode("ascii")
+
+
+# ========================================
+# ВЫБОР РАЗМЕРА И ПОДГОТОВКА
+# ========================================
+
+def select_photo_size(sizes: Sequence[Any], min_side: int = PHOTO_MAX_SIDE) -> Any:
+    """
+    Наименьший размер Telegram, длинная сторона которого не меньше min_side
+
+    Args:
+        sizes: message.photo (PhotoSize с width/height), в любом порядке
+        min_side: Разрешение, нужное модели
+
+    Returns:
+        Подходящий PhotoSize; если все меньше min_side - самый большой
+    """
+    if not sizes:
+        raise ValueError("нет размеров фото")
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if max(size.width, size.height) >= min_side:
+            return size
+    return ordered[-1]
+
+
+def _to_rgb(image: Image.Image) -> Image.Image:
+    """JPEG не хранит прозрачность и палитру: прозрачное - на белый фон"""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def prepare_image(
+    data: bytes,
+    max_side: int = PHOTO_MAX_SIDE,
+    quality: int = PHOTO_JPEG_QUALITY
+) -> PreparedPhoto:
+    """
+    Декодировать, повернуть по EXIF, уменьшить и сжать в JPEG (синхронно)
+
+    Args:
+        data: Байты изображения любого формата Pillow
+        max_side: Максимальная длинная сторона результата
+        quality: Качество JPEG
+
+    Returns:
+        PreparedPhoto (исходные байты, если перекодирование не нужно)
+    """
+    started = time.perf_counter()
+    with Image.open(BytesIO(data)) as source:
+        orientation = source.getexif().get(EXIF_ORIENTATION, 1)
+        if source.format == "JPEG" and orientation == 1 and max(source.size) <= max_side:
+            width, height = source.size
+            return PreparedPhoto(
+                data=bytes(data), mime_type="image/jpeg", width=width, height=height,
+                source_bytes=len(data), reencoded=False,
+                prepare_ms=(time.perf_counter() - started) * 1000
+            )
+
+        if source.format == "JPEG":
+            # Масштабирование при декодировании (1/2, 1/4, 1/8) - без полного растра
+            source.draft("RGB", (max_side, max_side))
+        image = _to_rgb(ImageOps.exif_transpose(source))
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        out = BytesIO()
+        image.save(out, format="JPEG", quality=quality)
+
+    return PreparedPhoto(
+        data=out.getvalue(), mime_type="image/jpeg", width=image.width, height=image.height,
+        source_bytes=len(data), reencoded=True,
+        prepare_ms=(time.perf_counter() - started) * 1000
+    )
+
+
+def _percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+# ========================================
+# КОНВЕЙЕР
+# ========================================
+
+class PhotoPipeline:
+    """Скачивание нужного размера, подготовка в пуле потоков, кэш и метрики"""
+
+    def __init__(
+        self,
+        workers: int = PHOTO_WORKERS,
+        max_side: int = PHOTO_MAX_SIDE,
+        quality: int = PHOTO_JPEG_QUALITY,
+        cache_entries: int = PHOTO_CACHE_ENTRIES,
+        cache_ttl: Optional[float] = PHOTO_CACHE_TTL_MINUTES * 60
+    ):
+        self.workers = workers
+        self.max_side = max_side
+        self.quality = quality
+        self.cache = BoundedState("Фото для анализа", max_entries=cache_entries, idle_ttl=cache_ttl)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "downloads": 0,
+            "downloaded_bytes": 0,
+            "prepared": 0,
+            "reencoded": 0,
+            "analyzed": 0,
+            "source_bytes": 0,
+            "upload_bytes": 0,
+            "errors": 0
+        }
+        self._download_ms: Deque[float] = deque(maxlen=TIMING_SAMPLES)
+        self._prepare_ms: Deque[float] = deque(maxlen=TIMING_SAMPLES)
+        self._vision_ms: Deque[float] = deque(maxlen=TIMING_SAMPLES)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="photo")
+        return self._executor
+
+    async def prepare(self, data: bytes, max_side: Optional[int] = None) -> PreparedPhoto:
+        """Подготовить байты изображения в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        try:
+            photo = await loop.run_in_executor(
+                self._pool(), prepare_image, bytes(data), max_side or self.max_side, self.quality
+            )
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self.stats["prepared"] += 1
+        self.stats["reencoded"] += int(photo.reencoded)
+        self._prepare_ms.append(photo.prepare_ms)
+        return photo
+
+    async def load(
+        self,
+        bot,
+        file_id: str,
+        unique_id: Optional[str] = None,
+        max_side: Optional[int] = None
+    ) -> PreparedPhoto:
+        """
+        Скачать фото из Telegram и подготовить (с кэшем по file_unique_id)
+
+        Args:
+            bot: Telegram bot (get_file)
+            file_id: ID файла для скачивания
+            unique_id: file_unique_id - ключ кэша (без него - file_id)
+            max_side: Разрешение для модели (по умолчанию PHOTO_MAX_SIDE)
+        """
+        self.stats["requests"] += 1
+        key = (unique_id or file_id, max_side or self.max_side)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return replace(cached, cached=True, download_ms=0.0, prepare_ms=0.0)
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # То же фото уже скачивается - ждём его, а не качаем второй раз
+            self.stats["cache_hits"] += 1
+            photo = await asyncio.shield(pending)
+            return replace(photo, cached=True, download_ms=0.0, prepare_ms=0.0)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            started = time.perf_counter()
+            telegram_file = await bot.get_file(file_id)
+            data = await telegram_file.download_as_bytearray()
+            download_ms = (time.perf_counter() - started) * 1000
+            self.stats["downloads"] += 1
+            self.stats["downloaded_bytes"] += len(data)
+            self._download_ms.append(download_ms)
+
+            photo = await self.prepare(data, max_side)
+            photo.download_ms = download_ms
+            self.cache[key] = photo
+            future.set_result(photo)
+            return photo
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def load_message_photo(self, bot, sizes: Sequence[Any], max_side: Optional[int] = None) -> PreparedPhoto:
+        """Фото из сообщения: наименьший подходящий размер, затем load()"""
+        size = select_photo_size(sizes, max_side or self.max_side)
+        return await self.load(bot, size.file_id, size.file_unique_id, max_side)
+
+    def report(self, photo: PreparedPhoto, vision_seconds: float, model: str):
+        """Учесть и записать в лог метрики одного запроса анализа фото"""
+        vision_ms = vision_seconds * 1000
+        self.stats["analyzed"] += 1
+        self.stats["source_bytes"] += photo.source_bytes
+        self.stats["upload_bytes"] += photo.upload_bytes
+        self._vision_ms.append(vision_ms)
+        logger.info(
+            f"📸 Фото{' (кэш)' if photo.cached else ''}: {photo.source_bytes} → {photo.upload_bytes} байт "
+            f"({photo.width}x{photo.height}), скачивание {photo.download_ms:.0f} мс, "
+            f"подготовка {photo.prepare_ms:.0f} мс, {model} {vision_ms:.0f} мс"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        source = self.stats["source_bytes"]
+        return {
+            **self.stats,
+            "cached_entries": len(self.cache),
+            "upload_ratio": round(self.stats["upload_bytes"] / source, 3) if source else None,
+            "download_p50_ms": round(_percentile(self._download_ms, 0.5)),
+            "prepare_p50_ms": round(_percentile(self._prepare_ms, 0.5)),
+            "prepare_p95_ms": round(_percentile(self._prepare_ms, 0.95)),
+            "vision_p50_ms": round(_percentile(self._vision_ms, 0.5)),
+            "vision_p95_ms": round(_percentile(self._vision_ms, 0.95))
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_pipeline: Optional[PhotoPipeline] = None
+
+
+def get_photo_pipeline() -> PhotoPipeline:
+    """Общий конвейер подготовки фото"""
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = PhotoPipeline()
+    return _pipeline
@@ -0,0 +1,252 @@
+"""
+Кэширование префикса промптов v1.0
+Большие системные промпты (optimized_prompts, role_modes, llm_council) больше
+не обрабатываются моделью заново на каждый запрос
+
+- Системный промпт нормализуется (пробелы в концах строк, лишние пустые строки),
+  поэтому одинаковый по смыслу промпт всегда отправляется байт в байт одинаковым
+- Динамическая часть (краткое содержание диалога из context_builder) отделяется
+  от статичного префикса и идёт после него
+- Claude: статичный префикс - отдельный блок system с cache_control (ephemeral),
+  повторные запросы читают его из кэша Anthropic (0.1 цены входных токенов)
+- Grok: xAI кэширует совпадающий префикс автоматически; заголовок x-grok-conv-id
+  по хэшу системного промпта направляет запросы с тем же префиксом на тот же сервер
+- Учёт по каждому вызову: входные токены без кэша, из кэша и записанные в кэш,
+  задержка запросов с попаданием и без (статистика - get_prompt_cache_stats)
+"""
+
+import os
+import re
+import hashlib
+import logging
+from collections import deque
+from dataclasses import dataclass, asdict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from context_builder import SUMMARY_HEADER
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+
+# Время жизни кэша Anthropic: "5m" (по умолчанию) или "1h"
+PROMPT_CACHE_TTL = os.getenv("PROMPT_CACHE_TTL", "5m")
+
+# Заголовок xAI для маршрутизации запросов с общим префиксом
+XAI_CONV_ID_HEADER = "x-grok-conv-id"
+
+# Начало динамической части system-промпта (всё до него - статичный префикс)
+DYNAMIC_MARKERS = ("\n\n" + SUMMARY_HEADER,)
+
+# Цена входного токена относительно обычного: чтение из кэша и запись в кэш
+CACHE_PRICING = {
+    "anthropic": {"read": 0.1, "write": 1.25},
+    "xai": {"read": 0.25, "write": 1.0},
+}
+
+# Сколько последних вызовов хранить для статистики
+PROMPT_CACHE_LOG_SIZE = 500
+
+_TRAILING_SPACES_RE = re.compile(r"[ \t]+\n")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+# ========================================
+# СТАБИЛЬНЫЕ ПРОМПТЫ
+# ========================================
+
+@lru_cache(maxsize=256)
+def normalize_prompt(text: str) -> str:
+    """Промпт без пробелов в концах строк и лишних пустых строк"""
+    if not text:
+        return ""
+    text = _TRAILING_SPACES_RE.sub("\n", text.replace("\r\n", "\n"))
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def split_system(system: str) -> Tuple[str, str]:
+    """Разделить system-промпт на статичный префикс и динамическую часть"""
+    system = system or ""
+    cut = min((i for i in (system.find(m) for m in DYNAMIC_MARKERS) if i >= 0), default=-1)
+    if cut < 0:
+        return normalize_prompt(system), ""
+    return normalize_prompt(system[:cut]), system[cut:].strip()
+
+
+def anthropic_system(system: str, default: str = "") -> List[Dict[str, Any]]:
+    """
+    Параметр system для Anthropic messages.create: блоки текста,
+    статичный префикс помечен cache_control
+
+    Args:
+        system: System-промпт (может содержать динамическую часть в конце)
+        default: Промпт, если system пустой
+    """
+    stable, dynamic = split_system(system or default)
+    blocks: List[Dict[str, Any]] = []
+    if stable:
+        block = {"type": "text", "text": stable}
+        if PROMPT_CACHE_ENABLED:
+            block["cache_control"] = {"type": "ephemeral"}
+            if PROMPT_CACHE_TTL != "5m":
+                block["cache_control"]["ttl"] = PROMPT_CACHE_TTL
+        blocks.append(block)
+    if dynamic:
+        blocks.append({"type": "text", "text": dynamic})
+    return blocks
+
+
+def stable_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Сообщения для xAI: текст system-сообщений нормализован (префикс байт в байт)"""
+    result = []
+    for message in messages:
+        content = message.get("content")
+        if message.get("role") == "system" and isinstance(content, str):
+            stable, dynamic = split_system(content)
+            message = {**message, "content": f"{stable}\n\n{dynamic}" if dynamic else stable}
+        result.append(message)
+    return result
+
+
+@lru_cache(maxsize=256)
+def _prefix_id(stable: str) -> str:
+    return hashlib.sha1(stable.encode("utf-8")).hexdigest()[:16]
+
+
+def xai_cache_headers(messages: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Заголовок x-grok-conv-id по статичному префиксу первого system-сообщения"""
+    if not PROMPT_CACHE_ENABLED or not messages:
+        return {}
+    first = messages[0]
+    if first.get("role") != "system" or not isinstance(first.get("content"), str):
+        return {}
+    stable, _ = split_system(first["content"])
+    return {XAI_CONV_ID_HEADER: _prefix_id(stable)} if stable else {}
+
+
+# ========================================
+# УЧЁТ ТОКЕНОВ
+# ========================================
+
+def _field(obj: Any, name: str) -> int:
+    """Поле usage: объект SDK или словарь из JSON"""
+    if obj is None:
+        return 0
+    value = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+    return int(value or 0)
+
+
+@dataclass
+class CallUsage:
+    """Входные токены одного вызова"""
+
+    provider: str
+    model: str
+    uncached_tokens: int
+    cached_tokens: int
+    cache_write_tokens: int = 0
+    latency_ms: Optional[float] = None
+
+    @property
+    def input_tokens(self) -> int:
+        return self.uncached_tokens + self.cached_tokens + self.cache_write_tokens
+
+    @property
+    def hit(self) -> bool:
+        return self.cached_tokens > 0
+
+
+class PromptCacheStats:
+    """Статистика кэша префикса по провайдерам"""
+
+    def __init__(self, log_size: int = PROMPT_CACHE_LOG_SIZE):
+        self.calls: deque = deque(maxlen=log_size)
+        self.totals: Dict[str, Dict[str, float]] = {}
+
+    def record(
+        self,
+        provider: str,
+        model: str,
+        uncached_tokens: int,
+        cached_tokens: int,
+        cache_write_tokens: int = 0,
+        latency_ms: Optional[float] = None
+    ) -> CallUsage:
+        """Записать вызов"""
+        usage = CallUsage(provider, model, uncached_tokens, cached_tokens, cache_write_tokens, latency_ms)
+        self.calls.append(usage)
+
+        totals = self.totals.setdefault(provider, {
+            "calls": 0, "hits": 0, "uncached_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0,
+            "hit_latency_ms": 0.0, "hit_timed": 0, "miss_latency_ms": 0.0, "miss_timed": 0
+        })
+        totals["calls"] += 1
+        totals["hits"] += usage.hit
+        totals["uncached_tokens"] += uncached_tokens
+        totals["cached_tokens"] += cached_tokens
+        totals["cache_write_tokens"] += cache_write_tokens
+        if latency_ms is not None:
+            kind = "hit" if usage.hit else "miss"
+            totals[f"{kind}_latency_ms"] += latency_ms
+            totals[f"{kind}_timed"] += 1
+
+        logger.debug(
+            f"📊 Кэш промпта {provider}/{model}: {cached_tokens} из кэша, "
+            f"{uncached_tokens} без кэша, {cache_write_tokens} записано"
+        )
+        return usage
+
+    def record_anthropic(self, model: str, usage: Any, latency_ms: Optional[float] = None) -> CallUsage:
+        """usage из ответа Anthropic: input_tokens не включает чтение и запись кэша"""
+        return self.record(
+            "anthropic", model,
+            uncached_tokens=_field(usage, "input_tokens"),
+            cached_tokens=_field(usage, "cache_read_input_tokens"),
+            cache_write_tokens=_field(usage, "cache_creation_input_tokens"),
+            latency_ms=latency_ms
+        )
+
+    def record_xai(self, model: str, usage: Optional[dict], latency_ms: Optional[float] = None) -> Optional[CallUsage]:
+        """usage из ответа xAI: prompt_tokens включает cached_tokens"""
+        if not usage:
+            return None
+        prompt_tokens = _field(usage, "prompt_tokens")
+        cached = min(prompt_tokens, _field(usage.get("prompt_tokens_details"), "cached_tokens"))
+        return self.record("xai", model, prompt_tokens - cached, cached, latency_ms=latency_ms)
+
+    def get_stats(self) -> dict:
+        """Токены из кэша и без, доля попаданий, экономия и задержка по провайдерам"""
+        result = {}
+        for provider, t in self.totals.items():
+            pricing = CACHE_PRICING.get(provider, {"read": 1.0, "write": 1.0})
+            total = t["uncached_tokens"] + t["cached_tokens"] + t["cache_write_tokens"]
+            billed = t["uncached_tokens"] + t["cached_tokens"] * pricing["read"] + t["cache_write_tokens"] * pricing["write"]
+            result[provider] = {
+                "calls": t["calls"],
+                "hit_rate": round(t["hits"] / t["calls"], 3) if t["calls"] else 0.0,
+                "input_tokens": total,
+                "cached_tokens": t["cached_tokens"],
+                "uncached_tokens": t["uncached_tokens"],
+                "cache_write_tokens": t["cache_write_tokens"],
+                "cached_share": round(t["cached_tokens"] / total, 3) if total else 0.0,
+                "cost_saved_share": round(1 - billed / total, 3) if total else 0.0,
+                "avg_hit_latency_ms": round(t["hit_latency_ms"] / t["hit_timed"], 1) if t["hit_timed"] else None,
+                "avg_miss_latency_ms": round(t["miss_latency_ms"] / t["miss_timed"], 1) if t["miss_timed"] else None,
+            }
+        return result
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        """Последние вызовы (для отладки)"""
+        return [asdict(call) for call in list(self.calls)[-limit:]]
+
+
+# Общая статистика для бота
+PROMPT_CACHE_STATS = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> dict:
+    """Статистика кэша префикса промптов"""
+    return PROMPT_CACHE_STATS.get_stats()
@@ -0,0 +1,252 @@
+"""
+Ограничение частоты запросов пользователей v1.0
+Замена списка datetime на пользователя (bot.check_rate_limit) на GCRA
+
+- GCRA (generic cell rate algorithm, "виртуальный token bucket"): на пользователя
+  хранится одно число - теоретическое время прибытия (TAT). Проверка - O(1)
+  по времени и памяти при любом числе запросов в окне
+- Лимит: RATE_LIMIT_MAX_REQUESTS единиц за RATE_LIMIT_WINDOW_SECONDS, всплеск до
+  полного лимита, дальше - равномерно (не "10 запросов и минута тишины")
+- Стоимость по функциям (RATE_LIMIT_COSTS): анализ фото и Совет AI расходуют
+  больше, чем текстовый вопрос
+- Два хранилища с одним интерфейсом (acquire(key, cost)):
+  MemoryGCRA - в процессе (ограниченный BoundedState, запись удаляется после
+  окна без запросов); RedisGCRA - Lua-скрипт в Redis (атомарно, время берётся
+  у Redis), лимиты общие для всех реплик бота и переживают перезапуск
+- При ошибке Redis проверка выполняется в памяти (бот не перестаёт отвечать)
+"""
+
+import os
+import math
+import time
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from state_store import BoundedState, STATE_MAX_USERS
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# === КОНФИГУРАЦИЯ ===
+
+# Лимит: единиц стоимости за окно (текстовый вопрос - 1 единица)
+RATE_LIMIT_MAX_REQUESTS = int(os.getenv("RATE_LIMIT_MAX_REQUESTS", "10"))
+RATE_LIMIT_WINDOW_SECONDS = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))
+
+# Хранилище: "memory" или "redis" (нужен REDIS_URL)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "redis").lower()
+
+# Стоимость запроса по функциям бота
+RATE_LIMIT_COSTS: Dict[str, float] = {
+    "text": 1,
+    "voice": 1,
+    "document": 2,
+    "photo": 3,
+    "council": 5,
+}
+
+# Префикс ключей в Redis
+RATE_LIMIT_KEY_PREFIX = "rl:"
+
+# GCRA в Redis: TAT хранится в миллисекундах, время - TIME сервера
+GCRA_LUA = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + tonumber(t[2]) / 1000
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - tolerance
+if now < allow_at then
+    return {0, tostring(allow_at - now), tostring((tolerance - (tat - now)) / interval)}
+end
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil(new_tat - now))
+return {1, '0', tostring((tolerance - (new_tat - now)) / interval)}
+"""
+
+
+@dataclass
+class RateLimitResult:
+    """Результат проверки лимита"""
+
+    allowed: bool
+    retry_after: float = 0.0
+    remaining: float = 0.0
+    backend: str = "memory"
+
+    def __bool__(self) -> bool:
+        return self.allowed
+
+
+# ========================================
+# ХРАНИЛИЩА
+# ========================================
+
+class MemoryGCRA:
+    """GCRA в памяти процесса: одно число (TAT) на пользователя"""
+
+    name = "memory"
+
+    def __init__(
+        self,
+        limit: int = RATE_LIMIT_MAX_REQUESTS,
+        period: float = RATE_LIMIT_WINDOW_SECONDS,
+        max_users: int = STATE_MAX_USERS,
+        clock=time.monotonic
+    ):
+        self.interval = period / limit
+        self.tolerance = period
+        self.clock = clock
+        # После окна без запросов TAT в прошлом - запись равносильна отсутствующей
+        self.tats = BoundedState("rate_limit", max_entries=max_users, idle_ttl=period)
+
+    def acquire_now(self, key: Any, cost: float = 1) -> RateLimitResult:
+        """Синхронная проверка и списание cost единиц"""
+        now = self.clock()
+        tat = max(self.tats.get(key, now), now)
+        new_tat = tat + self.interval * cost
+        allow_at = new_tat - self.tolerance
+        if now < allow_at:
+            return RateLimitResult(False, allow_at - now, (self.tolerance - (tat - now)) / self.interval, self.name)
+        self.tats[key] = new_tat
+        return RateLimitResult(True, 0.0, (self.tolerance - (new_tat - now)) / self.interval, self.name)
+
+    async def acquire(self, key: Any, cost: float = 1) -> RateLimitResult:
+        return self.acquire_now(key, cost)
+
+
+class RedisGCRA:
+    """GCRA в Redis (Lua-скрипт): общий лимит для всех реплик бота"""
+
+    name = "redis"
+
+    def __init__(
+        self,
+        client: Any,
+        limit: int = RATE_LIMIT_MAX_REQUESTS,
+        period: float = RATE_LIMIT_WINDOW_SECONDS,
+        prefix: str = RATE_LIMIT_KEY_PREFIX
+    ):
+        self.client = client
+        self.interval_ms = period * 1000 / limit
+        self.tolerance_ms = period * 1000
+        self.prefix = prefix
+        # register_script сам переходит с EVALSHA на EVAL при NOSCRIPT
+        self.script = client.register_script(GCRA_LUA)
+
+    async def acquire(self, key: Any, cost: float = 1) -> RateLimitResult:
+        allowed, retry_ms, remaining = await self.script(
+            keys=[f"{self.prefix}{key}"],
+            args=[self.interval_ms, self.tolerance_ms, cost]
+        )
+        return RateLimitResult(
+            bool(int(allowed)),
+            float(retry_ms) / 1000,
+            float(remaining),
+            self.name
+        )
+
+
+# ========================================
+# ОГРАНИЧИТЕЛЬ
+# ========================================
+
+class RateLimiter:
+    """Лимит запросов по пользователям со стоимостью функций"""
+
+    def __init__(
+        self,
+        limit: int = RATE_LIMIT_MAX_REQUESTS,
+        period: float = RATE_LIMIT_WINDOW_SECONDS,
+        costs: Optional[Dict[str, float]] = None
+    ):
+        self.limit = limit
+        self.period = period
+        self.costs = costs if costs is not None else RATE_LIMIT_COSTS
+        self.memory = MemoryGCRA(limit, period)
+        self.backend: Any = self.memory
+        self._redis_client = None
+        self._check_us: deque = deque(maxlen=1000)
+        self.allowed = Counter()
+        self.denied = Counter()
+        self.redis_errors = 0
+
+    def cost(self, feature: str) -> float:
+        """Стоимость функции (не больше лимита - иначе запрос не прошёл бы никогда)"""
+        return min(self.costs.get(feature, 1), self.limit)
+
+    async def check(self, key: Any, feature: str = "text") -> RateLimitResult:
+        """Проверить лимит и списать стоимость функции"""
+        started = time.perf_counter()
+        cost = self.cost(feature)
+        try:
+            result = await self.backend.acquire(key, cost)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"⚠️ Rate limit: ошибка {self.backend.name} ({e}), проверка в памяти")
+            result = self.memory.acquire_now(key, cost)
+        self._check_us.append((time.perf_counter() - started) * 1e6)
+
+        if result.allowed:
+            self.allowed[feature] += 1
+        else:
+            self.denied[feature] += 1
+            logger.warning(f"Rate limit exceeded for user {key} ({feature}), retry in {result.retry_after:.1f}s")
+        return result
+
+    async def init_redis(self, url: Optional[str] = None) -> bool:
+        """Переключиться на Redis (лимиты общие для реплик); False - остаётся память"""
+        if RATE_LIMIT_BACKEND != "redis" or not REDIS_AVAILABLE:
+            return False
+        url = url or os.getenv("REDIS_URL") or os.getenv("REDIS_TLS_URL")
+        if not url:
+            return False
+        try:
+            client = aioredis.from_url(url, socket_timeout=2, socket_connect_timeout=5)
+            await client.ping()
+        except Exception as e:
+            logger.warning(f"⚠️ Rate limit: Redis недоступен ({e}), лимиты в памяти")
+            return False
+        self._redis_client = client
+        self.backend = RedisGCRA(client, self.limit, self.period)
+        logger.info("✅ Rate limit: GCRA в Redis (общий для всех реплик)")
+        return True
+
+    async def close(self):
+        if self._redis_client is not None:
+            await self._redis_client.close()
+            self._redis_client = None
+        self.backend = self.memory
+
+    def get_stats(self) -> dict:
+        checks = sorted(self._check_us)
+        return {
+            "backend": self.backend.name,
+            "limit": f"{self.limit}/{self.period:g}s",
+            "allowed": dict(self.allowed),
+            "denied": dict(self.denied),
+            "redis_errors": self.redis_errors,
+            "users_in_memory": len(self.memory.tats),
+            "avg_check_us": round(sum(checks) / len(checks), 1) if checks else 0.0,
+            "p95_check_us": round(checks[min(len(checks) - 1, int(len(checks) * 0.95))], 1) if checks else 0.0
+        }
+
+
+def format_retry_after(seconds: float) -> str:
+    """Через сколько можно повторить: "через 12 с" """
+    return f"через {max(1, math.ceil(seconds))} с"
+
+
+# Общий ограничитель бота
+RATE_LIMITER = RateLimiter()
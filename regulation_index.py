@@ -0,0 +1,391 @@
+"""
+Единый индекс нормативов v1.0
+Все базы нормативов в одной структуре, построенной один раз
+
+- Источники: REGULATIONS (bot.py), regulations_2025_updated,
+  regulations_categories, regulations_2025 (федеральные законы и ключевые документы)
+- Код → запись: словарь по нормализованному коду (регистр, пробелы, тире, "_")
+- Поиск по словам: общий индекс search_index.SearchIndex (основы, BM25,
+  расширение по началу слова) по коду, названию, тегам и описанию
+- Поиск по началу кода ("СП 63" → "СП 63.13330.2018") - бинарный поиск
+  по отсортированным кодам; запрос-код существующего норматива возвращает
+  только совпадения по коду
+- Граф связанных нормативов (общая категория, общие теги, "заменяет")
+  считается при построении
+"""
+
+import time
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from regulation_matcher import normalize_code
+from russian_text import normalize_text
+from search_index import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+# Название весит больше описания
+TITLE_WEIGHT = 2
+FIELD_WEIGHTS = {"code": 1, "title": TITLE_WEIGHT, "text": 1}
+
+# Бонусы за совпадение кода
+EXACT_CODE_BOOST = 100.0
+CODE_PREFIX_BOOST = 10.0
+MAX_PREFIX_MATCHES = 50
+
+# Веса рёбер графа связанных нормативов
+RELATED_CATEGORY_WEIGHT = 1.0
+RELATED_TAG_WEIGHT = 0.5
+RELATED_REPLACED_WEIGHT = 2.0
+
+
+@dataclass
+class RegulationRecord:
+    """Норматив, собранный из всех баз"""
+
+    code: str
+    title: str = ""
+    url: str = ""
+    categories: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    text: List[str] = field(default_factory=list)
+    replaced: List[str] = field(default_factory=list)
+    # источник → (код в источнике, исходная запись)
+    sources: Dict[str, Tuple[str, dict]] = field(default_factory=dict)
+
+
+def _code_key(code: str) -> str:
+    """Ключ словаря кодов: "СП_48", "сп 48" и "СП48" совпадают"""
+    return normalize_code(str(code)).replace("_", "").replace(" ", "")
+
+
+class RegulationIndex:
+    """Индекс нормативов: код, BM25 по словам, связанные документы"""
+
+    def __init__(self):
+        self._records: List[RegulationRecord] = []
+        self._by_code: Dict[str, int] = {}
+        self._dirty = True
+
+        # Строится в _build()
+        self._words = SearchIndex("нормативов (слова)", FIELD_WEIGHTS, fuzzy=False)
+        self._sorted_codes: List[Tuple[str, int]] = []
+        self._related: List[List[int]] = []
+
+        self.stats = {
+            "lookups": 0,
+            "searches": 0,
+            "search_time_us": 0.0,
+            "builds": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    # ========================================
+    # НАПОЛНЕНИЕ
+    # ========================================
+
+    def add(
+        self,
+        code: str,
+        source: str,
+        data: dict,
+        title: str = "",
+        url: str = "",
+        category: str = "",
+        tags: Iterable[str] = (),
+        text: Iterable[str] = (),
+        replaced: str = ""
+    ) -> RegulationRecord:
+        """
+        Добавить норматив из источника (записи с одним кодом объединяются)
+
+        Args:
+            code: Код в источнике ("СП 63.13330.2018", "190-ФЗ", "СП_48")
+            source: Имя источника ("bot", "categories", "federal_laws", ...)
+            data: Исходная запись источника (возвращается поиском как есть)
+            title, url, category, tags, text: Поля для поиска и графа
+            replaced: Код норматива, который этот документ заменяет
+        """
+        key = _code_key(code)
+        doc = self._by_code.get(key)
+        if doc is None:
+            doc = self._by_code[key] = len(self._records)
+            self._records.append(RegulationRecord(code=" ".join(str(code).replace("_", " ").split())))
+        record = self._records[doc]
+
+        record.sources.setdefault(source, (code, data))
+        if title and not record.title:
+            record.title = title
+        if url and not record.url:
+            record.url = url
+        if category and category not in record.categories:
+            record.categories.append(category)
+        record.tags.extend(t for t in tags if t not in record.tags)
+        record.text.extend(t for t in text if t)
+        if replaced and replaced not in record.replaced:
+            record.replaced.append(replaced)
+        if title and title != record.title and title not in record.text:
+            record.text.append(title)
+
+        self._dirty = True
+        return record
+
+    def add_regulations(self, regulations: Dict[str, dict], source: str):
+        """Добавить словарь вида REGULATIONS: код → {title, url, category, replaced, ...}"""
+        for code, data in regulations.items():
+            self.add(
+                code, source, data,
+                title=data.get("title", ""),
+                url=data.get("url", ""),
+                category=data.get("category", ""),
+                replaced=data.get("replaced") or ""
+            )
+
+    # ========================================
+    # ПОСТРОЕНИЕ
+    # ========================================
+
+    def _ensure_built(self):
+        if self._dirty:
+            self._build()
+
+    def _build(self):
+        """Индекс слов, отсортированные коды и граф"""
+        started = time.perf_counter()
+
+        words = SearchIndex("нормативов (слова)", FIELD_WEIGHTS, fuzzy=False)
+        for doc, record in enumerate(self._records):
+            words.add(doc, {
+                "code": record.code,
+                "title": record.title,
+                "text": record.categories + record.tags + record.text
+            })
+        words.build()
+
+        self._words = words
+        self._sorted_codes = sorted((key, doc) for key, doc in self._by_code.items())
+        self._related = self._build_related()
+        self._dirty = False
+        self.stats["builds"] += 1
+
+        logger.info(
+            f"✅ Индекс нормативов: {len(self._records)} документов, {words.get_stats()['terms']} терминов, "
+            f"{sum(len(r) for r in self._related)} связей ({(time.perf_counter() - started) * 1000:.1f} мс)"
+        )
+
+    def _build_related(self) -> List[List[int]]:
+        """Связанные нормативы: общая категория, общие теги, замена документа"""
+        groups: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        for doc, record in enumerate(self._records):
+            for category in record.categories:
+                groups[("category", normalize_text(category))].append(doc)
+            for tag in record.tags:
+                groups[("tag", normalize_text(tag))].append(doc)
+
+        weights: List[Dict[int, float]] = [defaultdict(float) for _ in self._records]
+        for (kind, _), docs in groups.items():
+            weight = RELATED_CATEGORY_WEIGHT if kind == "category" else RELATED_TAG_WEIGHT
+            for doc in docs:
+                for other in docs:
+                    if other != doc:
+                        weights[doc][other] += weight
+
+        for doc, record in enumerate(self._records):
+            for code in record.replaced:
+                other = self._by_code.get(_code_key(code))
+                if other is not None and other != doc:
+                    weights[doc][other] += RELATED_REPLACED_WEIGHT
+                    weights[other][doc] += RELATED_REPLACED_WEIGHT
+
+        # Порядок: вес связи, затем порядок добавления
+        return [
+            [other for other, _ in sorted(edges.items(), key=lambda item: (-item[1], item[0]))]
+            for edges in weights
+        ]
+
+    # ========================================
+    # ЗАПРОСЫ
+    # ========================================
+
+    def get(self, code: str) -> Optional[RegulationRecord]:
+        """Норматив по коду (в любом написании)"""
+        self.stats["lookups"] += 1
+        doc = self._by_code.get(_code_key(code))
+        return self._records[doc] if doc is not None else None
+
+    def codes_with_prefix(self, prefix: str, limit: int = MAX_PREFIX_MATCHES) -> List[RegulationRecord]:
+        """Нормативы, код которых начинается с prefix ("СП 63" → "СП 63.13330.2018")"""
+        self._ensure_built()
+        return [self._records[doc] for doc in self._code_prefix_docs(_code_key(prefix), limit)]
+
+    def _code_prefix_docs(self, key: str, limit: int) -> List[int]:
+        docs = []
+        position = bisect_left(self._sorted_codes, (key, -1))
+        while position < len(self._sorted_codes) and len(docs) < limit:
+            code, doc = self._sorted_codes[position]
+            if not code.startswith(key):
+                break
+            docs.append(doc)
+            position += 1
+        return docs
+
+    def search(
+        self,
+        query: str,
+        limit: Optional[int] = 10,
+        source: Optional[str] = None
+    ) -> List[Tuple[RegulationRecord, float]]:
+        """
+        Поиск нормативов по коду и словам (BM25)
+
+        Args:
+            query: Код, начало кода или слова ("защитный слой бетона")
+            limit: Максимум результатов (None - все)
+            source: Только нормативы из этого источника
+
+        Returns:
+            [(запись, оценка)] по убыванию оценки
+        """
+        self._ensure_built()
+        started = time.perf_counter()
+
+        scores: Dict[int, float] = {hit.key: hit.score for hit in self._words.search(query, limit=None)}
+
+        if _looks_like_code(query):
+            key = _code_key(query)
+            exact = self._by_code.get(key)
+            prefixed = self._code_prefix_docs(key, MAX_PREFIX_MATCHES)
+            if exact is not None:
+                scores[exact] = scores.get(exact, 0.0) + EXACT_CODE_BOOST
+            for doc in prefixed:
+                scores[doc] = scores.get(doc, 0.0) + CODE_PREFIX_BOOST
+            # Запрос - код существующего норматива: только он (или коды с этим началом),
+            # без документов, совпавших лишь по "СП" или "ФЗ"
+            code_docs = [exact] if exact is not None else prefixed
+            if code_docs:
+                scores = {doc: scores[doc] for doc in code_docs}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        results = []
+        for doc, score in ranked:
+            record = self._records[doc]
+            if source is not None and source not in record.sources:
+                continue
+            results.append((record, score))
+            if limit is not None and len(results) >= limit:
+                break
+
+        self.stats["searches"] += 1
+        self.stats["search_time_us"] += (time.perf_counter() - started) * 1e6
+        return results
+
+    def related(self, code: str, limit: Optional[int] = None, source: Optional[str] = None) -> List[RegulationRecord]:
+        """Связанные нормативы из предпосчитанного графа (сильные связи первыми)"""
+        self._ensure_built()
+        doc = self._by_code.get(_code_key(code))
+        if doc is None:
+            return []
+        related = []
+        for other in self._related[doc]:
+            record = self._records[other]
+            if source is not None and source not in record.sources:
+                continue
+            related.append(record)
+            if limit is not None and len(related) >= limit:
+                break
+        return related
+
+    def get_stats(self) -> dict:
+        """Статистика индекса"""
+        searches = self.stats["searches"]
+        return {
+            "documents": len(self._records),
+            "terms": self._words.get_stats()["terms"],
+            "edges": sum(len(r) for r in self._related),
+            "lookups": self.stats["lookups"],
+            "searches": searches,
+            "search_avg_us": round(self.stats["search_time_us"] / searches, 1) if searches else 0.0,
+            "builds": self.stats["builds"]
+        }
+
+
+def _looks_like_code(query: str) -> bool:
+    """Запрос похож на код норматива (есть цифры)"""
+    return any(ch.isdigit() for ch in query)
+
+
+# ========================================
+# ОБЩИЙ ИНДЕКС
+# ========================================
+
+_index: Optional[RegulationIndex] = None
+
+
+def _load_sources(index: RegulationIndex):
+    """Базы нормативов проекта (недоступные модули пропускаются)"""
+    try:
+        from regulations_2025_updated import REGULATIONS_2025_UPDATED
+        index.add_regulations(REGULATIONS_2025_UPDATED, "updated_2025")
+    except ImportError:
+        logger.warning("⚠️ regulations_2025_updated.py не найден")
+
+    try:
+        from regulations_categories import REGULATIONS_CATEGORIES
+        for category_id, category in REGULATIONS_CATEGORIES.items():
+            for reg in category.get("regulations", []):
+                index.add(
+                    reg["code"], "categories", {**reg, "category_id": category_id, "category": category["name"]},
+                    title=reg.get("name", ""),
+                    category=category["name"],
+                    tags=reg.get("tags", [])
+                )
+    except ImportError:
+        logger.warning("⚠️ regulations_categories.py недоступен")
+
+    try:
+        from regulations_2025 import FEDERAL_LAWS, KEY_REGULATIONS_2025
+        for code, data in FEDERAL_LAWS.items():
+            index.add(
+                code, "federal_laws", data,
+                title=data.get("title", ""),
+                url=data.get("url", ""),
+                text=[data.get("scope", "")] + list(data.get("key_points", []))
+            )
+        for code, data in KEY_REGULATIONS_2025.items():
+            index.add(
+                code, "key_regulations", data,
+                title=data.get("name", ""),
+                url=data.get("url", ""),
+                text=[data.get("content", "")]
+            )
+    except ImportError:
+        logger.warning("⚠️ regulations_2025.py не найден")
+
+
+def get_regulation_index() -> RegulationIndex:
+    """Общий индекс по всем базам нормативов (строится при первом обращении)"""
+    global _index
+    if _index is None:
+        _index = RegulationIndex()
+        _load_sources(_index)
+        _index._build()
+    return _index
+
+
+def register_regulations(regulations: Dict[str, dict], source: str = "bot"):
+    """Добавить словарь нормативов в общий индекс (например, REGULATIONS из bot.py)"""
+    get_regulation_index().add_regulations(regulations, source)
+
+
+def search_regulations(
+    query: str,
+    limit: Optional[int] = 10,
+    source: Optional[str] = None
+) -> List[Tuple[RegulationRecord, float]]:
+    """Поиск по общему индексу: [(запись, оценка)]"""
+    return get_regulation_index().search(query, limit=limit, source=source)
@@ -0,0 +1,218 @@
+"""
+Поиск кодов нормативов в тексте v1.0
+Один предкомпилированный автомат вместо отдельных regex и циклов по словарю
+
+- Словарь: все коды из REGULATIONS (bot.py), regulations_2025,
+  regulations_categories и regulations_2025_updated
+- Коды собираются в префиксное дерево, которое компилируется в одно
+  регулярное выражение: проход по тексту идёт в C-движке re, а не циклом
+  Python по символам (на словаре в сотни кодов это быстрее, чем Ахо–Корасик
+  на чистом Python)
+- Нормализация: регистр, ё/е, любые пробелы (в т.ч. неразрывные) и варианты
+  тире (‐ ‑ ‒ – — −); "СП63.13330.2018" и "СП 63.13330.2018" совпадают
+- Один проход: известные коды и коды неизвестных нормативов (по префиксу
+  СП/ГОСТ/СНиП/ППБ + номер) с позициями в исходном тексте
+"""
+
+import re
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from russian_text import trie_regex
+
+logger = logging.getLogger(__name__)
+
+_DASHES = "‐‑‒–—―−"
+_DASH_TABLE = {ord(ch): "-" for ch in _DASHES}
+_DASH_CLASS = "[-" + _DASHES + "]"
+
+# Номер норматива, которого нет в словаре, по префиксу
+_GENERIC_PATTERNS = [
+    r"СП[ \-]?\d+(?:[.\-]\d+)*",
+    r"ГОСТ[ \-]?(?:[РЕ] ?)?(?:ИСО ?|ISO ?|EN ?)?\d+(?:[.\-]\d+)*",
+    r"СНиП[ \-]?\d+(?:[.\-]\d+)*",
+    r"ППБ[ \-]?\d+(?:-\d+)*",
+]
+
+# Префикс кода: буквы до первой цифры ("СП", "ГОСТ Р", "РД")
+_PREFIX_RE = re.compile(r"^([^\W\d_]+(?: [^\W\d_]+)*)[ \-]?(?=\d)")
+
+# Код не продолжается дальше буквой, цифрой или ".цифра" / "-цифра"
+_END = r"(?![\w])(?![.\-" + _DASHES + r"]\d)"
+
+
+class RegulationMatch(NamedTuple):
+    """Найденный код: позиции в исходном тексте и код"""
+
+    start: int
+    end: int
+    code: str
+    known: bool
+
+
+def normalize_code(code: str) -> str:
+    """Нормализованная форма кода: нижний регистр, ё → е, одно тире, одиночные пробелы"""
+    return " ".join(code.translate(_DASH_TABLE).lower().replace("ё", "е").split())
+
+
+def _code_variants(code: str) -> List[str]:
+    """Написания кода: с пробелом, без пробела и через дефис после префикса"""
+    normalized = normalize_code(code).replace("_", " ")
+    match = _PREFIX_RE.match(normalized)
+    if not match:
+        return [normalized]
+    prefix, rest = match.group(1), normalized[match.end():]
+    return list(dict.fromkeys([normalized, f"{prefix} {rest}", f"{prefix}{rest}", f"{prefix}-{rest}"]))
+
+
+def _char_regex(ch: str) -> str:
+    """Регулярное выражение для символа нормализованного кода"""
+    if ch == " ":
+        return r"\s+"
+    if ch == "-":
+        return _DASH_CLASS
+    if ch == "е":
+        return "[её]"
+    return re.escape(ch)
+
+
+class RegulationMatcher:
+    """Предкомпилированный поиск кодов нормативов"""
+
+    def __init__(self, codes: Iterable[str] = ()):
+        self._codes: Dict[str, str] = {}
+        self._regex: Optional[re.Pattern] = None
+        self.add_codes(codes)
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def add_codes(self, codes: Iterable[str]):
+        """Добавить коды (выражение перекомпилируется при следующем поиске)"""
+        for code in codes:
+            code = " ".join(str(code).split())
+            if not code or not any(ch.isdigit() for ch in code):
+                continue
+            for variant in _code_variants(code):
+                self._codes.setdefault(variant, code)
+        self._regex = None
+
+    def _build(self) -> re.Pattern:
+        """Скомпилировать словарь и шаблоны неизвестных кодов в одно выражение"""
+        known = trie_regex(self._codes, _char_regex)
+        generic = "|".join(_GENERIC_PATTERNS).lower()
+        # Текст приводится к нижнему регистру до поиска: без IGNORECASE re заметно быстрее
+        self._regex = re.compile(f"(?<!\\w)(?:(?P<known>{known}){_END}|(?P<generic>{generic}){_END})")
+        logger.info(f"✅ Поиск нормативов: {len(set(self._codes.values()))} кодов, {len(self._codes)} написаний")
+        return self._regex
+
+    def find_all(self, text: str) -> List[RegulationMatch]:
+        """
+        Найти все коды нормативов за один проход
+
+        Returns:
+            Непересекающиеся совпадения (самые длинные) по порядку в тексте
+        """
+        if not text:
+            return []
+        regex = self._regex or self._build()
+
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Редкие символы меняют длину при lower() - сравниваем посимвольно
+            lowered = "".join(ch.lower()[0] for ch in text)
+
+        matches = []
+        for match in regex.finditer(lowered):
+            start, end = match.span()
+            if match.group("known") is not None:
+                code = self._codes.get(normalize_code(match.group()))
+                if code is not None:
+                    matches.append(RegulationMatch(start, end, code, True))
+                    continue
+            raw = text[start:end]
+            matches.append(RegulationMatch(start, end, " ".join(raw.translate(_DASH_TABLE).split()), False))
+        return matches
+
+    def find_codes(self, text: str, known_only: bool = False) -> List[str]:
+        """Уникальные коды в порядке появления"""
+        return list(dict.fromkeys(
+            m.code for m in self.find_all(text) if m.known or not known_only
+        ))
+
+
+# ========================================
+# ОБЩИЙ АВТОМАТ
+# ========================================
+
+_matcher: Optional[RegulationMatcher] = None
+
+
+def _collect_strings(value, out: List[str]):
+    """Все строки во вложенных dict/list"""
+    if isinstance(value, str):
+        out.append(value)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _collect_strings(key, out)
+            _collect_strings(item, out)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect_strings(item, out)
+
+
+def _load_known_codes() -> List[str]:
+    """Коды из баз нормативов проекта (недоступные модули пропускаются)"""
+    codes: List[str] = []
+
+    try:
+        from regulations_2025_updated import REGULATIONS_2025_UPDATED
+        codes.extend(REGULATIONS_2025_UPDATED.keys())
+    except ImportError:
+        logger.warning("⚠️ regulations_2025_updated.py не найден")
+
+    try:
+        from regulations_categories import REGULATIONS_CATEGORIES
+        for category in REGULATIONS_CATEGORIES.values():
+            codes.extend(reg["code"] for reg in category.get("regulations", []))
+    except ImportError:
+        logger.warning("⚠️ regulations_categories.py недоступен")
+
+    try:
+        import regulations_2025
+        codes.extend(regulations_2025.FEDERAL_LAWS.keys())
+        # В базе 2025 коды встречаются в названиях и описаниях
+        strings: List[str] = []
+        for name in dir(regulations_2025):
+            if name.isupper():
+                _collect_strings(getattr(regulations_2025, name), strings)
+        scanner = RegulationMatcher()
+        for value in strings:
+            codes.extend(m.code for m in scanner.find_all(value))
+    except ImportError:
+        logger.warning("⚠️ regulations_2025.py не найден")
+
+    return codes
+
+
+def get_regulation_matcher() -> RegulationMatcher:
+    """Общий автомат по всем известным кодам (ленивая инициализация)"""
+    global _matcher
+    if _matcher is None:
+        _matcher = RegulationMatcher(_load_known_codes())
+    return _matcher
+
+
+def register_regulation_codes(codes: Iterable[str]):
+    """Добавить коды в общий автомат (например, REGULATIONS из bot.py)"""
+    get_regulation_matcher().add_codes(codes)
+
+
+def extract_regulation_codes(text: str) -> List[str]:
+    """
+    Извлечь коды нормативов из текста
+
+    Returns:
+        Уникальные коды (известные - в написании из базы) в порядке появления
+    """
+    return get_regulation_matcher().find_codes(text)
@@ -367,22 +367,23 @@ def get_all_regulations():
     }
 
 def search_regulation(query: str) -> dict:
-    """Поиск по базе нормативов"""
-    results = []
-    query_lower = query.lower()
+    """Поиск по базе нормативов (единый индекс, ранжирование BM25)"""
+    from regulation_index import get_regulation_index
 
-    # Поиск в федеральных законах
-    for code, data in FEDERAL_LAWS.items():
-        if query_lower in code.lower() or query_lower in data['title'].lower():
+    results = []
+    for record, _ in get_regulation_index().search(query, limit=None):
+        # Федеральные законы
+        if 'federal_laws' in record.sources:
+            code, data = record.sources['federal_laws']
             results.append({
                 'type': 'Федеральный закон',
                 'code': code,
                 'data': data
             })
 
-    # Поиск в ключевых нормативах
-    for code, data in KEY_REGULATIONS_2025.items():
-        if query_lower in data['name'].lower() or query_lower in data['content'].lower():
+        # Ключевые нормативы
+        if 'key_regulations' in record.sources:
+            code, data = record.sources['key_regulations']
             results.append({
                 'type': 'Нормативный документ',
                 'code': code,
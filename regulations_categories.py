@@ -5,6 +5,8 @@
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from regulation_index import get_regulation_index
+
 # Категории нормативов
 REGULATIONS_CATEGORIES = {
     "foundations": {
@@ -205,22 +207,16 @@ def get_regulations_by_category(category_id):
     return text
 
 def search_regulations_by_keyword(keyword):
-    """Поиск нормативов по ключевому слову"""
-    keyword_lower = keyword.lower()
+    """Поиск нормативов по ключевому слову (код, название, теги; ранжирование BM25)"""
     results = []
 
-    for category_id, category_data in REGULATIONS_CATEGORIES.items():
-        for reg in category_data["regulations"]:
-            # Поиск в названии, коде и тегах
-            if (keyword_lower in reg["code"].lower() or
-                keyword_lower in reg["name"].lower() or
-                any(keyword_lower in tag.lower() for tag in reg["tags"])):
-
-                results.append({
-                    "category": category_data["name"],
-                    "code": reg["code"],
-                    "name": reg["name"]
-                })
+    for record, _ in get_regulation_index().search(keyword, limit=None, source="categories"):
+        _, reg = record.sources["categories"]
+        results.append({
+            "category": reg["category"],
+            "code": reg["code"],
+            "name": reg["name"]
+        })
 
     return results
 
@@ -241,22 +237,10 @@ def get_all_regulations_text():
     return text
 
 def get_related_regulations(current_code):
-    """Получить связанные нормативы"""
-    # Найти категорию текущего норматива
-    current_category = None
-    for category_id, category_data in REGULATIONS_CATEGORIES.items():
-        for reg in category_data["regulations"]:
-            if reg["code"] == current_code:
-                current_category = category_id
-                break
-
-    if not current_category:
-        return []
-
-    # Вернуть все нормативы из этой категории, кроме текущего
+    """Получить связанные нормативы (предпосчитанный граф: категория, теги)"""
     related = []
-    for reg in REGULATIONS_CATEGORIES[current_category]["regulations"]:
-        if reg["code"] != current_code:
-            related.append(f"{reg['code']} - {reg['name']}")
+    for record in get_regulation_index().related(current_code, source="categories"):
+        _, reg = record.sources["categories"]
+        related.append(f"{reg['code']} - {reg['name']}")
 
     return related
@@ -5,6 +5,7 @@
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from functools import lru_cache
 import logging
 
 logger = logging.getLogger(__name__)
@@ -75,8 +76,9 @@ def create_role_selection_menu():
 # SYSTEM PROMPTS ДЛЯ РАЗНЫХ РОЛЕЙ
 # ========================================
 
+@lru_cache(maxsize=None)
 def get_role_system_prompt(role_id: str) -> str:
-    """Получить system prompt для конкретной роли"""
+    """Получить system prompt для конкретной роли (один и тот же текст - для кэша префикса)"""
 
     base_prompt = """Вы — AI-помощник по строительству СтройНадзорAI.
 Всегда используйте актуальные требования 2025-2026 года."""
@@ -0,0 +1,234 @@
+"""
+Нормализация русского текста для поиска v1.0
+Токенизация, стоп-слова, стемминг (Snowball Russian), символьные n-граммы
+и регулярное выражение по словарю (префиксное дерево)
+
+Используется индексами поиска (кэш ответов, FAQ, нормативы), чтобы текст
+нормализовался один раз при построении индекса, а не на каждом запросе.
+"""
+
+import re
+from functools import lru_cache
+from typing import Callable, Iterable, List
+
+# Токены: слова и числа ("b25", "63", "13330")
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+
+STOP_WORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы
+где да даже для до его ее если есть еще же за здесь и из или им их к как ко
+когда кто ли либо мне можно мой мы на над надо наш не него нее нет ни них но
+ну о об однако он она они оно от очень по под при про с со так также такой там
+те тем то того тоже той только том ты у уже хотя чего чей чем что чтобы чье эта
+эти это этот я ли какой какая какие каком
+""".split())
+
+# ========================================
+# SNOWBALL RUSSIAN STEMMER
+# ========================================
+
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND_1 = ("вшись", "вши", "в")
+_PERFECTIVE_GERUND_2 = ("ившись", "ывшись", "ивши", "ывши", "ив", "ыв")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий",
+    "ый", "ой", "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = (
+    "ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют",
+    "ны", "ть", "й", "л", "н"
+)
+_VERB_2 = (
+    "ейте", "уйте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено",
+    "ует", "уют", "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым",
+    "ен", "ят", "ит", "ыт", "ую", "ю"
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи",
+    "ии", "ей", "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия",
+    "ья", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я"
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _by_length(suffixes):
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+_PERFECTIVE_GERUND_1 = _by_length(_PERFECTIVE_GERUND_1)
+_PERFECTIVE_GERUND_2 = _by_length(_PERFECTIVE_GERUND_2)
+_ADJECTIVE = _by_length(_ADJECTIVE)
+_PARTICIPLE_1 = _by_length(_PARTICIPLE_1)
+_PARTICIPLE_2 = _by_length(_PARTICIPLE_2)
+_VERB_1 = _by_length(_VERB_1)
+_VERB_2 = _by_length(_VERB_2)
+_NOUN = _by_length(_NOUN)
+
+
+def _regions(word: str):
+    """Начало областей RV и R2 (индексы в слове)"""
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start: int) -> int:
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def _remove(rv: str, suffixes, preceded_by_a: bool = False):
+    """Удалить первый подходящий суффикс; None если не найден"""
+    for suffix in suffixes:
+        if rv.endswith(suffix):
+            stem = rv[:-len(suffix)]
+            if preceded_by_a and not (stem.endswith("а") or stem.endswith("я")):
+                continue
+            return stem
+    return None
+
+
+def _remove_group(rv: str, group1, group2):
+    """Удалить суффикс из группы 1 (после а/я) или группы 2"""
+    stem = _remove(rv, group1, preceded_by_a=True)
+    if stem is None:
+        stem = _remove(rv, group2)
+    return stem
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """
+    Стемминг русского слова (алгоритм Snowball Russian)
+
+    Args:
+        word: Слово в нижнем регистре
+
+    Returns:
+        Основа слова
+    """
+    word = word.replace("ё", "е")
+    if len(word) < 3 or not any("а" <= ch <= "я" for ch in word):
+        return word
+
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    stem_ = _remove_group(rv, _PERFECTIVE_GERUND_1, _PERFECTIVE_GERUND_2)
+    if stem_ is not None:
+        rv = stem_
+    else:
+        stem_ = _remove(rv, _REFLEXIVE)
+        if stem_ is not None:
+            rv = stem_
+
+        stem_ = _remove(rv, _ADJECTIVE)
+        if stem_ is not None:
+            participle = _remove_group(stem_, _PARTICIPLE_1, _PARTICIPLE_2)
+            rv = participle if participle is not None else stem_
+        else:
+            stem_ = _remove_group(rv, _VERB_1, _VERB_2)
+            if stem_ is None:
+                stem_ = _remove(rv, _NOUN)
+            if stem_ is not None:
+                rv = stem_
+
+    # Шаг 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательный суффикс в R2
+    for suffix in _DERIVATIONAL:
+        if rv.endswith(suffix) and len(prefix) + len(rv) - len(suffix) >= r2_start:
+            rv = rv[:-len(suffix)]
+            break
+
+    # Шаг 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        stem_ = _remove(rv, _SUPERLATIVE)
+        if stem_ is not None:
+            rv = stem_[:-1] if stem_.endswith("нн") else stem_
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+# ========================================
+# ТОКЕНИЗАЦИЯ
+# ========================================
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, ё → е, единичные пробелы"""
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+def tokenize(text: str, drop_stop_words: bool = True) -> List[str]:
+    """Разбить текст на токены (без стемминга)"""
+    tokens = _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+    if drop_stop_words:
+        tokens = [t for t in tokens if t not in STOP_WORDS]
+    return tokens
+
+
+def stem_tokens(text: str, drop_stop_words: bool = True) -> List[str]:
+    """Токены текста, приведённые к основам"""
+    return [stem(t) for t in tokenize(text, drop_stop_words)]
+
+
+def char_ngrams(token: str, n: int = 3) -> List[str]:
+    """Символьные n-граммы слова с маркерами границ (для устойчивости к опечаткам)"""
+    padded = f"#{token}#"
+    if len(padded) <= n:
+        return [padded]
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+# ========================================
+# СЛОВАРЬ → РЕГУЛЯРНОЕ ВЫРАЖЕНИЕ
+# ========================================
+
+def trie_regex(words: Iterable[str], char_regex: Callable[[str], str] = re.escape) -> str:
+    """
+    Словарь → одно регулярное выражение по префиксному дереву
+
+    В каждой позиции находится самое длинное слово словаря (длинные продолжения
+    первыми, при неудаче - короткие). Используется поиском кодов нормативов
+    и ключевых слов выбора модели.
+
+    Args:
+        words: Слова (коды, фразы)
+        char_regex: Выражение для символа (по умолчанию - сам символ)
+    """
+    trie: dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    return _node_regex(trie, char_regex) if trie else "(?!)"
+
+
+def _node_regex(node: dict, char_regex: Callable[[str], str]) -> str:
+    terminal = "" in node
+    branches = [char_regex(ch) + _node_regex(child, char_regex) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # Жадно: сначала длинное слово, при неудаче - короткое
+    return "(?:" + body + ")?" if terminal else body
@@ -0,0 +1,306 @@
+"""
+Поисковый индекс по локальным базам знаний v1.0
+Используется FAQ (faq.py), быстрым ответом без AI и индексом нормативов
+(regulation_index.py - поиск по словам)
+
+- Строится один раз: основы слов (russian_text.stem) по полям документа,
+  веса BM25 считаются при построении - запрос только суммирует их
+- Поля с весами: вопрос и ключевые слова важнее текста ответа
+- Опечатки: неизвестная основа заменяется близкими словами словаря -
+  кандидаты из индекса триграмма → слова, отбор по расстоянию правки
+  (замена, вставка, удаление, перестановка соседних букв)
+- Неизвестная основа сначала расширяется до слов с таким началом ("трещ" → "трещин")
+- coverage: доля веса (IDF) слов запроса, найденных в главных полях документа -
+  по ней решается, достаточно ли уверен ответ без AI
+"""
+
+import time
+import logging
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from math import log
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+from russian_text import char_ngrams, stem_tokens
+
+logger = logging.getLogger(__name__)
+
+# BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Опечатки: минимальная длина основы, число кандидатов по триграммам
+FUZZY_MIN_TERM = 4
+FUZZY_CANDIDATES = 20
+FUZZY_MAX_EXPANSIONS = 3
+
+# Расширение по началу слова
+PREFIX_MIN_TERM = 4
+PREFIX_MAX_EXPANSIONS = 8
+
+# Кэш разбора слов запроса (словарь индекса не меняется после построения)
+EXPANSION_CACHE_SIZE = 4096
+
+
+@dataclass
+class SearchHit:
+    """Найденный документ"""
+
+    key: Any
+    payload: Any
+    score: float
+    coverage: float
+
+
+FieldValue = Union[str, Iterable[str]]
+
+
+class SearchIndex:
+    """Инвертированный индекс с BM25 и исправлением опечаток"""
+
+    def __init__(
+        self,
+        name: str,
+        field_weights: Dict[str, int],
+        head_fields: Iterable[str] = (),
+        fuzzy: bool = True
+    ):
+        """
+        Args:
+            name: Имя индекса (для логов)
+            field_weights: Поле → вес (сколько раз слова поля учитываются в BM25)
+            head_fields: Главные поля для coverage (по умолчанию - все)
+            fuzzy: Исправлять опечатки (без него - только расширение по началу слова)
+        """
+        self.name = name
+        self.field_weights = field_weights
+        self.head_fields = tuple(head_fields) or tuple(field_weights)
+        self.fuzzy = fuzzy
+
+        self._keys: List[Any] = []
+        self._payloads: List[Any] = []
+        self._doc_terms: List[Dict[str, int]] = []
+        self._head_terms: List[FrozenSet[str]] = []
+        self._dirty = True
+
+        # Строится в build()
+        self._postings: Dict[str, List[Tuple[int, float]]] = {}
+        self._idf: Dict[str, float] = {}
+        self._vocabulary: List[str] = []
+        self._trigrams: Dict[str, List[str]] = {}
+        self._expansions: "OrderedDict[str, List[Tuple[str, float]]]" = OrderedDict()
+
+        self.stats = {
+            "searches": 0,
+            "search_time_us": 0.0,
+            "fuzzy_corrections": 0
+        }
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    # ========================================
+    # ПОСТРОЕНИЕ
+    # ========================================
+
+    def add(self, key: Any, fields: Dict[str, FieldValue], payload: Any = None):
+        """
+        Добавить документ
+
+        Args:
+            key: Идентификатор документа
+            fields: Поле → текст или список строк (ключевые слова)
+            payload: Что вернуть в результатах поиска
+        """
+        freqs: Dict[str, int] = defaultdict(int)
+        head = set()
+        for field_name, value in fields.items():
+            weight = self.field_weights.get(field_name, 0)
+            if not weight or not value:
+                continue
+            text = value if isinstance(value, str) else " ".join(value)
+            terms = stem_tokens(text)
+            for term in terms:
+                freqs[term] += weight
+            if field_name in self.head_fields:
+                head.update(terms)
+
+        self._keys.append(key)
+        self._payloads.append(payload)
+        self._doc_terms.append(dict(freqs))
+        self._head_terms.append(frozenset(head))
+        self._dirty = True
+
+    def build(self):
+        """Посчитать веса BM25, словарь и триграммы"""
+        started = time.perf_counter()
+        n_docs = len(self._doc_terms)
+        lengths = [sum(freqs.values()) for freqs in self._doc_terms]
+        avg_length = (sum(lengths) / n_docs) if n_docs else 1.0
+
+        doc_freq: Dict[str, int] = defaultdict(int)
+        for freqs in self._doc_terms:
+            for term in freqs:
+                doc_freq[term] += 1
+        self._idf = {term: log(1 + (n_docs - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+        postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        for doc, freqs in enumerate(self._doc_terms):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc] / avg_length)
+            for term, tf in freqs.items():
+                postings[term].append((doc, self._idf[term] * tf * (BM25_K1 + 1) / (tf + norm)))
+        self._postings = dict(postings)
+        self._vocabulary = sorted(self._postings)
+
+        trigrams: Dict[str, List[str]] = defaultdict(list)
+        for term in self._vocabulary if self.fuzzy else ():
+            if len(term) >= FUZZY_MIN_TERM:
+                for gram in set(char_ngrams(term)):
+                    trigrams[gram].append(term)
+        self._trigrams = dict(trigrams)
+        self._expansions.clear()
+        self._dirty = False
+
+        logger.info(
+            f"✅ Индекс {self.name}: {n_docs} документов, {len(self._vocabulary)} слов "
+            f"({(time.perf_counter() - started) * 1000:.1f} мс)"
+        )
+
+    # ========================================
+    # СЛОВА ЗАПРОСА
+    # ========================================
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        """
+        Слова словаря для основы запроса
+
+        Returns:
+            [(слово, множитель)]: само слово, слова с таким началом или
+            близкие по триграммам (с множителем-сходством)
+        """
+        if term in self._postings:
+            return [(term, 1.0)]
+
+        cached = self._expansions.get(term)
+        if cached is not None:
+            self._expansions.move_to_end(term)
+            return cached
+
+        expansions: List[Tuple[str, float]] = []
+        if len(term) >= PREFIX_MIN_TERM:
+            position = bisect_left(self._vocabulary, term)
+            while (position < len(self._vocabulary) and len(expansions) < PREFIX_MAX_EXPANSIONS
+                   and self._vocabulary[position].startswith(term)):
+                expansions.append((self._vocabulary[position], 1.0))
+                position += 1
+
+        if self.fuzzy and not expansions and len(term) >= FUZZY_MIN_TERM:
+            # Кандидаты - по общим триграммам, проверка - расстоянием правки
+            shared: Dict[str, int] = defaultdict(int)
+            for gram in set(char_ngrams(term)):
+                for candidate in self._trigrams.get(gram, ()):
+                    shared[candidate] += 1
+            candidates = sorted(shared.items(), key=lambda item: (-item[1], item[0]))[:FUZZY_CANDIDATES]
+            max_distance = 1 if len(term) <= 5 else 2
+            scored = []
+            for candidate, _ in candidates:
+                distance = _edit_distance(term, candidate, max_distance)
+                if distance <= max_distance:
+                    scored.append((candidate, 1.0 - distance / (max(len(term), len(candidate)) + 1)))
+            scored.sort(key=lambda item: (-item[1], item[0]))
+            expansions = scored[:FUZZY_MAX_EXPANSIONS]
+
+        self._expansions[term] = expansions
+        if len(self._expansions) > EXPANSION_CACHE_SIZE:
+            self._expansions.popitem(last=False)
+        return expansions
+
+    # ========================================
+    # ПОИСК
+    # ========================================
+
+    def search(self, query: str, limit: Optional[int] = 10, min_score: float = 0.0) -> List[SearchHit]:
+        """
+        Ранжированный поиск
+
+        Args:
+            query: Текст запроса
+            limit: Максимум результатов (None - все)
+            min_score: Минимальная оценка BM25
+
+        Returns:
+            Список SearchHit по убыванию оценки
+        """
+        if self._dirty:
+            self.build()
+        started = time.perf_counter()
+
+        scores: Dict[int, float] = {}
+        # Слово запроса → [(слово словаря, множитель)] и его вес IDF для coverage
+        query_terms: List[Tuple[List[Tuple[str, float]], float]] = []
+        for term in dict.fromkeys(stem_tokens(query)):
+            expansions = self._expand(term)
+            if expansions and expansions[0][0] != term and expansions[0][1] < 1.0:
+                self.stats["fuzzy_corrections"] += 1
+            # Неизвестное слово без замен тоже снижает coverage
+            idf = max((self._idf[t] for t, _ in expansions), default=log(1 + len(self._keys) + 0.5))
+            query_terms.append((expansions, idf))
+
+            best: Dict[int, float] = {}
+            for vocab_term, factor in expansions:
+                for doc, weight in self._postings[vocab_term]:
+                    weight *= factor
+                    if weight > best.get(doc, 0.0):
+                        best[doc] = weight
+            for doc, weight in best.items():
+                scores[doc] = scores.get(doc, 0.0) + weight
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        total_idf = sum(idf for _, idf in query_terms) or 1.0
+        hits = []
+        for doc, score in ranked:
+            if score < min_score:
+                break
+            head = self._head_terms[doc]
+            matched = sum(
+                idf * max((factor for t, factor in expansions if t in head), default=0.0)
+                for expansions, idf in query_terms
+            )
+            hits.append(SearchHit(self._keys[doc], self._payloads[doc], score, matched / total_idf))
+            if limit is not None and len(hits) >= limit:
+                break
+
+        self.stats["searches"] += 1
+        self.stats["search_time_us"] += (time.perf_counter() - started) * 1e6
+        return hits
+
+    def get_stats(self) -> dict:
+        """Статистика индекса"""
+        searches = self.stats["searches"]
+        return {
+            "documents": len(self._keys),
+            "terms": len(self._vocabulary),
+            "searches": searches,
+            "search_avg_us": round(self.stats["search_time_us"] / searches, 1) if searches else 0.0,
+            "fuzzy_corrections": self.stats["fuzzy_corrections"]
+        }
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Расстояние Дамерау-Левенштейна (с перестановкой соседних букв); > limit - сразу limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
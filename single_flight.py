@@ -0,0 +1,193 @@
+"""
+Single-flight для одинаковых одновременных AI запросов v1.0
+
+Когда популярный вопрос (новый ГОСТ, бетонирование в мороз) приходит от многих
+пользователей одновременно, к провайдеру уходит ОДИН запрос, а остальные
+ждут его результат:
+
+- Ключ - generate_cache_key(вопрос, контекст роли + отпечаток промпта), поэтому
+  объединяются только запросы с одинаковыми сообщениями и параметрами
+- Обычный режим: все ожидающие получают один и тот же ответ (или ошибку)
+- Streaming: подписчики получают те же чанки; опоздавшие сначала получают
+  уже пришедшие чанки, затем новые
+- Отмена одного ожидающего (новое сообщение пользователя) не отменяет общий
+  запрос; он отменяется, только когда ждать его больше некому
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from cache_manager import generate_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+def make_flight_key(question: str, role: Optional[str], messages: List[Dict[str, Any]], **params) -> str:
+    """
+    Ключ single-flight для AI запроса
+
+    Args:
+        question: Вопрос пользователя
+        role: Роль пользователя (контекст)
+        messages: Полный список сообщений запроса (system + история + вопрос)
+        **params: Параметры генерации (model, max_tokens, ...)
+
+    Returns:
+        Ключ generate_cache_key(question, "<роль>:<отпечаток промпта>")
+    """
+    fingerprint = hashlib.md5(
+        json.dumps([messages, params], ensure_ascii=False, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return generate_cache_key(question, f"{role or 'universal'}:{fingerprint}")
+
+
+class _Flight:
+    """Один общий запрос и его подписчики"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        # Для streaming
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов по ключу"""
+
+    def __init__(self, name: str = "llm"):
+        self.name = name
+        self._calls: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Flight] = {}
+        self.stats = {
+            "leaders": 0,
+            "followers": 0,
+            "stream_leaders": 0,
+            "stream_followers": 0,
+            "abandoned": 0
+        }
+
+    # ========================================
+    # ОБЫЧНЫЙ РЕЖИМ
+    # ========================================
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить запрос или присоединиться к уже выполняющемуся
+
+        Args:
+            key: Ключ (make_flight_key)
+            factory: Функция, создающая корутину запроса (вызывается только у лидера)
+
+        Returns:
+            Результат общего запроса
+        """
+        flight = self._calls.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(factory())
+            flight.task.add_done_callback(lambda _: self._forget(self._calls, key, flight))
+            self._calls[key] = flight
+            self.stats["leaders"] += 1
+        else:
+            self.stats["followers"] += 1
+            logger.info(f"🔗 Single-flight: присоединились к запросу {key[:12]}... (ждут: {flight.waiters + 1})")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            self._abandon_if_unused(flight)
+
+    # ========================================
+    # STREAMING
+    # ========================================
+
+    async def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Подписаться на общий streaming запрос
+
+        Args:
+            key: Ключ (make_flight_key)
+            factory: Функция, создающая async-генератор чанков (вызывается только у лидера)
+
+        Yields:
+            Те же чанки, что получает лидер, с самого начала ответа
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(self._pump(flight, factory))
+            flight.task.add_done_callback(lambda _: self._forget(self._streams, key, flight))
+            self._streams[key] = flight
+            self.stats["stream_leaders"] += 1
+        else:
+            self.stats["stream_followers"] += 1
+            logger.info(f"🔗 Single-flight: подписка на поток {key[:12]}... ({len(flight.chunks)} чанков уже готово)")
+
+        flight.waiters += 1
+        position = 0
+        try:
+            while True:
+                if position < len(flight.chunks):
+                    chunk = flight.chunks[position]
+                    position += 1
+                    yield chunk
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                flight.changed.clear()
+                await flight.changed.wait()
+        finally:
+            flight.waiters -= 1
+            self._abandon_if_unused(flight)
+
+    async def _pump(self, flight: _Flight, factory: Callable[[], AsyncIterator[str]]):
+        """Читать поток провайдера и раздавать чанки подписчикам"""
+        try:
+            async for chunk in factory():
+                flight.chunks.append(chunk)
+                flight.changed.set()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.changed.set()
+
+    # ========================================
+    # СЛУЖЕБНОЕ
+    # ========================================
+
+    def _forget(self, registry: Dict[str, _Flight], key: str, flight: _Flight):
+        """Убрать завершённый запрос: следующий такой же вопрос пойдёт к провайдеру"""
+        if registry.get(key) is flight:
+            del registry[key]
+
+    def _abandon_if_unused(self, flight: _Flight):
+        """Отменить общий запрос, если его больше никто не ждёт"""
+        if flight.waiters == 0 and flight.task is not None and not flight.task.done():
+            flight.task.cancel()
+            self.stats["abandoned"] += 1
+
+    def get_stats(self) -> dict:
+        """Статистика объединения запросов"""
+        return {
+            **self.stats,
+            "in_flight": len(self._calls),
+            "streams_in_flight": len(self._streams)
+        }
+
+
+# Общий single-flight для ответов на вопросы
+LLM_SINGLE_FLIGHT = SingleFlight("llm")
@@ -25,13 +25,13 @@ async def smart_model_selection_text(
         Dict с результатом или None (если нужно использовать Grok)
     """
     try:
-        from model_selector import ModelSelector
+        from model_selector import get_model_selector
         from optimized_handlers import handle_with_claude_technical, handle_with_gemini_image, handle_with_grok
         from optimized_prompts import CLAUDE_SYSTEM_PROMPT_TECHNICAL, GEMINI_IMAGE_PROMPT_SYSTEM, GROK_SYSTEM_PROMPT_GENERAL
         from history_manager import get_user_history, add_message_to_history_async
+        from context_builder import CONTEXT_BUILDER, CONTEXT_HISTORY_LIMIT
 
-        selector = ModelSelector()
-        decision = selector.classify_request(question, has_photo=False)
+        decision = get_model_selector().classify_request(question, has_photo=False)
 
         logger.info(f"🤖 Умный выбор: {decision['model']}")
         logger.info(f"💡 {decision['reason']}")
@@ -40,13 +40,19 @@ async def smart_model_selection_text(
         # CLAUDE - технические вопросы
         if decision["model"] == "claude_technical":
             try:
-                conversation_history = await get_user_history(user_id, limit=10)
+                history = await get_user_history(user_id, limit=CONTEXT_HISTORY_LIMIT)
+                context_result = CONTEXT_BUILDER.build(
+                    history,
+                    system_prompts=[CLAUDE_SYSTEM_PROMPT_TECHNICAL],
+                    model="claude-sonnet-4-5-20250929",
+                    question=question
+                )
 
                 answer = await handle_with_claude_technical(
                     question=question,
                     user_id=user_id,
-                    conversation_history=conversation_history,
-                    system_prompt=CLAUDE_SYSTEM_PROMPT_TECHNICAL
+                    conversation_history=context_result.history,
+                    system_prompt=context_result.system
                 )
 
                 # Удаляем thinking message
@@ -125,13 +131,19 @@ async def smart_model_selection_text(
         # GROK - простые вопросы и web search
         elif decision["model"] == "grok_general":
             try:
-                conversation_history = await get_user_history(user_id, limit=10)
+                history = await get_user_history(user_id, limit=CONTEXT_HISTORY_LIMIT)
+                context_result = CONTEXT_BUILDER.build(
+                    history,
+                    system_prompts=[GROK_SYSTEM_PROMPT_GENERAL],
+                    model="grok-2-latest",
+                    question=question
+                )
 
                 answer = await handle_with_grok(
                     question=question,
                     user_id=user_id,
-                    conversation_history=conversation_history,
-                    system_prompt=GROK_SYSTEM_PROMPT_GENERAL,
+                    conversation_history=context_result.history,
+                    system_prompt=context_result.system,
                     needs_web_search=decision.get("needs_web_search", False)
                 )
 
@@ -172,21 +184,23 @@ async def smart_model_selection_photo(
     question: str,
     photo_file_id: str,
     update,
-    context
+    context,
+    photo_unique_id: Optional[str] = None
 ) -> Optional[Dict]:
     """
     Умный выбор модели для фото
 
+    photo_unique_id - file_unique_id фото (ключ кэша photo_pipeline)
+
     Returns:
         Dict с результатом или None (если нужно использовать Grok)
     """
     try:
-        from model_selector import ModelSelector
+        from model_selector import get_model_selector
         from optimized_handlers import handle_with_gemini_vision
         from optimized_prompts import GEMINI_VISION_PROMPT_DEFECTS
 
-        selector = ModelSelector()
-        decision = selector.classify_request(question, has_photo=True)
+        decision = get_model_selector().classify_request(question, has_photo=True)
 
         logger.info(f"📸 Умный выбор для фото: {decision['model']}")
 
@@ -197,7 +211,8 @@ async def smart_model_selection_photo(
                     question=question,
                     photo_file_id=photo_file_id,
                     bot=context.bot,
-                    system_prompt=GEMINI_VISION_PROMPT_DEFECTS
+                    system_prompt=GEMINI_VISION_PROMPT_DEFECTS,
+                    photo_unique_id=photo_unique_id
                 )
 
                 await update.message.reply_text(
@@ -0,0 +1,336 @@
+"""
+Ограниченное состояние пользователей в памяти v1.0
+Словари вида "user_id -> данные" больше не растут с числом пользователей
+
+- BoundedState: словарь с LRU-вытеснением (не больше max_entries записей)
+  и удалением записей, к которым не обращались дольше idle_ttl секунд.
+  Отсутствующий ключ загружается через loader (например, история с диска)
+  или создаётся default_factory (как defaultdict). При вытеснении
+  вызывается on_evict - данные можно сбросить на диск (при фоновой очистке
+  on_evict выполняется в потоке: запись на диск не останавливает event loop)
+- StateRegistry: реестр структур в памяти - число записей и приблизительный
+  объём в байтах по каждой, общий фоновый sweeper, который раз в
+  STATE_SWEEP_INTERVAL секунд вызывает очистку всех зарегистрированных структур
+- Отчёт для команды администратора (/memory) - STATE_REGISTRY.report()
+"""
+
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Сколько пользователей держать в памяти в каждой структуре
+STATE_MAX_USERS = int(os.getenv("STATE_MAX_USERS", "5000"))
+
+# Через сколько минут без обращений данные пользователя выгружаются из памяти
+STATE_IDLE_TTL_MINUTES = float(os.getenv("STATE_IDLE_TTL_MINUTES", "60"))
+
+# Период фоновой очистки (секунды)
+STATE_SWEEP_INTERVAL = float(os.getenv("STATE_SWEEP_INTERVAL", "60"))
+
+# Подсчёт объёма: глубина обхода и число записей, по которым оценивается большая структура
+SIZE_MAX_DEPTH = 8
+SIZE_SAMPLE_ENTRIES = 200
+
+_MISSING = object()
+
+
+# ========================================
+# ОБЪЁМ В ПАМЯТИ
+# ========================================
+
+def approx_size(obj: Any, max_depth: int = SIZE_MAX_DEPTH) -> int:
+    """Приблизительный объём объекта в байтах (sys.getsizeof с обходом вложенных)"""
+    seen = set()
+    total = 0
+    stack = [(obj, 0)]
+    while stack:
+        item, depth = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        try:
+            total += sys.getsizeof(item)
+        except TypeError:
+            continue
+        if depth >= max_depth or isinstance(item, (str, bytes, bytearray, int, float, bool)):
+            continue
+
+        if isinstance(item, dict):
+            for key, value in item.items():
+                stack.append((key, depth + 1))
+                stack.append((value, depth + 1))
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend((child, depth + 1) for child in item)
+        elif hasattr(item, "__dict__") and not isinstance(item, type):
+            stack.append((vars(item), depth + 1))
+    return total
+
+
+def container_size(container: Any, sample: int = SIZE_SAMPLE_ENTRIES) -> int:
+    """
+    Объём словаря/списка: маленькие считаются целиком, большие - по выборке
+    записей с экстраполяцией на всю структуру
+    """
+    if isinstance(container, MutableMapping) and not isinstance(container, dict):
+        container = dict(container.items())
+    if not isinstance(container, (dict, list, tuple, set)) or len(container) <= sample:
+        return approx_size(container)
+
+    items = list(container.items()) if isinstance(container, dict) else list(container)
+    step = len(items) / sample
+    sampled = [items[int(i * step)] for i in range(sample)]
+    per_entry = sum(approx_size(item) for item in sampled) / sample
+    return sys.getsizeof(container) + int(per_entry * len(items))
+
+
+# ========================================
+# ОГРАНИЧЕННЫЙ СЛОВАРЬ
+# ========================================
+
+class BoundedState(MutableMapping):
+    """Словарь user_id -> данные с LRU-вытеснением и удалением по простою"""
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = STATE_MAX_USERS,
+        idle_ttl: Optional[float] = STATE_IDLE_TTL_MINUTES * 60,
+        default_factory: Optional[Callable[[], Any]] = None,
+        loader: Optional[Callable[[Hashable], Any]] = None,
+        on_evict: Optional[Callable[[Hashable, Any], Any]] = None
+    ):
+        """
+        Args:
+            name: Имя структуры (для логов и отчёта)
+            max_entries: Максимум записей в памяти
+            idle_ttl: Удалять записи без обращений дольше idle_ttl секунд (None - не удалять)
+            default_factory: Значение для отсутствующего ключа (как у defaultdict)
+            loader: Загрузка отсутствующего ключа (приоритетнее default_factory)
+            on_evict: Вызывается с (ключ, значение) при вытеснении и удалении по простою
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.default_factory = default_factory
+        self.loader = loader
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._touched: Dict[Hashable, float] = {}
+
+        self.stats = {"hits": 0, "loads": 0, "evicted_lru": 0, "evicted_idle": 0}
+
+    def _touch(self, key: Hashable):
+        self._data.move_to_end(key)
+        self._touched[key] = time.monotonic()
+
+    def _evict(self, key: Hashable):
+        value = self._data.pop(key)
+        self._touched.pop(key, None)
+        if self.on_evict is not None:
+            self._notify_evicted([(key, value)])
+
+    def _notify_evicted(self, items: List[tuple]):
+        """on_evict для удалённых записей"""
+        for key, value in items:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.error(f"❌ {self.name}: ошибка выгрузки {key}: {e}")
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self._data.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats["hits"] += 1
+            self._touch(key)
+            return value
+
+        if self.loader is not None:
+            value = self.loader(key)
+        elif self.default_factory is not None:
+            value = self.default_factory()
+        else:
+            raise KeyError(key)
+        self.stats["loads"] += 1
+        self[key] = value
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._touch(key)
+        while len(self._data) > self.max_entries:
+            self._evict(next(iter(self._data)))
+            self.stats["evicted_lru"] += 1
+
+    def __delitem__(self, key: Hashable):
+        del self._data[key]
+        self._touched.pop(key, None)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение без загрузки и создания (не продлевает жизнь записи)"""
+        return self._data.get(key, default)
+
+    def _idle_keys(self, now: Optional[float]) -> List[Hashable]:
+        """Ключи без обращений дольше idle_ttl"""
+        if self.idle_ttl is None:
+            return []
+        cutoff = (now if now is not None else time.monotonic()) - self.idle_ttl
+        # Записи упорядочены по последнему обращению - старые в начале
+        idle = []
+        for key in self._data:
+            if self._touched.get(key, 0.0) > cutoff:
+                break
+            idle.append(key)
+        return idle
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Удалить записи без обращений дольше idle_ttl"""
+        idle = self._idle_keys(now)
+        for key in idle:
+            self._evict(key)
+        self.stats["evicted_idle"] += len(idle)
+        return len(idle)
+
+    async def sweep_async(self, now: Optional[float] = None) -> int:
+        """
+        sweep для фоновой очистки: записи удаляются из памяти сразу,
+        on_evict (например, запись истории на диск) выполняется в потоке
+        """
+        items = []
+        for key in self._idle_keys(now):
+            items.append((key, self._data.pop(key)))
+            self._touched.pop(key, None)
+        self.stats["evicted_idle"] += len(items)
+        if items and self.on_evict is not None:
+            await asyncio.to_thread(self._notify_evicted, items)
+        return len(items)
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "entries": len(self._data), "max_entries": self.max_entries}
+
+
+# ========================================
+# РЕЕСТР И ФОНОВАЯ ОЧИСТКА
+# ========================================
+
+class StateRegistry:
+    """Учёт памяти по структурам и общий фоновый sweeper"""
+
+    def __init__(self, interval: float = STATE_SWEEP_INTERVAL):
+        self.interval = interval
+        self._sources: Dict[str, Callable[[], Any]] = {}
+        self._sweepers: Dict[str, Callable[[], Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"sweeps": 0, "evicted": 0, "last_sweep_ms": 0.0}
+
+    def register(
+        self,
+        name: str,
+        source: Any,
+        sweep: Optional[Callable[[], Any]] = None
+    ):
+        """
+        Зарегистрировать структуру
+
+        Args:
+            name: Имя в отчёте
+            source: Структура или функция без аргументов, возвращающая её
+                (для объектов, создаваемых позже, например голосового ассистента)
+            sweep: Очистка (синхронная или async), возвращает число удалённых записей.
+                Для BoundedState по умолчанию - её sweep_async
+        """
+        self._sources[name] = source if callable(source) else (lambda: source)
+        if sweep is None and isinstance(source, BoundedState):
+            sweep = source.sweep_async
+        if sweep is not None:
+            self._sweepers[name] = sweep
+
+    async def sweep(self) -> int:
+        """Один проход очистки всех структур"""
+        started = time.perf_counter()
+        evicted = 0
+        for name, sweeper in list(self._sweepers.items()):
+            try:
+                result = sweeper()
+                if inspect.isawaitable(result):
+                    result = await result
+                evicted += int(result or 0)
+            except Exception as e:
+                logger.error(f"❌ Очистка {name}: {e}")
+
+        self.stats["sweeps"] += 1
+        self.stats["evicted"] += evicted
+        self.stats["last_sweep_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if evicted:
+            logger.info(f"🗑️ Выгружено из памяти записей без обращений: {evicted}")
+        return evicted
+
+    def report(self) -> List[dict]:
+        """Число записей и приблизительный объём каждой структуры"""
+        rows = []
+        for name, source in self._sources.items():
+            try:
+                container = source()
+            except Exception as e:
+                logger.warning(f"⚠️ Отчёт памяти {name}: {e}")
+                continue
+            if container is None:
+                continue
+            entries = len(container) if hasattr(container, "__len__") else None
+            rows.append({"name": name, "entries": entries, "bytes": container_size(container)})
+        return rows
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sweep()
+
+    def start(self):
+        """Запустить фоновую очистку (вызывать из работающего event loop)"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._sweep_loop())
+            logger.info(f"✅ Очистка состояния в памяти запущена (каждые {self.interval:g}с)")
+
+    async def stop(self):
+        task = self._task
+        self._task = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "structures": len(self._sources), "running": self._task is not None}
+
+
+def format_bytes(size: int) -> str:
+    """Размер для человека: Б, КБ, МБ"""
+    if size < 1024:
+        return f"{size} Б"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} КБ"
+    return f"{size / (1024 * 1024):.1f} МБ"
+
+
+# Общий реестр бота
+STATE_REGISTRY = StateRegistry()
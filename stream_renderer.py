@@ -0,0 +1,552 @@
+"""
+Потоковый вывод ответа в Telegram v1.0
+Постепенное появление ответа правками одного сообщения без флуда
+
+- Правки ограничены токен-бакетами на чат (личный чат ~1 правка/с, группа
+  ~20 в минуту) и общим бакетом бота (~30 запросов/с)
+- Адаптивный темп: чем длиннее сообщение, тем реже правки (каждая правка
+  пересылает весь текст); после RetryAfter от Telegram чат блокируется на
+  указанное время, а темп замедляется и постепенно восстанавливается
+- Сообщение не длиннее 4096 символов: при переполнении текущее сообщение
+  завершается на границе абзаца/строки/предложения и ответ продолжается в
+  новом; отправленные части больше не пересылаются
+- Границы частей безопасны для Markdown: незакрытые ```, ** и ` закрываются
+  в конце части и открываются заново в следующей
+- Метрики: время до первого токена и первой правки, правки и сообщения на ответ,
+  пропущенные из-за лимита правки, ожидания RetryAfter
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Правок в секунду на личный чат и на группу (Telegram: ~1/с и 20/мин)
+STREAM_EDIT_RATE = float(os.getenv("STREAM_EDIT_RATE", "1.0"))
+STREAM_GROUP_EDIT_RATE = float(os.getenv("STREAM_GROUP_EDIT_RATE", str(20 / 60)))
+STREAM_EDIT_BURST = int(os.getenv("STREAM_EDIT_BURST", "3"))
+
+# Общий лимит бота (Telegram: ~30 сообщений/с)
+STREAM_GLOBAL_RATE = float(os.getenv("STREAM_GLOBAL_RATE", "30"))
+
+# Новых символов, ради которых стоит править сообщение
+STREAM_MIN_EDIT_CHARS = 40
+
+# Максимальное замедление темпа после RetryAfter
+MAX_SLOWDOWN = 8.0
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_PLACEHOLDER = "⏳ Генерирую ответ..."
+STREAM_CURSOR = "▊"
+
+# Сообщение для клавиатуры подсказок: ReplyKeyboardMarkup нельзя добавить правкой
+REPLY_KEYBOARD_NOTE = "💡 Похожие вопросы - на клавиатуре ниже"
+
+# Чатов с бакетами в памяти (давно неактивные вытесняются)
+MAX_TRACKED_CHATS = 10000
+
+# Попыток отправить обязательную правку (конец части, финал) при RetryAfter
+FORCED_ATTEMPTS = 3
+
+
+# ========================================
+# ЛИМИТЫ TELEGRAM
+# ========================================
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Секунд до появления токена"""
+        now = self.clock()
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def try_acquire(self) -> bool:
+        """Взять токен, если он есть"""
+        if self.wait_time() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def block(self, seconds: float):
+        """Запретить запросы на seconds (RetryAfter) и обнулить накопленные токены"""
+        now = self.clock()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = now
+
+
+class EditRateLimiter:
+    """Бакеты правок по чатам и общий бакет бота"""
+
+    def __init__(
+        self,
+        private_rate: float = STREAM_EDIT_RATE,
+        group_rate: float = STREAM_GROUP_EDIT_RATE,
+        burst: int = STREAM_EDIT_BURST,
+        global_rate: float = STREAM_GLOBAL_RATE,
+        clock=time.monotonic
+    ):
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+
+    def bucket(self, chat_id: int) -> TokenBucket:
+        """Бакет чата (у групп отрицательный id и лимит строже)"""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.private_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.burst, self.clock)
+            if len(self._chats) > MAX_TRACKED_CHATS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def wait_time(self, chat_id: int) -> float:
+        return max(self.bucket(chat_id).wait_time(), self.global_bucket.wait_time())
+
+    def try_acquire(self, chat_id: int) -> bool:
+        """Токен и чата, и бота (или ни одного)"""
+        if self.wait_time(chat_id) > 0:
+            return False
+        self.bucket(chat_id).tokens -= 1
+        self.global_bucket.tokens -= 1
+        return True
+
+    async def acquire(self, chat_id: int):
+        """Дождаться токена (для обязательных запросов)"""
+        while not self.try_acquire(chat_id):
+            await asyncio.sleep(self.wait_time(chat_id))
+
+    def penalize(self, chat_id: int, retry_after: float):
+        """Telegram ответил RetryAfter - чат молчит указанное время"""
+        self.bucket(chat_id).block(retry_after)
+
+
+_limiter: Optional[EditRateLimiter] = None
+
+
+def get_edit_limiter() -> EditRateLimiter:
+    """Общие лимиты правок для всех ответов бота"""
+    global _limiter
+    if _limiter is None:
+        _limiter = EditRateLimiter()
+    return _limiter
+
+
+# ========================================
+# ГРАНИЦЫ ЧАСТЕЙ И MARKDOWN
+# ========================================
+
+def _open_markers(text: str) -> List[str]:
+    """Незакрытые в тексте маркеры Markdown: ```, ** и ` (по порядку открытия)"""
+    opened: List[str] = []
+    segments = text.split("```")
+    for index, segment in enumerate(segments):
+        if index % 2:
+            continue  # внутри блока кода разметки нет
+        for marker in ("**", "`"):
+            count = segment.count(marker) if marker == "**" else segment.replace("**", "").count("`")
+            if count % 2:
+                opened.append(marker)
+    if len(segments) % 2 == 0:
+        opened.append("```")
+    return opened
+
+
+def close_markdown(text: str) -> str:
+    """Закрыть незакрытые маркеры (промежуточный кадр с parse_mode)"""
+    closing = "".join(("\n```" if marker == "```" else marker) for marker in reversed(_open_markers(text)))
+    return text + closing
+
+
+def markdown_cut(text: str, limit: int, markdown: bool = True) -> Tuple[str, str, int]:
+    """
+    Разрезать текст, не превышающий limit в первой части
+
+    Args:
+        markdown: Закрывать и заново открывать маркеры разметки (без parse_mode -
+            только разрез по разделителю, иначе в тексте появятся лишние "**")
+
+    Returns:
+        (первая часть с закрытыми маркерами, открывающие маркеры для продолжения,
+         позиция в text, с которой начинается продолжение)
+    """
+    # Запас под закрывающие маркеры
+    window = text[:limit - 8]
+    cut = len(window)
+    for separator in ("\n\n", "\n", ". ", " "):
+        position = window.rfind(separator, len(window) // 2)
+        if position > 0:
+            cut = position + len(separator)
+            break
+
+    head = text[:cut].rstrip()
+    reopen = ""
+    if markdown:
+        opened = _open_markers(head)
+        head = close_markdown(head)
+        reopen = "".join(("```\n" if marker == "```" else marker) for marker in opened)
+
+    while cut < len(text) and text[cut] in " \n":
+        cut += 1
+    return head, reopen, cut
+
+
+# ========================================
+# МЕТРИКИ
+# ========================================
+
+@dataclass
+class StreamStats:
+    """Метрики одного ответа"""
+
+    ttft_ms: Optional[float] = None
+    first_edit_ms: Optional[float] = None
+    edits: int = 0
+    throttled: int = 0
+    flood_waits: int = 0
+    messages: int = 0
+    chars: int = 0
+    duration_ms: float = 0.0
+
+
+class StreamMetrics:
+    """Сводные метрики потоковых ответов"""
+
+    def __init__(self):
+        self.answers = 0
+        self.totals = {"edits": 0, "throttled": 0, "flood_waits": 0, "messages": 0}
+        self._ttft: List[float] = []
+        self._first_edit: List[float] = []
+
+    def record(self, stats: StreamStats):
+        self.answers += 1
+        for key in self.totals:
+            self.totals[key] += getattr(stats, key)
+        if stats.ttft_ms is not None:
+            self._ttft.append(stats.ttft_ms)
+        if stats.first_edit_ms is not None:
+            self._first_edit.append(stats.first_edit_ms)
+        # Для перцентилей достаточно последних ответов
+        del self._ttft[:-1000], self._first_edit[:-1000]
+
+    @staticmethod
+    def _percentile(values: List[float], share: float) -> float:
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * share))], 1)
+
+    def get_stats(self) -> dict:
+        answers = self.answers
+        return {
+            "answers": answers,
+            **self.totals,
+            "edits_per_answer": round(self.totals["edits"] / answers, 2) if answers else 0.0,
+            "messages_per_answer": round(self.totals["messages"] / answers, 2) if answers else 0.0,
+            "ttft_p50_ms": self._percentile(self._ttft, 0.5),
+            "ttft_p95_ms": self._percentile(self._ttft, 0.95),
+            "first_edit_p50_ms": self._percentile(self._first_edit, 0.5)
+        }
+
+
+STREAM_METRICS = StreamMetrics()
+
+
+# ========================================
+# РЕНДЕРЕР
+# ========================================
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Секунды из telegram.error.RetryAfter (int или timedelta в новых версиях)"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        return None
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class StreamRenderer:
+    """
+    Вывод ответа по мере генерации
+
+    Использование:
+        renderer = StreamRenderer(update.message)
+        await renderer.start()
+        async for chunk in stream:
+            await renderer.feed(chunk)
+        await renderer.finish()
+        await renderer.attach_markup(reply_markup)
+    """
+
+    def __init__(
+        self,
+        reply_to,
+        chat_id: Optional[int] = None,
+        limiter: Optional[EditRateLimiter] = None,
+        parse_mode: Optional[str] = None,
+        placeholder: str = STREAM_PLACEHOLDER,
+        cursor: str = STREAM_CURSOR,
+        limit: int = TELEGRAM_MESSAGE_LIMIT,
+        metrics: Optional[StreamMetrics] = STREAM_METRICS,
+        clock=time.monotonic
+    ):
+        self.reply_to = reply_to
+        self.chat_id = chat_id if chat_id is not None else getattr(reply_to, "chat_id", 0)
+        self.limiter = limiter or get_edit_limiter()
+        self.parse_mode = parse_mode
+        self.placeholder = placeholder
+        self.cursor = cursor
+        self.limit = limit
+        self.metrics = metrics
+        self.clock = clock
+
+        self.text = ""
+        self.messages: list = []
+        self.stats = StreamStats()
+
+        self._offset = 0        # начало текста текущего сообщения в self.text
+        self._prefix = ""       # маркеры, открытые заново в текущем сообщении
+        self._shown = ""        # текст, который сейчас в текущем сообщении
+        self._shown_chars = 0   # сколько символов ответа уже видно
+        self._last_edit = 0.0
+        self._slowdown = 1.0
+        self._started_at = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+        self._finished = False
+
+    def _elapsed_ms(self) -> float:
+        return round((self.clock() - self._started_at) * 1000, 1)
+
+    def _display(self) -> str:
+        """Текст текущего сообщения (без курсора)"""
+        return self._prefix + self.text[self._offset:]
+
+    def _frame(self, text: str) -> str:
+        """Промежуточный кадр: закрытая разметка и курсор"""
+        if self.parse_mode:
+            text = close_markdown(text)
+        return text + self.cursor
+
+    async def start(self, message=None):
+        """Отправить сообщение-заглушку (или продолжить в уже отправленном message)"""
+        self._started_at = self.clock()
+        if message is None:
+            await self.limiter.acquire(self.chat_id)
+            message = await self.reply_to.reply_text(self.placeholder)
+            self._shown = self.placeholder
+        else:
+            self._shown = getattr(message, "text", "") or ""
+        self.messages.append(message)
+        self.stats.messages = 1
+        self._last_edit = self.clock()
+
+    async def feed(self, chunk: str):
+        """Добавить часть ответа; правка отправляется, если пришло время"""
+        if not chunk:
+            return
+        if self.stats.ttft_ms is None:
+            self.stats.ttft_ms = self._elapsed_ms()
+        self.text += chunk
+        self.stats.chars = len(self.text)
+
+        # Запас под курсор и закрывающую разметку кадра
+        while len(self._display()) > self.limit - 16:
+            await self._rollover()
+
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+        if not self._edit_due():
+            return
+        if not self.limiter.try_acquire(self.chat_id):
+            self.stats.throttled += 1
+            return
+        self._edit_task = asyncio.ensure_future(self._edit(self._frame(self._display()), len(self.text)))
+
+    def _edit_due(self) -> bool:
+        """Пора ли править: первый текст - сразу, дальше - по адаптивному интервалу"""
+        visible = len(self.text) - self._shown_chars
+        if self.stats.edits == 0:
+            return bool(self.text.strip())
+        if visible < STREAM_MIN_EDIT_CHARS:
+            return False
+        # Длинное сообщение - больше байт на правку, правим реже
+        fill = len(self._display()) / self.limit
+        interval = self._slowdown * (1 + fill) / self.limiter.bucket(self.chat_id).rate
+        return self.clock() - self._last_edit >= interval
+
+    async def _edit(self, text: str, chars: int) -> bool:
+        """Одна правка текущего сообщения (chars - сколько символов ответа в кадре)"""
+        try:
+            await self.messages[-1].edit_text(text, parse_mode=self.parse_mode)
+        except Exception as e:
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                self.stats.flood_waits += 1
+                self.limiter.penalize(self.chat_id, retry_after)
+                self._slowdown = min(MAX_SLOWDOWN, self._slowdown * 2)
+                logger.warning(f"⚠️ Стрим: Telegram RetryAfter {retry_after:.0f} с, чат {self.chat_id}")
+                return False
+            if "not modified" in str(e).lower():
+                return True
+            if self.parse_mode and "parse" in str(e).lower():
+                # Модель выдала разметку, которую Telegram не принимает - дальше без неё
+                self.parse_mode = None
+                return await self._edit(text, chars)
+            logger.warning(f"⚠️ Стрим: ошибка правки: {e}")
+            return False
+
+        self.stats.edits += 1
+        if self.stats.first_edit_ms is None:
+            self.stats.first_edit_ms = self._elapsed_ms()
+        self._shown = text
+        self._shown_chars = chars
+        self._last_edit = self.clock()
+        self._slowdown = max(1.0, self._slowdown * 0.9)
+        return True
+
+    async def _wait_edit(self):
+        if self._edit_task is not None:
+            await asyncio.gather(self._edit_task, return_exceptions=True)
+            self._edit_task = None
+
+    async def _forced(self, send) -> Optional[object]:
+        """Обязательный запрос: дождаться лимита, при RetryAfter повторить"""
+        for _ in range(FORCED_ATTEMPTS):
+            await self.limiter.acquire(self.chat_id)
+            try:
+                return await send()
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None:
+                    raise
+                self.stats.flood_waits += 1
+                self.limiter.penalize(self.chat_id, retry_after)
+        return None
+
+    async def _forced_edit(self, text: str, reply_markup=None):
+        if text == self._shown and reply_markup is None:
+            return
+        try:
+            result = await self._forced(lambda: self.messages[-1].edit_text(
+                text, parse_mode=self.parse_mode, reply_markup=reply_markup
+            ))
+        except Exception as e:
+            if "not modified" in str(e).lower():
+                return
+            if not self.parse_mode:
+                raise
+            self.parse_mode = None
+            result = await self._forced(lambda: self.messages[-1].edit_text(text, reply_markup=reply_markup))
+        if result is None:
+            raise RuntimeError("Telegram не принял правку ответа")
+        self.stats.edits += 1
+        if self.stats.first_edit_ms is None:
+            self.stats.first_edit_ms = self._elapsed_ms()
+        self._shown = text
+        self._shown_chars = len(self.text)
+        self._last_edit = self.clock()
+
+    async def _rollover(self):
+        """Завершить текущее сообщение и продолжить ответ в новом"""
+        await self._wait_edit()
+        display = self._display()
+        head, reopen, cut = markdown_cut(display, self.limit, markdown=bool(self.parse_mode))
+        self._offset += cut - len(self._prefix)
+        self._prefix = reopen
+
+        await self._forced_edit(head)
+        continuation = self._frame(self._display())
+        message = await self._forced(lambda: self.reply_to.reply_text(continuation, parse_mode=self.parse_mode))
+        if message is None:
+            raise RuntimeError("Telegram не принял продолжение ответа")
+        self.messages.append(message)
+        self.stats.messages += 1
+        self._shown = continuation
+        self._shown_chars = len(self.text)
+        self._last_edit = self.clock()
+
+    async def finish(self) -> list:
+        """
+        Финальный текст без курсора
+
+        Returns:
+            Отправленные сообщения ответа
+        """
+        await self._wait_edit()
+        if self._finished:
+            return self.messages
+        self._finished = True
+
+        if self.text.strip():
+            display = self._display()
+            await self._forced_edit(close_markdown(display) if self.parse_mode else display)
+
+        self.stats.duration_ms = self._elapsed_ms()
+        if self.metrics is not None:
+            self.metrics.record(self.stats)
+        logger.info(
+            f"📊 Стрим: {self.stats.chars} симв., {self.stats.edits} правок, "
+            f"{self.stats.messages} сообщ., TTFT {self.stats.ttft_ms} мс, "
+            f"первая правка {self.stats.first_edit_ms} мс, пропущено {self.stats.throttled}"
+        )
+        return self.messages
+
+    async def attach_markup(self, reply_markup):
+        """
+        Кнопки к ответу: inline-клавиатура - правкой последнего сообщения,
+        клавиатура подсказок (ReplyKeyboardMarkup) - коротким сообщением
+        """
+        if reply_markup is None or not self.messages:
+            return
+        if hasattr(reply_markup, "inline_keyboard"):
+            await self._forced(lambda: self.messages[-1].edit_reply_markup(reply_markup=reply_markup))
+        else:
+            await self._forced(lambda: self.reply_to.reply_text(REPLY_KEYBOARD_NOTE, reply_markup=reply_markup))
+
+    async def abort(self):
+        """Ошибка генерации: удалить незавершённые сообщения ответа"""
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+        await self._wait_edit()
+        if self._finished:
+            return
+        self._finished = True
+        for message in self.messages:
+            try:
+                await message.delete()
+            except Exception:
+                pass
+        self.messages = []
+
+
+def get_stream_stats() -> dict:
+    """Сводные метрики потоковых ответов"""
+    return STREAM_METRICS.get_stats()
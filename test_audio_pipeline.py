@@ -0,0 +1,217 @@
+"""
+Тест конвертации аудио в памяти (audio_pipeline.py, voice_handler.py)
+Проверяет декодирование через pipe и потоковую выдачу PCM, ограничение числа
+процессов без остановки event loop, ошибки и таймауты ffmpeg, отсутствие
+записи на диск и перекодирования OGG для Whisper
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from audio_pipeline import AudioConversionError, AudioConverter
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Заменитель ffmpeg: читает stdin, "декодирует" (удваивает байты) и пишет в stdout кусками
+FAKE_FFMPEG = r'''
+import os, sys, time
+data = sys.stdin.buffer.read()
+if data.startswith(b"BAD"):
+    sys.stderr.write("Invalid data found when processing input")
+    sys.exit(1)
+time.sleep(float(os.environ.get("FAKE_FFMPEG_DELAY", "0")))
+out = bytes(b for b in data for _ in range(2))
+for i in range(0, len(out), 4096):
+    sys.stdout.buffer.write(out[i:i + 4096])
+    sys.stdout.buffer.flush()
+'''
+
+
+def fake_converter(directory: str, delay: float = 0.0, **kwargs) -> AudioConverter:
+    path = os.path.join(directory, "fake_ffmpeg.py")
+    with open(path, "w") as f:
+        f.write(FAKE_FFMPEG)
+    os.environ["FAKE_FFMPEG_DELAY"] = str(delay)
+    return AudioConverter(command=[sys.executable, path], **kwargs)
+
+
+def test_pipe_and_streaming():
+    """Данные проходят через pipe целиком и потоково, кусками"""
+    logger.info("ТЕСТ 1: Pipe и потоковое декодирование")
+    voice = os.urandom(50_000)
+
+    async def scenario(directory):
+        converter = fake_converter(directory)
+        pcm = await converter.ogg_to_pcm(voice)
+        chunks = [chunk async for chunk in converter.iter_pcm(voice, chunk_bytes=8000)]
+        return converter, pcm, chunks
+
+    with tempfile.TemporaryDirectory() as directory:
+        converter, pcm, chunks = asyncio.run(scenario(directory))
+    expected = bytes(b for b in voice for _ in range(2))
+    ok = (
+        pcm == expected and b"".join(chunks) == expected
+        and len(chunks) > 5 and all(len(c) <= 8000 for c in chunks)
+        and converter.stats["conversions"] == 2 and converter.stats["bytes_out"] == 2 * len(expected)
+    )
+    logger.info(f"{'✅' if ok else '❌'} {len(pcm)} байт PCM, потоком {len(chunks)} кусков")
+    return ok
+
+
+def test_bounded_pool_without_loop_stall():
+    """Не больше concurrency процессов, event loop продолжает работать"""
+    logger.info("ТЕСТ 2: Пул конвертаций")
+
+    async def scenario(directory):
+        converter = fake_converter(directory, delay=0.3, concurrency=3)
+        gaps = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(converter.ogg_to_pcm(os.urandom(2000)) for _ in range(9)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick
+        return converter, results, elapsed, max(gaps)
+
+    with tempfile.TemporaryDirectory() as directory:
+        converter, results, elapsed, max_gap = asyncio.run(scenario(directory))
+    stats = converter.get_stats()
+    ok = (
+        all(len(r) == 4000 for r in results)
+        and stats["max_active"] == 3 and stats["active"] == 0
+        and 0.85 < elapsed < 3.0
+        and max_gap < 0.1
+        and stats["avg_wait_ms"] > 0
+    )
+    logger.info(f"{'✅' if ok else '❌'} 9 конвертаций по 3 за {elapsed:.2f}с, "
+                f"макс. пауза event loop {max_gap * 1000:.0f} мс, {stats}")
+    return ok
+
+
+def test_errors_and_timeout():
+    """Ошибка ffmpeg, таймаут (процесс завершается) и отсутствие ffmpeg"""
+    logger.info("ТЕСТ 3: Ошибки и таймаут")
+
+    async def expect_error(coroutine):
+        try:
+            await coroutine
+        except AudioConversionError as e:
+            return str(e)
+        return None
+
+    async def scenario(directory):
+        converter = fake_converter(directory)
+        bad = await expect_error(converter.ogg_to_pcm(b"BAD data"))
+        slow = fake_converter(directory, delay=5, timeout=0.5)
+        started = time.perf_counter()
+        timeout = await expect_error(slow.ogg_to_pcm(b"ok"))
+        stream_timeout = await expect_error(_drain(slow.iter_pcm(b"ok")))
+        timeout_elapsed = time.perf_counter() - started
+        missing = await expect_error(AudioConverter(command=["/nonexistent/ffmpeg"]).ogg_to_pcm(b"x"))
+        return converter, slow, bad, timeout, stream_timeout, timeout_elapsed, missing
+
+    async def _drain(iterator):
+        async for _ in iterator:
+            pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        converter, slow, bad, timeout, stream_timeout, elapsed, missing = asyncio.run(scenario(directory))
+    ok = (
+        bad is not None and "Invalid data" in bad
+        and timeout is not None and stream_timeout is not None and elapsed < 2.5
+        and slow.stats["timeouts"] == 2 and slow.active == 0
+        and missing == "ffmpeg не установлен"
+        and converter.stats["failures"] == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} ошибка: {bad!r}, таймауты за {elapsed:.2f}с, без ffmpeg: {missing!r}")
+    return ok
+
+
+def test_voice_message_without_disk_writes():
+    """Голосовое скачивается в память, Whisper получает исходный OGG, файлов не появляется"""
+    logger.info("ТЕСТ 4: Без записи на диск")
+    import voice_handler
+
+    voice = b"OggS" + os.urandom(20_000)
+    sent = {}
+
+    class FakeFile:
+        async def download_as_bytearray(self):
+            return bytearray(voice)
+
+        async def download_to_drive(self, *args, **kwargs):
+            raise AssertionError("запись на диск")
+
+    class FakeBot:
+        async def get_file(self, file_id):
+            return FakeFile()
+
+    class FakeTranscriptions:
+        def create(self, model, file, language, response_format):
+            sent["file"] = file
+            return "какой защитный слой бетона"
+
+    class FakeClient:
+        class audio:
+            transcriptions = FakeTranscriptions()
+
+    saved = (voice_handler.VOICE_ENGINE, voice_handler.OPENAI_VOICE_ENABLED, voice_handler.openai_client)
+    voice_handler.VOICE_ENGINE, voice_handler.OPENAI_VOICE_ENABLED = "openai", True
+    voice_handler.openai_client = FakeClient()
+    watched = [os.getcwd(), tempfile.gettempdir(), str(voice_handler.VOICE_TEMP_DIR)]
+    before = {d: set(os.listdir(d)) if os.path.isdir(d) else set() for d in watched}
+    try:
+        result = asyncio.run(voice_handler.process_voice_message(FakeBot(), "file-id", user_id=1))
+    finally:
+        voice_handler.VOICE_ENGINE, voice_handler.OPENAI_VOICE_ENABLED, voice_handler.openai_client = saved
+    after = {d: set(os.listdir(d)) if os.path.isdir(d) else set() for d in watched}
+
+    ok = (
+        result["success"] and result["text"] == "какой защитный слой бетона"
+        and sent["file"] == ("voice.ogg", voice)
+        and before == after
+    )
+    logger.info(f"{'✅' if ok else '❌'} {result}, новых файлов: "
+                f"{sum(len(after[d] - before[d]) for d in watched)}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("voice_handler").setLevel(logging.ERROR)
+    results = {
+        "Pipe и потоковое декодирование": test_pipe_and_streaming(),
+        "Пул конвертаций": test_bounded_pool_without_loop_stall(),
+        "Ошибки и таймаут": test_errors_and_timeout(),
+        "Без записи на диск": test_voice_message_without_disk_writes()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,319 @@
+"""
+Тест передачи аудио клиент <-> Gemini Live (audio_relay.py, websocket_proxy.py,
+backend/server.py)
+Проверяет пачки base64 в сторону Gemini, буфер джиттера к клиенту, бинарные
+кадры в backend/server.py и нагрузку: одновременные сессии на ядро через
+websocket_proxy с локальным заменителем Gemini
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from audio_relay import (
+    AudioRelay, JitterBuffer, UplinkBatcher, REALTIME_PREFIX, RELAY_STATS, ms_to_bytes
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Кадр микрофона 20 мс, 16 кГц
+FRAME = ms_to_bytes(20, 16000)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+async def fake_gemini(ws):
+    """Заменитель Gemini Live: на каждую пачку - ответ в 1.5 раза длиннее (24 кГц)"""
+    json.loads(await ws.recv())
+    await ws.send(json.dumps({"setupComplete": {}}))
+    async for message in ws:
+        data = json.loads(message)
+        if "realtime_input" in data:
+            pcm = base64.b64decode(data["realtime_input"]["media_chunks"][0]["data"])
+            reply = pcm + pcm[:len(pcm) // 2]
+            await ws.send(json.dumps({"serverContent": {"modelTurn": {"parts": [
+                {"inlineData": {"mimeType": "audio/pcm;rate=24000", "data": base64.b64encode(reply).decode()}}
+            ]}}}))
+        elif data.get("client_content", {}).get("turn_complete"):
+            await ws.send(json.dumps({"serverContent": {"turnComplete": True}}))
+
+
+def test_uplink_batching():
+    """20-мс кадры уходят в Gemini пачками по 100 мс, base64 старых клиентов - как есть"""
+    logger.info("ТЕСТ 1: Пачки в сторону Gemini")
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def scenario():
+        batcher = UplinkBatcher(send, batch_ms=100)
+        frames = [os.urandom(FRAME) for _ in range(12)]
+        for frame in frames:
+            await batcher.push(frame)
+        pending = batcher.pending
+        await batcher.flush_stale(now=time.monotonic() + 1)
+        await batcher.push_encoded(base64.b64encode(b"legacy").decode())
+        return frames, pending
+
+    frames, pending = asyncio.run(scenario())
+    decoded = [json.loads(m) for m in sent]
+    chunks = [d["realtime_input"]["media_chunks"][0] for d in decoded]
+    pcm = b"".join(base64.b64decode(c["data"]) for c in chunks[:-1])
+    ok = (
+        len(sent) == 4 and all(m.startswith(REALTIME_PREFIX) for m in sent)
+        and pcm == b"".join(frames)
+        and len(base64.b64decode(chunks[0]["data"])) == ms_to_bytes(100, 16000)
+        and pending == 2 * FRAME
+        and base64.b64decode(chunks[-1]["data"]) == b"legacy"
+        and all(c["mime_type"] == "audio/pcm" for c in chunks)
+    )
+    logger.info(f"{'✅' if ok else '❌'} 12 кадров -> {len(sent) - 1} пачек + 1 готовая base64")
+    return ok
+
+
+def test_jitter_buffer():
+    """Предзаполнение, кадры одного размера, опережение не больше lead, порядок и прерывание"""
+    logger.info("ТЕСТ 2: Буфер джиттера")
+    clock = FakeClock()
+    jb = JitterBuffer(sample_rate=24000, frame_ms=40, prebuffer_ms=120, lead_ms=200, clock=clock)
+    frame = ms_to_bytes(40, 24000)
+
+    jb.push(bytes(frame * 2))
+    waiting = jb.ready()                     # меньше предзаполнения
+    jb.push(bytes(frame * 6 + 100))
+    first = jb.ready()                       # 200 мс опережения = 5 кадров по 40 мс
+    due = jb.next_due()
+    clock.now += 0.1
+    second = jb.ready()                      # клиент проиграл 100 мс -> ещё 2 кадра
+    jb.mark('{"type":"transcript"}')
+    jb.push(bytes(frame * 3))
+    dropped = jb.clear()                     # прерывание
+    after_clear = jb.ready()
+    clock.now += 1
+    jb.push(bytes(frame + 10))
+    jb.mark('{"type":"turn_complete"}')
+    jb.end_turn()
+    tail = jb.ready()
+
+    ok = (
+        waiting == [] and len(first) == 5 and all(len(f) == frame for f in first)
+        and abs(due - 0.04) < 1e-6
+        and len(second) == 2
+        and dropped == frame + 100 + 3 * frame
+        and after_clear == ['{"type":"transcript"}']
+        and tail == [bytes(frame), bytes(10), '{"type":"turn_complete"}']
+        and jb.buffered == 0
+    )
+    logger.info(f"{'✅' if ok else '❌'} сразу {len(first)} кадров, через 100 мс ещё {len(second)}, "
+                f"сброшено {dropped} байт, конец: {[len(i) if isinstance(i, bytes) else i for i in tail]}")
+    return ok
+
+
+def start_fake_gemini():
+    """Заменитель Gemini в отдельном потоке (для синхронного TestClient)"""
+    import websockets
+
+    started = threading.Event()
+    state = {}
+
+    def run():
+        async def main():
+            async with websockets.serve(fake_gemini, "127.0.0.1", 0) as server:
+                state["port"] = server.sockets[0].getsockname()[1]
+                state["stop"] = asyncio.get_running_loop().create_future()
+                state["loop"] = asyncio.get_running_loop()
+                started.set()
+                await state["stop"]
+
+        asyncio.run(main())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait(5)
+    return state, thread
+
+
+def test_backend_binary_frames():
+    """backend/server.py: бинарные кадры в обе стороны и старый JSON-протокол"""
+    logger.info("ТЕСТ 3: Бинарные кадры в backend/server.py")
+    try:
+        from fastapi.testclient import TestClient
+        from backend import server
+    except ImportError as e:
+        logger.info(f"⏭️ нет зависимостей backend ({e}) - пропуск")
+        return True
+
+    state, thread = start_fake_gemini()
+    server.GEMINI_API_KEY = "test"
+    server.GEMINI_LIVE_URL = f"ws://127.0.0.1:{state['port']}/"
+    client = TestClient(server.app)
+    speech = os.urandom(ms_to_bytes(300, 16000))
+
+    def talk(url, binary):
+        audio = bytearray()
+        events = []
+        with client.websocket_connect(url) as ws:
+            assert ws.receive_json()["type"] == "connected"
+            assert ws.receive_json()["type"] == "ready"
+            for offset in range(0, len(speech), FRAME):
+                chunk = speech[offset:offset + FRAME]
+                if binary:
+                    ws.send_bytes(chunk)
+                else:
+                    ws.send_json({"type": "audio", "data": base64.b64encode(chunk).decode()})
+            ws.send_json({"type": "end_turn"})
+            while True:
+                message = ws.receive()
+                if message.get("bytes") is not None:
+                    audio += message["bytes"]
+                    continue
+                data = json.loads(message["text"])
+                events.append(data["type"])
+                if data["type"] == "audio":
+                    audio += base64.b64decode(data["data"])
+                if data["type"] == "turn_complete":
+                    break
+        return bytes(audio), events
+
+    try:
+        binary_audio, binary_events = talk("/api/ws?audio=binary", True)
+        legacy_audio, legacy_events = talk("/api/ws", False)
+    finally:
+        state["loop"].call_soon_threadsafe(state["stop"].set_result, None)
+        thread.join(5)
+
+    expected = len(speech) * 3 // 2
+    ok = (
+        abs(len(binary_audio) - expected) <= ms_to_bytes(20, 24000)
+        and binary_events == ["turn_complete"]
+        and abs(len(legacy_audio) - expected) <= ms_to_bytes(300, 24000)
+        and legacy_events[-1] == "turn_complete" and "audio" in legacy_events
+    )
+    logger.info(f"{'✅' if ok else '❌'} binary: {len(binary_audio)} байт ответа, "
+                f"base64: {len(legacy_audio)} байт (ожидалось ~{expected})")
+    return ok
+
+
+def test_load_sessions_per_core():
+    """Нагрузка: одновременные сессии через websocket_proxy, сессий реального времени на ядро"""
+    logger.info("ТЕСТ 4: Нагрузка - сессии на ядро")
+    import websockets
+    import websocket_proxy
+
+    os.environ.setdefault("GOOGLE_API_KEY", "test")
+    sessions, seconds = 40, 2.0
+    frames = int(seconds * 1000 / 20)
+
+    async def client(port, index):
+        audio = 0
+        async with websockets.connect(f"ws://127.0.0.1:{port}/stream/user{index}") as ws:
+            assert json.loads(await ws.recv())["type"] == "ready"
+            started = time.monotonic()
+            for i in range(frames):
+                await ws.send(os.urandom(FRAME))
+                # Микрофон: кадр каждые 20 мс
+                await asyncio.sleep(max(0.0, started + (i + 1) * 0.02 - time.monotonic()))
+            await ws.send(json.dumps({"type": "end_turn"}))
+            expected = frames * FRAME * 3 // 2
+            while audio < expected:
+                message = await asyncio.wait_for(ws.recv(), 10)
+                if isinstance(message, bytes):
+                    audio += len(message)
+            await ws.send(json.dumps({"type": "stop"}))
+        return audio
+
+    async def scenario():
+        async with websockets.serve(fake_gemini, "127.0.0.1", 0) as gemini:
+            websocket_proxy.GEMINI_LIVE_URL = f"ws://127.0.0.1:{gemini.sockets[0].getsockname()[1]}/"
+            async with websockets.serve(websocket_proxy.websocket_handler, "127.0.0.1", 0) as proxy:
+                port = proxy.sockets[0].getsockname()[1]
+                cpu = time.process_time()
+                wall = time.perf_counter()
+                received = await asyncio.gather(*(client(port, i) for i in range(sessions)))
+                return received, time.process_time() - cpu, time.perf_counter() - wall
+
+    before = dict(RELAY_STATS.counters)
+    received, cpu, wall = asyncio.run(scenario())
+    stats = {k: v - before.get(k, 0) for k, v in RELAY_STATS.counters.items()}
+    audio_seconds = sessions * seconds
+    per_core = audio_seconds / cpu
+
+    # Прежний путь на тех же данных: JSON и base64 на каждый кадр в обе стороны
+    pcm = os.urandom(FRAME)
+    reply = json.dumps({"serverContent": {"modelTurn": {"parts": [
+        {"inlineData": {"data": base64.b64encode(pcm + pcm[:FRAME // 2]).decode()}}]}}})
+    started = time.process_time()
+    for _ in range(5000):
+        json.dumps({"realtime_input": {"media_chunks": [{"data": base64.b64encode(pcm).decode('utf-8'),
+                                                         "mime_type": "audio/pcm"}]}})
+        base64.b64decode(json.loads(reply)["serverContent"]["modelTurn"]["parts"][0]["inlineData"]["data"])
+    legacy_us = (time.process_time() - started) / 5000 * 1e6
+
+    async def batched():
+        async def noop(message):
+            pass
+        relay = AudioRelay(noop, noop, noop)
+        batch_reply = json.dumps({"serverContent": {"modelTurn": {"parts": [
+            {"inlineData": {"data": base64.b64encode(os.urandom(FRAME * 15 // 2)).decode()}}]}}})
+        started = time.process_time()
+        for i in range(5000):
+            await relay.uplink.push(pcm)
+            if i % 5 == 4:
+                relay.server_message(batch_reply)
+                relay.jitter.clear()
+        return (time.process_time() - started) / 5000 * 1e6
+
+    batched_us = asyncio.run(batched())
+    expected = frames * FRAME * 3 // 2
+    ok = (
+        all(r >= expected for r in received)
+        and stats.get("batches_up", 0) <= sessions * (frames // 5 + 2)
+        and per_core > 10
+        and batched_us < legacy_us
+    )
+    logger.info(f"   {sessions} сессий x {seconds:g}с: CPU {cpu:.2f}с за {wall:.2f}с, "
+                f"пачек в Gemini {stats.get('batches_up', 0)}, кадров клиентам {stats.get('frames_down', 0)}")
+    logger.info(f"   На кадр 20 мс: прежний путь {legacy_us:.1f} мкс, пачками {batched_us:.1f} мкс")
+    logger.info(f"{'✅' if ok else '❌'} ~{per_core:.0f} сессий реального времени на ядро "
+                f"(включая клиентов и заменитель Gemini в том же процессе)")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    for name in ("websocket_proxy", "websockets", "backend.server", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    results = {
+        "Пачки в сторону Gemini": test_uplink_batching(),
+        "Буфер джиттера": test_jitter_buffer(),
+        "Бинарные кадры в backend/server.py": test_backend_binary_frames(),
+        "Нагрузка - сессии на ядро": test_load_sessions_per_core()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
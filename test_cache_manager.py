@@ -0,0 +1,167 @@
+"""
+Тест семантического кэша ответов (cache_manager.py)
+Проверяет поиск перефразированных вопросов, LRU/TTL вытеснение
+и время top-k поиска на 100k закэшированных вопросов
+"""
+
+import asyncio
+import logging
+import random
+import sys
+import time
+
+import cache_manager
+from cache_manager import (
+    MEMORY_CACHE,
+    SEMANTIC_INDEX,
+    clear_cache,
+    find_similar_cached_question,
+    find_similar_cached_questions,
+    get_cache_stats,
+    get_cached_answer,
+    set_cached_answer,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+logging.getLogger("cache_manager").setLevel(logging.WARNING)
+
+
+def test_semantic_hit():
+    """Перефразированный вопрос находит сохранённый ответ"""
+    logger.info("ТЕСТ 1: Семантическое попадание")
+
+    async def run():
+        await clear_cache()
+        await set_cached_answer("Какой класс бетона нужен для ленточного фундамента?", "B25")
+        await set_cached_answer("Как часто проверять леса на стройплощадке?", "Ежедневно")
+        exact = await get_cached_answer("Какой класс бетона нужен для ленточного фундамента?")
+        similar = await find_similar_cached_question("класс бетона для фундамента ленточного типа", threshold=0.5)
+        unrelated = await find_similar_cached_question("сколько стоит кирпич", threshold=0.5)
+        return exact, similar, unrelated
+
+    exact, similar, unrelated = asyncio.run(run())
+    ok = exact == "B25" and similar == "B25" and unrelated is None
+    logger.info(f"{'✅' if ok else '❌'} точный: {exact}, похожий: {similar}, чужой: {unrelated}")
+    return ok
+
+
+def test_lru_and_ttl():
+    """Переполнение вытесняет давно неиспользованные записи, просроченные не отдаются"""
+    logger.info("ТЕСТ 2: LRU и TTL")
+    original_limit = cache_manager.CACHE_MAX_ENTRIES
+    cache_manager.CACHE_MAX_ENTRIES = 3
+
+    async def run():
+        await clear_cache()
+        for i in range(3):
+            await set_cached_answer(f"вопрос номер {i} про арматуру", f"ответ {i}")
+        await get_cached_answer("вопрос номер 0 про арматуру")  # 0 становится свежим
+        await set_cached_answer("вопрос номер 3 про арматуру", "ответ 3")  # вытесняет 1
+        evicted = await get_cached_answer("вопрос номер 1 про арматуру")
+        kept = await get_cached_answer("вопрос номер 0 про арматуру")
+
+        await set_cached_answer("устаревший вопрос про опалубку", "старый ответ", ttl_hours=-1)
+        expired = await get_cached_answer("устаревший вопрос про опалубку")
+        expired_similar = find_similar_cached_questions("устаревший вопрос про опалубку", top_k=3)
+        return evicted, kept, expired, expired_similar
+
+    try:
+        evicted, kept, expired, expired_similar = asyncio.run(run())
+    finally:
+        cache_manager.CACHE_MAX_ENTRIES = original_limit
+
+    ok = (
+        evicted is None and kept == "ответ 0" and expired is None
+        and all(m['answer'] != "старый ответ" for m in expired_similar)
+        and len(MEMORY_CACHE) <= 3
+    )
+    logger.info(f"{'✅' if ok else '❌'} вытеснен: {evicted}, сохранён: {kept}, просрочен: {expired}")
+    return ok
+
+
+def test_topk_latency_100k():
+    """Top-k поиск по 100k вопросам укладывается в миллисекунду"""
+    logger.info("ТЕСТ 3: Задержка top-k на 100k вопросов")
+
+    subjects = ["бетон", "арматура", "фундамент", "кладка", "опалубка", "кровля", "перекрытие",
+                "гидроизоляция", "утеплитель", "сварка", "леса", "котлован", "свая", "стяжка"]
+    actions = ["как проверить", "какой допуск", "какая толщина", "какой класс", "как принять",
+               "норматив для", "сроки твердения", "контроль качества", "требования к"]
+    details = ["зимой", "по СП 70.13330", "в подвале", "на перекрытии", "для частного дома",
+               "по ГОСТ 7473", "при -10", "многоэтажного здания", "на сваях", "в сейсмике"]
+
+    rng = random.Random(42)
+    original_limit = cache_manager.CACHE_MAX_ENTRIES
+    cache_manager.CACHE_MAX_ENTRIES = 200_000
+    items = [
+        (f"qa:bench{i}", f"{rng.choice(actions)} {rng.choice(subjects)} {rng.choice(details)} вариант {i}")
+        for i in range(100_000)
+    ]
+
+    MEMORY_CACHE.clear()
+    started = time.perf_counter()
+    SEMANTIC_INDEX.rebuild(items)
+    expires_at = time.time() + 3600
+    for key, question in items:
+        MEMORY_CACHE[key] = {'answer': key, 'question': question, 'context': None,
+                             'count': 0, 'expires_at': expires_at}
+    build_s = time.perf_counter() - started
+
+    queries = [f"{rng.choice(actions)} {rng.choice(subjects)} {rng.choice(details)}" for _ in range(200)]
+    for q in queries[:10]:
+        find_similar_cached_questions(q, top_k=5)  # прогрев
+
+    timings = []
+    for q in queries:
+        t0 = time.perf_counter()
+        results = find_similar_cached_questions(q, top_k=5)
+        timings.append((time.perf_counter() - t0) * 1000)
+
+    cache_manager.CACHE_MAX_ENTRIES = original_limit
+    asyncio.run(clear_cache())
+
+    timings.sort()
+    p50 = timings[len(timings) // 2]
+    p95 = timings[int(len(timings) * 0.95)]
+    limit_ms = 1.0 if cache_manager.NUMPY_AVAILABLE else 50.0
+    ok = p50 < limit_ms and len(results) == 5
+    logger.info(
+        f"{'✅' if ok else '❌'} построение: {build_s:.1f}с, p50: {p50:.3f} мс, p95: {p95:.3f} мс "
+        f"(лимит p50 {limit_ms} мс, numpy: {cache_manager.NUMPY_AVAILABLE})"
+    )
+    return ok
+
+
+def test_stats():
+    """Статистика включает метрики семантического поиска"""
+    logger.info("ТЕСТ 4: Статистика")
+    stats = get_cache_stats()
+    ok = stats['semantic_lookups'] > 0 and 'semantic_p95_us' in stats and 'evictions' in stats
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Семантическое попадание": test_semantic_hit(),
+        "LRU и TTL": test_lru_and_ttl(),
+        "Top-k на 100k": test_topk_latency_100k(),
+        "Статистика": test_stats()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
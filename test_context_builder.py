@@ -0,0 +1,155 @@
+"""
+Тест сборки контекста по бюджету токенов (context_builder.py)
+Проверяет оценку токенов, упаковку в бюджет модели, краткое содержание старых
+реплик и его кэш, удаление повторов system-промптов и вопроса, экономию токенов
+"""
+
+import logging
+import sys
+import time
+
+from context_builder import ContextBuilder, estimate_tokens
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SYSTEM = "Вы — СтройНадзорAI, дружелюбный AI-помощник по строительству в России."
+LONG_ANSWER = (
+    "Защитный слой бетона для фундаментов принимается не менее 40 мм по СП 63.13330.2018. "
+    + "Подробно: требования к армированию, анкеровке и контролю на объекте. " * 60
+)
+
+
+def dialog(turns: int, answer: str) -> list:
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Вопрос {i}: какой защитный слой бетона?", "timestamp": "t"})
+        history.append({"role": "assistant", "content": answer, "timestamp": "t"})
+    return history
+
+
+def test_token_estimate():
+    """Оценка близка к BPE: ~3 символа кириллицы на токен, повторная оценка из кэша"""
+    logger.info("ТЕСТ 1: Оценка токенов")
+    russian = "Защитный слой бетона для фундаментов не менее 40 мм"
+    english = "The concrete cover for foundations is at least 40 mm"
+    estimate_tokens.cache_clear()
+    ru, en = estimate_tokens(russian), estimate_tokens(english)
+    estimate_tokens(russian)
+
+    ok = (
+        len(russian) / 4.5 < ru < len(russian) / 2
+        and len(english) / 6 < en < len(english) / 3
+        and estimate_tokens("") == 0
+        and estimate_tokens.cache_info().hits == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} ru: {len(russian)} симв. → {ru}, en: {len(english)} симв. → {en}")
+    return ok
+
+
+def test_budget_packing():
+    """Длинные ответы не раздувают промпт: свежие целиком, старые кратко"""
+    logger.info("ТЕСТ 2: Бюджет токенов")
+    builder = ContextBuilder(budgets={"small": 3000}, default_budget=6000)
+    history = dialog(10, LONG_ANSWER)
+    result = builder.build(history, system_prompts=[SYSTEM], model="small", question="А для колонн?")
+
+    ok = (
+        result.tokens <= 3000
+        and 0 < result.kept_messages < len(history)
+        and result.history[0]["role"] == "user"
+        and result.history[-1] == {"role": "assistant", "content": LONG_ANSWER}
+        and result.summarized_messages > 0
+        and "РАНЕЕ В ДИАЛОГЕ" in result.system and "СП 63.13330.2018" in result.system
+        and result.messages[-1] == {"role": "user", "content": "А для колонн?"}
+        and result.saved_tokens > 0
+    )
+    logger.info(f"{'✅' if ok else '❌'} {result.tokens} токенов, целиком {result.kept_messages}, "
+                f"кратко {result.summarized_messages}, сэкономлено {result.saved_tokens}")
+    return ok
+
+
+def test_short_chat_uses_more_context():
+    """Короткие реплики: в бюджет входит больше прежних 10 сообщений"""
+    logger.info("ТЕСТ 3: Короткий диалог")
+    builder = ContextBuilder()
+    history = dialog(15, "40 мм.")
+    result = builder.build(history, system_prompts=[SYSTEM], question="А для колонн?")
+
+    ok = result.kept_messages == len(history) and result.summarized_messages == 0 and "РАНЕЕ" not in result.system
+    logger.info(f"{'✅' if ok else '❌'} целиком {result.kept_messages} из {len(history)}, {result.tokens} токенов")
+    return ok
+
+
+def test_deduplication_and_cache():
+    """Повторы промптов и вопроса удаляются, краткое содержание берётся из кэша"""
+    logger.info("ТЕСТ 4: Повторы и кэш")
+    builder = ContextBuilder(default_budget=2500)
+    role_base = "Вы — AI-помощник по строительству СтройНадзорAI."
+    role_prompt = role_base + "\n\n**ВАША РОЛЬ: ПОМОЩНИК ПРОРАБА**"
+    question = "Какой нахлёст арматуры?"
+    history = [{"role": "system", "content": SYSTEM}] + dialog(8, LONG_ANSWER) + [
+        {"role": "user", "content": question},
+    ]
+
+    first = builder.build(history, system_prompts=[SYSTEM, role_base, role_prompt, SYSTEM], question=question)
+    hits_before = builder.summary_cache_hits
+    second = builder.build(history, system_prompts=[SYSTEM, role_prompt], question=question)
+    stats = builder.get_stats()
+
+    ok = (
+        first.system.count(SYSTEM) == 1 and first.system.count(role_base) == 1
+        and sum(1 for m in first.messages if m["role"] == "system") == 1
+        and [m["content"] for m in first.messages].count(question) == 1
+        and first.duplicates_removed == 1
+        and builder.summary_cache_hits - hits_before >= second.summarized_messages > 0
+        and second.system == first.system
+        and stats["requests"] == 2 and stats["tokens_saved"] > 0 and stats["duplicates_removed"] == 2
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def test_build_speed():
+    """Сборка контекста из 50 записей - доли миллисекунды"""
+    logger.info("ТЕСТ 5: Скорость")
+    builder = ContextBuilder()
+    history = dialog(25, LONG_ANSWER)
+    builder.build(history, system_prompts=[SYSTEM], question="А для колонн?")
+
+    runs = 200
+    started = time.perf_counter()
+    for _ in range(runs):
+        builder.build(history, system_prompts=[SYSTEM], question="А для колонн?")
+    avg_ms = (time.perf_counter() - started) * 1000 / runs
+
+    ok = avg_ms < 1.0
+    logger.info(f"{'✅' if ok else '❌'} среднее {avg_ms:.3f} мс")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("context_builder").setLevel(logging.WARNING)
+    results = {
+        "Оценка токенов": test_token_estimate(),
+        "Бюджет токенов": test_budget_packing(),
+        "Короткий диалог": test_short_chat_uses_more_context(),
+        "Повторы и кэш": test_deduplication_and_cache(),
+        "Скорость": test_build_speed()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
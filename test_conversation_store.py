@@ -0,0 +1,186 @@
+"""
+Тест append-only хранилища истории диалогов (conversation_store.py)
+Проверяет дозапись, write-behind, компакцию, миграцию старого JSON
+и то, что запись на диск не держит блокировку хранилища
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from conversation_store import ConversationStore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def test_append_and_reload():
+    """Записи дописываются строками и читаются после перезапуска"""
+    logger.info("\n" + "="*80)
+    logger.info("ТЕСТ 1: Дозапись и повторная загрузка")
+    logger.info("="*80)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(Path(tmp), max_records=5)
+        for i in range(3):
+            store.append(1, {'role': 'user', 'content': f"вопрос {i}"})
+        store.replace_last(1, {'role': 'user', 'content': "вопрос 2 (исправлен)"})
+
+        lines = store.segment_path(1).read_text(encoding='utf-8').splitlines()
+        reloaded = ConversationStore(Path(tmp), max_records=5).load(1)
+
+        ok = len(lines) == 4 and [m['content'] for m in reloaded] == [
+            "вопрос 0", "вопрос 1", "вопрос 2 (исправлен)"
+        ]
+        logger.info(f"{'✅' if ok else '❌'} Строк в сегменте: {len(lines)}, записей: {len(reloaded)}")
+        return ok
+
+
+def test_compaction():
+    """Разросшийся сегмент переписывается до последних max_records"""
+    logger.info("\n" + "="*80)
+    logger.info("ТЕСТ 2: Компакция сегмента")
+    logger.info("="*80)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(Path(tmp), max_records=10, compact_factor=2.0)
+        for i in range(25):
+            store.append(7, {'role': 'user', 'content': str(i)})
+
+        lines = store.segment_path(7).read_text(encoding='utf-8').splitlines()
+        records = ConversationStore(Path(tmp), max_records=10).load(7)
+
+        ok = (
+            len(lines) <= 20
+            and store.stats['compactions'] >= 1
+            and [m['content'] for m in records] == [str(i) for i in range(15, 25)]
+        )
+        logger.info(f"{'✅' if ok else '❌'} Строк после компакции: {len(lines)}, компакций: {store.stats['compactions']}")
+        return ok
+
+
+def test_legacy_migration():
+    """Старый user_<id>.json переносится в сегмент при первом чтении"""
+    logger.info("\n" + "="*80)
+    logger.info("ТЕСТ 3: Миграция старого формата")
+    logger.info("="*80)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = Path(tmp) / "user_42.json"
+        legacy.write_text(json.dumps({
+            'user_id': 42,
+            'messages': [{'role': 'user', 'content': "старое сообщение"}]
+        }, ensure_ascii=False), encoding='utf-8')
+
+        store = ConversationStore(
+            Path(tmp),
+            legacy_prefix="user",
+            legacy_reader=lambda data: data.get('messages', [])
+        )
+        records = store.load(42)
+
+        ok = records[0]['content'] == "старое сообщение" and store.segment_path(42).exists()
+        logger.info(f"{'✅' if ok else '❌'} Мигрировано записей: {len(records)}")
+        return ok
+
+
+def test_write_behind():
+    """С фоновой задачей запись не блокирует обработчик и не теряется при остановке"""
+    logger.info("\n" + "="*80)
+    logger.info("ТЕСТ 4: Write-behind буфер")
+    logger.info("="*80)
+
+    async def run(tmp: Path):
+        store = ConversationStore(tmp, max_records=1000, flush_interval=0.05)
+        store.start()
+
+        started = time.perf_counter()
+        for i in range(2000):
+            store.append(i % 10, {'role': 'user', 'content': f"сообщение {i}"})
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        pending = store.get_stats()['pending_records']
+
+        await store.stop()
+        return elapsed_ms, pending
+
+    with tempfile.TemporaryDirectory() as tmp:
+        elapsed_ms, pending = asyncio.run(run(Path(tmp)))
+        reloaded = ConversationStore(Path(tmp), max_records=1000)
+        total = sum(len(reloaded.load(user_id)) for user_id in range(10))
+
+        ok = pending > 0 and total == 2000
+        logger.info(f"{'✅' if ok else '❌'} 2000 append за {elapsed_ms:.1f} мс, на диске после stop(): {total}")
+        return ok
+
+
+class SlowDiskStore(ConversationStore):
+    """Перезапись сегмента занимает 0.3 с (медленный диск)"""
+
+    def _rewrite(self, user_id, records):
+        time.sleep(0.3)
+        super()._rewrite(user_id, records)
+
+
+def test_flush_outside_lock():
+    """Пока идёт запись на диск, append и load других пользователей не ждут"""
+    logger.info("\n" + "="*80)
+    logger.info("ТЕСТ 5: Запись на диск без блокировки")
+    logger.info("="*80)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SlowDiskStore(Path(tmp), max_records=10)
+        store._flush_task = object()  # как при запущенной фоновой задаче: сброс вручную
+        store.load(1)
+        store.load(2)
+        store.replace(1, [{'role': 'user', 'content': 'старое'}])
+
+        flusher = threading.Thread(target=store.flush)
+        flusher.start()
+        time.sleep(0.05)
+        started = time.perf_counter()
+        store.append(2, {'role': 'user', 'content': 'новое'})
+        store.append(1, {'role': 'assistant', 'content': 'после снимка'})
+        history = store.load(2)
+        waited_ms = (time.perf_counter() - started) * 1000
+        flusher.join()
+        store.flush()
+
+        reloaded = ConversationStore(Path(tmp), max_records=10)
+        ok = (
+            waited_ms < 100 and len(history) == 1
+            and [r['content'] for r in reloaded.load(1)] == ['старое', 'после снимка']
+            and [r['content'] for r in reloaded.load(2)] == ['новое']
+        )
+        logger.info(f"{'✅' if ok else '❌'} append во время записи: {waited_ms:.1f} мс")
+        return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Дозапись и загрузка": test_append_and_reload(),
+        "Компакция": test_compaction(),
+        "Миграция": test_legacy_migration(),
+        "Write-behind": test_write_behind(),
+        "Запись без блокировки": test_flush_outside_lock()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,233 @@
+"""
+Тест кэша LLM Council (council_cache.py)
+Проверяет нормализацию ключа вопроса, ответ на повторный вопрос из кэша без
+вызова моделей, частичное попадание (опрашивается только недостающий участник),
+TTL и смену версии при правке шаблона промпта
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import llm_council
+from council_cache import CouncilCache, context_fingerprint, question_key
+from llm_council import LLMCouncil, stage_version
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+QUESTION = "В чём разница между СП 63 и СНиП 52-01?"
+
+
+class FakeXAI:
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def chat_completions_create_async(self, model, messages, max_tokens=1000, temperature=0.7):
+        self.calls["grok"] += 1
+        await asyncio.sleep(0.02)
+        return {"choices": [{"message": {"content": "Grok: СП 63 - актуализированная редакция"}}]}
+
+
+class FakeChairmanStream:
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def __aenter__(self):
+        self.calls["chairman"] += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for text in ("🏛️ РЕШЕНИЕ: ", "СП 63.13330 заменил СНиП 52-01-2003."):
+            await asyncio.sleep(0.02)
+            yield text
+
+    async def get_final_message(self):
+        return type("Message", (), {"usage": {"input_tokens": 10}})()
+
+
+class FakeClaude:
+    def __init__(self, calls):
+        self.calls = calls
+        self.messages = self
+
+    async def create(self, **kwargs):
+        self.calls["claude"] += 1
+        await asyncio.sleep(0.02)
+        block = type("Block", (), {"text": "Claude: СНиП 52-01 отменён как обязательный"})()
+        return type("Response", (), {"usage": {"input_tokens": 10}, "content": [block]})()
+
+    def stream(self, **kwargs):
+        return FakeChairmanStream(self.calls)
+
+
+class FakeGemini:
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def generate_content_async(self, prompt, stream=False):
+        self.calls["gemini"] += 1
+        await asyncio.sleep(5)
+        return type("Response", (), {"text": "Gemini"})()
+
+
+def make_council(cache: CouncilCache) -> tuple:
+    calls = {"grok": 0, "claude": 0, "gemini": 0, "chairman": 0}
+    council = LLMCouncil.__new__(LLMCouncil)
+    council.xai_client = FakeXAI(calls)
+    council.claude_client = FakeClaude(calls)
+    council.gemini_model = FakeGemini(calls)
+    council.available_models = ["grok", "claude", "gemini"]
+    council.is_available = True
+    council.cache = cache
+    return council, calls
+
+
+def test_question_key():
+    """Регистр, ё/е и пунктуация не меняют ключ; контекст - меняет"""
+    logger.info("ТЕСТ 1: Ключ вопроса")
+    variants = [QUESTION, "в чем разница между сп 63 и снип 52-01", "В ЧЁМ разница  между СП 63 и СНиП 52–01 ?!"]
+    keys = {question_key(q) for q in variants}
+
+    ok = (
+        len(keys) == 1 and question_key("Разница между СП 63 и СНиП 52-02") not in keys
+        and context_fingerprint("") == ""
+        and context_fingerprint("user: привет") == context_fingerprint("User:  привет")
+        and context_fingerprint("user: привет") != context_fingerprint("user: фундамент")
+    )
+    logger.info(f"{'✅' if ok else '❌'} {keys}")
+    return ok
+
+
+def test_question_key_collisions():
+    """Отрицание, модальные слова и знак числа дают разные ключи"""
+    logger.info("ТЕСТ 2: Разные вопросы - разные ключи")
+    pairs = [
+        ("Можно ли бетонировать при -10 градусах?", "Можно ли бетонировать при +10 градусах?"),
+        ("Можно ли бетонировать при −10 градусах?", "Можно ли бетонировать при 10 градусах?"),
+        ("Нужно ли армирование плиты?", "Не нужно ли армирование плиты?"),
+        ("Можно ли снимать опалубку через 3 дня?", "Нельзя ли снимать опалубку через 3 дня?"),
+        ("Разница между СП 63 и СНиП 52-01", "Разница между СП 63 и СНиП 52-101"),
+    ]
+    collisions = [pair for pair in pairs if question_key(pair[0]) == question_key(pair[1])]
+
+    ok = not collisions and question_key("Бетонировать при -10°") == question_key("бетонировать при –10 °")
+    logger.info(f"{'✅' if ok else '❌'} совпадений: {collisions}")
+    return ok
+
+
+def test_repeat_from_cache():
+    """Повторный вопрос - без вызовов моделей, за миллисекунды"""
+    logger.info("ТЕСТ 3: Повторный вопрос")
+    with tempfile.TemporaryDirectory() as tmp:
+        council, calls = make_council(CouncilCache(cache_dir=tmp))
+        first = asyncio.run(council.consult(QUESTION, skip_review=True))
+        calls_after_first = dict(calls)
+
+        # Новый процесс: память пуста, записи читаются с диска
+        council.cache = CouncilCache(cache_dir=tmp)
+        chunks = []
+
+        async def collect(chunk):
+            chunks.append(chunk)
+
+        started = time.perf_counter()
+        second = asyncio.run(council.consult("в чем разница между сп 63 и снип 52-01", skip_review=True, on_chunk=collect))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+    ok = (
+        first["success"] and calls_after_first == {"grok": 1, "claude": 1, "gemini": 1, "chairman": 1}
+        and calls == calls_after_first
+        and second["final_answer"] == first["final_answer"] and chunks == [first["final_answer"]]
+        and second["trace"]["fully_cached"] and elapsed_ms < 50
+    )
+    logger.info(f"{'✅' if ok else '❌'} повтор за {elapsed_ms:.1f} мс, вызовы {calls}")
+    return ok
+
+
+def test_partial_hit():
+    """Частичное попадание: опрашивается только недостающий участник, синтез - из кэша"""
+    logger.info("ТЕСТ 4: Частичное попадание")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CouncilCache(cache_dir=tmp)
+        council, calls = make_council(cache)
+        first = asyncio.run(council.consult(QUESTION, skip_review=True))
+
+        claude_key = CouncilCache.opinion_key(stage_version("opinion", "claude"), QUESTION, "", "claude")
+        cache._forget(claude_key)
+        second = asyncio.run(council.consult(QUESTION, skip_review=True))
+        members = second["trace"]["members"]
+
+    ok = (
+        calls["grok"] == 1 and calls["claude"] == 2 and calls["chairman"] == 1
+        and members["opinions:grok"]["status"] == "cached"
+        and members["opinions:claude"]["status"] == "ok"
+        and members["synthesis:claude"]["status"] == "cached"
+        and second["final_answer"] == first["final_answer"]
+    )
+    logger.info(f"{'✅' if ok else '❌'} вызовы {calls}, {members}")
+    return ok
+
+
+def test_ttl_and_version():
+    """Запись старше TTL не отдаётся и удаляется; правка промпта меняет версию"""
+    logger.info("ТЕСТ 5: TTL и версия")
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CouncilCache(cache_dir=tmp, ttl_hours=1)
+        cache.put("ab" * 32, "старый ответ", "opinion")
+        fresh = cache.get("ab" * 32)
+        cache._memory["ab" * 32]["created_at"] -= 2 * 3600
+        expired = cache.get("ab" * 32)
+        file_removed = not os.path.exists(cache._path("ab" * 32))
+
+    version = stage_version("opinion", "grok")
+    original = llm_council.COUNCIL_SYSTEM_PROMPT
+    try:
+        llm_council.COUNCIL_SYSTEM_PROMPT = original + "\nДобавлено новое требование."
+        stage_version.cache_clear()
+        changed = stage_version("opinion", "grok")
+    finally:
+        llm_council.COUNCIL_SYSTEM_PROMPT = original
+        stage_version.cache_clear()
+
+    ok = (
+        fresh == "старый ответ" and expired is None and file_removed
+        and cache.stats["expired"] == 1
+        and changed != version and stage_version("opinion", "grok") == version
+    )
+    logger.info(f"{'✅' if ok else '❌'} {cache.get_stats()}, версия {version} → {changed}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("llm_council").setLevel(logging.WARNING)
+    results = {
+        "Ключ вопроса": test_question_key(),
+        "Разные вопросы": test_question_key_collisions(),
+        "Повторный вопрос": test_repeat_from_cache(),
+        "Частичное попадание": test_partial_hit(),
+        "TTL и версия": test_ttl_and_version()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
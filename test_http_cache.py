@@ -0,0 +1,266 @@
+"""
+Тест асинхронного загрузчика нормативов с дисковым кэшем (http_cache.py, web_search.py)
+Проверяет TTL, перепроверку по ETag (304), ограничение запросов на хост,
+объединение одинаковых запросов, мемоизацию разбора страниц и сборку мусора
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import web_search
+from http_cache import CachedFetcher
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class StubCntdHandler(BaseHTTPRequestHandler):
+    """Имитация поиска docs.cntd.ru с ETag и задержкой"""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # Счётчик "активных" охватывает только обработку, не отправку ответа
+        with StubCntdHandler.lock:
+            StubCntdHandler.requests.append((self.path, self.headers.get("If-None-Match")))
+            StubCntdHandler.active += 1
+            StubCntdHandler.peak = max(StubCntdHandler.peak, StubCntdHandler.active)
+        time.sleep(0.05)
+        with StubCntdHandler.lock:
+            StubCntdHandler.active -= 1
+
+        code = parse_qs(urlsplit(self.path).query).get("q", [""])[0]
+        etag = f'"{abs(hash(code))}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = (
+            '<div class="search-result-item">'
+            f'<a class="link" href="/document/{len(code)}">{code} Бетонные конструкции</a>'
+            '<span class="status">Действующий</span> с 20.06.2019</div>'
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_stub_server = None
+
+
+def get_stub_url() -> str:
+    """Запустить stub-сервер на свободном порту (один раз на процесс)"""
+    global _stub_server
+    if _stub_server is None:
+        _stub_server = ThreadingHTTPServer(("127.0.0.1", 0), StubCntdHandler)
+        threading.Thread(target=_stub_server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{_stub_server.server_address[1]}"
+
+
+def reset_stub():
+    StubCntdHandler.requests = []
+    StubCntdHandler.peak = 0
+
+
+def test_ttl_and_revalidation():
+    """Свежая запись - без сети; после TTL - условный GET и 304"""
+    logger.info("ТЕСТ 1: TTL и перепроверка по ETag")
+    url = f"{get_stub_url()}/search?q=SP63"
+    reset_stub()
+
+    async def run():
+        fetcher = CachedFetcher(cache_dir=tempfile.mkdtemp(), ttl_hours=1)
+        first = await fetcher.fetch(url)
+        second = await fetcher.fetch(url)
+
+        fetcher.ttl_seconds = 0  # запись устарела
+        third = await fetcher.fetch(url)
+        await fetcher.aclose()
+        return first, second, third, fetcher.get_stats()
+
+    first, second, third, stats = asyncio.run(run())
+    ok = (
+        first.from_network and not second.from_network
+        and third.digest == first.digest
+        and len(StubCntdHandler.requests) == 2
+        and StubCntdHandler.requests[1][1] is not None
+        and stats["fresh_hits"] == 1 and stats["revalidated"] == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} запросов к серверу: {len(StubCntdHandler.requests)}, статистика: {stats}")
+    return ok
+
+
+def test_disk_cache_survives_restart():
+    """Новый загрузчик с тем же каталогом отдаёт страницу без сети"""
+    logger.info("ТЕСТ 2: Дисковый кэш после перезапуска")
+    url = f"{get_stub_url()}/search?q=GOST"
+    cache_dir = tempfile.mkdtemp()
+    reset_stub()
+
+    async def run():
+        first = CachedFetcher(cache_dir=cache_dir)
+        await first.fetch(url)
+        await first.aclose()
+        second = CachedFetcher(cache_dir=cache_dir)
+        response = await second.fetch(url)
+        return response
+
+    response = asyncio.run(run())
+    ok = not response.from_network and "Бетонные" in response.text and len(StubCntdHandler.requests) == 1
+    logger.info(f"{'✅' if ok else '❌'} запросов к серверу: {len(StubCntdHandler.requests)}")
+    return ok
+
+
+def test_concurrent_codes_with_host_limit():
+    """Нормативы проверяются одновременно, но не больше max_per_host на хост"""
+    logger.info("ТЕСТ 3: Параллельные запросы с лимитом на хост")
+    reset_stub()
+    codes = [f"СП {i}.13330.2018" for i in range(12)]
+
+    async def run():
+        fetcher = CachedFetcher(cache_dir=tempfile.mkdtemp(), max_per_host=3)
+        original_fetcher, original_base = web_search.get_fetcher, web_search.CNTD_BASE_URL
+        web_search.get_fetcher = lambda: fetcher
+        web_search.CNTD_BASE_URL = get_stub_url()
+        try:
+            started = time.perf_counter()
+            # Дубликат кода объединяется с уже идущим запросом
+            results = await web_search.search_regulations_async(codes + codes[:1])
+            elapsed = time.perf_counter() - started
+        finally:
+            web_search.get_fetcher, web_search.CNTD_BASE_URL = original_fetcher, original_base
+            await fetcher.aclose()
+        return results, elapsed, fetcher.get_stats()
+
+    results, elapsed, stats = asyncio.run(run())
+    ok = (
+        all(r and r["status"] == "Действующий" for r in results)
+        and StubCntdHandler.peak <= 3
+        and len(StubCntdHandler.requests) == 12
+        and stats["coalesced"] == 1
+        and elapsed < 12 * 0.05
+    )
+    logger.info(
+        f"{'✅' if ok else '❌'} 13 кодов за {elapsed:.2f}с, пик на хост: {StubCntdHandler.peak}, "
+        f"запросов: {len(StubCntdHandler.requests)}"
+    )
+    return ok
+
+
+def test_parse_memoized():
+    """Повторный поиск не запускает ни сеть, ни BeautifulSoup"""
+    logger.info("ТЕСТ 4: Мемоизация разбора")
+    reset_stub()
+
+    async def run():
+        fetcher = CachedFetcher(cache_dir=tempfile.mkdtemp())
+        original_fetcher, original_base = web_search.get_fetcher, web_search.CNTD_BASE_URL
+        web_search.get_fetcher = lambda: fetcher
+        web_search.CNTD_BASE_URL = get_stub_url()
+        try:
+            await web_search.search_regulation_cntd_async("СП 70.13330.2012")
+            misses = web_search.PARSE_STATS["misses"]
+            repeat = await web_search.search_regulation_cntd_async("СП 70.13330.2012")
+        finally:
+            web_search.get_fetcher, web_search.CNTD_BASE_URL = original_fetcher, original_base
+            await fetcher.aclose()
+        return repeat, misses
+
+    repeat, misses = asyncio.run(run())
+    ok = (
+        repeat["valid_from"] == "20.06.2019"
+        and web_search.PARSE_STATS["misses"] == misses
+        and len(StubCntdHandler.requests) == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} разбор: {web_search.PARSE_STATS}, запросов: {len(StubCntdHandler.requests)}")
+    return ok
+
+
+def test_garbage_collection():
+    """Старые записи и тела страниц без ссылок удаляются, живые остаются"""
+    logger.info("ТЕСТ 5: Сборка мусора")
+    reset_stub()
+    cache_dir = tempfile.mkdtemp()
+    old = time.time() - 2 * 86400
+
+    async def run():
+        fetcher = CachedFetcher(cache_dir=cache_dir, max_age_days=1)
+        kept = await fetcher.fetch(f"{get_stub_url()}/search?q=SP20")
+        expired = await fetcher.fetch(f"{get_stub_url()}/search?q=SP22.13330")
+        await fetcher.aclose()
+
+        # Запись устарела (в т.ч. на диске), а в каталоге тел лежит тело без ссылок
+        meta_path = fetcher._meta_path(expired.url)
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({**meta, "fetched_at": old}, f)
+        fetcher._meta.pop(expired.url)
+        orphan = fetcher._blob_path("0" * 64)
+        with open(orphan, 'w', encoding='utf-8') as f:
+            f.write("replaced page")
+        for path in (orphan, expired.path):
+            os.utime(path, (old, old))
+
+        result = await asyncio.to_thread(fetcher.collect_garbage)
+        again = await fetcher.fetch(kept.url)
+        await fetcher.aclose()
+        return kept, expired, orphan, result, again
+
+    kept, expired, orphan, result, again = asyncio.run(run())
+    ok = (
+        result == {"expired": 1, "blobs_removed": 2}
+        and not os.path.exists(orphan) and not os.path.exists(expired.path)
+        and os.path.exists(kept.path) and not again.from_network
+        and len(StubCntdHandler.requests) == 2
+    )
+    logger.info(f"{'✅' if ok else '❌'} {result}, файлов страниц: {len(os.listdir(os.path.dirname(kept.path)))}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "TTL и ETag": test_ttl_and_revalidation(),
+        "Дисковый кэш": test_disk_cache_survives_restart(),
+        "Лимит на хост": test_concurrent_codes_with_host_limit(),
+        "Мемоизация разбора": test_parse_memoized(),
+        "Сборка мусора": test_garbage_collection()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,142 @@
+"""
+Тест локальной классификации намерений (intent_classifier.py)
+Проверяет точность на вопросах вне обучающих примеров, решение о запросе к Grok,
+метрики согласия, журнал и офлайн-обучение, время предсказания
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from intent_classifier import (
+    IntentClassifier, IntentPrediction, IntentRouter, main, read_log, seed_samples
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Вопросы, которых нет во встроенных примерах
+HELD_OUT = [
+    ("ок, запиши", "simple_save"),
+    ("сохрани в проект пожалуйста", "simple_save"),
+    ("что такое ПОС", "simple_question"),
+    ("чем отличается М300 от B22.5", "simple_question"),
+    ("какой защитный слой бетона для колонн", "technical_question"),
+    ("нахлест арматуры 16 мм", "technical_question"),
+    ("рассчитай армирование балки пролетом 6 м", "complex_analysis"),
+    ("проанализируй причины трещин в плите и что делать", "complex_analysis"),
+]
+
+_classifier = None
+
+
+def get_classifier() -> IntentClassifier:
+    global _classifier
+    if _classifier is None:
+        _classifier = IntentClassifier()
+        _classifier.train(seed_samples())
+    return _classifier
+
+
+def test_held_out_accuracy():
+    """Новые формулировки классифицируются верно"""
+    logger.info("ТЕСТ 1: Точность")
+    classifier = get_classifier()
+    predictions = [(text, expected, classifier.predict(text)) for text, expected in HELD_OUT]
+    wrong = [(text, p.intent) for text, expected, p in predictions if p.intent != expected]
+
+    ok = not wrong
+    logger.info(f"{'✅' if ok else '❌'} верно {len(HELD_OUT) - len(wrong)}/{len(HELD_OUT)}, ошибки: {wrong}")
+    return ok
+
+
+def test_teacher_only_when_unsure():
+    """Grok нужен только при низкой уверенности; согласие и расхождения считаются"""
+    logger.info("ТЕСТ 2: Запрос к Grok и метрики")
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "intent_log.jsonl")
+        router = IntentRouter(get_classifier(), threshold=0.6, audit_rate=0.0, log_path=log_path)
+
+        confident = router.predict("да, сохрани")
+        unsure = IntentPrediction("simple_question", 0.4, {})
+        router.record_teacher("можно ли штукатурить зимой", unsure, "technical_question")
+        router.record_teacher("что такое ППР", IntentPrediction("simple_question", 0.5, {}), "simple_question")
+        router.record_teacher("бетон", unsure, "garbage")
+
+        stats = router.get_stats()
+        logged = read_log(log_path)
+
+    ok = (
+        not router.needs_teacher(confident) and router.needs_teacher(unsure)
+        and stats["teacher_calls"] == 3 and stats["teacher_errors"] == 1
+        and stats["agreements"] == 1 and stats["disagreements"] == 1 and stats["agreement_rate"] == 0.5
+        and stats["confusion"] == {"simple_question": {"technical_question": 1, "simple_question": 1}}
+        and logged == [("можно ли штукатурить зимой", "technical_question"), ("что такое ППР", "simple_question")]
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def test_offline_training():
+    """Журнал ответов Grok исправляет ошибку модели после офлайн-обучения"""
+    logger.info("ТЕСТ 3: Офлайн-обучение")
+    question = "можно ли штукатурить стены при минус пяти"
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "intent_log.jsonl")
+        model_path = os.path.join(tmp, "intent_model.json")
+        router = IntentRouter(get_classifier(), log_path=log_path)
+        for text in [question, "можно ли штукатурить при минусовой температуре", "штукатурка зимой при минус 5",
+                     "можно ли класть плитку при минус пяти", "можно ли красить фасад при минус пяти"]:
+            router.record_teacher(text, IntentPrediction("simple_question", 0.4, {}), "technical_question")
+
+        code = main(["train", log_path, model_path])
+        trained = IntentClassifier()
+        loaded = trained.load(model_path)
+
+    prediction = trained.predict(question)
+    ok = code == 0 and loaded and prediction.intent == "technical_question"
+    logger.info(f"{'✅' if ok else '❌'} после обучения: {prediction.intent} ({prediction.confidence:.2f})")
+    return ok
+
+
+def test_predict_speed():
+    """Предсказание - микросекунды вместо запроса к API"""
+    logger.info("ТЕСТ 4: Скорость")
+    classifier = get_classifier()
+    texts = [text for text, _ in HELD_OUT]
+    runs = 2000
+    started = time.perf_counter()
+    for i in range(runs):
+        classifier.predict(texts[i % len(texts)])
+    avg_us = (time.perf_counter() - started) * 1e6 / runs
+
+    ok = avg_us < 200
+    logger.info(f"{'✅' if ok else '❌'} среднее {avg_us:.1f} мкс")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Точность": test_held_out_accuracy(),
+        "Grok и метрики": test_teacher_only_when_unsure(),
+        "Офлайн-обучение": test_offline_training(),
+        "Скорость": test_predict_speed()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,143 @@
+"""
+Тест быстрых ответов без AI (knowledge_fast_path.py)
+Проверяет ответы из баз знаний, отказ при низкой уверенности,
+приоритет баз, статистику и время поиска
+"""
+
+import logging
+import sys
+import time
+
+from knowledge_fast_path import Corpus, KnowledgeFastPath, FAST_PATH
+from search_index import SearchIndex
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def make_faq_like(name: str, questions: dict) -> SearchIndex:
+    index = SearchIndex(name, {"q": 3, "keywords": 3, "a": 1}, head_fields=("q", "keywords"))
+    for q_id, q_data in questions.items():
+        index.add(q_id, q_data, payload=(q_data["q"], q_data["a"]))
+    index.build()
+    return index
+
+
+FIRST = {
+    "cracks": {"q": "Допустимая ширина трещин в бетоне?", "a": "0,3-0,4 мм", "keywords": ["трещины"]},
+    "b25": {"q": "Какая прочность бетона B25?", "a": "25 МПа", "keywords": ["b25", "м350"]},
+    "curing": {"q": "Сколько дней твердеет бетон?", "a": "28 суток", "keywords": ["твердение"]},
+}
+SECOND = {
+    "cracks": {"q": "Ширина раскрытия трещин", "a": "Другой ответ", "keywords": ["трещины"]},
+    "roof": {"q": "Минимальный уклон кровли из профнастила", "a": "12°", "keywords": ["кровля", "уклон"]},
+    "pile": {"q": "Длина сваи", "a": "По расчёту", "keywords": ["сваи"]},
+}
+
+
+def make_fast_path() -> KnowledgeFastPath:
+    return KnowledgeFastPath([
+        Corpus("first", "Первая", lambda: make_faq_like("first", FIRST), min_coverage=0.75, min_score=1.0),
+        Corpus("second", "Вторая", lambda: make_faq_like("second", SECOND), min_coverage=0.75, min_score=1.0),
+    ])
+
+
+def test_practical_knowledge_answers():
+    """Вопросы по практической базе получают ответ из неё"""
+    logger.info("ТЕСТ 1: Ответы из баз знаний")
+    fast_path = KnowledgeFastPath()
+    fast_path.warm_up()
+
+    height = fast_path.find_answer("работа на высоте группы безопасности")
+    winter = fast_path.find_answer("зимнее бетонирование методы прогрева")
+
+    ok = (
+        height is not None and height.source == "practical" and "Работа на высоте" in height.title
+        and winter is not None and "прогрев" in winter.text.lower()
+        and fast_path.get_stats()["hits"] == 2
+    )
+    logger.info(f"{'✅' if ok else '❌'} {height and height.title}, {winter and winter.title}")
+    return ok
+
+
+def test_low_confidence_goes_to_model():
+    """Частичное совпадение, болтовня и длинные вопросы уходят модели"""
+    logger.info("ТЕСТ 2: Низкая уверенность")
+    fast_path = KnowledgeFastPath()
+    questions = [
+        "Почему на объекте в Казани трещит стяжка после прогрева, что делать с подрядчиком?",
+        "привет как дела",
+        "как выбрать кирпич для печи",
+        "бетон",
+    ]
+    answers = [fast_path.find_answer(q) for q in questions]
+    stats = fast_path.get_stats()
+
+    ok = all(a is None for a in answers) and stats["misses"] + stats["skipped"] == len(questions)
+    logger.info(f"{'✅' if ok else '❌'} {[a and a.title for a in answers]}, {stats}")
+    return ok
+
+
+def test_priority_and_margin():
+    """Первая база с уверенным ответом побеждает; неоднозначный ответ пропускается"""
+    logger.info("ТЕСТ 3: Приоритет баз")
+    fast_path = make_fast_path()
+
+    cracks = fast_path.find_answer("ширина трещин")
+    roof = fast_path.find_answer("уклон кровли из профнастила")
+    ambiguous = fast_path.find_answer("бетон прочность твердеет")
+    fast_path.record_refine()
+    stats = fast_path.get_stats()
+
+    ok = (
+        cracks is not None and cracks.source == "first" and cracks.text == "0,3-0,4 мм"
+        and roof is not None and roof.source == "second"
+        and ambiguous is None
+        and stats["hits_by_source"] == {"first": 1, "second": 1}
+        and stats["refine_requests"] == 1 and stats["refine_rate"] == 0.5
+    )
+    logger.info(f"{'✅' if ok else '❌'} {cracks and cracks.source}, {roof and roof.source}, {stats}")
+    return ok
+
+
+def test_lookup_speed():
+    """Поиск по всем базам - доли миллисекунды (вместо секунд у модели)"""
+    logger.info("ТЕСТ 4: Скорость")
+    FAST_PATH.warm_up()
+    questions = ["работа на высоте группы безопасности", "как выбрать кирпич для печи",
+                 "сроки твердения бетона зимой", "патент для иностранных работников"]
+
+    runs = 500
+    started = time.perf_counter()
+    for i in range(runs):
+        FAST_PATH.find_answer(questions[i % len(questions)])
+    avg_ms = (time.perf_counter() - started) * 1000 / runs
+
+    ok = avg_ms < 1.0
+    logger.info(f"{'✅' if ok else '❌'} среднее {avg_ms:.3f} мс, {FAST_PATH.get_stats()}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Базы знаний": test_practical_knowledge_answers(),
+        "Низкая уверенность": test_low_confidence_goes_to_model(),
+        "Приоритет": test_priority_and_margin(),
+        "Скорость": test_lookup_speed()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
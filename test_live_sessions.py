@@ -0,0 +1,247 @@
+"""
+Тест общего менеджера голосовых сессий (live_sessions.py)
+Проверяет лимит одновременных сессий и вытеснение простаивающих, закрытие
+по колесу таймеров (простой и разрыв соединения), очередь отправки при
+медленном сервере модели, лимит транскрипции и метрики
+"""
+
+import asyncio
+import logging
+import sys
+
+from live_sessions import LiveSessionManager, SessionTranscript, TimerWheel
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBackend:
+    """Сессия бэкенда: медленная отправка, флаг соединения, stop()"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.is_connected = True
+        self.sent = []
+        self.stopped = False
+
+    async def send(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(message)
+        return True
+
+    async def stop(self):
+        self.stopped = True
+        self.is_connected = False
+
+
+def test_session_limit():
+    """Не больше max_sessions; вытесняется только давно простаивающая"""
+    logger.info("ТЕСТ 1: Лимит сессий")
+
+    async def scenario():
+        clock = FakeClock()
+        manager = LiveSessionManager(max_sessions=2, idle_seconds=600, preempt_idle_seconds=60, clock=clock)
+        first = await manager.open(("gemini", 1), "gemini", FakeBackend)
+        clock.now += 30
+        second = await manager.open(("proxy", 2), "proxy", FakeBackend)
+        rejected = await manager.open(("gemini", 3), "gemini", FakeBackend)
+
+        clock.now += 40  # первая простаивает 70 с, вторая 40 с
+        second.touch()
+        third = await manager.open(("gemini", 3), "gemini", FakeBackend)
+
+        replaced_backend = third.session
+        again = await manager.open(("gemini", 3), "gemini", FakeBackend)
+        failed = await manager.open(("openai", 4), "openai", lambda: None)
+        return manager, first, rejected, third, replaced_backend, again, failed
+
+    manager, first, rejected, third, replaced, again, failed = asyncio.run(scenario())
+    stats = manager.get_stats()
+    ok = (
+        rejected is None and first.session.stopped and replaced.stopped
+        and again is not None and again is not third and failed is None
+        and stats["active"] == 2 and stats["backends"] == {"proxy": 1, "gemini": 1}
+        and stats["closed"] == {"preempted": 1, "replaced": 1}
+        and stats["rejected"] == 2 and stats["failed"] == 0
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def test_timer_wheel_expiry():
+    """Колесо: простаивающие закрываются, активные перепланируются, разрыв - сразу"""
+    logger.info("ТЕСТ 2: Колесо таймеров")
+
+    wheel = TimerWheel(horizon=10, tick=1, now=0)
+    wheel.schedule("a", 3.5)
+    wheel.schedule("b", 100)  # дальше горизонта - в последний слот
+    early, due = wheel.advance(2.9), wheel.advance(3.0)
+    wheel_ok = early == [] and due == ["a"] and wheel.advance(12) == ["b"]
+
+    async def scenario():
+        clock = FakeClock()
+        manager = LiveSessionManager(max_sessions=1000, idle_seconds=60, tick=1, clock=clock)
+        sessions = [await manager.open(("proxy", i), "proxy", FakeBackend) for i in range(300)]
+
+        checked = []
+        for step in range(1, 61):
+            clock.now += 1
+            for live in sessions[:100]:  # треть сессий активна
+                live.touch()
+            checked.append(len(manager.wheel.slots[(manager.wheel._index + 1) % len(manager.wheel.slots)]))
+            await manager.expire()
+        after_idle = len(manager)
+
+        # Разрыв соединения: закрытие на следующем шаге, не через минуту
+        sessions[0].session.is_connected = False
+        manager.check_soon(("proxy", 0))
+        clock.now += 1
+        await manager.expire()
+        return manager, sessions, after_idle, max(checked)
+
+    manager, sessions, after_idle, max_slot = asyncio.run(scenario())
+    ok = (
+        wheel_ok and after_idle == 100 and len(manager) == 99
+        and all(live.session.stopped for live in sessions[100:])
+        and sessions[0].session.stopped and not sessions[1].session.stopped
+        and manager.closed == {"idle": 200, "disconnected": 1}
+        and max_slot <= 300
+    )
+    logger.info(f"{'✅' if ok else '❌'} после простоя: {after_idle}, закрыто: {manager.closed}")
+    return ok
+
+
+def test_backpressure():
+    """Медленный сервер: очередь ограничена по байтам, порядок сохраняется"""
+    logger.info("ТЕСТ 3: Очередь отправки")
+
+    async def scenario():
+        manager = LiveSessionManager(buffer_bytes=3000, send_timeout=0.05)
+        live = await manager.open(("proxy", 1), "proxy", lambda: FakeBackend(delay=0.02))
+        backend = live.session
+
+        accepted, peak = [], 0
+        for i in range(10):
+            accepted.append(await live.send(backend.send, i, nbytes=1000))
+            peak = max(peak, live.buffered)
+        while live.buffered:
+            await asyncio.sleep(0.01)
+
+        # Сервер завис: место не освобождается - сообщение отбрасывается по таймауту
+        backend.delay = 1.0
+        stalled = [await live.send(backend.send, f"s{i}", nbytes=1000) for i in range(4)]
+
+        # Ошибка отправки закрывает сессию
+        async def broken(message):
+            raise ConnectionError("upstream closed")
+        other = await manager.open(("proxy", 2), "proxy", FakeBackend)
+        await other.send(broken, "x", nbytes=10)
+        await asyncio.sleep(0.05)
+        closed_on_error = manager.get(("proxy", 2)) is None and other.session.stopped
+        await manager.stop()
+        return manager, backend, accepted, peak, stalled, closed_on_error
+
+    manager, backend, accepted, peak, stalled, closed_on_error = asyncio.run(scenario())
+    ok = (
+        all(accepted) and backend.sent[:10] == list(range(10)) and peak <= 3000
+        and stalled == [True, True, True, False]
+        and manager.stats["backpressure_drops"] == 1 and manager.stats["backpressure_waits"] >= 7
+        and closed_on_error and manager.stats["send_errors"] == 1
+        and len(manager) == 0 and manager.closed.get("shutdown") == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} пик очереди {peak} байт, отброшено: {stalled}, {manager.stats}")
+    return ok
+
+
+def test_transcript_limits():
+    """Транскрипция: не больше max_turns обменов и max_chars символов"""
+    logger.info("ТЕСТ 4: Лимит транскрипции")
+
+    transcript = SessionTranscript(max_turns=5, max_chars=1000)
+    for i in range(20):
+        transcript.set_user(f"вопрос {i}")
+        transcript.add_bot("ответ ")
+        transcript.add_bot(str(i))
+        transcript.commit()
+    by_turns = [turn["user"] for turn in transcript] == [f"вопрос {i}" for i in range(15, 20)]
+
+    long = SessionTranscript(max_turns=50, max_chars=1000)
+    for _ in range(10):
+        long.set_user("в" * 100)
+        for _ in range(100):
+            long.add_bot("о" * 50)  # ответ на 5000 символов обрезается
+        long.commit()
+    empty_commit = long.commit()
+
+    ok = (
+        by_turns and transcript.total == 20 and transcript.dropped == 15
+        and len(long) == 1 and long.chars <= 1100 and long.total == 10
+        and len(long.turns[0]["bot"]) == 1000 and not empty_commit
+    )
+    logger.info(f"{'✅' if ok else '❌'} обменов: {len(transcript)}/{transcript.total}, "
+                f"длинные: {len(long)} ({long.chars} симв.)")
+    return ok
+
+
+def test_metrics():
+    """Байт/с в обе стороны и задержка от запроса до первого аудио"""
+    logger.info("ТЕСТ 5: Метрики")
+
+    async def scenario():
+        clock = FakeClock()
+        manager = LiveSessionManager(clock=clock)
+        live = await manager.open(("gemini", 1), "gemini", FakeBackend)
+        for latency in (0.2, 0.3, 0.4, 0.5, 1.5):
+            await live.send(live.session.send, "audio", nbytes=32000, request=True)
+            await asyncio.sleep(0)
+            clock.now += latency
+            live.received(48000)
+            clock.now += 0.1
+            live.received(48000)  # продолжение ответа - не замер
+        live.received(100, audio=False)
+        return manager.get_stats(), live.get_stats()
+
+    stats, session_stats = asyncio.run(scenario())
+    ok = (
+        stats["latency_p50_ms"] == 400 and stats["latency_p95_ms"] == 1500
+        and stats["bytes_out_per_s"] == 16000 and stats["bytes_in_per_s"] == 48010
+        and session_stats["bytes_out"] == 160000 and session_stats["bytes_in"] == 480100
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("live_sessions").setLevel(logging.ERROR)
+    results = {
+        "Лимит сессий": test_session_limit(),
+        "Колесо таймеров": test_timer_wheel_expiry(),
+        "Очередь отправки": test_backpressure(),
+        "Лимит транскрипции": test_transcript_limits(),
+        "Метрики": test_metrics()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,214 @@
+"""
+Тест планировщика LLM Council (llm_council.py)
+Проверяет выход по кворуму 2 из 3 без ожидания медленной модели, дедлайны
+участников, потоковый синтез Председателя с запасным ответом и трассировку этапов
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+import llm_council
+from llm_council import CouncilStats, CouncilTrace, LLMCouncil
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+QUESTION = "Как правильно армировать плиту перекрытия по СП 63.13330 с учётом нагрузок?"
+SYNTHESIS = ["🏛️ **РЕШЕНИЕ СОВЕТА**\n\n", "Армирование по СП 63.13330 ", "с защитным слоем 20 мм."]
+
+
+class FakeXAI:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def chat_completions_create_async(self, model, messages, max_tokens=1000, temperature=0.7):
+        await asyncio.sleep(self.delay)
+        return {"choices": [{"message": {"content": "Grok: шаг стержней 200 мм"}}]}
+
+
+class FakeStream:
+    def __init__(self, fail):
+        self.fail = fail
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    async def text_stream(self):
+        for text in SYNTHESIS:
+            await asyncio.sleep(0.01)
+            if self.fail:
+                raise RuntimeError("overloaded")
+            yield text
+
+    async def get_final_message(self):
+        class Message:
+            usage = {"input_tokens": 100, "cache_read_input_tokens": 0}
+        return Message()
+
+
+class FakeClaude:
+    def __init__(self, delay, fail_stream=False):
+        self.delay = delay
+        self.fail_stream = fail_stream
+        self.messages = self
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(self.delay)
+
+        class Response:
+            usage = {"input_tokens": 50}
+            content = [type("Block", (), {"text": "Claude: защитный слой 20 мм"})()]
+        return Response()
+
+    def stream(self, **kwargs):
+        return FakeStream(self.fail_stream)
+
+
+class FakeGemini:
+    def __init__(self, delay):
+        self.delay = delay
+        self.cancelled = False
+
+    async def generate_content_async(self, prompt, stream=False):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return type("Response", (), {"text": "Gemini: практика"})()
+
+
+def make_council(grok=0.05, claude=0.05, gemini=5.0, fail_stream=False) -> LLMCouncil:
+    council = LLMCouncil.__new__(LLMCouncil)
+    council.xai_client = FakeXAI(grok)
+    council.claude_client = FakeClaude(claude, fail_stream)
+    council.gemini_model = FakeGemini(gemini)
+    council.available_models = ["grok", "claude", "gemini"]
+    council.is_available = True
+    council.cache = None
+    return council
+
+
+def test_quorum_early_exit():
+    """Синтез начинается после 2 мнений из 3, медленная модель отменяется"""
+    logger.info("ТЕСТ 1: Кворум")
+    council = make_council(gemini=5.0)
+
+    started = time.perf_counter()
+    result = asyncio.run(council.consult(QUESTION, skip_review=True))
+    elapsed = time.perf_counter() - started
+    trace = result["trace"]
+
+    ok = (
+        result["success"] and elapsed < 1.0
+        and result["opinions"]["gemini"] is None and council.gemini_model.cancelled
+        and result["models_used"] == ["grok", "claude"]
+        and trace["early_exit"] and trace["members"]["opinions:gemini"]["status"] == "cancelled"
+        and trace["members"]["opinions:grok"]["status"] == "ok"
+    )
+    logger.info(f"{'✅' if ok else '❌'} {elapsed:.2f} с, {trace}")
+    return ok
+
+
+def test_member_deadline():
+    """Без кворума этап ждёт не дольше дедлайна участников"""
+    logger.info("ТЕСТ 2: Дедлайны")
+    council = make_council(claude=2.0, gemini=2.0)
+    original = llm_council.COUNCIL_MEMBER_DEADLINE
+    llm_council.COUNCIL_MEMBER_DEADLINE = 0.2
+    try:
+        trace = CouncilTrace()
+        started = time.perf_counter()
+        opinions = asyncio.run(council.stage1_get_opinions(QUESTION, trace=trace))
+        elapsed = time.perf_counter() - started
+    finally:
+        llm_council.COUNCIL_MEMBER_DEADLINE = original
+
+    ok = (
+        elapsed < 0.5 and opinions["grok"] and opinions["claude"] is None and opinions["gemini"] is None
+        and trace.members["opinions:claude"]["status"] == "timeout"
+        and trace.members["opinions:gemini"]["status"] == "timeout" and not trace.early_exit
+        and 150 < trace.stages["opinions"] < 500
+    )
+    logger.info(f"{'✅' if ok else '❌'} {elapsed:.2f} с, {trace.members}")
+    return ok
+
+
+def test_streaming_synthesis():
+    """Ответ Председателя приходит частями; при сбое - лучший ответ этапа 1"""
+    logger.info("ТЕСТ 3: Потоковый синтез")
+    chunks, fallback_chunks = [], []
+
+    async def collect(chunk):
+        chunks.append(chunk)
+
+    async def collect_fallback(chunk):
+        fallback_chunks.append(chunk)
+
+    result = asyncio.run(make_council().consult(QUESTION, skip_review=False, on_chunk=collect))
+    failed = asyncio.run(make_council(fail_stream=True).consult(QUESTION, skip_review=True, on_chunk=collect_fallback))
+    trace = result["trace"]
+
+    ok = (
+        chunks == SYNTHESIS and result["final_answer"] == "".join(SYNTHESIS)
+        and set(result["reviews"]) == {"grok", "claude"}
+        and set(trace["stages_ms"]) == {"opinions", "review", "synthesis"}
+        and trace["first_token_ms"] < trace["total_ms"]
+        and failed["success"] and fallback_chunks == [failed["final_answer"]]
+        and failed["final_answer"].startswith("Grok")
+    )
+    logger.info(f"{'✅' if ok else '❌'} {len(chunks)} частей, первый токен {trace['first_token_ms']} мс, "
+                f"всего {trace['total_ms']} мс")
+    return ok
+
+
+def test_stats():
+    """Сводка: число консультаций, ранние выходы, промахи участников"""
+    logger.info("ТЕСТ 4: Статистика")
+    stats = CouncilStats()
+    early = CouncilTrace(early_exit=True, total_ms=1200.0, first_token_ms=900.0)
+    early.members["opinions:gemini"] = {"status": "cancelled", "ms": 800.0}
+    late = CouncilTrace(total_ms=3000.0)
+    late.members["opinions:claude"] = {"status": "timeout", "ms": 2500.0}
+    stats.record(early)
+    stats.record(late)
+    summary = stats.get_stats()
+
+    ok = (
+        summary["consults"] == 2 and summary["early_exits"] == 1
+        and summary["p50_total_ms"] == 3000.0 and summary["p50_first_token_ms"] == 900.0
+        and summary["member_misses"] == {"gemini_cancelled": 1, "claude_timeout": 1}
+    )
+    logger.info(f"{'✅' if ok else '❌'} {summary}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Кворум": test_quorum_early_exit(),
+        "Дедлайны": test_member_deadline(),
+        "Потоковый синтез": test_streaming_synthesis(),
+        "Статистика": test_stats()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
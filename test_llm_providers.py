@@ -0,0 +1,148 @@
+"""
+Тест асинхронной цепочки AI провайдеров (llm_providers.py)
+Проверяет fallback, hedging, отмену по новому сообщению и ограничение конкурентности
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from llm_providers import ProviderChain, run_user_request
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class FakeChain(ProviderChain):
+    """Цепочка с имитацией провайдеров: задержка и ошибка задаются на провайдера"""
+
+    def __init__(self, delays: dict, failing: set = frozenset(), **kwargs):
+        super().__init__(xai_client=object(), **kwargs)
+        self.claude_client = object()
+        self.gemini_available = True
+        self.providers = ["xai", "claude", "gemini"]
+        self.delays = delays
+        self.failing = failing
+        self.active = 0
+        self.peak = 0
+        self.cancelled = []
+
+    async def _fake(self, name: str) -> str:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(self.delays.get(name, 0))
+            if name in self.failing:
+                raise Exception(f"{name} down")
+            return f"ответ от {name}"
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        finally:
+            self.active -= 1
+
+    async def _call_xai(self, *args):
+        return await self._fake("xai")
+
+    async def _call_claude(self, *args):
+        return await self._fake("claude")
+
+    async def _call_gemini(self, *args):
+        return await self._fake("gemini")
+
+
+MESSAGES = [{"role": "user", "content": "Какой бетон для фундамента?"}]
+
+
+def test_fallback():
+    """Ошибка Grok сразу переключает на Claude, затем на Gemini"""
+    logger.info("ТЕСТ 1: Fallback по цепочке")
+
+    async def run():
+        chain = FakeChain({}, failing={"xai", "claude"}, hedge_after=0)
+        response = await chain.complete(MESSAGES, "grok-4-1-fast", 100)
+        return response, chain.get_stats()
+
+    response, stats = asyncio.run(run())
+    ok = response["provider"] == "gemini" and stats["fallbacks"] == 2
+    logger.info(f"{'✅' if ok else '❌'} Ответил: {response['provider']}, fallbacks: {stats['fallbacks']}")
+    return ok
+
+
+def test_hedging():
+    """Медленный Grok дублируется Claude, победитель отменяет проигравшего"""
+    logger.info("ТЕСТ 2: Hedged-запрос")
+
+    async def run():
+        chain = FakeChain({"xai": 1.0, "claude": 0.05}, hedge_after=0.05)
+        started = time.perf_counter()
+        response = await chain.complete(MESSAGES, "grok-4-1-fast", 100)
+        await asyncio.sleep(0)
+        return response, time.perf_counter() - started, chain
+
+    response, elapsed, chain = asyncio.run(run())
+    ok = response["provider"] == "claude" and elapsed < 0.5 and "xai" in chain.cancelled
+    logger.info(f"{'✅' if ok else '❌'} Ответил: {response['provider']} за {elapsed:.2f}с, отменены: {chain.cancelled}")
+    return ok
+
+
+def test_cancel_on_new_message():
+    """Второе сообщение пользователя отменяет первый незавершённый запрос"""
+    logger.info("ТЕСТ 3: Отмена при новом сообщении")
+
+    async def run():
+        chain = FakeChain({"xai": 0.3}, hedge_after=0)
+        first = asyncio.ensure_future(run_user_request(1, chain.complete(MESSAGES, "grok", 100)))
+        await asyncio.sleep(0.05)
+        second = await run_user_request(1, chain.complete(MESSAGES, "grok", 100))
+        try:
+            await first
+            return False, second
+        except asyncio.CancelledError:
+            return True, second
+
+    first_cancelled, second = asyncio.run(run())
+    ok = first_cancelled and second["provider"] == "xai"
+    logger.info(f"{'✅' if ok else '❌'} Первый отменён: {first_cancelled}, второй: {second['provider']}")
+    return ok
+
+
+def test_bounded_concurrency():
+    """Одновременных вызовов провайдера не больше max_concurrency"""
+    logger.info("ТЕСТ 4: Семафор на провайдера")
+
+    async def run():
+        chain = FakeChain({"xai": 0.02}, hedge_after=0, max_concurrency=4)
+        await asyncio.gather(*[chain.complete(MESSAGES, "grok", 100) for _ in range(40)])
+        return chain.peak
+
+    peak = asyncio.run(run())
+    ok = peak == 4
+    logger.info(f"{'✅' if ok else '❌'} 40 запросов, пик одновременных: {peak}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Fallback": test_fallback(),
+        "Hedging": test_hedging(),
+        "Отмена": test_cancel_on_new_message(),
+        "Семафор": test_bounded_concurrency()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,171 @@
+"""
+Тест маршрутизации запросов (model_selector.py)
+Проверяет совпадение решений автомата с построчной проверкой списков ключевых слов,
+пересекающиеся ключевые слова, LRU и пакетный режим, время маршрутизации
+на нескольких тысячах вопросов из баз бота (цель - менее 20 мкс на сообщение)
+"""
+
+import logging
+import sys
+import time
+
+from model_selector import ModelSelector, get_model_selector
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+PHRASINGS = ["{}", "Подскажите, {}", "{} - какие требования?", "почему {} на объекте"]
+
+
+def reference_model(selector: ModelSelector, question: str, has_photo: bool) -> tuple:
+    """Решение прежней реализации: any(kw in question) по каждому списку"""
+    q = question.lower()
+
+    def has(keywords):
+        return any(kw in q for kw in keywords)
+
+    if has_photo:
+        return ("gemini_vision", False) if has(selector.defect_keywords) else ("grok_vision", False)
+    if has(selector.drawing_keywords):
+        return ("gemini_image", False)
+    if has(selector.simple_question_patterns):
+        return ("grok_general", False)
+    regulations = selector._mentions_regulations(question)
+    if (has(selector.technical_keywords) or has(selector.legal_keywords)
+            or regulations or has(selector.technical_context_keywords)):
+        return ("claude_technical", regulations)
+    return ("grok_general", has(selector.web_search_keywords))
+
+
+def load_questions() -> list:
+    """Вопросы и темы из баз бота во всех формулировках PHRASINGS"""
+    from intent_classifier import SEED_EXAMPLES
+    from knowledge_fast_path import _nested_keys
+    from practical_knowledge_2025 import get_all_practical_knowledge
+    from practical_knowledge_advanced_2025 import get_all_advanced_knowledge
+    from regulations_2025_updated import REGULATIONS_2025_UPDATED
+
+    topics = [text for examples in SEED_EXAMPLES.values() for text in examples]
+    for sections in (get_all_practical_knowledge(), get_all_advanced_knowledge()):
+        for section in sections.values():
+            topics.extend(_nested_keys(section))
+    for code, reg in REGULATIONS_2025_UPDATED.items():
+        topics.extend([f"Что требует {code}?", reg["title"], f"{reg['title']} ({code}) действует?"])
+
+    return list(dict.fromkeys(p.format(t) for t in topics for p in PHRASINGS))
+
+
+def test_matches_reference():
+    """Автомат даёт те же решения, что и проверка каждого списка"""
+    logger.info("ТЕСТ 1: Совпадение с прежней логикой")
+    selector = ModelSelector()
+    questions = load_questions()
+
+    mismatches = []
+    for question in questions:
+        for has_photo in (False, True):
+            decision = selector.classify_request(question, has_photo)
+            got = (decision["model"], decision["needs_web_search"])
+            expected = reference_model(selector, question, has_photo)
+            if got != expected:
+                mismatches.append((question, has_photo, got, expected))
+
+    ok = not mismatches and len(questions) > 2000
+    logger.info(f"{'✅' if ok else '❌'} {len(questions)} вопросов, расхождений: {len(mismatches)} {mismatches[:3]}")
+    return ok
+
+
+def test_overlapping_keywords():
+    """Слова внутри других ключевых слов и пересечения не теряются"""
+    logger.info("ТЕСТ 2: Пересекающиеся ключевые слова")
+    selector = ModelSelector()
+    # "момент" (расчёт) внутри "на данный момент" (поиск), "иск" в "риск", "что с" в "что сейчас"
+    cases = {
+        "на данный момент": {"technical", "web"},
+        "нужен планировщик": {"drawing"},
+        "какой риск": {"legal", "context"},
+        "рассчитать": {"technical"},
+        "что сейчас": {"web", "defect"},
+    }
+    found = {text: set(selector._automaton.find_groups(text)) for text in cases}
+
+    ok = found == cases
+    logger.info(f"{'✅' if ok else '❌'} {found}")
+    return ok
+
+
+def test_cache_and_batch():
+    """Повторы берутся из LRU, решения - копии, пакет сохраняет порядок"""
+    logger.info("ТЕСТ 3: LRU и пакетный режим")
+    selector = ModelSelector(cache_size=2)
+    first = selector.classify_request("Рассчитай нагрузку на плиту")
+    first["model"] = "changed"
+    again = selector.classify_request("Рассчитай нагрузку на плиту")
+    selector.classify_request("Нарисуй схему")
+    selector.classify_request("Привет")
+    selector.classify_request("Рассчитай нагрузку на плиту")
+
+    batch = selector.classify_many(["Привет", "Нарисуй схему", "Привет", "Требования СП 63.13330"])
+    stats = selector.get_stats()
+
+    ok = (
+        again["model"] == "claude_technical"
+        and [d["model"] for d in batch] == ["grok_general", "gemini_image", "grok_general", "claude_technical"]
+        and batch[3]["needs_web_search"] is True
+        and stats["cache_size"] == 2 and stats["requests"] == 8 and stats["cache_hits"] == 2
+        and get_model_selector() is get_model_selector()
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def test_routing_speed():
+    """Маршрутизация нескольких тысяч разных вопросов - менее 20 мкс на сообщение"""
+    logger.info("ТЕСТ 4: Скорость")
+    questions = load_questions()
+    selector = ModelSelector(cache_size=0)
+    selector.classify_many(questions[:100])
+
+    runs = 3
+    started = time.perf_counter()
+    for _ in range(runs):
+        for question in questions:
+            selector.classify_request(question)
+    avg_us = (time.perf_counter() - started) * 1e6 / (runs * len(questions))
+
+    cached = ModelSelector()
+    cached.classify_many(questions)
+    started = time.perf_counter()
+    for question in questions:
+        cached.classify_request(question)
+    cached_us = (time.perf_counter() - started) * 1e6 / len(questions)
+
+    ok = avg_us < 20
+    logger.info(f"{'✅' if ok else '❌'} {len(questions)} вопросов: {avg_us:.1f} мкс без кэша, "
+                f"{cached_us:.1f} мкс из LRU")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Совпадение с прежней логикой": test_matches_reference(),
+        "Пересечения": test_overlapping_keywords(),
+        "LRU и пакет": test_cache_and_batch(),
+        "Скорость": test_routing_speed()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,300 @@
+"""
+Тест конвейера подготовки фото (photo_pipeline.py)
+Проверяет выбор размера Telegram, поворот по EXIF, уменьшение и JPEG,
+передачу подходящего JPEG без перекодирования, кэш по file_unique_id с
+одной загрузкой на одновременные запросы, работу без блокировки event loop,
+метрики (байты, время подготовки и анализа) и однократный учёт анализа Gemini
+"""
+
+import asyncio
+import logging
+import sys
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+from PIL import Image
+
+import gemini_vision
+from photo_pipeline import (
+    EXIF_ORIENTATION,
+    PhotoPipeline,
+    prepare_image,
+    select_photo_size
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def make_jpeg(width: int, height: int, orientation: int = 1, quality: int = 92) -> bytes:
+    """Снимок с шумной текстурой (как фото с камеры), при необходимости с EXIF"""
+    image = Image.effect_noise((width, height), 40).convert("RGB")
+    # Левая половина светлее - по ней проверяется поворот
+    image.paste((230, 230, 230), (0, 0, width // 2, height // 8))
+    out = BytesIO()
+    exif = Image.Exif()
+    if orientation != 1:
+        exif[EXIF_ORIENTATION] = orientation
+    image.save(out, format="JPEG", quality=quality, exif=exif.tobytes())
+    return out.getvalue()
+
+
+def photo_sizes(width: int, height: int):
+    """message.photo как у Telegram: 90, 320, 800, 1280, 2560 по длинной стороне"""
+    sizes = []
+    for side in (90, 320, 800, 1280, 2560):
+        scale = min(1.0, side / max(width, height))
+        sizes.append(SimpleNamespace(
+            width=round(width * scale), height=round(height * scale),
+            file_id=f"file_{side}", file_unique_id=f"uniq_{side}"
+        ))
+    return sizes
+
+
+class FakeBot:
+    """bot.get_file -> файл с download_as_bytearray (с задержкой сети)"""
+
+    def __init__(self, files, delay: float = 0.02):
+        self.files = files
+        self.delay = delay
+        self.downloads = []
+
+    async def get_file(self, file_id):
+        bot = self
+
+        class TelegramFile:
+            async def download_as_bytearray(self):
+                await asyncio.sleep(bot.delay)
+                bot.downloads.append(file_id)
+                return bytearray(bot.files[file_id])
+
+        return TelegramFile()
+
+
+def test_select_size():
+    """Наименьший размер не меньше нужного модели, иначе самый большой"""
+    logger.info("ТЕСТ 1: Выбор размера Telegram")
+    sizes = photo_sizes(4000, 3000)
+    shuffled = [sizes[3], sizes[0], sizes[4], sizes[2], sizes[1]]
+    small = photo_sizes(600, 400)[:3]
+
+    ok = (
+        select_photo_size(shuffled).file_id == "file_1280"
+        and select_photo_size(sizes, 1000).file_id == "file_1280"
+        and select_photo_size(sizes, 2000).file_id == "file_2560"
+        and select_photo_size(sizes, 320).file_id == "file_320"
+        and select_photo_size(small, 1280).file_id == "file_800"
+    )
+    logger.info(f"{'✅' if ok else '❌'} 4000x3000 → {select_photo_size(shuffled).width}px")
+    return ok
+
+
+def test_prepare_image():
+    """Поворот по EXIF, уменьшение, JPEG из PNG с прозрачностью, передача как есть"""
+    logger.info("ТЕСТ 2: Подготовка изображения")
+
+    # Снимок с камеры телефона: 4000x3000, ориентация 6 (повернуть на 90°)
+    rotated = prepare_image(make_jpeg(4000, 3000, orientation=6), max_side=1280)
+    with Image.open(BytesIO(rotated.data)) as image:
+        rotated_ok = (
+            image.format == "JPEG" and image.size == (960, 1280)
+            and Image.Exif.get(image.getexif(), EXIF_ORIENTATION, 1) == 1
+            # Светлая полоса сверху слева ушла к правому краю
+            and sum(image.getpixel((950, 10))) > sum(image.getpixel((10, 1270)))
+        )
+
+    rgba = Image.new("RGBA", (2000, 1000), (255, 0, 0, 0))
+    rgba.paste((0, 0, 255, 255), (0, 0, 1000, 1000))
+    png = BytesIO()
+    rgba.save(png, format="PNG")
+    flattened = prepare_image(png.getvalue(), max_side=1280)
+    with Image.open(BytesIO(flattened.data)) as image:
+        png_ok = (
+            image.mode == "RGB" and image.size == (1280, 640)
+            and image.getpixel((1200, 300))[0] > 240  # прозрачное - на белом фоне
+            and image.getpixel((100, 300))[2] > 200
+        )
+
+    small = make_jpeg(1280, 960)
+    passthrough = prepare_image(small, max_side=1280)
+
+    ok = (
+        rotated_ok and rotated.reencoded and png_ok
+        and not passthrough.reencoded and passthrough.data == small
+        and (passthrough.width, passthrough.height) == (1280, 960)
+    )
+    logger.info(f"{'✅' if ok else '❌'} EXIF: {rotated.width}x{rotated.height} "
+                f"({rotated.source_bytes} → {rotated.upload_bytes} байт), PNG: {flattened.width}x{flattened.height}")
+    return ok
+
+
+def test_cache_single_flight():
+    """Одновременные запросы одного фото - одна загрузка; повтор - из кэша"""
+    logger.info("ТЕСТ 3: Кэш по file_unique_id")
+    sizes = photo_sizes(4000, 3000)
+    files = {size.file_id: make_jpeg(size.width, size.height) for size in sizes[2:]}
+
+    async def scenario():
+        pipeline = PhotoPipeline(workers=2)
+        bot = FakeBot(files)
+        try:
+            first = await asyncio.gather(*(pipeline.load_message_photo(bot, sizes) for _ in range(5)))
+            again = await pipeline.load(bot, "file_1280", "uniq_1280")
+            bigger = await pipeline.load_message_photo(bot, sizes, max_side=2000)
+            return bot, first, again, bigger, pipeline.get_stats()
+        finally:
+            pipeline.close()
+
+    bot, first, again, bigger, stats = asyncio.run(scenario())
+    ok = (
+        bot.downloads == ["file_1280", "file_2560"]
+        and sum(not photo.cached for photo in first) == 1 and again.cached
+        and all(photo.data == first[0].data for photo in first + [again])
+        and not first[0].reencoded and first[0].download_ms > 0
+        and bigger.width == 2000 and bigger.reencoded
+        and stats["requests"] == 7 and stats["cache_hits"] == 5 and stats["downloads"] == 2
+    )
+    logger.info(f"{'✅' if ok else '❌'} загрузок: {bot.downloads}, из кэша: {stats['cache_hits']}")
+    return ok
+
+
+def test_pool_benchmark():
+    """Было: самый большой размер целиком; стало: нужный размер. Event loop свободен"""
+    logger.info("ТЕСТ 4: Бенчмарк подготовки")
+    camera = make_jpeg(4000, 3000, orientation=6)
+    telegram_large = make_jpeg(2560, 1920)
+    telegram_target = make_jpeg(1280, 960)
+
+    # Прежний путь: PIL.Image.open + save в JPEG без уменьшения, в event loop
+    started = time.perf_counter()
+    with Image.open(BytesIO(telegram_large)) as image:
+        legacy = BytesIO()
+        image.save(legacy, format="JPEG")
+    legacy_ms = (time.perf_counter() - started) * 1000
+    legacy_bytes = legacy.tell()
+
+    async def run():
+        pipeline = PhotoPipeline(workers=2)
+        gaps = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        try:
+            await pipeline.prepare(telegram_target)  # прогрев пула
+            tick = asyncio.create_task(ticker())
+            started = time.perf_counter()
+            results = await asyncio.gather(*(pipeline.prepare(camera) for _ in range(8)))
+            elapsed = (time.perf_counter() - started) * 1000
+            target = await pipeline.prepare(telegram_target)
+            stop.set()
+            await tick
+            return results, target, elapsed, max(gaps), pipeline.get_stats()
+        finally:
+            pipeline.close()
+
+    results, target, elapsed, gap, stats = asyncio.run(run())
+    logger.info(f"   Прежний путь (2560px, в event loop): {legacy_bytes} байт, {legacy_ms:.0f} мс")
+    logger.info(f"   Выбранный размер 1280px: {target.upload_bytes} байт, {target.prepare_ms:.1f} мс (без перекодирования)")
+    logger.info(f"   Снимок 4000x3000 с EXIF: {len(camera)} → {results[0].upload_bytes} байт, "
+                f"8 шт. за {elapsed:.0f} мс (p50 {stats['prepare_p50_ms']} мс)")
+
+    ok = (
+        target.upload_bytes < legacy_bytes / 2
+        and all(r.upload_bytes < len(camera) / 4 for r in results)
+        and gap < 0.15
+    )
+    logger.info(f"{'✅' if ok else '❌'} макс. пауза event loop {gap * 1000:.0f} мс")
+    return ok
+
+
+def test_report_metrics():
+    """Метрики на запрос: байты до/после и время ответа модели"""
+    logger.info("ТЕСТ 5: Метрики")
+    pipeline = PhotoPipeline()
+    photo = prepare_image(make_jpeg(3000, 2000), max_side=1280)
+    for seconds in (1.2, 0.8, 2.0):
+        pipeline.report(photo, seconds, "gemini")
+    stats = pipeline.get_stats()
+    ok = (
+        stats["analyzed"] == 3 and stats["vision_p50_ms"] == 1200
+        and stats["upload_bytes"] == 3 * photo.upload_bytes
+        and 0 < stats["upload_ratio"] < 0.5
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def test_gemini_counted_once():
+    """Фото из handle_photo уходит в Gemini без повторной подготовки и учитывается один раз"""
+    logger.info("ТЕСТ 6: Учёт анализа Gemini")
+    sizes = photo_sizes(4000, 3000)
+    files = {"file_2560": make_jpeg(2560, 1920)}
+
+    class FakeModel:
+        def __init__(self, name):
+            self.name = name
+
+        def generate_content(self, parts):
+            time.sleep(0.01)
+            return SimpleNamespace(text=f"Дефектов нет ({self.name})")
+
+    async def scenario():
+        pipeline = PhotoPipeline(workers=2)
+        saved = (gemini_vision.GEMINI_AVAILABLE, gemini_vision.gemini_client, gemini_vision.get_photo_pipeline)
+        gemini_vision.GEMINI_AVAILABLE = True
+        gemini_vision.gemini_client = SimpleNamespace(GenerativeModel=FakeModel)
+        gemini_vision.get_photo_pipeline = lambda: pipeline
+        try:
+            # Как handle_photo: загрузка и подготовка, затем анализ готового фото
+            prepared = await pipeline.load(FakeBot(files), "file_2560", "uniq_2560")
+            answer = await gemini_vision.GeminiVisionAnalyzer().analyze_defect_photo(prepared, "трещины?")
+            return answer, pipeline.get_stats()
+        finally:
+            gemini_vision.GEMINI_AVAILABLE, gemini_vision.gemini_client, gemini_vision.get_photo_pipeline = saved
+            pipeline.close()
+
+    answer, stats = asyncio.run(scenario())
+    ok = (
+        answer is not None and gemini_vision.GEMINI_VISION_MODEL in answer
+        and stats["prepared"] == stats["analyzed"] == 1
+        and stats["upload_ratio"] < 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} подготовок: {stats['prepared']}, анализов: {stats['analyzed']}, "
+                f"доля байт: {stats['upload_ratio']}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("photo_pipeline").setLevel(logging.WARNING)
+    results = {
+        "Выбор размера Telegram": test_select_size(),
+        "Подготовка изображения": test_prepare_image(),
+        "Кэш по file_unique_id": test_cache_single_flight(),
+        "Бенчмарк подготовки": test_pool_benchmark(),
+        "Метрики": test_report_metrics(),
+        "Учёт анализа Gemini": test_gemini_counted_once()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,131 @@
+"""
+Тест кэша префикса промптов (prompt_cache.py)
+Проверяет байтовую стабильность system-промптов, блоки cache_control для Claude,
+заголовок x-grok-conv-id и нормализацию для xAI, учёт токенов из кэша и без
+"""
+
+import logging
+import sys
+
+from context_builder import ContextBuilder
+from optimized_prompts import CLAUDE_SYSTEM_PROMPT_TECHNICAL
+from prompt_cache import (
+    PromptCacheStats, XAI_CONV_ID_HEADER, anthropic_system, normalize_prompt,
+    split_system, stable_messages, xai_cache_headers
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+LONG_ANSWER = "Защитный слой бетона не менее 40 мм по СП 63.13330.2018. " + "Подробности армирования. " * 80
+
+
+def dialog(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Вопрос {i}: какой защитный слой?"})
+        history.append({"role": "assistant", "content": LONG_ANSWER})
+    return history
+
+
+def test_byte_stable_prefix():
+    """Статичный префикс одинаков при любом кратком содержании диалога"""
+    logger.info("ТЕСТ 1: Стабильный префикс")
+    builder = ContextBuilder(default_budget=2500)
+    short = builder.build(dialog(1), system_prompts=[CLAUDE_SYSTEM_PROMPT_TECHNICAL], question="А для колонн?")
+    long = builder.build(dialog(12), system_prompts=[CLAUDE_SYSTEM_PROMPT_TECHNICAL + "  \n\n\n"],
+                         question="А для плит?")
+
+    short_blocks, long_blocks = anthropic_system(short.system), anthropic_system(long.system)
+    ok = (
+        len(short_blocks) == 1 and len(long_blocks) == 2
+        and short_blocks[0] == long_blocks[0]
+        and long_blocks[0]["cache_control"] == {"type": "ephemeral"}
+        and "cache_control" not in long_blocks[1] and "РАНЕЕ В ДИАЛОГЕ" in long_blocks[1]["text"]
+        and long_blocks[0]["text"] == normalize_prompt(CLAUDE_SYSTEM_PROMPT_TECHNICAL)
+        and anthropic_system("", default="Эксперт")[0]["text"] == "Эксперт"
+    )
+    logger.info(f"{'✅' if ok else '❌'} префикс {len(long_blocks[0]['text'])} симв., "
+                f"динамическая часть {len(long_blocks[1]['text'])} симв.")
+    return ok
+
+
+def test_xai_prefix():
+    """xAI: одинаковый префикс - одинаковый conv-id, system нормализован, история не тронута"""
+    logger.info("ТЕСТ 2: xAI префикс")
+    system = "Вы — СтройНадзорAI.   \n\n\n\nОтвечайте кратко.\n"
+    first = [{"role": "system", "content": system}, {"role": "user", "content": "Вопрос 1  "}]
+    second = [{"role": "system", "content": normalize_prompt(system) + "\n\n📋 РАНЕЕ В ДИАЛОГЕ (кратко):\n❓ Вопрос 1"},
+              {"role": "user", "content": "Вопрос 2"}]
+    other = [{"role": "system", "content": "Другой промпт"}, {"role": "user", "content": "Вопрос 1"}]
+
+    prepared = stable_messages(first)
+    ok = (
+        prepared[0]["content"] == "Вы — СтройНадзорAI.\n\nОтвечайте кратко."
+        and prepared[1] is first[1] and first[0]["content"] == system
+        and xai_cache_headers(first) == xai_cache_headers(second)
+        and xai_cache_headers(first) != xai_cache_headers(other)
+        and XAI_CONV_ID_HEADER in xai_cache_headers(first)
+        and xai_cache_headers([{"role": "user", "content": "без system"}]) == {}
+        and split_system(second[0]["content"])[0] == prepared[0]["content"]
+    )
+    logger.info(f"{'✅' if ok else '❌'} {xai_cache_headers(first)}")
+    return ok
+
+
+def test_usage_accounting():
+    """Учёт токенов: Anthropic (чтение/запись отдельно) и xAI (cached_tokens внутри prompt_tokens)"""
+    logger.info("ТЕСТ 3: Учёт токенов")
+    stats = PromptCacheStats()
+
+    class Usage:
+        def __init__(self, inp, read, write):
+            self.input_tokens = inp
+            self.cache_read_input_tokens = read
+            self.cache_creation_input_tokens = write
+
+    miss = stats.record_anthropic("claude", Usage(200, 0, 1100), latency_ms=2400)
+    hit = stats.record_anthropic("claude", Usage(210, 1100, 0), latency_ms=1500)
+    stats.record_anthropic("claude", Usage(190, 1100, 0), latency_ms=1300)
+    xai = stats.record_xai("grok", {"prompt_tokens": 1500, "prompt_tokens_details": {"cached_tokens": 1280}}, 800)
+    stats.record_xai("grok", {"prompt_tokens": 1500})
+    skipped = stats.record_xai("grok", None)
+    summary = stats.get_stats()
+    claude, grok = summary["anthropic"], summary["xai"]
+
+    ok = (
+        not miss.hit and hit.hit and hit.input_tokens == 1310
+        and xai.uncached_tokens == 220 and xai.cached_tokens == 1280 and skipped is None
+        and claude["calls"] == 3 and claude["cached_tokens"] == 2200 and claude["cache_write_tokens"] == 1100
+        and claude["hit_rate"] == round(2 / 3, 3) and claude["cost_saved_share"] > 0.3
+        and claude["avg_hit_latency_ms"] == 1400.0 and claude["avg_miss_latency_ms"] == 2400.0
+        and grok["calls"] == 2 and grok["hit_rate"] == 0.5 and grok["avg_miss_latency_ms"] is None
+        and len(stats.recent()) == 5 and stats.recent(1)[0]["provider"] == "xai"
+    )
+    logger.info(f"{'✅' if ok else '❌'} {summary}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("context_builder").setLevel(logging.WARNING)
+    results = {
+        "Стабильный префикс": test_byte_stable_prefix(),
+        "xAI префикс": test_xai_prefix(),
+        "Учёт токенов": test_usage_accounting()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,187 @@
+"""
+Тест ограничения частоты запросов (rate_limiter.py)
+Проверяет GCRA (всплеск и равномерное восстановление), стоимость функций,
+Redis-хранилище через Lua-скрипт и переход в память при ошибке Redis,
+постоянное время проверки и память на пользователя (бенчмарк)
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from rate_limiter import MemoryGCRA, RateLimiter, RedisGCRA
+from state_store import approx_size
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Redis с тем же алгоритмом, что и GCRA_LUA (ответы - байты, как у redis-py)"""
+
+    def __init__(self, clock, fail=False):
+        self.clock = clock
+        self.fail = fail
+        self.data = {}
+        self.calls = 0
+
+    def register_script(self, script):
+        async def run(keys, args):
+            self.calls += 1
+            if self.fail:
+                raise ConnectionError("Connection refused")
+            interval, tolerance, cost = (float(a) for a in args)
+            now = self.clock() * 1000
+            tat = max(self.data.get(keys[0], now), now)
+            new_tat = tat + interval * cost
+            allow_at = new_tat - tolerance
+            if now < allow_at:
+                return [0, str(allow_at - now).encode(), str((tolerance - (tat - now)) / interval).encode()]
+            self.data[keys[0]] = new_tat
+            return [1, b"0", str((tolerance - (new_tat - now)) / interval).encode()]
+        return run
+
+
+def test_gcra_burst_and_refill():
+    """Всплеск до лимита, затем один запрос на каждые window/limit секунд"""
+    logger.info("ТЕСТ 1: Всплеск и восстановление")
+    clock = FakeClock()
+    limiter = MemoryGCRA(limit=10, period=60, clock=clock)
+
+    burst = [limiter.acquire_now(1).allowed for _ in range(12)]
+    denied = limiter.acquire_now(1)
+    clock.now += 6
+    after_interval = limiter.acquire_now(1).allowed
+    clock.now += 60
+    refilled = sum(limiter.acquire_now(1).allowed for _ in range(12))
+    other_user = limiter.acquire_now(2).allowed
+
+    ok = (
+        burst == [True] * 10 + [False] * 2
+        and abs(denied.retry_after - 6.0) < 1e-6
+        and after_interval and refilled == 10 and other_user
+        and len(limiter.tats) == 2
+    )
+    logger.info(f"{'✅' if ok else '❌'} всплеск {sum(burst)}, повтор через {denied.retry_after:.1f}с, "
+                f"после окна {refilled}")
+    return ok
+
+
+def test_feature_costs():
+    """Фото и Совет расходуют больше текста, стоимость не превышает лимит"""
+    logger.info("ТЕСТ 2: Стоимость функций")
+
+    async def scenario():
+        limiter = RateLimiter(limit=10, period=60, costs={"text": 1, "photo": 3, "council": 5, "huge": 50})
+        clock = FakeClock()
+        limiter.memory = limiter.backend = MemoryGCRA(10, 60, clock=clock)
+
+        council = await limiter.check(1, "council")
+        photos = [bool(await limiter.check(1, "photo")) for _ in range(2)]
+        text = await limiter.check(1, "text")
+        clock.now += 60
+        huge = await limiter.check(2, "huge")
+        return limiter, council, photos, text, huge
+
+    limiter, council, photos, text, huge = asyncio.run(scenario())
+    stats = limiter.get_stats()
+    ok = (
+        council.allowed and abs(council.remaining - 5) < 1e-6
+        and photos == [True, False]
+        and text.allowed and abs(text.remaining - 1) < 1e-6
+        and huge.allowed and limiter.cost("huge") == 10
+        and stats["denied"] == {"photo": 1} and stats["allowed"]["council"] == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} совет: осталось {council.remaining:.0f}, фото {photos}, {stats}")
+    return ok
+
+
+def test_redis_backend_and_fallback():
+    """Redis-хранилище с тем же интерфейсом; при ошибке Redis - проверка в памяти"""
+    logger.info("ТЕСТ 3: Redis и переход в память")
+
+    async def scenario():
+        clock = FakeClock()
+        redis = FakeRedis(clock)
+        limiter = RateLimiter(limit=10, period=60)
+        limiter.backend = RedisGCRA(redis, 10, 60)
+        redis_results = [await limiter.check(7, "photo") for _ in range(4)]
+
+        broken = FakeRedis(clock, fail=True)
+        limiter.backend = RedisGCRA(broken, 10, 60)
+        fallback = await limiter.check(8, "text")
+        return limiter, redis, redis_results, fallback
+
+    limiter, redis, results, fallback = asyncio.run(scenario())
+    ok = (
+        [r.allowed for r in results] == [True, True, True, False]
+        and all(r.backend == "redis" for r in results)
+        and abs(results[-1].retry_after - 12.0) < 1e-3
+        and list(redis.data) == ["rl:7"]
+        and fallback.allowed and fallback.backend == "memory"
+        and limiter.redis_errors == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} redis: {[r.allowed for r in results]}, "
+                f"повтор через {results[-1].retry_after:.1f}с, при ошибке: {fallback.backend}")
+    return ok
+
+
+def test_constant_time_benchmark():
+    """Время проверки и память на пользователя не зависят от числа запросов и пользователей"""
+    logger.info("ТЕСТ 4: Бенчмарк")
+    timings = {}
+    per_user = {}
+    for users in (100, 10_000, 100_000):
+        limiter = MemoryGCRA(limit=10, period=60, max_users=users)
+        # Каждый пользователь уже сделал запросы (история в окне)
+        for user_id in range(users):
+            limiter.acquire_now(user_id)
+
+        checks = 200_000
+        started = time.perf_counter()
+        for i in range(checks):
+            limiter.acquire_now(i % users)
+        timings[users] = (time.perf_counter() - started) * 1e6 / checks
+        per_user[users] = approx_size(dict(list(limiter.tats.items())[:100])) / 100
+
+    spread = max(timings.values()) / min(timings.values())
+    ok = spread < 3.0 and max(per_user.values()) < 200 and max(per_user.values()) / min(per_user.values()) < 1.5
+    for users in timings:
+        logger.info(f"   {users} польз.: {timings[users]:.2f} мкс на проверку, ~{per_user[users]:.0f} Б на пользователя")
+    logger.info(f"{'✅' if ok else '❌'} разброс времени x{spread:.2f}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("rate_limiter").setLevel(logging.ERROR)
+    results = {
+        "Всплеск и восстановление": test_gcra_burst_and_refill(),
+        "Стоимость функций": test_feature_costs(),
+        "Redis и переход в память": test_redis_backend_and_fallback(),
+        "Бенчмарк": test_constant_time_benchmark()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
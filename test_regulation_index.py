@@ -0,0 +1,178 @@
+"""
+Тест единого индекса нормативов (regulation_index.py)
+Проверяет поиск по коду в любом написании, ранжирование BM25 со стеммингом,
+точные ответы на запрос-код, граф связанных нормативов, поиск по базе 2025 и время запросов (< 50 мкс)
+"""
+
+import logging
+import statistics
+import sys
+import time
+
+from regulation_index import RegulationIndex, get_regulation_index
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+CATEGORIES = {
+    "Фундаменты": [
+        {"code": "СП 22.13330.2016", "name": "Основания зданий и сооружений", "tags": ["фундамент", "грунт"]},
+        {"code": "СП 24.13330.2021", "name": "Свайные фундаменты", "tags": ["сваи", "фундамент"]},
+    ],
+    "Бетон": [
+        {"code": "СП 63.13330.2018", "name": "Бетонные и железобетонные конструкции", "tags": ["бетон", "арматура"]},
+        {"code": "ГОСТ 18105-2018", "name": "Бетоны. Правила контроля прочности", "tags": ["бетон", "прочность"]},
+        {"code": "СП 70.13330.2012", "name": "Несущие и ограждающие конструкции", "tags": ["монтаж", "фундамент"]},
+    ],
+}
+
+
+def make_index() -> RegulationIndex:
+    index = RegulationIndex()
+    for category, regulations in CATEGORIES.items():
+        for reg in regulations:
+            index.add(reg["code"], "categories", reg, title=reg["name"], category=category, tags=reg["tags"])
+    index.add_regulations({
+        "СП 63.13330.2018": {"title": "Бетонные и железобетонные конструкции", "url": "https://docs.cntd.ru/document/554403082",
+                             "category": "Конструкции", "replaced": "СНиП 52-01-2003"},
+        "СНиП 52-01-2003": {"title": "Бетонные и железобетонные конструкции. Основные положения", "url": "",
+                            "category": "Архив"},
+    }, source="bot")
+    return index
+
+
+def test_code_lookup():
+    """Код находится в любом написании, записи разных баз объединяются"""
+    logger.info("ТЕСТ 1: Поиск по коду")
+    index = make_index()
+    variants = ["СП 63.13330.2018", "сп63.13330.2018", "СП  63.13330.2018", "СП_63.13330.2018"]
+    records = [index.get(v) for v in variants]
+
+    record = records[0]
+    ok = (
+        all(r is record for r in records)
+        and set(record.sources) == {"categories", "bot"}
+        and record.url.startswith("https://")
+        and index.get("СП 999.1.2030") is None
+        and [r.code for r in index.codes_with_prefix("СП 2")] == ["СП 22.13330.2016", "СП 24.13330.2021"]
+    )
+    logger.info(f"{'✅' if ok else '❌'} {record.code}: {sorted(record.sources)}")
+    return ok
+
+
+def test_bm25_ranking():
+    """Словоформы находятся по основе, редкие слова и название весят больше"""
+    logger.info("ТЕСТ 2: Ранжирование BM25")
+    index = make_index()
+    piles = [r.code for r, _ in index.search("свайный фундамент")]
+    strength = [r.code for r, _ in index.search("контроль прочности бетонов")]
+    by_code = [r.code for r, _ in index.search("СП 24")]
+    exact = [r.code for r, _ in index.search("сп 63.13330.2018")]
+    prefix = [r.code for r, _ in index.search("СП 2")]
+    unknown = [r.code for r, _ in index.search("СП 999")]
+    only_bot = [r.code for r, _ in index.search("бетонные конструкции", source="bot")]
+
+    ok = (
+        piles[0] == "СП 24.13330.2021"
+        and strength[0] == "ГОСТ 18105-2018"
+        and by_code == ["СП 24.13330.2021"]
+        and exact == ["СП 63.13330.2018"]
+        and sorted(prefix) == ["СП 22.13330.2016", "СП 24.13330.2021"]
+        and len(unknown) > 1
+        and set(only_bot) == {"СП 63.13330.2018", "СНиП 52-01-2003"}
+        and index.search("кровля") == []
+    )
+    logger.info(f"{'✅' if ok else '❌'} сваи: {piles}, прочность: {strength}, код: {by_code[:2]}, bot: {only_bot}")
+    return ok
+
+
+def test_related_graph():
+    """Связанные: та же категория и общие теги, замена документа - сильная связь"""
+    logger.info("ТЕСТ 3: Связанные нормативы")
+    index = make_index()
+    related = [r.code for r in index.related("СП 63.13330.2018")]
+    piles = [r.code for r in index.related("СП 24.13330.2021", source="categories")]
+
+    ok = (
+        related[0] == "СНиП 52-01-2003"
+        and related[1] == "ГОСТ 18105-2018"
+        and "СП 70.13330.2012" in related
+        and piles[0] == "СП 22.13330.2016"
+        and "СП 70.13330.2012" in piles
+        and index.related("СП 999.1.2030") == []
+    )
+    logger.info(f"{'✅' if ok else '❌'} СП 63: {related}, СП 24: {piles}")
+    return ok
+
+
+def test_regulations_2025_search():
+    """regulations_2025.search_regulation работает через индекс"""
+    logger.info("ТЕСТ 4: Поиск по базе 2025")
+    from regulations_2025 import search_regulation
+
+    laws = search_regulation("пожарной безопасности")
+    by_code = search_regulation("СП 48")
+    law = search_regulation("384-ФЗ")
+    ok = (
+        laws and laws[0]['type'] == 'Федеральный закон' and laws[0]['code'] == "123-ФЗ"
+        and [r['code'] for r in by_code] == ["СП_48"] and by_code[0]['type'] == 'Нормативный документ'
+        and [r['code'] for r in law] == ["384-ФЗ"]
+    )
+    logger.info(f"{'✅' if ok else '❌'} {[r['code'] for r in laws]}, {[r['code'] for r in by_code]}, {[r['code'] for r in law]}")
+    return ok
+
+
+def test_lookup_speed():
+    """Медиана запроса по коду и поиска по словам - меньше 50 мкс"""
+    logger.info("ТЕСТ 5: Скорость")
+    index = get_regulation_index()
+    queries = ["пожарная безопасность", "защитный слой бетона", "СП 63", "исполнительная документация", "190-ФЗ"]
+    codes = ["СП 63.13330.2018", "сп48.13330.2019", "190-ФЗ", "ГОСТ 18105-2018"]
+    for query in queries:
+        index.search(query)  # прогрев lru_cache стемминга
+
+    def median_us(func, args, runs=2000):
+        timings = []
+        for i in range(runs):
+            arg = args[i % len(args)]
+            started = time.perf_counter()
+            func(arg)
+            timings.append((time.perf_counter() - started) * 1e6)
+        return statistics.median(timings)
+
+    get_us = median_us(index.get, codes)
+    search_us = median_us(index.search, queries)
+    related_us = median_us(index.related, codes)
+
+    ok = get_us < 50 and search_us < 50 and related_us < 50
+    logger.info(
+        f"{'✅' if ok else '❌'} {len(index)} документов: код {get_us:.1f} мкс, "
+        f"поиск {search_us:.1f} мкс, связанные {related_us:.1f} мкс"
+    )
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Код": test_code_lookup(),
+        "BM25": test_bm25_ranking(),
+        "Связанные": test_related_graph(),
+        "База 2025": test_regulations_2025_search(),
+        "Скорость": test_lookup_speed()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,163 @@
+"""
+Тест поиска кодов нормативов (regulation_matcher.py)
+Проверяет нормализацию пробелов и тире, позиции совпадений, самые длинные
+совпадения, неизвестные коды, короткие коды ("СП 63") и время прохода по длинному ответу
+"""
+
+import logging
+import sys
+import time
+
+from regulation_matcher import RegulationMatcher, extract_regulation_codes, get_regulation_matcher
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+KNOWN = ["СП 63.13330.2018", "СП 63.13330", "ГОСТ 31937-2011", "СНиП 2.01.07-85", "ГОСТ Р 57580.1-2017"]
+
+
+def test_normalized_variants():
+    """Разные пробелы, регистр и тире находят один и тот же код"""
+    logger.info("ТЕСТ 1: Нормализация написания")
+    matcher = RegulationMatcher(KNOWN)
+    variants = [
+        "СП 63.13330.2018", "сп63.13330.2018", "СП 63.13330.2018",
+        "СП   63.13330.2018", "СП-63.13330.2018"
+    ]
+    found = [matcher.find_codes(f"см. {v}, п. 5") for v in variants]
+    dashes = matcher.find_codes("ГОСТ 31937–2011 и ГОСТ 31937—2011 и СНиП 2.01.07−85")
+
+    ok = all(f == ["СП 63.13330.2018"] for f in found) and dashes == ["ГОСТ 31937-2011", "СНиП 2.01.07-85"]
+    logger.info(f"{'✅' if ok else '❌'} варианты: {found}, тире: {dashes}")
+    return ok
+
+
+def test_spans_and_longest_match():
+    """Позиции указывают в исходный текст, выбирается самое длинное совпадение"""
+    logger.info("ТЕСТ 2: Позиции и самое длинное совпадение")
+    matcher = RegulationMatcher(KNOWN)
+    text = "По  СП 63.13330.2018 и по СП 63.13330 (старая ред.)"
+    matches = matcher.find_all(text)
+    spans = [text[m.start:m.end] for m in matches]
+
+    ok = (
+        [m.code for m in matches] == ["СП 63.13330.2018", "СП 63.13330"]
+        and spans == ["СП 63.13330.2018", "СП 63.13330"]
+    )
+    logger.info(f"{'✅' if ok else '❌'} {matches}")
+    return ok
+
+
+def test_unknown_codes_and_boundaries():
+    """Неизвестные коды находятся по префиксу, части других кодов - нет"""
+    logger.info("ТЕСТ 3: Неизвестные коды и границы")
+    matcher = RegulationMatcher(KNOWN)
+    matches = matcher.find_all("Новый СП 999.1325800.2030, ГОСТР 1.2 и ППБ 01-03. Код СП 63.13330.20189 и ASП 63.13330.2018")
+
+    codes = [(m.code, m.known) for m in matches]
+    ok = codes == [
+        ("СП 999.1325800.2030", False),
+        ("ГОСТР 1.2", False),
+        ("ППБ 01-03", False),
+        ("СП 63.13330.20189", False),
+    ]
+    logger.info(f"{'✅' if ok else '❌'} {codes}")
+    return ok
+
+
+def test_call_sites():
+    """web_search, model_selector и llm_council используют общий автомат"""
+    logger.info("ТЕСТ 4: Общий автомат в модулях")
+    from llm_council import is_complex_question
+    from model_selector import extract_regulation_codes as selector_extract
+    from web_search import extract_regulation_codes as web_extract
+
+    text = "Нужен СП 63.13330.2018 и ГОСТ 31937-2011"
+    complex_question, reason = is_complex_question("Сравни требования СП 70.13330.2012 и СП 63.13330.2018 к опалубке")
+
+    ok = (
+        web_extract(text) == selector_extract(text) == extract_regulation_codes(text)
+        == ["СП 63.13330.2018", "ГОСТ 31937-2011"]
+        and complex_question and "нормативов" in reason
+    )
+    logger.info(f"{'✅' if ok else '❌'} {web_extract(text)}, council: {reason}")
+    return ok
+
+
+def test_bare_codes():
+    """Номер без точки/тире ("СП 63") - тоже код; несколько кодов в вопросе"""
+    logger.info("ТЕСТ 5: Короткие коды и вопросы с несколькими кодами")
+    from llm_council import is_complex_question
+    from model_selector import get_model_selector
+
+    matcher = RegulationMatcher(KNOWN)
+    bare = [matcher.find_codes(text) for text in ("СП 63", "по СП 70 и СП 63.13330", "СП 20 и СП 22")]
+    selector = get_model_selector()
+    questions = [
+        "Сравни требования СП 20 и СП 22 к нагрузкам на основание",
+        "Какие требования СП 63 и СНиП 52-01 к защитному слою бетона"
+    ]
+    reasons = [is_complex_question(q)[1] for q in questions]
+
+    ok = (
+        bare == [["СП 63"], ["СП 70", "СП 63.13330"], ["СП 20", "СП 22"]]
+        and all("2 шт." in reason for reason in reasons)
+        and selector._mentions_regulations("Что говорит СП 70 про опалубку?")
+    )
+    logger.info(f"{'✅' if ok else '❌'} {bare}, council: {reasons}")
+    return ok
+
+
+def test_speed_vs_dictionary_loop():
+    """Один проход по ответу (с позициями и нормализацией) - доли миллисекунды"""
+    logger.info("ТЕСТ 6: Скорость")
+    matcher = get_regulation_matcher()
+    codes = sorted({code for code in matcher._codes.values()})
+    answer = ("Для монолитного перекрытия применяйте бетон B25 по СП 63.13330.2018, "
+              "контроль прочности по ГОСТ 18105-2018. ") * 40
+
+    matcher.find_all(answer)  # построение автомата
+    runs = 200
+    started = time.perf_counter()
+    for _ in range(runs):
+        found = matcher.find_codes(answer, known_only=True)
+    matcher_ms = (time.perf_counter() - started) * 1000 / runs
+
+    started = time.perf_counter()
+    for _ in range(runs):
+        naive = [code for code in codes if code in answer]
+    naive_ms = (time.perf_counter() - started) * 1000 / runs
+
+    ok = "СП 63.13330.2018" in found and set(naive) <= set(found) and matcher_ms < 5
+    logger.info(
+        f"{'✅' if ok else '❌'} {len(codes)} кодов, ответ {len(answer)} символов: "
+        f"автомат {matcher_ms:.2f} мс (с позициями), цикл по словарю {naive_ms:.2f} мс"
+    )
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Нормализация": test_normalized_variants(),
+        "Позиции": test_spans_and_longest_match(),
+        "Неизвестные коды": test_unknown_codes_and_boundaries(),
+        "Модули": test_call_sites(),
+        "Короткие коды": test_bare_codes(),
+        "Скорость": test_speed_vs_dictionary_loop()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,165 @@
+"""
+Тест поискового индекса по базам знаний (search_index.py)
+Проверяет ранжирование BM25 по словоформам, опечатки (триграммы),
+поиск по началу слова, coverage и время поиска (микросекунды)
+"""
+
+import logging
+import statistics
+import sys
+import time
+
+from search_index import SearchIndex
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# База в формате FAQ_DATABASE (faq.py)
+DATABASE = {
+    "concrete": {
+        "questions": {
+            "b25_strength": {
+                "q": "Какая прочность бетона B25?",
+                "a": "Бетон класса B25 (М350): прочность на сжатие 25 МПа. СП 63.13330.2018",
+                "keywords": ["b25", "м350", "прочность бетона", "класс бетона"]
+            },
+            "concrete_curing": {
+                "q": "Сколько дней твердеет бетон?",
+                "a": "При +20°C бетон набирает 70% прочности за 7 суток, 100% - за 28 суток",
+                "keywords": ["твердение", "набор прочности", "сроки"]
+            },
+            "winter_concreting": {
+                "q": "Как бетонировать зимой?",
+                "a": "Противоморозные добавки, прогрев, укрытие. Контроль температуры по ППР",
+                "keywords": ["зимнее бетонирование", "мороз", "прогрев"]
+            },
+        }
+    },
+    "defects": {
+        "questions": {
+            "cracks": {
+                "q": "Какая допустимая ширина раскрытия трещин?",
+                "a": "Для железобетона 0,3-0,4 мм (СП 63.13330.2018)",
+                "keywords": ["трещины", "раскрытие трещин", "дефекты"]
+            },
+            "rebar_overlap": {
+                "q": "Какой нахлёст арматуры А500?",
+                "a": "Не менее 30 диаметров и не менее 250 мм",
+                "keywords": ["нахлест", "арматура", "перепуск"]
+            },
+        }
+    }
+}
+
+
+def make_index(fuzzy: bool = True) -> SearchIndex:
+    index = SearchIndex("тест", {"q": 3, "keywords": 3, "a": 1}, head_fields=("q", "keywords"), fuzzy=fuzzy)
+    for category_id, category in DATABASE.items():
+        for q_id, q_data in category["questions"].items():
+            index.add((category_id, q_id), q_data, payload=q_data)
+    index.build()
+    return index
+
+
+def test_ranking():
+    """Словоформы находятся по основе, лучший ответ - первым"""
+    logger.info("ТЕСТ 1: Ранжирование")
+    index = make_index()
+    winter = index.search("бетонирование в мороз")
+    cracks = index.search("трещина")
+    rebar = index.search("нахлест арматуры")
+
+    ok = (
+        winter[0].key == ("concrete", "winter_concreting")
+        and cracks[0].key == ("defects", "cracks")
+        and rebar[0].key == ("defects", "rebar_overlap")
+        and index.search("кровля") == []
+    )
+    logger.info(f"{'✅' if ok else '❌'} {winter[0].key}, {cracks[0].key}, {rebar[0].key}")
+    return ok
+
+
+def test_typos_and_prefix():
+    """Опечатки исправляются по триграммам, начало слова расширяется"""
+    logger.info("ТЕСТ 2: Опечатки и начало слова")
+    index = make_index()
+    typo = index.search("трешины")
+    typo_rebar = index.search("арматруа нахлест")
+    prefix = index.search("твер")
+    # Без исправления опечаток (индекс нормативов) - только начало слова
+    exact_only = make_index(fuzzy=False)
+
+    ok = (
+        typo and typo[0].key == ("defects", "cracks")
+        and typo_rebar and typo_rebar[0].key == ("defects", "rebar_overlap")
+        and prefix and prefix[0].key == ("concrete", "concrete_curing")
+        and index.get_stats()["fuzzy_corrections"] >= 2
+        and not exact_only.search("трешины")
+        and exact_only.search("твер")[0].key == ("concrete", "concrete_curing")
+    )
+    logger.info(f"{'✅' if ok else '❌'} трешины → {typo[0].key if typo else None}, "
+                f"твер → {prefix[0].key if prefix else None}")
+    return ok
+
+
+def test_coverage():
+    """coverage высокий, когда слова запроса есть в вопросе, и низкий для лишних слов"""
+    logger.info("ТЕСТ 3: Coverage")
+    index = make_index()
+    exact = index.search("Какая прочность бетона B25?")[0]
+    answer_only = index.search("сжатие")[0]
+    partial = index.search("прочность бетона B25 при заливке колонн на объекте")[0]
+
+    ok = (
+        exact.key == ("concrete", "b25_strength") and exact.coverage > 0.99
+        and answer_only.coverage == 0.0
+        and 0.2 < partial.coverage < 0.7
+    )
+    logger.info(f"{'✅' if ok else '❌'} точный: {exact.coverage:.2f}, ответ: {answer_only.coverage:.2f}, "
+                f"частичный: {partial.coverage:.2f}")
+    return ok
+
+
+def test_search_speed():
+    """Медиана поиска - десятки микросекунд (без AI и сети)"""
+    logger.info("ТЕСТ 4: Скорость")
+    index = make_index()
+    queries = ["прочность бетона B25", "трешины в плите", "нахлест арматуры", "бетонирование зимой", "твер"]
+    for query in queries:
+        index.search(query)
+
+    timings = []
+    for i in range(2000):
+        started = time.perf_counter()
+        index.search(queries[i % len(queries)])
+        timings.append((time.perf_counter() - started) * 1e6)
+    median_us = statistics.median(timings)
+
+    ok = median_us < 50
+    logger.info(f"{'✅' if ok else '❌'} медиана {median_us:.1f} мкс, {index.get_stats()}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Ранжирование": test_ranking(),
+        "Опечатки": test_typos_and_prefix(),
+        "Coverage": test_coverage(),
+        "Скорость": test_search_speed()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,168 @@
+"""
+Тест single-flight для одинаковых одновременных AI запросов (single_flight.py)
+Проверяет один вызов провайдера на N ожидающих, общие чанки streaming
+и то, что отмена одного ожидающего не отменяет общий запрос
+"""
+
+import asyncio
+import logging
+import sys
+
+from single_flight import SingleFlight, make_flight_key
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MESSAGES = [
+    {"role": "system", "content": "Вы — эксперт по строительным нормативам РФ."},
+    {"role": "user", "content": "Можно ли бетонировать при -15?"}
+]
+
+
+def test_concurrent_calls_share_one_upstream():
+    """50 одинаковых вопросов - один вызов провайдера"""
+    logger.info("ТЕСТ 1: Один вызов на 50 одинаковых запросов")
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"choices": [{"message": {"content": "Да, с прогревом"}}]}
+
+    async def run():
+        flight = SingleFlight()
+        key = make_flight_key("Можно ли бетонировать при -15?", "foreman", MESSAGES, model="grok")
+        results = await asyncio.gather(*[flight.do(key, upstream) for _ in range(50)])
+        # После завершения следующий запрос снова идёт к провайдеру
+        await flight.do(key, upstream)
+        return results, flight.get_stats()
+
+    results, stats = asyncio.run(run())
+    ok = (
+        len(calls) == 2
+        and all(r["choices"][0]["message"]["content"] == "Да, с прогревом" for r in results)
+        and stats["followers"] == 49 and stats["in_flight"] == 0
+    )
+    logger.info(f"{'✅' if ok else '❌'} вызовов провайдера: {len(calls)}, статистика: {stats}")
+    return ok
+
+
+def test_key_separates_context():
+    """Разная роль или история - разные ключи"""
+    logger.info("ТЕСТ 2: Ключ учитывает роль и промпт")
+    question = "Можно ли бетонировать при -15?"
+    base = make_flight_key(question, "foreman", MESSAGES, model="grok")
+    other_role = make_flight_key(question, "engineer", MESSAGES, model="grok")
+    other_history = make_flight_key(
+        question, "foreman", [MESSAGES[0], {"role": "assistant", "content": "..."}, MESSAGES[1]], model="grok"
+    )
+    same = make_flight_key(question, "foreman", list(MESSAGES), model="grok")
+
+    ok = base == same and len({base, other_role, other_history}) == 3
+    logger.info(f"{'✅' if ok else '❌'} ключи различаются по контексту")
+    return ok
+
+
+def test_streaming_subscribers_get_same_chunks():
+    """Подписчики, в т.ч. опоздавший, получают те же чанки от одного потока"""
+    logger.info("ТЕСТ 3: Общий streaming")
+    streams = []
+
+    async def upstream():
+        streams.append(1)
+        for part in ["При ", "-15 ", "нужен ", "прогрев"]:
+            await asyncio.sleep(0.02)
+            yield part
+
+    async def collect(flight, key, delay=0.0):
+        await asyncio.sleep(delay)
+        return [chunk async for chunk in flight.stream(key, upstream)]
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(
+            collect(flight, "k"), collect(flight, "k"), collect(flight, "k", delay=0.05)
+        )
+
+    results = asyncio.run(run())
+    expected = ["При ", "-15 ", "нужен ", "прогрев"]
+    ok = len(streams) == 1 and all(r == expected for r in results)
+    logger.info(f"{'✅' if ok else '❌'} потоков провайдера: {len(streams)}, чанки: {results[2]}")
+    return ok
+
+
+def test_cancel_one_waiter_keeps_flight():
+    """Отмена одного ожидающего не отменяет общий запрос; отмена всех - отменяет"""
+    logger.info("ТЕСТ 4: Отмена ожидающих")
+    cancelled = []
+
+    async def upstream():
+        try:
+            await asyncio.sleep(0.1)
+            return "ответ"
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do("k", upstream))
+        second = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        survivor = await second
+
+        lonely = asyncio.ensure_future(flight.do("k2", upstream))
+        await asyncio.sleep(0.01)
+        lonely.cancel()
+        await asyncio.sleep(0.01)
+        return survivor, flight.get_stats()
+
+    survivor, stats = asyncio.run(run())
+    ok = survivor == "ответ" and len(cancelled) == 1 and stats["abandoned"] == 1
+    logger.info(f"{'✅' if ok else '❌'} выживший получил: {survivor}, отменено вызовов: {len(cancelled)}")
+    return ok
+
+
+def test_error_propagates_to_all():
+    """Ошибка провайдера доходит до всех ожидающих"""
+    logger.info("ТЕСТ 5: Ошибка у всех ожидающих")
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise Exception("AI сервисы временно недоступны")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(*[flight.do("k", upstream) for _ in range(5)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    ok = all(isinstance(r, Exception) and "недоступны" in str(r) for r in results)
+    logger.info(f"{'✅' if ok else '❌'} ошибок: {sum(isinstance(r, Exception) for r in results)}/5")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Один вызов на N запросов": test_concurrent_calls_share_one_upstream(),
+        "Ключ и контекст": test_key_separates_context(),
+        "Общий streaming": test_streaming_subscribers_get_same_chunks(),
+        "Отмена ожидающих": test_cancel_one_waiter_keeps_flight(),
+        "Ошибка у всех": test_error_propagates_to_all()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
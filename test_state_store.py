@@ -0,0 +1,202 @@
+"""
+Тест ограниченного состояния в памяти (state_store.py)
+Проверяет LRU-вытеснение с выгрузкой истории на диск и повторной загрузкой,
+удаление по простою, фоновую очистку реестра (выгрузка на диск в потоке)
+и учёт объёма по структурам
+"""
+
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+
+from conversation_store import ConversationStore
+from state_store import BoundedState, StateRegistry, approx_size, container_size
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def test_lru_spills_history_to_disk():
+    """Вытесненная история записывается на диск и читается обратно при обращении"""
+    logger.info("ТЕСТ 1: LRU и выгрузка на диск")
+    with tempfile.TemporaryDirectory() as directory:
+        store = ConversationStore(directory, max_records=50)
+        conversations = BoundedState(
+            "test", max_entries=100, loader=store.load,
+            on_evict=lambda user_id, _: store.evict(user_id)
+        )
+
+        for user_id in range(1000):
+            store.append(user_id, {"role": "user", "content": f"вопрос {user_id}"})
+            conversations[user_id] = store.load(user_id)
+
+        in_memory = len(conversations), store.get_stats()["users_cached"]
+        reloaded = conversations[7]
+        ok = (
+            in_memory == (100, 100)
+            and reloaded == [{"role": "user", "content": "вопрос 7"}]
+            and conversations.stats["evicted_lru"] == 901
+            and store.get_stats()["evictions"] >= 900
+        )
+    logger.info(f"{'✅' if ok else '❌'} в памяти {in_memory}, после вытеснения: {reloaded}")
+    return ok
+
+
+def test_idle_sweep():
+    """Записи без обращений дольше idle_ttl удаляются, активные остаются"""
+    logger.info("ТЕСТ 2: Удаление по простою")
+    evicted = []
+    state = BoundedState("test", idle_ttl=60, default_factory=list,
+                         on_evict=lambda key, _: evicted.append(key))
+    for user_id in range(10):
+        state[user_id].append(time.time())
+
+    now = time.monotonic()
+    state[3].append(time.time())
+    removed_early = state.sweep(now=now + 30)
+    state._touched[3] = now + 50
+    removed = state.sweep(now=now + 90)
+
+    ok = removed_early == 0 and removed == 9 and list(state) == [3] and sorted(evicted) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    logger.info(f"{'✅' if ok else '❌'} удалено {removed}, осталось {list(state)}")
+    return ok
+
+
+def test_registry_report_and_sweeper():
+    """Отчёт по структурам и фоновая очистка (синхронные и async sweep)"""
+    logger.info("ТЕСТ 3: Реестр и фоновая очистка")
+
+    class Sessions:
+        def __init__(self):
+            self.active_sessions = {1: {"audio": b"x" * 5000}}
+
+        async def cleanup(self):
+            stopped = len(self.active_sessions)
+            self.active_sessions.clear()
+            return stopped
+
+    async def scenario():
+        registry = StateRegistry(interval=0.05)
+        state = BoundedState("test", idle_ttl=0.01, default_factory=list)
+        for user_id in range(50):
+            state[user_id].extend(f"сообщение {user_id}-{i} " * 20 for i in range(5))
+        cache = {f"k{i}": {"answer": f"ответ {i} " * 50} for i in range(1000)}
+        sessions = Sessions()
+
+        registry.register("Истории", state)
+        registry.register("Кэш", cache)
+        registry.register("Голос", lambda: sessions.active_sessions, sweep=sessions.cleanup)
+        registry.register("Не создан", lambda: None)
+
+        before = {row["name"]: row for row in registry.report()}
+        registry.start()
+        await asyncio.sleep(0.2)
+        await registry.stop()
+        after = {row["name"]: row for row in registry.report()}
+        return registry, before, after
+
+    registry, before, after = asyncio.run(scenario())
+    exact_cache = approx_size({f"k{i}": {"answer": f"ответ {i} " * 50} for i in range(1000)})
+    ok = (
+        set(before) == {"Истории", "Кэш", "Голос"}
+        and before["Истории"]["entries"] == 50 and before["Истории"]["bytes"] > 50 * 5 * 200
+        and abs(before["Кэш"]["bytes"] - exact_cache) / exact_cache < 0.1
+        and before["Голос"]["bytes"] > 5000
+        and after["Истории"]["entries"] == 0 and after["Голос"]["entries"] == 0
+        and registry.stats["sweeps"] >= 2 and registry.stats["evicted"] == 51
+    )
+    logger.info(f"{'✅' if ok else '❌'} до: {before}, после: {after}, {registry.get_stats()}")
+    return ok
+
+
+def test_size_estimate_speed():
+    """Оценка объёма большой структуры по выборке - миллисекунды"""
+    logger.info("ТЕСТ 4: Скорость оценки объёма")
+    cache = {f"k{i}": {"answer": "ответ " * 50, "question": "вопрос"} for i in range(100_000)}
+    started = time.perf_counter()
+    size = container_size(cache)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    ok = size > 100_000 * 300 and elapsed_ms < 200
+    logger.info(f"{'✅' if ok else '❌'} ~{size / 1024 / 1024:.1f} МБ за {elapsed_ms:.1f} мс")
+    return ok
+
+
+def test_sweep_flushes_off_loop():
+    """Фоновая очистка пишет историю на диск в потоке - event loop не ждёт диск"""
+    logger.info("ТЕСТ 5: Выгрузка на диск в потоке")
+
+    def slow_evict(store, user_id):
+        time.sleep(0.05)  # медленный диск
+        store.evict(user_id)
+
+    async def scenario(directory):
+        store = ConversationStore(directory, max_records=50)
+        conversations = BoundedState(
+            "test", idle_ttl=0.01, loader=store.load,
+            on_evict=lambda user_id, _: slow_evict(store, user_id)
+        )
+        for user_id in range(5):
+            store.append(user_id, {"role": "user", "content": f"вопрос {user_id}"})
+            conversations[user_id] = store.load(user_id)
+        await asyncio.sleep(0.02)
+
+        registry = StateRegistry()
+        registry.register("Истории", conversations)
+        gaps = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        evicted = await registry.sweep()
+        stop.set()
+        await tick
+        return evicted, max(gaps), store.get_stats()
+
+    with tempfile.TemporaryDirectory() as directory:
+        evicted, gap, stats = asyncio.run(scenario(directory))
+        reloaded = ConversationStore(directory, max_records=50).load(3)
+
+    ok = (
+        evicted == 5 and gap < 0.1
+        and stats["evictions"] == 5 and stats["users_cached"] == 0
+        and reloaded == [{"role": "user", "content": "вопрос 3"}]
+    )
+    logger.info(f"{'✅' if ok else '❌'} выгружено {evicted} за 5 x 50 мс, макс. пауза event loop {gap * 1000:.0f} мс")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("conversation_store").setLevel(logging.WARNING)
+    results = {
+        "LRU и выгрузка на диск": test_lru_spills_history_to_disk(),
+        "Удаление по простою": test_idle_sweep(),
+        "Реестр и фоновая очистка": test_registry_report_and_sweeper(),
+        "Скорость оценки объёма": test_size_estimate_speed(),
+        "Выгрузка на диск в потоке": test_sweep_flushes_off_loop()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,266 @@
+"""
+Тест потокового вывода ответа (stream_renderer.py)
+Проверяет переход в новое сообщение на 4096 символах без повторной отправки,
+границы частей для Markdown, лимиты правок на чат, реакцию на RetryAfter,
+кнопки после ответа и метрики
+"""
+
+import asyncio
+import logging
+import sys
+
+from stream_renderer import (
+    EditRateLimiter, StreamMetrics, StreamRenderer, REPLY_KEYBOARD_NOTE,
+    close_markdown, markdown_cut
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class FloodError(Exception):
+    """Как telegram.error.RetryAfter"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class FakeMessage:
+    def __init__(self, chat, text, reply_markup=None):
+        self.chat = chat
+        self.text = text
+        self.reply_markup = reply_markup
+        self.deleted = False
+
+    async def edit_text(self, text, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(0)
+        self.chat.edit_calls += 1
+        if self.chat.flood_next:
+            self.chat.flood_next = False
+            raise FloodError(0.05)
+        self.text = text
+        return self
+
+    async def edit_reply_markup(self, reply_markup=None):
+        self.reply_markup = reply_markup
+        return self
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeChat:
+    """Сообщение пользователя, на которое отвечает бот (update.message)"""
+
+    def __init__(self, chat_id=1):
+        self.chat_id = chat_id
+        self.sent = []
+        self.edit_calls = 0
+        self.flood_next = False
+
+    async def reply_text(self, text, parse_mode=None, reply_markup=None):
+        message = FakeMessage(self, text, reply_markup)
+        self.sent.append(message)
+        return message
+
+
+def fast_limiter() -> EditRateLimiter:
+    return EditRateLimiter(private_rate=1000, group_rate=1000, burst=1000, global_rate=10000)
+
+
+async def stream(renderer: StreamRenderer, text: str, chunk_size: int = 50):
+    await renderer.start()
+    for start in range(0, len(text), chunk_size):
+        await renderer.feed(text[start:start + chunk_size])
+    return await renderer.finish()
+
+
+def test_rollover():
+    """Длинный ответ продолжается в новых сообщениях, прежние части не пересылаются"""
+    logger.info("ТЕСТ 1: Переход в новое сообщение")
+    paragraphs = [f"Пункт {i}. " + "Бетон набирает прочность в течение 28 суток. " * 6 for i in range(60)]
+    text = "\n\n".join(paragraphs)
+    chat = FakeChat()
+    renderer = StreamRenderer(chat, limiter=fast_limiter(), metrics=StreamMetrics())
+
+    messages = asyncio.run(stream(renderer, text))
+    rebuilt = "\n\n".join(m.text for m in messages)
+
+    ok = (
+        len(text) > 3 * 4096 and len(messages) == len(chat.sent) >= 4
+        and all(len(m.text) <= 4096 for m in messages)
+        and all(m.text.rstrip().endswith(".") for m in messages)
+        and rebuilt.split() == text.split()
+        and renderer.stats.messages == len(messages)
+    )
+    logger.info(f"{'✅' if ok else '❌'} {len(text)} симв. → {len(messages)} сообщ., "
+                f"длины {[len(m.text) for m in messages]}, правок {renderer.stats.edits}")
+    return ok
+
+
+def test_markdown_boundaries():
+    """Блок кода и жирный текст на границе закрываются и открываются заново"""
+    logger.info("ТЕСТ 2: Границы Markdown")
+    code = "```\n" + "\n".join(f"x{i} = {i} * 2" for i in range(400)) + "\n```\nГотово."
+    head, reopen, cut = markdown_cut(code, 1000)
+    bold_head, bold_reopen, _ = markdown_cut("**" + "важно " * 300 + "**", 500)
+
+    chat = FakeChat()
+    renderer = StreamRenderer(chat, limiter=fast_limiter(), metrics=StreamMetrics(), limit=1000,
+                              parse_mode="Markdown")
+    messages = asyncio.run(stream(renderer, code, chunk_size=37))
+
+    ok = (
+        len(head) <= 1000 and head.endswith("\n```") and reopen == "```\n" and code[cut - 1] == "\n"
+        and bold_head.endswith("**") and bold_reopen == "**"
+        and close_markdown("**жирный и `код") == "**жирный и `код`**"
+        and len(messages) >= 4
+        and all(m.text.count("```") % 2 == 0 for m in messages)
+        and messages[-1].text.endswith("Готово.")
+    )
+    logger.info(f"{'✅' if ok else '❌'} части: {[m.text.count('```') for m in messages]}")
+    return ok
+
+
+def test_plain_text_rollover():
+    """Без parse_mode маркеры на границе частей не добавляются: текст как есть"""
+    logger.info("ТЕСТ 3: Переход без разметки")
+    text = "**" + "слово " * 400 + "** и `код` в конце"
+    head, reopen, _ = markdown_cut(text, 500, markdown=False)
+
+    chat = FakeChat()
+    renderer = StreamRenderer(chat, limiter=fast_limiter(), metrics=StreamMetrics(), limit=1000)
+    messages = asyncio.run(stream(renderer, text, chunk_size=37))
+
+    ok = (
+        reopen == "" and not head.endswith("**")
+        and len(messages) >= 3
+        and sum(m.text.count("**") for m in messages) == 2
+        and messages[0].text.startswith("**") and not messages[1].text.startswith("**")
+        and " ".join(m.text for m in messages).split() == text.split()
+    )
+    logger.info(f"{'✅' if ok else '❌'} {len(messages)} сообщ., конец первой части: {messages[0].text[-12:]!r}")
+    return ok
+
+
+def test_abort_after_rollover():
+    """Ошибка после начала синтеза (Совет AI): удаляются заглушка и все продолжения"""
+    logger.info("ТЕСТ 4: Отмена после перехода в новое сообщение")
+
+    async def run():
+        chat = FakeChat()
+        placeholder = await chat.reply_text("🏛️ Собираю Совет AI...")
+        renderer = StreamRenderer(chat, limiter=fast_limiter(), metrics=StreamMetrics(), limit=1000,
+                                  parse_mode="Markdown")
+        await renderer.start(message=placeholder)
+        for _ in range(60):
+            await renderer.feed("Синтез мнений экспертов по **бетону**. ")
+        shown = list(renderer.messages)
+        await renderer.abort()
+        edits = chat.edit_calls
+        await asyncio.sleep(0.05)
+        return chat, shown, renderer, edits
+
+    chat, shown, renderer, edits = asyncio.run(run())
+    ok = (
+        len(shown) >= 2 and shown[0] is chat.sent[0]
+        and all(m.deleted for m in chat.sent)
+        and renderer.messages == [] and chat.edit_calls == edits
+    )
+    logger.info(f"{'✅' if ok else '❌'} удалено {sum(m.deleted for m in chat.sent)} из {len(chat.sent)} сообщ.")
+    return ok
+
+
+def test_rate_limits():
+    """Частые токены не превращаются в частые правки: лимит на чат и адаптивный темп"""
+    logger.info("ТЕСТ 5: Лимит правок")
+    chat = FakeChat()
+    # Заглушка и первая правка - из запаса бакета, дальше не чаще 1 правки в секунду
+    limiter = EditRateLimiter(private_rate=1.0, burst=2, global_rate=30)
+    renderer = StreamRenderer(chat, limiter=limiter, metrics=StreamMetrics())
+
+    async def run():
+        await renderer.start()
+        for i in range(300):
+            await renderer.feed(f"слово{i} ")
+            await asyncio.sleep(0)
+        return await renderer.finish()
+
+    messages = asyncio.run(run())
+    stats = renderer.stats
+
+    ok = (
+        len(messages) == 1 and messages[0].text.rstrip().endswith("слово299")
+        and stats.edits <= 3 and chat.edit_calls <= 3
+        and stats.ttft_ms is not None and stats.first_edit_ms < 100
+    )
+    logger.info(f"{'✅' if ok else '❌'} {stats}")
+    return ok
+
+
+def test_flood_wait_and_markup():
+    """RetryAfter блокирует чат и замедляет темп; кнопки добавляются без пересылки ответа"""
+    logger.info("ТЕСТ 6: RetryAfter и кнопки")
+    chat = FakeChat(chat_id=-100)
+    limiter = fast_limiter()
+    metrics = StreamMetrics()
+    renderer = StreamRenderer(chat, limiter=limiter, metrics=metrics)
+
+    class InlineMarkup:
+        inline_keyboard = [["🔍 Подробнее"]]
+
+    class ReplyMarkup:
+        keyboard = [["Похожий вопрос"]]
+
+    async def run():
+        await renderer.start()
+        chat.flood_next = True
+        await renderer.feed("Первая часть ответа. ")
+        await renderer._wait_edit()
+        blocked = limiter.wait_time(chat.chat_id) > 0
+        await renderer.feed("Вторая часть ответа, после паузы.")
+        await renderer.finish()
+        await renderer.attach_markup(InlineMarkup())
+        await renderer.attach_markup(ReplyMarkup())
+        return blocked
+
+    blocked = asyncio.run(run())
+    summary = metrics.get_stats()
+
+    ok = (
+        blocked and renderer.stats.flood_waits == 1 and renderer._slowdown > 1
+        and chat.sent[0].text == "Первая часть ответа. Вторая часть ответа, после паузы."
+        and isinstance(chat.sent[0].reply_markup, InlineMarkup)
+        and len(chat.sent) == 2 and chat.sent[1].text == REPLY_KEYBOARD_NOTE
+        and summary["answers"] == 1 and summary["flood_waits"] == 1 and summary["edits_per_answer"] >= 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} {renderer.stats}, {summary}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Переход в новое сообщение": test_rollover(),
+        "Границы Markdown": test_markdown_boundaries(),
+        "Переход без разметки": test_plain_text_rollover(),
+        "Отмена после перехода": test_abort_after_rollover(),
+        "Лимит правок": test_rate_limits(),
+        "RetryAfter и кнопки": test_flood_wait_and_markup()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
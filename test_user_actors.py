@@ -0,0 +1,184 @@
+"""
+Нагрузочный тест очередей пользователей (user_actors.py)
+Тысячи одновременных обновлений: история каждого пользователя остаётся
+целой (вопрос - ответ по порядку отправки), разные пользователи идут
+параллельно, пропускная способность растёт с числом пользователей
+"""
+
+import asyncio
+import logging
+import random
+import sys
+import tempfile
+import time
+
+from conversation_store import ConversationStore
+from user_actors import UserActors, update_key
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+async def handle(store: ConversationStore, user_id: int, i: int, delay: float):
+    """Как handle_text: вопрос в историю, ожидание модели, ответ в историю"""
+    store.append(user_id, {"role": "user", "content": f"вопрос {i}"})
+    await asyncio.sleep(delay)
+    history = store.load(user_id)
+    store.append(user_id, {"role": "assistant", "content": f"ответ {i} (контекст {len(history)})"})
+
+
+def history_intact(store: ConversationStore, user_id: int, messages: int) -> bool:
+    records = store.load(user_id)
+    expected = []
+    for i in range(messages):
+        expected += [("user", f"вопрос {i}"), ("assistant", f"ответ {i}")]
+    got = [(r["role"], r["content"].split(" (")[0]) for r in records]
+    return got == expected
+
+
+async def fire(users: int, messages: int, delay, actors) -> tuple:
+    """Все обновления отправлены разом; сообщения пользователя - в порядке отправки"""
+    tmp = tempfile.mkdtemp()
+    store = ConversationStore(tmp, max_records=2 * messages + 10)
+
+    async def update(user_id, i):
+        coroutine = handle(store, user_id, i, delay() if callable(delay) else delay)
+        if actors is None:
+            await coroutine
+        else:
+            await actors.process(user_id, coroutine)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(update(u, i) for i in range(messages) for u in range(users)))
+    elapsed = time.perf_counter() - started
+    store.flush()
+    return store, elapsed
+
+
+def test_history_intact():
+    """5000 обновлений от 250 пользователей: история цела; без очередей - перемешана"""
+    logger.info("ТЕСТ 1: Целостность истории")
+    users, messages = 250, 20
+    jitter = lambda: random.uniform(0, 0.003)  # noqa: E731
+    actors = UserActors()
+
+    store, elapsed = asyncio.run(fire(users, messages, jitter, actors))
+    broken = [u for u in range(users) if not history_intact(store, u, messages)]
+    control, _ = asyncio.run(fire(users, messages, jitter, None))
+    control_broken = sum(1 for u in range(users) if not history_intact(control, u, messages))
+    stats = actors.get_stats()
+
+    ok = (
+        not broken and control_broken > users // 2
+        and stats["processed"] == users * messages and stats["active_users"] == 0
+        and stats["max_depth"] == messages
+    )
+    logger.info(f"{'✅' if ok else '❌'} {users * messages} обновлений за {elapsed:.2f} с, "
+                f"повреждено: {len(broken)} (без очередей: {control_broken}), {stats}")
+    return ok
+
+
+def test_throughput_scales():
+    """Пропускная способность растёт с числом пользователей (ожидание модели 5 мс)"""
+    logger.info("ТЕСТ 2: Масштабирование")
+    messages, delay = 20, 0.005
+    rates = {}
+    for users in (1, 10, 100, 400):
+        _, elapsed = asyncio.run(fire(users, messages, delay, UserActors()))
+        rates[users] = users * messages / elapsed
+
+    ok = (
+        rates[1] < 1 / delay * 1.05
+        and rates[100] > 30 * rates[1]
+        and rates[400] > 0.8 * rates[100]
+    )
+    logger.info(f"{'✅' if ok else '❌'} обновлений/с: " + ", ".join(f"{u} польз. - {r:.0f}" for u, r in rates.items()))
+    return ok
+
+
+def test_on_queued_and_keys():
+    """Новое обновление за незавершённым вызывает on_queued; ключ - пользователь или чат"""
+    logger.info("ТЕСТ 3: on_queued и ключи")
+    actors = UserActors()
+    queued = []
+
+    async def run():
+        first = asyncio.ensure_future(actors.process(7, asyncio.sleep(0.02), on_queued=queued.append))
+        await asyncio.sleep(0)
+        await actors.process(7, asyncio.sleep(0), on_queued=queued.append)
+        await actors.process(8, asyncio.sleep(0), on_queued=queued.append)
+        await first
+        return await actors.process(None, asyncio.sleep(0, result="без очереди"))
+
+    result = asyncio.run(run())
+
+    class User:
+        id = 42
+
+    class Chat:
+        id = -100
+
+    class Update:
+        effective_user = User()
+        effective_chat = Chat()
+
+    class ChannelPost:
+        effective_user = None
+        effective_chat = Chat()
+
+    ok = (
+        queued == [7] and result == "без очереди"
+        and update_key(Update()) == 42 and update_key(ChannelPost()) == -100 and update_key(object()) is None
+        and actors.get_stats()["active_users"] == 0
+    )
+    logger.info(f"{'✅' if ok else '❌'} on_queued: {queued}, {actors.get_stats()}")
+    return ok
+
+
+def test_flood_does_not_starve_others():
+    """Очередь одного пользователя не занимает общий лимит одновременных обновлений"""
+    logger.info("ТЕСТ 4: Общий лимит после очереди пользователя")
+    actors = UserActors()
+    limit = asyncio.Semaphore(2)
+
+    async def run():
+        flood = [asyncio.ensure_future(actors.process(1, asyncio.sleep(0.05), limit=limit)) for _ in range(20)]
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        await actors.process(2, asyncio.sleep(0.01), limit=limit)
+        other_ms = (time.perf_counter() - started) * 1000
+        pending = sum(not task.done() for task in flood)
+        await asyncio.gather(*flood)
+        return other_ms, pending
+
+    other_ms, pending = asyncio.run(run())
+    ok = other_ms < 100 and pending >= 15
+    logger.info(f"{'✅' if ok else '❌'} второй пользователь: {other_ms:.0f} мс, у первого ещё в очереди: {pending}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    random.seed(1)
+    logging.getLogger("user_actors").setLevel(logging.ERROR)
+    results = {
+        "Целостность истории": test_history_intact(),
+        "Масштабирование": test_throughput_scales(),
+        "on_queued и ключи": test_on_queued_and_keys(),
+        "Общий лимит": test_flood_does_not_starve_others()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,277 @@
+"""
+Тест пула распознавания Vosk (vosk_pool.py)
+Проверяет потоковую выдачу промежуточного текста, переиспользование
+распознавателей в тёплых процессах, перезапуск упавшего обработчика и
+пропускную способность (RTF на ядро, масштабирование по процессам).
+Если установлен vosk и есть модель и примеры в voice_samples/ - бенчмарк
+на настоящей модели
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import wave
+from pathlib import Path
+
+from vosk_pool import VoskPool, VoskPoolError
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+CHUNK = SAMPLE_RATE  # 0.5 с PCM s16le
+
+# Примеры голосовых для бенчмарка на настоящей модели (WAV 16 кГц моно)
+VOICE_SAMPLES_DIR = Path("voice_samples")
+
+
+class FakeRecognizer:
+    """Распознаватель с API KaldiRecognizer: слово на кусок, сегмент из 4 слов"""
+
+    # Процессорное время на секунду аудио (RTF заменителя)
+    RTF = 0.1
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.words, self.segment, self.count = [], [], 0
+
+    def _burn(self, seconds):
+        end = time.process_time() + seconds
+        while time.process_time() < end:
+            pass
+
+    def AcceptWaveform(self, pcm):
+        if pcm.startswith(b"CRASH"):
+            os._exit(1)
+        self._burn(len(pcm) / (self.sample_rate * 2) * self.RTF)
+        self.count += 1
+        self.words.append(f"слово{self.count}")
+        if len(self.words) == 4:
+            self.segment, self.words = self.words, []
+            return True
+        return False
+
+    def Result(self):
+        return json.dumps({"text": " ".join(self.segment)})
+
+    def PartialResult(self):
+        return json.dumps({"partial": " ".join(self.words)})
+
+    def FinalResult(self):
+        text, self.words = " ".join(self.words), []
+        return json.dumps({"text": text})
+
+    def Reset(self):
+        self.words, self.segment, self.count = [], [], 0
+
+
+def fake_factory(sample_rate):
+    return FakeRecognizer(sample_rate)
+
+
+async def pcm_stream(chunks: int, delay: float = 0.0):
+    """Поток PCM как из audio_pipeline.iter_pcm (куски меньше куска пула)"""
+    for _ in range(chunks * 2):
+        if delay:
+            await asyncio.sleep(delay)
+        yield bytes(CHUNK // 2)
+
+
+def test_streaming_partials():
+    """Промежуточный текст приходит до окончания распознавания"""
+    logger.info("ТЕСТ 1: Потоковое распознавание")
+
+    async def scenario():
+        pool = VoskPool(workers=1, factory=fake_factory)
+        partials = []
+        finished = False
+
+        async def on_partial(text):
+            partials.append((text, finished))
+
+        try:
+            result = await pool.recognize(pcm_stream(10, delay=0.005), SAMPLE_RATE, on_partial)
+            finished = True
+        finally:
+            pool.close()
+        return result, partials
+
+    result, partials = asyncio.run(scenario())
+    texts = [text for text, _ in partials]
+    ok = (
+        result["text"] == " ".join(f"слово{i}" for i in range(1, 11))
+        and abs(result["audio_seconds"] - 5.0) < 1e-6
+        and len(partials) >= 8 and not any(done for _, done in partials)
+        and texts[-1].startswith("слово1 слово2 слово3 слово4")
+        and len(texts) == len(set(texts))
+    )
+    logger.info(f"{'✅' if ok else '❌'} {len(partials)} промежуточных, итог: {result}")
+    return ok
+
+
+def test_warm_recognizer_reuse():
+    """Распознаватель создаётся один раз на процесс и частоту, а не на сообщение"""
+    logger.info("ТЕСТ 2: Переиспользование распознавателей")
+
+    async def scenario():
+        pool = VoskPool(workers=2, factory=fake_factory)
+        try:
+            results = await asyncio.gather(*(
+                pool.recognize(bytes(CHUNK * 3), SAMPLE_RATE) for _ in range(8)
+            ))
+            other_rate = await pool.recognize(bytes(8000 * 2), 8000)
+            return results, other_rate, pool.get_stats()
+        finally:
+            pool.close()
+
+    results, other_rate, stats = asyncio.run(scenario())
+    ok = (
+        all(r["text"] == "слово1 слово2 слово3" for r in results)
+        and {r["worker"] for r in results} == {0, 1}
+        and other_rate["audio_seconds"] == 1.0
+        and stats["jobs"] == 9 and stats["recognizers"] == 3
+    )
+    logger.info(f"{'✅' if ok else '❌'} 9 сообщений, распознавателей создано: {stats['recognizers']}")
+    return ok
+
+
+def test_worker_crash_restart():
+    """Упавший обработчик заменяется, следующее сообщение распознаётся"""
+    logger.info("ТЕСТ 3: Перезапуск обработчика")
+
+    async def scenario():
+        pool = VoskPool(workers=1, factory=fake_factory)
+        try:
+            error = None
+            try:
+                await pool.recognize(b"CRASH" + bytes(100), SAMPLE_RATE)
+            except VoskPoolError as e:
+                error = str(e)
+            result = await pool.recognize(bytes(CHUNK), SAMPLE_RATE)
+            return error, result, pool.get_stats()
+        finally:
+            pool.close()
+
+    error, result, stats = asyncio.run(scenario())
+    ok = (
+        error is not None and result["text"] == "слово1"
+        and stats["restarts"] == 1 and stats["failures"] == 1
+    )
+    logger.info(f"{'✅' if ok else '❌'} ошибка: {error!r}, после перезапуска: {result['text']!r}")
+    return ok
+
+
+def test_throughput_benchmark():
+    """RTF на ядро и пропускная способность пула; event loop не блокируется"""
+    logger.info("ТЕСТ 4: Бенчмарк пропускной способности")
+    cores = os.cpu_count() or 1
+    messages, seconds = 8, 4
+
+    async def run(workers):
+        pool = VoskPool(workers=workers, factory=fake_factory)
+        pool.start()
+        gaps = []
+        stop = asyncio.Event()
+
+        async def ticker():
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        try:
+            await pool.recognize(bytes(CHUNK), SAMPLE_RATE)  # прогрев
+            tick = asyncio.create_task(ticker())
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                pool.recognize(pcm_stream(seconds * 2), SAMPLE_RATE) for _ in range(messages)
+            ))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await tick
+            return pool.get_stats(), messages * seconds / elapsed, max(gaps)
+        finally:
+            pool.close()
+
+    single, single_speed, single_gap = asyncio.run(run(1))
+    workers = min(cores, 4) if cores > 1 else 2
+    multi, multi_speed, multi_gap = asyncio.run(run(workers))
+    scaling = multi_speed / single_speed
+    expected = min(workers, cores)
+
+    ok = (
+        0.05 < single["rtf_per_core"] < 0.3
+        and scaling > 0.7 * expected
+        and max(single_gap, multi_gap) < 0.1
+    )
+    logger.info(f"   RTF на ядро: {single['rtf_per_core']:.3f} (1 процесс), {multi['rtf_per_core']:.3f} ({workers})")
+    logger.info(f"   1 процесс: {single_speed:.1f} с аудио/с, {workers} процессов: {multi_speed:.1f} с аудио/с "
+                f"(x{scaling:.2f}, ядер: {cores})")
+    logger.info(f"{'✅' if ok else '❌'} макс. пауза event loop {max(single_gap, multi_gap) * 1000:.0f} мс")
+    return ok
+
+
+def test_real_vosk_benchmark():
+    """RTF настоящей модели на примерах из voice_samples/ (если есть vosk и модель)"""
+    logger.info("ТЕСТ 5: Бенчмарк Vosk на примерах")
+    try:
+        import voice_handler
+    except ImportError:
+        logger.info("⏭️ voice_handler недоступен - пропуск")
+        return True
+
+    samples = sorted(VOICE_SAMPLES_DIR.glob("*.wav"))
+    if not voice_handler.VOSK_ENABLED or not samples:
+        logger.info("⏭️ vosk не установлен, нет модели или примеров в voice_samples/ - пропуск")
+        return True
+
+    async def scenario():
+        pool = VoskPool(model_path=voice_handler.vosk_model_path)
+        try:
+            results = []
+            for sample in samples:
+                with wave.open(str(sample)) as wav:
+                    pcm, rate = wav.readframes(wav.getnframes()), wav.getframerate()
+                results.append((sample.name, await pool.recognize(pcm, rate)))
+            return results, pool.get_stats()
+        finally:
+            pool.close()
+
+    results, stats = asyncio.run(scenario())
+    for name, result in results:
+        logger.info(f"   {name}: {result['audio_seconds']:.1f}с, RTF {result['rtf']:.3f}, {result['text'][:60]!r}")
+    ok = stats["rtf_per_core"] < 1.0 and stats["recognizers"] <= stats["workers"] * 2
+    logger.info(f"{'✅' if ok else '❌'} RTF на ядро: {stats['rtf_per_core']:.3f}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    logging.getLogger("vosk_pool").setLevel(logging.ERROR)
+    results = {
+        "Потоковое распознавание": test_streaming_partials(),
+        "Переиспользование распознавателей": test_warm_recognizer_reuse(),
+        "Перезапуск обработчика": test_worker_crash_restart(),
+        "Бенчмарк пропускной способности": test_throughput_benchmark(),
+        "Бенчмарк Vosk на примерах": test_real_vosk_benchmark()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,190 @@
+"""
+Тест пула соединений XAIClient на локальном stub-сервере
+Проверяет keep-alive (одно TCP соединение на серию запросов), streaming и метрики
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from xai_client import XAIClient
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+class StubXAIHandler(BaseHTTPRequestHandler):
+    """Минимальная имитация /v1/chat/completions"""
+
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        StubXAIHandler.connections.add(self.client_address)
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if payload["model"] == "rate-limited":
+            body = b'{"error": "rate limit"}'
+            self.send_response(429)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if payload.get("stream"):
+            chunks = "".join(
+                f"data: {json.dumps({'choices': [{'delta': {'content': part}}]})}\n\n"
+                for part in ["Бетон ", "B25"]
+            ) + "data: [DONE]\n\n"
+            body = chunks.encode("utf-8")
+            content_type = "text/event-stream"
+        else:
+            body = json.dumps({
+                "choices": [{"message": {"content": f"ok:{payload['messages'][-1]['content']}"}}]
+            }).encode("utf-8")
+            content_type = "application/json"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_stub_server = None
+
+
+def get_stub_url() -> str:
+    """Запустить stub-сервер на свободном порту (один раз на процесс)"""
+    global _stub_server
+    if _stub_server is None:
+        _stub_server = ThreadingHTTPServer(("127.0.0.1", 0), StubXAIHandler)
+        threading.Thread(target=_stub_server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{_stub_server.server_address[1]}/v1"
+
+
+def test_sync_keepalive():
+    """Серия синхронных запросов идёт через одно соединение"""
+    logger.info("ТЕСТ 1: Keep-alive синхронного клиента")
+    base_url = get_stub_url()
+    StubXAIHandler.connections.clear()
+
+    client = XAIClient(api_key="test", base_url=base_url)
+    answers = [
+        client.chat_completions_create("grok", [{"role": "user", "content": str(i)}])
+        for i in range(10)
+    ]
+    client.close()
+
+    ok = (
+        len(StubXAIHandler.connections) == 1
+        and answers[-1]["choices"][0]["message"]["content"] == "ok:9"
+        and client.get_metrics()["requests"] == 10
+    )
+    logger.info(f"{'✅' if ok else '❌'} 10 запросов, TCP соединений: {len(StubXAIHandler.connections)}")
+    return ok
+
+
+def test_async_pool_and_stream():
+    """Асинхронные запросы и streaming используют общий пул"""
+    logger.info("ТЕСТ 2: Асинхронный пул и streaming")
+    base_url = get_stub_url()
+    StubXAIHandler.connections.clear()
+
+    async def run():
+        client = XAIClient(api_key="test", base_url=base_url, max_connections=4)
+        await client.start()
+
+        for i in range(5):
+            await client.chat_completions_create_async("grok", [{"role": "user", "content": str(i)}])
+        await asyncio.gather(*[
+            client.chat_completions_create_async("grok", [{"role": "user", "content": str(i)}])
+            for i in range(20)
+        ])
+
+        parts = []
+        async for part in client.chat_completions_create_stream("grok", [{"role": "user", "content": "?"}]):
+            parts.append(part)
+
+        metrics = client.get_metrics()
+        await client.aclose()
+        return "".join(parts), metrics
+
+    text, metrics = asyncio.run(run())
+    ok = text == "Бетон B25" and metrics["requests"] == 26 and len(StubXAIHandler.connections) <= 4
+    logger.info(
+        f"{'✅' if ok else '❌'} stream='{text}', запросов: {metrics['requests']}, "
+        f"TCP соединений: {len(StubXAIHandler.connections)}, p50: {metrics['p50_latency_ms']} мс"
+    )
+    return ok
+
+
+def test_error_mapping():
+    """HTTP 429 превращается в понятное сообщение и считается в метриках"""
+    logger.info("ТЕСТ 3: Обработка 429")
+    base_url = get_stub_url()
+
+    client = XAIClient(api_key="test", base_url=base_url)
+    try:
+        client.chat_completions_create("rate-limited", [{"role": "user", "content": "?"}])
+        ok = False
+    except Exception as e:
+        ok = "лимит" in str(e) and client.get_metrics()["errors"] == 1
+    client.close()
+
+    logger.info(f"{'✅' if ok else '❌'} 429 обработан")
+    return ok
+
+
+def test_loop_change_closes_pool():
+    """Пул прежнего event loop закрывается, когда клиент переходит в новый"""
+    logger.info("ТЕСТ 4: Смена event loop")
+    base_url = get_stub_url()
+    client = XAIClient(api_key="test", base_url=base_url)
+
+    async def request():
+        await client.chat_completions_create_async("grok", [{"role": "user", "content": "?"}])
+        return client._async_client
+
+    first = asyncio.run(request())
+
+    async def next_loop():
+        second = await request()
+        await client.aclose()
+        return second
+
+    second = asyncio.run(next_loop())
+    ok = first is not second and first.is_closed and second.is_closed and not client._closing
+    logger.info(f"{'✅' if ok else '❌'} прежний пул закрыт: {first.is_closed}")
+    return ok
+
+
+def run_all_tests():
+    """Запуск всех тестов"""
+    results = {
+        "Keep-alive (sync)": test_sync_keepalive(),
+        "Пул и streaming (async)": test_async_pool_and_stream(),
+        "Ошибка 429": test_error_mapping(),
+        "Смена event loop": test_loop_change_closes_pool()
+    }
+
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        logger.info(f"{'✅ PASSED' if result else '❌ FAILED'}: {test_name}")
+    logger.info(f"Успешно: {passed}/{len(results)} тестов")
+
+    return passed == len(results)
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,183 @@
+"""
+Последовательная обработка обновлений одного пользователя v1.0
+Текст, фото и голос одного пользователя больше не обрабатываются одновременно
+
+- У каждого пользователя своя FIFO-очередь (asyncio.Lock отдаёт захват по
+  порядку ожидания): реплики попадают в историю в порядке отправки,
+  вопрос и ответ не перемешиваются с соседним сообщением
+- Разные пользователи обрабатываются параллельно (PerUserUpdateProcessor
+  для Application.builder().concurrent_updates(...))
+- Общий лимит BOT_CONCURRENT_UPDATES занимается только после очереди
+  пользователя: обновления, ждущие своей очереди, слотов не держат, и один
+  пользователь, засыпающий бота сообщениями, не блокирует остальных
+- Очередь пользователя удаляется, когда в ней никого нет - память не растёт
+  с числом пользователей
+- on_queued: вызывается, когда новое обновление встаёт за незавершённым
+  (бот отменяет предыдущий AI запрос, чтобы не ждать устаревший ответ)
+- Статистика: ожидание в очереди, максимальная глубина, активные пользователи
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from telegram.ext import BaseUpdateProcessor
+    TELEGRAM_AVAILABLE = True
+except ImportError:
+    TELEGRAM_AVAILABLE = False
+
+# === КОНФИГУРАЦИЯ ===
+
+# Сколько обновлений (разных пользователей) обрабатывать одновременно
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "256"))
+
+# Предупреждение о длинной очереди одного пользователя
+USER_QUEUE_WARN_DEPTH = 10
+
+
+class _Slot:
+    """Очередь одного пользователя"""
+
+    __slots__ = ("lock", "waiters")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiters = 0
+
+
+def update_key(update: Any) -> Optional[int]:
+    """Ключ очереди: пользователь, иначе чат (None - обновление без отправителя)"""
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat is not None else None
+
+
+class UserActors:
+    """Очереди обработки по пользователям"""
+
+    def __init__(self):
+        self._slots: Dict[Hashable, _Slot] = {}
+        self._waits_ms: deque = deque(maxlen=1000)
+        self.stats = {"processed": 0, "queued": 0, "max_depth": 0}
+
+    def depth(self, key: Hashable) -> int:
+        """Сколько обновлений пользователя в работе и в очереди"""
+        slot = self._slots.get(key)
+        return slot.waiters if slot is not None else 0
+
+    def busy(self, key: Hashable) -> bool:
+        return self.depth(key) > 0
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        """Выполнить блок в очереди пользователя key"""
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+        slot.waiters += 1
+        if slot.waiters > 1:
+            self.stats["queued"] += 1
+        if slot.waiters > self.stats["max_depth"]:
+            self.stats["max_depth"] = slot.waiters
+        if slot.waiters == USER_QUEUE_WARN_DEPTH:
+            logger.warning(f"⚠️ Очередь пользователя {key}: {slot.waiters} обновлений")
+
+        queued_at = time.perf_counter()
+        try:
+            async with slot.lock:
+                self._waits_ms.append((time.perf_counter() - queued_at) * 1000)
+                yield
+        finally:
+            slot.waiters -= 1
+            self.stats["processed"] += 1
+            if slot.waiters == 0 and self._slots.get(key) is slot:
+                del self._slots[key]
+
+    async def process(
+        self,
+        key: Optional[Hashable],
+        coroutine: Awaitable,
+        on_queued: Optional[Callable[[Hashable], Any]] = None,
+        limit: Optional[asyncio.Semaphore] = None
+    ) -> Any:
+        """
+        Выполнить корутину обработчика в очереди пользователя
+
+        Args:
+            key: Ключ пользователя (None - без очереди)
+            coroutine: Обработка обновления
+            on_queued: Вызывается, если у пользователя уже есть незавершённое обновление
+            limit: Общий лимит одновременных обновлений - занимается, когда
+                подошла очередь пользователя
+        """
+        if key is None:
+            return await self._run(coroutine, limit)
+        if on_queued is not None and self.busy(key):
+            on_queued(key)
+        async with self.hold(key):
+            return await self._run(coroutine, limit)
+
+    @staticmethod
+    async def _run(coroutine: Awaitable, limit: Optional[asyncio.Semaphore]) -> Any:
+        if limit is None:
+            return await coroutine
+        async with limit:
+            return await coroutine
+
+    def get_stats(self) -> dict:
+        waits = sorted(self._waits_ms)
+        return {
+            **self.stats,
+            "active_users": len(self._slots),
+            "avg_wait_ms": round(sum(waits) / len(waits), 1) if waits else 0.0,
+            "p95_wait_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0
+        }
+
+
+# Общие очереди бота
+USER_ACTORS = UserActors()
+
+
+if TELEGRAM_AVAILABLE:
+    class PerUserUpdateProcessor(BaseUpdateProcessor):
+        """
+        Обработчик обновлений python-telegram-bot: параллельно по пользователям,
+        последовательно внутри пользователя
+
+        Семафор BaseUpdateProcessor берётся до do_process_update, то есть до
+        очереди пользователя, поэтому он открыт без ограничения, а
+        max_concurrent_updates применяется уже в очереди (UserActors.process)
+        """
+
+        def __init__(
+            self,
+            max_concurrent_updates: int = BOT_CONCURRENT_UPDATES,
+            actors: UserActors = USER_ACTORS,
+            on_queued: Optional[Callable[[Hashable, Any], Any]] = None
+        ):
+            super().__init__(sys.maxsize)
+            self.limit = asyncio.BoundedSemaphore(max_concurrent_updates)
+            self.actors = actors
+            self.on_queued = on_queued
+
+        async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+            on_queued = None
+            if self.on_queued is not None:
+                on_queued = lambda key: self.on_queued(key, update)  # noqa: E731
+            await self.actors.process(update_key(update), coroutine, on_queued, self.limit)
+
+        async def initialize(self) -> None:
+            pass
+
+        async def shutdown(self) -> None:
+            pass
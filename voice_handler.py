@@ -1,23 +1,29 @@
 """
 Модуль для обработки голосовых сообщений
 Поддержка: OpenAI Whisper, Vosk (офлайн)
+
+Голосовое сообщение скачивается в память и не пишется на диск:
+- Whisper получает исходный OGG/Opus без перекодирования в MP3
+- Для Vosk OGG декодируется в PCM через ffmpeg pipe (audio_pipeline,
+  ограниченный пул асинхронных процессов)
+- Vosk распознаёт в пуле тёплых процессов (vosk_pool) потоково: промежуточный
+  текст показывается в чате, пока голосовое ещё распознаётся
 """
 
 import os
 import logging
 import asyncio
-import json
-import wave
-import subprocess
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from audio_pipeline import AudioConversionError, get_audio_converter, PCM_SAMPLE_RATE
+from vosk_pool import get_vosk_pool
 
 logger = logging.getLogger(__name__)
 
-# Папка для временных голосовых файлов
+# Папка временных голосовых файлов прежних версий (только для очистки)
 VOICE_TEMP_DIR = Path("voice_temp")
-VOICE_TEMP_DIR.mkdir(exist_ok=True)
 
 # Папка для Vosk моделей
 VOSK_MODEL_DIR = Path("vosk_models")
@@ -31,8 +37,8 @@ VOSK_MODEL_DIR.mkdir(exist_ok=True)
 openai_client = None
 OPENAI_VOICE_ENABLED = False
 
-# Vosk модель
-vosk_model = None
+# Путь к модели Vosk (модель загружают процессы vosk_pool)
+vosk_model_path = None
 VOSK_ENABLED = False
 
 # Приоритет движков: 1) OpenAI Whisper  2) Vosk
@@ -62,13 +68,10 @@ def init_openai_voice():
 
 def init_vosk():
     """Инициализация Vosk для офлайн распознавания"""
-    global vosk_model, VOSK_ENABLED
+    global vosk_model_path, VOSK_ENABLED
 
     try:
-        from vosk import Model, SetLogLevel
-
-        # Отключаем лишние логи Vosk
-        SetLogLevel(-1)
+        import vosk  # noqa: F401 - модель загружается в процессах распознавания
 
         # Ищем модель в папке vosk_models
         model_paths = [
@@ -82,9 +85,9 @@ def init_vosk():
 
         for model_path in model_paths:
             if model_path.exists():
-                vosk_model = Model(str(model_path))
+                vosk_model_path = str(model_path)
                 VOSK_ENABLED = True
-                logger.info(f"✅ Vosk модель загружена: {model_path}")
+                logger.info(f"✅ Vosk модель найдена: {model_path}")
                 return True
 
         logger.warning(
@@ -126,89 +129,45 @@ init_voice_engine()
 
 
 # ========================================
-# КОНВЕРТАЦИЯ АУДИО
+# АУДИО В ПАМЯТИ
 # ========================================
 
-def convert_ogg_to_wav(ogg_path: str) -> Optional[str]:
-    """Конвертирует OGG в WAV для Vosk"""
-    try:
-        wav_path = ogg_path.replace('.ogg', '.wav')
-        result = subprocess.run(
-            ['ffmpeg', '-y', '-i', ogg_path, '-ar', '16000', '-ac', '1', wav_path],
-            capture_output=True,
-            timeout=30
-        )
-        if result.returncode == 0 and Path(wav_path).exists():
-            return wav_path
-        return None
-    except FileNotFoundError:
-        logger.warning("ffmpeg не установлен")
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка конвертации: {e}")
-        return None
+# Голосовое сообщение: байты OGG/Opus или путь к файлу (старые вызовы)
+VoiceInput = Union[bytes, bytearray, str, Path]
 
+# Получатель промежуточного текста распознавания
+PartialCallback = Callable[[str], Awaitable[Any]]
 
-def convert_ogg_to_mp3(ogg_path: str) -> Optional[str]:
-    """Конвертирует OGG в MP3 для OpenAI"""
-    try:
-        mp3_path = ogg_path.replace('.ogg', '.mp3')
-        result = subprocess.run(
-            ['ffmpeg', '-y', '-i', ogg_path, '-acodec', 'libmp3lame', '-q:a', '2', mp3_path],
-            capture_output=True,
-            timeout=30
-        )
-        if result.returncode == 0 and Path(mp3_path).exists():
-            return mp3_path
-        return None
-    except FileNotFoundError:
-        logger.warning("ffmpeg не установлен")
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка конвертации: {e}")
-        return None
+
+async def read_voice_input(voice: VoiceInput) -> bytes:
+    """Байты голосового сообщения (файл читается вне event loop)"""
+    if isinstance(voice, (bytes, bytearray)):
+        return bytes(voice)
+    return await asyncio.to_thread(Path(voice).read_bytes)
 
 
 # ========================================
 # РАСПОЗНАВАНИЕ ЧЕРЕЗ OPENAI WHISPER
 # ========================================
 
-async def transcribe_with_openai(audio_path: str) -> dict:
-    """Распознавание через OpenAI Whisper API"""
+async def transcribe_with_openai(voice: VoiceInput) -> dict:
+    """Распознавание через OpenAI Whisper API (OGG принимается без перекодирования)"""
 
     if not OPENAI_VOICE_ENABLED or not openai_client:
         return {"success": False, "text": "", "error": "OpenAI не инициализирован"}
 
     try:
-        file_path = Path(audio_path)
-
-        # Конвертируем OGG в MP3 если нужно (Whisper лучше работает с MP3)
-        if file_path.suffix.lower() == '.ogg':
-            mp3_path = convert_ogg_to_mp3(audio_path)
-            if mp3_path:
-                file_path = Path(mp3_path)
-            # Если конвертация не удалась, пробуем с OGG
-
-        loop = asyncio.get_event_loop()
+        data = await read_voice_input(voice)
 
         def _transcribe():
-            with open(file_path, "rb") as audio_file:
-                response = openai_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language="ru",
-                    response_format="text"
-                )
-            return response
-
-        text = await loop.run_in_executor(None, _transcribe)
-
-        # Удаляем временный MP3
-        if str(file_path).endswith('.mp3') and file_path != Path(audio_path):
-            try:
-                file_path.unlink(missing_ok=True)
-            except:
-                pass
+            return openai_client.audio.transcriptions.create(
+                model="whisper-1",
+                file=("voice.ogg", data),
+                language="ru",
+                response_format="text"
+            )
+
+        text = await asyncio.to_thread(_transcribe)
 
         if text:
             return {"success": True, "text": text.strip(), "error": "", "engine": "openai"}
@@ -224,59 +183,30 @@ async def transcribe_with_openai(audio_path: str) -> dict:
 # РАСПОЗНАВАНИЕ ЧЕРЕЗ VOSK
 # ========================================
 
-async def transcribe_with_vosk(audio_path: str) -> dict:
-    """Распознавание через Vosk (офлайн)"""
+async def transcribe_with_vosk(voice: VoiceInput, on_partial: Optional[PartialCallback] = None) -> dict:
+    """
+    Распознавание через Vosk (офлайн) в пуле тёплых процессов (vosk_pool)
+
+    PCM из ffmpeg отправляется в распознаватель кусками по мере декодирования,
+    промежуточный текст передаётся в on_partial.
+    """
 
-    if not VOSK_ENABLED or not vosk_model:
+    if not VOSK_ENABLED or not vosk_model_path:
         return {"success": False, "text": "", "error": "Vosk не инициализирован"}
 
     try:
-        from vosk import KaldiRecognizer
-
-        if audio_path.endswith('.ogg'):
-            wav_path = convert_ogg_to_wav(audio_path)
-            if not wav_path:
-                return {"success": False, "text": "", "error": "Не удалось конвертировать аудио"}
-        else:
-            wav_path = audio_path
-
-        loop = asyncio.get_event_loop()
-
-        def _transcribe():
-            wf = wave.open(wav_path, "rb")
-            if wf.getnchannels() != 1 or wf.getsampwidth() != 2:
-                return ""
-
-            rec = KaldiRecognizer(vosk_model, wf.getframerate())
-            rec.SetWords(True)
-
-            results = []
-            while True:
-                data = wf.readframes(4000)
-                if len(data) == 0:
-                    break
-                if rec.AcceptWaveform(data):
-                    part = json.loads(rec.Result())
-                    if part.get('text'):
-                        results.append(part['text'])
-
-            final = json.loads(rec.FinalResult())
-            if final.get('text'):
-                results.append(final['text'])
-
-            wf.close()
-            return " ".join(results).strip()
-
-        text = await loop.run_in_executor(None, _transcribe)
-
-        if wav_path != audio_path:
-            try:
-                Path(wav_path).unlink(missing_ok=True)
-            except:
-                pass
-
-        if text:
-            return {"success": True, "text": text, "error": "", "engine": "vosk"}
+        data = await read_voice_input(voice)
+        try:
+            result = await get_vosk_pool(vosk_model_path).recognize(
+                get_audio_converter().iter_pcm(data), PCM_SAMPLE_RATE, on_partial
+            )
+        except AudioConversionError as e:
+            logger.warning(f"⚠️ Не удалось конвертировать аудио: {e}")
+            return {"success": False, "text": "", "error": "Не удалось конвертировать аудио"}
+
+        logger.info(f"🎤 Vosk: {result['audio_seconds']:.1f}с аудио, RTF {result['rtf']:.3f}")
+        if result["text"]:
+            return {"success": True, "text": result["text"], "error": "", "engine": "vosk"}
         else:
             return {"success": False, "text": "", "error": "Речь не распознана"}
 
@@ -285,14 +215,26 @@ async def transcribe_with_vosk(audio_path: str) -> dict:
         return {"success": False, "text": "", "error": str(e)}
 
 
+def start_vosk_pool() -> bool:
+    """Запустить процессы Vosk заранее (при старте бота - модель загружается сразу)"""
+    if not VOSK_ENABLED or not vosk_model_path:
+        return False
+    get_vosk_pool(vosk_model_path).start()
+    return True
+
+
 # ========================================
 # ОСНОВНЫЕ ФУНКЦИИ
 # ========================================
 
-async def transcribe_voice(voice_file_path: str) -> dict:
+async def transcribe_voice(voice: VoiceInput, on_partial: Optional[PartialCallback] = None) -> dict:
     """
     Распознаёт голосовое сообщение в текст
 
+    Args:
+        voice: Байты OGG/Opus (или путь к файлу)
+        on_partial: Промежуточный текст во время распознавания (только Vosk)
+
     Приоритет движков:
     1. OpenAI Whisper (лучшее качество)
     2. Vosk (офлайн fallback)
@@ -303,18 +245,19 @@ async def transcribe_voice(voice_file_path: str) -> dict:
             "error": "Голосовые сообщения отключены. Нужен OPENAI_API_KEY или Vosk модель."
         }
 
-    logger.info(f"🎤 Распознавание голоса ({VOICE_ENGINE}): {voice_file_path}")
+    voice = await read_voice_input(voice)
+    logger.info(f"🎤 Распознавание голоса ({VOICE_ENGINE}): {len(voice)} байт")
 
     # Используем выбранный движок
     if VOICE_ENGINE == "openai":
-        result = await transcribe_with_openai(voice_file_path)
+        result = await transcribe_with_openai(voice)
         # Fallback на Vosk
         if not result["success"] and VOSK_ENABLED:
             logger.info("OpenAI не сработал, пробуем Vosk...")
-            result = await transcribe_with_vosk(voice_file_path)
+            result = await transcribe_with_vosk(voice, on_partial)
 
     elif VOICE_ENGINE == "vosk":
-        result = await transcribe_with_vosk(voice_file_path)
+        result = await transcribe_with_vosk(voice, on_partial)
 
     else:
         result = {"success": False, "text": "", "error": "Неизвестный движок"}
@@ -325,22 +268,23 @@ async def transcribe_voice(voice_file_path: str) -> dict:
     return result
 
 
-async def download_voice_file(bot, file_id: str, user_id: int) -> str:
-    """Скачивает голосовое сообщение из Telegram"""
+async def download_voice_bytes(bot, file_id: str) -> bytes:
+    """Скачивает голосовое сообщение из Telegram в память"""
     try:
         file = await bot.get_file(file_id)
-        timestamp = int(datetime.now().timestamp())
-        file_path = VOICE_TEMP_DIR / f"voice_{user_id}_{timestamp}.ogg"
-        await file.download_to_drive(file_path)
-        logger.info(f"✅ Голосовое сообщение скачано: {file_path}")
-        return str(file_path)
+        data = bytes(await file.download_as_bytearray())
+        logger.info(f"✅ Голосовое сообщение скачано: {len(data)} байт")
+        return data
     except Exception as e:
         logger.error(f"❌ Ошибка скачивания: {e}")
         raise
 
 
-async def process_voice_message(bot, voice_file_id: str, user_id: int) -> dict:
-    """Полная обработка голосового сообщения"""
+async def process_voice_message(
+    bot, voice_file_id: str, user_id: int,
+    on_partial: Optional[PartialCallback] = None
+) -> dict:
+    """Полная обработка голосового сообщения (on_partial - промежуточный текст)"""
     if not VOICE_ENGINE:
         return {
             "success": False, "text": "",
@@ -350,22 +294,12 @@ async def process_voice_message(bot, voice_file_id: str, user_id: int) -> dict:
                     "2️⃣ Vosk модель (офлайн)"
         }
 
-    file_path = None
     try:
-        file_path = await download_voice_file(bot, voice_file_id, user_id)
-        result = await transcribe_voice(file_path)
-        return result
+        voice = await download_voice_bytes(bot, voice_file_id)
+        return await transcribe_voice(voice, on_partial)
     except Exception as e:
         logger.error(f"❌ Ошибка обработки голоса: {e}")
         return {"success": False, "text": "", "error": f"Ошибка: {str(e)}"}
-    finally:
-        if file_path:
-            try:
-                Path(file_path).unlink(missing_ok=True)
-                Path(file_path.replace('.ogg', '.wav')).unlink(missing_ok=True)
-                Path(file_path.replace('.ogg', '.mp3')).unlink(missing_ok=True)
-            except:
-                pass
 
 
 def cleanup_old_voice_files(max_age_hours: int = 24):
@@ -0,0 +1,367 @@
+"""
+Пул процессов распознавания Vosk v1.0
+Распознавание идёт в тёплых процессах-обработчиках, а не в event loop бота
+
+- VOSK_WORKERS процессов; каждый загружает модель по пути один раз при
+  первом распознавании. Процессы запускаются через forkserver (или spawn),
+  а не fork: бот к этому моменту многопоточный (executor, хранилища, httpx),
+  и fork такого процесса может унаследовать захваченную блокировку
+- Распознаватель (KaldiRecognizer) в обработчике создаётся один раз на частоту
+  дискретизации и переиспользуется: между сообщениями - Reset()
+- Потоковое распознавание: PCM отправляется кусками по мере декодирования
+  (audio_pipeline.iter_pcm), на каждый кусок обработчик возвращает промежуточный
+  текст - длинное голосовое показывается в чате, пока идёт распознавание
+- Сообщение закреплено за одним обработчиком на всё время распознавания
+  (у распознавателя есть состояние), свободные обработчики - в очереди
+- Упавший обработчик перезапускается; статистика: RTF (процессорное время
+  распознавания / длительность аудио) на ядро и по обработчикам
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import multiprocessing
+from collections import deque
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, List, Optional, Union
+
+from audio_pipeline import PCM_SAMPLE_RATE, PCM_SAMPLE_WIDTH
+
+logger = logging.getLogger(__name__)
+
+# === КОНФИГУРАЦИЯ ===
+
+# Число процессов распознавания (по умолчанию - ядра, но не больше 4)
+VOSK_WORKERS = int(os.getenv("VOSK_WORKERS", str(min(os.cpu_count() or 1, 4))))
+
+# Размер куска PCM, отправляемого обработчику (секунды)
+VOSK_CHUNK_SECONDS = float(os.getenv("VOSK_CHUNK_SECONDS", "0.5"))
+
+# Сколько ждать ответа обработчика на один кусок (секунды)
+VOSK_CHUNK_TIMEOUT = 30.0
+
+# Модель, загруженная в процессе-обработчике (одна на все его распознаватели)
+_shared_model: Any = None
+
+
+class VoskPoolError(Exception):
+    """Обработчик упал или не ответил"""
+
+
+# ========================================
+# ОБРАБОТЧИК (отдельный процесс)
+# ========================================
+
+class VoskRecognizerFactory:
+    """Распознаватель Vosk: модель загружается один раз в процессе-обработчике"""
+
+    def __init__(self, model_path: Optional[str] = None):
+        self.model_path = model_path
+
+    def __call__(self, sample_rate: int):
+        global _shared_model
+        from vosk import KaldiRecognizer, Model, SetLogLevel
+
+        if _shared_model is None:
+            SetLogLevel(-1)
+            _shared_model = Model(self.model_path)
+        recognizer = KaldiRecognizer(_shared_model, sample_rate)
+        recognizer.SetWords(False)
+        return recognizer
+
+
+def _text(raw: str, field: str) -> str:
+    try:
+        return json.loads(raw).get(field, "")
+    except ValueError:
+        return ""
+
+
+def _worker_main(conn, factory: Callable[[int], Any]):
+    """
+    Цикл обработчика. Протокол (кортежи через Pipe):
+        ("start", sample_rate) -> ("ready", создано распознавателей)
+        ("chunk", pcm)         -> ("partial", текст сегментов + текущая гипотеза)
+        ("end",)               -> ("final", текст, процессорное время, секунды аудио)
+    """
+    recognizers: Dict[int, Any] = {}
+    created = 0
+    recognizer = None
+    segments: List[str] = []
+    cpu = 0.0
+    audio_bytes = 0
+    sample_rate = PCM_SAMPLE_RATE
+
+    # Модель загружается сразу при запуске, а не на первом голосовом
+    try:
+        recognizers[PCM_SAMPLE_RATE] = factory(PCM_SAMPLE_RATE)
+        created += 1
+    except Exception:
+        pass  # ошибка повторится на "start" и дойдёт до пула
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        kind = message[0]
+
+        if kind == "start":
+            sample_rate = message[1]
+            recognizer = recognizers.get(sample_rate)
+            if recognizer is None:
+                recognizer = recognizers[sample_rate] = factory(sample_rate)
+                created += 1
+            else:
+                recognizer.Reset()
+            segments, cpu, audio_bytes = [], 0.0, 0
+            conn.send(("ready", created))
+
+        elif kind == "chunk":
+            started = time.process_time()
+            pcm = message[1]
+            audio_bytes += len(pcm)
+            if recognizer.AcceptWaveform(pcm):
+                text = _text(recognizer.Result(), "text")
+                if text:
+                    segments.append(text)
+                current = ""
+            else:
+                current = _text(recognizer.PartialResult(), "partial")
+            cpu += time.process_time() - started
+            conn.send(("partial", " ".join(segments + ([current] if current else []))))
+
+        elif kind == "end":
+            started = time.process_time()
+            text = _text(recognizer.FinalResult(), "text")
+            if text:
+                segments.append(text)
+            cpu += time.process_time() - started
+            conn.send(("final", " ".join(segments).strip(), cpu,
+                       audio_bytes / (sample_rate * PCM_SAMPLE_WIDTH)))
+
+        elif kind == "stop":
+            return
+
+
+# ========================================
+# ПУЛ (основной процесс)
+# ========================================
+
+class _Worker:
+    """Процесс-обработчик и его конец Pipe"""
+
+    def __init__(self, index: int, context, factory: Callable[[int], Any]):
+        self.index = index
+        self.conn, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child, factory),
+            name=f"vosk-worker-{index}", daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.jobs = 0
+        self.recognizers = 0
+        self.cpu_seconds = 0.0
+        self.audio_seconds = 0.0
+
+    async def request(self, message: tuple, timeout: float = VOSK_CHUNK_TIMEOUT) -> tuple:
+        """Отправить сообщение и дождаться ответа (без блокировки event loop)"""
+        loop = asyncio.get_running_loop()
+        try:
+            self.conn.send(message)
+        except (BrokenPipeError, OSError) as e:
+            raise VoskPoolError(f"обработчик {self.index} недоступен: {e}") from e
+
+        ready = loop.create_future()
+        fd = self.conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            raise VoskPoolError(f"обработчик {self.index} не ответил за {timeout:g} с")
+        finally:
+            loop.remove_reader(fd)
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise VoskPoolError(f"обработчик {self.index} завершился") from e
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=2)
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=2)
+        self.conn.close()
+
+
+class VoskPool:
+    """Тёплые процессы Vosk с потоковым распознаванием"""
+
+    def __init__(
+        self,
+        workers: int = VOSK_WORKERS,
+        factory: Optional[Callable[[int], Any]] = None,
+        model_path: Optional[str] = None,
+        chunk_seconds: float = VOSK_CHUNK_SECONDS
+    ):
+        """
+        Args:
+            workers: Число процессов
+            factory: Создание распознавателя по частоте (по умолчанию - Vosk);
+                передаётся в процесс, поэтому должна сериализоваться pickle
+            model_path: Путь к модели Vosk
+            chunk_seconds: Размер куска PCM
+        """
+        self.size = max(1, workers)
+        self.factory = factory or VoskRecognizerFactory(model_path)
+        self.chunk_bytes = int(chunk_seconds * PCM_SAMPLE_RATE) * PCM_SAMPLE_WIDTH
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._workers: List[_Worker] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._latencies_ms: deque = deque(maxlen=500)
+        self.stats = {"jobs": 0, "failures": 0, "restarts": 0,
+                      "audio_seconds": 0.0, "cpu_seconds": 0.0}
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """Запустить обработчики (заранее: модель загрузится до первого голосового)"""
+        if self._workers:
+            return
+        self._workers = [_Worker(i, self.context, self.factory) for i in range(self.size)]
+        self._idle = asyncio.Queue()
+        for worker in self._workers:
+            self._idle.put_nowait(worker)
+        logger.info(f"✅ Пул Vosk запущен: {self.size} процессов ({self.context.get_start_method()})")
+
+    def _restart(self, worker: _Worker) -> _Worker:
+        worker.kill()
+        fresh = _Worker(worker.index, self.context, self.factory)
+        self._workers[self._workers.index(worker)] = fresh
+        self.stats["restarts"] += 1
+        logger.warning(f"⚠️ Обработчик Vosk {worker.index} перезапущен")
+        return fresh
+
+    async def _chunks(self, audio: Union[bytes, AsyncIterable[bytes]]) -> AsyncIterable[bytes]:
+        """Куски PCM размера chunk_bytes из байтов или потока ffmpeg"""
+        if isinstance(audio, (bytes, bytearray)):
+            for offset in range(0, len(audio), self.chunk_bytes):
+                yield bytes(audio[offset:offset + self.chunk_bytes])
+            return
+        buffer = bytearray()
+        async for piece in audio:
+            buffer.extend(piece)
+            while len(buffer) >= self.chunk_bytes:
+                yield bytes(buffer[:self.chunk_bytes])
+                del buffer[:self.chunk_bytes]
+        if buffer:
+            yield bytes(buffer)
+
+    async def recognize(
+        self,
+        audio: Union[bytes, AsyncIterable[bytes]],
+        sample_rate: int = PCM_SAMPLE_RATE,
+        on_partial: Optional[Callable[[str], Awaitable[Any]]] = None
+    ) -> dict:
+        """
+        Распознать PCM s16le моно
+
+        Args:
+            audio: PCM целиком или поток кусков (audio_pipeline.iter_pcm)
+            sample_rate: Частота дискретизации
+            on_partial: Вызывается с текущим текстом, когда он меняется
+
+        Returns:
+            {"text", "audio_seconds", "cpu_seconds", "rtf", "worker"}
+        """
+        if not self._workers:
+            self.start()
+        started = time.perf_counter()
+        worker = await self._idle.get()
+        ok = False
+        try:
+            _, worker.recognizers = await worker.request(("start", sample_rate))
+
+            shown = ""
+            async for chunk in self._chunks(audio):
+                _, partial = await worker.request(("chunk", chunk))
+                if on_partial is not None and partial and partial != shown:
+                    shown = partial
+                    await on_partial(partial)
+
+            _, text, cpu_seconds, audio_seconds = await worker.request(("end",))
+            ok = True
+        except VoskPoolError:
+            self.stats["failures"] += 1
+            raise
+        finally:
+            if not ok:
+                # Распознаватель в середине сообщения (или процесс упал) - заменить
+                worker = self._restart(worker)
+            self._idle.put_nowait(worker)
+
+        worker.jobs += 1
+        worker.cpu_seconds += cpu_seconds
+        worker.audio_seconds += audio_seconds
+        self.stats["jobs"] += 1
+        self.stats["cpu_seconds"] += cpu_seconds
+        self.stats["audio_seconds"] += audio_seconds
+        self._latencies_ms.append((time.perf_counter() - started) * 1000)
+        return {
+            "text": text,
+            "audio_seconds": round(audio_seconds, 3),
+            "cpu_seconds": round(cpu_seconds, 4),
+            "rtf": round(cpu_seconds / audio_seconds, 4) if audio_seconds else 0.0,
+            "worker": worker.index
+        }
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+        self._idle = None
+
+    def get_stats(self) -> dict:
+        latencies = sorted(self._latencies_ms)
+        audio = self.stats["audio_seconds"]
+        return {
+            **self.stats,
+            "workers": self.size,
+            "recognizers": sum(w.recognizers for w in self._workers),
+            "audio_seconds": round(audio, 1),
+            "cpu_seconds": round(self.stats["cpu_seconds"], 2),
+            # RTF на ядро: < 1 - одно ядро распознаёт быстрее реального времени
+            "rtf_per_core": round(self.stats["cpu_seconds"] / audio, 4) if audio else 0.0,
+            "p50_latency_ms": round(latencies[len(latencies) // 2], 1) if latencies else 0.0,
+            "per_worker": [
+                {"worker": w.index, "jobs": w.jobs, "recognizers": w.recognizers,
+                 "rtf": round(w.cpu_seconds / w.audio_seconds, 4) if w.audio_seconds else 0.0}
+                for w in self._workers
+            ]
+        }
+
+
+_pool: Optional[VoskPool] = None
+
+
+def get_vosk_pool(model_path: Optional[str] = None) -> VoskPool:
+    """Общий пул распознавания (путь к модели передаётся при первом вызове)"""
+    global _pool
+    if _pool is None:
+        _pool = VoskPool(model_path=model_path)
+    return _pool
@@ -7,23 +7,104 @@ xAI Grok (web_search, x_search) - бесплатно и эффективнее!
 Этот модуль теперь используется только для:
 - Проверки статуса нормативов на docs.cntd.ru
 - Поиска новостей Минстроя на minstroyrf.gov.ru
+
+Запросы асинхронные (http_cache.py): нормативы проверяются одновременно,
+страницы кэшируются на диске с перепроверкой по ETag/Last-Modified, а
+результаты разбора запоминаются по хэшу страницы.
 """
 
-import requests
-from bs4 import BeautifulSoup
+import asyncio
 import logging
 import re
-from typing import Optional, Dict, List
+from collections import OrderedDict
+from typing import Optional, Dict, List, Tuple
 from datetime import datetime
+from urllib.parse import quote_plus
+
+from bs4 import BeautifulSoup
+
+from http_cache import get_fetcher
+from regulation_matcher import extract_regulation_codes
 
 logger = logging.getLogger(__name__)
 
+CNTD_BASE_URL = "https://docs.cntd.ru"
+
+# Сколько нормативов проверять за один поиск
+MAX_REGULATIONS_PER_SEARCH = 3
+
+
+# === МЕМОИЗАЦИЯ ПАРСИНГА ===
+# Ключ - SHA-256 страницы + параметры разбора: пока страница не изменилась,
+# BeautifulSoup не запускается повторно
+
+_PARSE_CACHE: "OrderedDict[Tuple, object]" = OrderedDict()
+_PARSE_CACHE_SIZE = 1024
+PARSE_STATS = {"hits": 0, "misses": 0}
+
+
+async def _memoized_parse(response, key: Tuple, parser):
+    """Результат parser(html) для страницы, разобранной один раз (чтение и разбор - в потоке)"""
+    cache_key = (response.digest,) + key
+    if cache_key in _PARSE_CACHE:
+        _PARSE_CACHE.move_to_end(cache_key)
+        PARSE_STATS["hits"] += 1
+        return _PARSE_CACHE[cache_key]
+
+    PARSE_STATS["misses"] += 1
+    result = await asyncio.to_thread(lambda: parser(response.text))
+    _PARSE_CACHE[cache_key] = result
+    if len(_PARSE_CACHE) > _PARSE_CACHE_SIZE:
+        _PARSE_CACHE.popitem(last=False)
+    return result
+
+
+def _run_sync(coro):
+    """Выполнить async функцию из синхронного кода (скрипты, тесты)"""
+    return asyncio.run(coro)
+
 
 # === ПАРСИНГ DOCS.CNTD.RU (БАЗА НОРМАТИВОВ) ===
 
-def search_regulation_cntd(regulation_code: str) -> Optional[Dict]:
+def _parse_cntd_search(html: str, regulation_code: str) -> Optional[Dict]:
+    """Разобрать страницу поиска docs.cntd.ru (первый результат)"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Ищем первый результат поиска
+    result = soup.find('div', class_='search-result-item')
+    if not result:
+        return None
+
+    # Извлекаем информацию
+    title_elem = result.find('a', class_='link')
+    if not title_elem:
+        return None
+
+    title = title_elem.get_text(strip=True)
+    link = CNTD_BASE_URL + title_elem['href']
+
+    # Ищем статус (действует/отменен)
+    status_elem = result.find('span', class_='status')
+    status = status_elem.get_text(strip=True) if status_elem else "неизвестен"
+
+    # Дата введения
+    date_pattern = r'с\s+(\d{2}\.\d{2}\.\d{4})'
+    date_match = re.search(date_pattern, result.get_text())
+    valid_from = date_match.group(1) if date_match else None
+
+    return {
+        "code": regulation_code,
+        "title": title,
+        "link": link,
+        "status": status,
+        "valid_from": valid_from,
+        "source": "docs.cntd.ru"
+    }
+
+
+async def search_regulation_cntd_async(regulation_code: str) -> Optional[Dict]:
     """
-    Поиск норматива на docs.cntd.ru
+    Поиск норматива на docs.cntd.ru (асинхронно, с дисковым кэшем)
 
     Args:
         regulation_code: Код норматива (например, "СП 63.13330.2018", "ГОСТ 31937-2011")
@@ -32,68 +113,69 @@ def search_regulation_cntd(regulation_code: str) -> Optional[Dict]:
         Dict с информацией о нормативе или None
     """
     try:
-        # Очищаем код норматива для поиска
-        search_query = regulation_code.replace(" ", "+")
-        search_url = f"https://docs.cntd.ru/search?q={search_query}"
+        search_url = f"{CNTD_BASE_URL}/search?q={quote_plus(regulation_code)}"
 
         logger.info(f"🔍 Поиск норматива: {regulation_code}")
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-
-        response = requests.get(search_url, headers=headers, timeout=10)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Ищем первый результат поиска
-        result = soup.find('div', class_='search-result-item')
-        if not result:
-            logger.warning(f"Норматив {regulation_code} не найден на docs.cntd.ru")
+        response = await get_fetcher().fetch(search_url)
+        if response is None:
             return None
 
-        # Извлекаем информацию
-        title_elem = result.find('a', class_='link')
-        if not title_elem:
+        parsed = await _memoized_parse(response, ("search", regulation_code),
+                                       lambda html: _parse_cntd_search(html, regulation_code))
+        if not parsed:
+            logger.warning(f"Норматив {regulation_code} не найден на docs.cntd.ru")
             return None
 
-        title = title_elem.get_text(strip=True)
-        link = "https://docs.cntd.ru" + title_elem['href']
-
-        # Ищем статус (действует/отменен)
-        status_elem = result.find('span', class_='status')
-        status = status_elem.get_text(strip=True) if status_elem else "неизвестен"
-
-        # Дата введения
-        date_pattern = r'с\s+(\d{2}\.\d{2}\.\d{4})'
-        date_match = re.search(date_pattern, result.get_text())
-        valid_from = date_match.group(1) if date_match else None
-
-        result_data = {
-            "code": regulation_code,
-            "title": title,
-            "link": link,
-            "status": status,
-            "valid_from": valid_from,
-            "source": "docs.cntd.ru",
-            "search_date": datetime.now().strftime("%Y-%m-%d %H:%M")
-        }
-
-        logger.info(f"✅ Найден: {title} ({status})")
+        result_data = {**parsed, "search_date": datetime.now().strftime("%Y-%m-%d %H:%M")}
+        logger.info(f"✅ Найден: {result_data['title']} ({result_data['status']})")
         return result_data
 
-    except requests.RequestException as e:
-        logger.error(f"Ошибка запроса к docs.cntd.ru: {e}")
-        return None
     except Exception as e:
         logger.error(f"Ошибка парсинга docs.cntd.ru: {e}")
         return None
 
 
-def get_regulation_text(regulation_url: str, max_chars: int = 5000) -> Optional[str]:
+def search_regulation_cntd(regulation_code: str) -> Optional[Dict]:
+    """Синхронная версия search_regulation_cntd_async (вне event loop)"""
+    return _run_sync(search_regulation_cntd_async(regulation_code))
+
+
+async def search_regulations_async(regulation_codes: List[str]) -> List[Optional[Dict]]:
+    """
+    Проверить несколько нормативов одновременно
+
+    Запросы идут параллельно, число одновременных запросов к одному хосту
+    ограничено HTTP_MAX_PER_HOST.
+
+    Returns:
+        Результаты в порядке regulation_codes (None для ненайденных)
+    """
+    return list(await asyncio.gather(*[search_regulation_cntd_async(code) for code in regulation_codes]))
+
+
+def _parse_regulation_text(html: str, max_chars: int) -> Optional[str]:
+    """Извлечь основной текст страницы норматива"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Ищем основной контент
+    content = soup.find('div', class_='document-content')
+    if not content:
+        content = soup.find('div', id='text')
+
+    if content:
+        text = content.get_text(separator='\n', strip=True)
+        # Ограничиваем размер
+        if len(text) > max_chars:
+            text = text[:max_chars] + "..."
+        return text
+
+    return None
+
+
+async def get_regulation_text_async(regulation_url: str, max_chars: int = 5000) -> Optional[str]:
     """
-    Получить текст норматива с docs.cntd.ru
+    Получить текст норматива с docs.cntd.ru (асинхронно, с дисковым кэшем)
 
     Args:
         regulation_url: URL страницы норматива
@@ -103,39 +185,50 @@ def get_regulation_text(regulation_url: str, max_chars: int = 5000) -> Optional[
         Текст норматива или None
     """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
+        response = await get_fetcher().fetch(regulation_url)
+        if response is None:
+            return None
+        return await _memoized_parse(response, ("text", max_chars),
+                                     lambda html: _parse_regulation_text(html, max_chars))
 
-        response = requests.get(regulation_url, headers=headers, timeout=10)
-        response.raise_for_status()
+    except Exception as e:
+        logger.error(f"Ошибка получения текста норматива: {e}")
+        return None
 
-        soup = BeautifulSoup(response.text, 'html.parser')
 
-        # Ищем основной контент
-        content = soup.find('div', class_='document-content')
-        if not content:
-            content = soup.find('div', id='text')
+def get_regulation_text(regulation_url: str, max_chars: int = 5000) -> Optional[str]:
+    """Синхронная версия get_regulation_text_async (вне event loop)"""
+    return _run_sync(get_regulation_text_async(regulation_url, max_chars))
 
-        if content:
-            text = content.get_text(separator='\n', strip=True)
-            # Ограничиваем размер
-            if len(text) > max_chars:
-                text = text[:max_chars] + "..."
-            return text
 
-        return None
+# === ПАРСИНГ MINSTROYRF.GOV.RU (НОВОСТИ И ИЗМЕНЕНИЯ) ===
 
-    except Exception as e:
-        logger.error(f"Ошибка получения текста норматива: {e}")
-        return None
+MINSTROY_NEWS_URL = "https://minstroyrf.gov.ru/trades/gospolitika/"
 
 
-# === ПАРСИНГ MINSTROYRF.GOV.RU (НОВОСТИ И ИЗМЕНЕНИЯ) ===
+def _parse_minstroy_news(html: str) -> List[Dict]:
+    """Все новости со страницы Минстроя (фильтрация по словам - отдельно)"""
+    soup = BeautifulSoup(html, 'html.parser')
 
-def search_minstroy_news(keywords: List[str], max_results: int = 3) -> List[Dict]:
+    items = []
+    for item in soup.find_all('div', class_='news-item'):
+        title_elem = item.find('a')
+        if not title_elem:
+            continue
+
+        date_elem = item.find('time')
+        items.append({
+            "title": title_elem.get_text(strip=True),
+            "date": date_elem.get_text(strip=True) if date_elem else "Дата неизвестна",
+            "link": "https://minstroyrf.gov.ru" + title_elem['href'],
+            "source": "minstroyrf.gov.ru"
+        })
+    return items
+
+
+async def search_minstroy_news_async(keywords: List[str], max_results: int = 3) -> List[Dict]:
     """
-    Поиск новостей на сайте Минстроя России
+    Поиск новостей на сайте Минстроя России (асинхронно, с дисковым кэшем)
 
     Args:
         keywords: Ключевые слова для поиска
@@ -145,47 +238,20 @@ def search_minstroy_news(keywords: List[str], max_results: int = 3) -> List[Dict
         List с новостями
     """
     try:
-        # URL раздела новостей Минстроя
-        news_url = "https://minstroyrf.gov.ru/trades/gospolitika/"
-
         logger.info(f"🔍 Поиск новостей Минстроя: {', '.join(keywords)}")
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-
-        response = requests.get(news_url, headers=headers, timeout=10)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, 'html.parser')
+        response = await get_fetcher().fetch(MINSTROY_NEWS_URL)
+        if response is None:
+            return []
 
-        # Ищем новости
-        news_items = soup.find_all('div', class_='news-item', limit=max_results * 2)
+        news_items = await _memoized_parse(response, ("minstroy",), _parse_minstroy_news)
 
-        results = []
-        for item in news_items:
-            if len(results) >= max_results:
-                break
-
-            title_elem = item.find('a')
-            if not title_elem:
-                continue
-
-            title = title_elem.get_text(strip=True)
-
-            # Проверяем наличие ключевых слов
-            if any(keyword.lower() in title.lower() for keyword in keywords):
-                date_elem = item.find('time')
-                date = date_elem.get_text(strip=True) if date_elem else "Дата неизвестна"
-
-                link = "https://minstroyrf.gov.ru" + title_elem['href']
-
-                results.append({
-                    "title": title,
-                    "date": date,
-                    "link": link,
-                    "source": "minstroyrf.gov.ru"
-                })
+        # Проверяем наличие ключевых слов
+        keywords_lower = [keyword.lower() for keyword in keywords]
+        results = [
+            item for item in news_items
+            if any(keyword in item["title"].lower() for keyword in keywords_lower)
+        ][:max_results]
 
         logger.info(f"✅ Найдено {len(results)} новостей Минстроя")
         return results
@@ -195,6 +261,11 @@ def search_minstroy_news(keywords: List[str], max_results: int = 3) -> List[Dict
         return []
 
 
+def search_minstroy_news(keywords: List[str], max_results: int = 3) -> List[Dict]:
+    """Синхронная версия search_minstroy_news_async (вне event loop)"""
+    return _run_sync(search_minstroy_news_async(keywords, max_results))
+
+
 # === ОПРЕДЕЛЕНИЕ НЕОБХОДИМОСТИ ПОИСКА НОРМАТИВОВ ===
 
 def should_perform_web_search(user_message: str) -> bool:
@@ -230,36 +301,9 @@ def should_perform_web_search(user_message: str) -> bool:
     return any(trigger in message_lower for trigger in search_triggers)
 
 
-def extract_regulation_codes(text: str) -> List[str]:
-    """
-    Извлечь коды нормативов из текста
-
-    Args:
-        text: Текст для анализа
-
-    Returns:
-        List с кодами нормативов
-    """
-    # Паттерны для разных типов нормативов
-    patterns = [
-        r'СП\s+[\d.]+\.[\d.]+',  # СП 63.13330.2018
-        r'ГОСТ\s+[РЕ\s]*[\d.-]+',  # ГОСТ 31937-2011, ГОСТ Р 57580
-        r'СНиП\s+[\d.-]+',  # СНиП 2.01.07-85
-        r'ППБ\s+[\d-]+',  # ППБ 01-03
-    ]
-
-    codes = []
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        codes.extend(matches)
-
-    # Убираем дубликаты
-    return list(set(codes))
-
-
 # === ГЛАВНАЯ ФУНКЦИЯ ПОИСКА ===
 
-def perform_web_search(user_message: str) -> Optional[str]:
+async def perform_web_search_async(user_message: str) -> Optional[str]:
     """
     Выполнить веб-поиск на основе сообщения пользователя
 
@@ -270,6 +314,8 @@ def perform_web_search(user_message: str) -> Optional[str]:
     1. Проверки статуса нормативов (СП, ГОСТ, СНиП) на docs.cntd.ru
     2. Поиска новостей Минстроя на minstroyrf.gov.ru
 
+    Все нормативы и новости запрашиваются одновременно.
+
     Args:
         user_message: Сообщение пользователя
 
@@ -281,15 +327,26 @@ def perform_web_search(user_message: str) -> Optional[str]:
 
     logger.info(f"🌐 Активирован веб-поиск нормативов для: {user_message[:100]}...")
 
+    regulation_codes = extract_regulation_codes(user_message)[:MAX_REGULATIONS_PER_SEARCH]
+    # Новости Минстроя - если упоминаются года 2025-2027
+    wants_news = any(year in user_message for year in ["2025", "2026", "2027"])
+
+    async def no_news():
+        return []
+
+    regulations, news = await asyncio.gather(
+        search_regulations_async(regulation_codes),
+        search_minstroy_news_async(["норматив", "СП", "строительство", "требования"], max_results=2)
+        if wants_news else no_news()
+    )
+
     results_text = "🌐 **РЕЗУЛЬТАТЫ ВЕБ-ПОИСКА:**\n\n"
     found_anything = False
 
-    # 1. Ищем упомянутые нормативы
-    regulation_codes = extract_regulation_codes(user_message)
+    # 1. Упомянутые нормативы
     if regulation_codes:
         results_text += "📚 **ПРОВЕРКА НОРМАТИВОВ:**\n"
-        for code in regulation_codes[:3]:  # Максимум 3 норматива
-            reg_info = search_regulation_cntd(code)
+        for reg_info in regulations:
             if reg_info:
                 results_text += f"\n• **{reg_info['code']}**\n"
                 results_text += f"  Название: {reg_info['title']}\n"
@@ -300,18 +357,15 @@ def perform_web_search(user_message: str) -> Optional[str]:
                 found_anything = True
         results_text += "\n"
 
-    # 2. Ищем новости Минстроя (если упоминаются года 2025-2027)
-    if any(year in user_message for year in ["2025", "2026", "2027"]):
-        keywords = ["норматив", "СП", "строительство", "требования"]
-        news = search_minstroy_news(keywords, max_results=2)
-        if news:
-            results_text += "📰 **АКТУАЛЬНЫЕ НОВОСТИ МИНСТРОЯ:**\n"
-            for item in news:
-                results_text += f"\n• **{item['title']}**\n"
-                results_text += f"  Дата: {item['date']}\n"
-                results_text += f"  Ссылка: {item['link']}\n"
-                found_anything = True
-            results_text += "\n"
+    # 2. Новости Минстроя
+    if news:
+        results_text += "📰 **АКТУАЛЬНЫЕ НОВОСТИ МИНСТРОЯ:**\n"
+        for item in news:
+            results_text += f"\n• **{item['title']}**\n"
+            results_text += f"  Дата: {item['date']}\n"
+            results_text += f"  Ссылка: {item['link']}\n"
+            found_anything = True
+        results_text += "\n"
 
     if not found_anything:
         return None
@@ -320,3 +374,8 @@ def perform_web_search(user_message: str) -> Optional[str]:
     results_text += "*Данные актуальны на момент поиска*"
 
     return results_text
+
+
+def perform_web_search(user_message: str) -> Optional[str]:
+    """Синхронная версия perform_web_search_async (вне event loop)"""
+    return _run_sync(perform_web_search_async(user_message))
@@ -13,6 +13,12 @@ WebSocket Прокси для Real-time Streaming с Gemini Live API
   Telegram Mini App (динамик)
 
 Задержка: < 100ms (сотые доли секунды!)
+
+Аудио между клиентом и прокси - бинарные кадры; base64 только в сторону
+Gemini, пачками (audio_relay.py). К клиенту - через буфер джиттера.
+Сессии - в общем менеджере live_sessions: лимит подключений, закрытие
+простаивающих, очередь отправки в Gemini (медленный Gemini притормаживает
+чтение от клиента)
 """
 
 import asyncio
@@ -21,9 +27,12 @@ import json
 import os
 import logging
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Optional
 from dotenv import load_dotenv
 
+from audio_relay import AudioRelay, get_relay_stats
+from live_sessions import LIVE_SESSIONS, LiveSession
+
 # Импорт универсального промта
 try:
     from optimized_prompts import UNIVERSAL_SYSTEM_PROMPT
@@ -42,8 +51,7 @@ logger = logging.getLogger(__name__)
 # URL Gemini Multimodal Live API
 GEMINI_LIVE_URL = "wss://generativelanguage.googleapis.com/ws/google.ai.generativelanguage.v1alpha.GenerativeService.BidiGenerateContent"
 
-# Активные сессии: {user_id: gemini_websocket}
-active_sessions: Dict[str, websockets.WebSocketServerProtocol] = {}
+BACKEND = "proxy"
 
 
 class GeminiLiveProxy:
@@ -63,6 +71,8 @@ class GeminiLiveProxy:
         self.client_ws = None
         self.is_connected = False
         self.session_id = None
+        self.relay: Optional[AudioRelay] = None
+        self.live: Optional[LiveSession] = None
 
     async def connect_to_gemini(self):
         """Подключение к Gemini Live API"""
@@ -161,41 +171,31 @@ class GeminiLiveProxy:
     async def bridge_client_to_gemini(self):
         """
         Поток: Telegram Mini App → Gemini
-        Передаём аудио от пользователя в Gemini
+        Передаём аудио от пользователя в Gemini (пачками, audio_relay)
         """
         try:
             async for message in self.client_ws:
-                if isinstance(message, str):
-                    # JSON команды (например, stop, interrupt)
-                    data = json.loads(message)
-
-                    if data.get("type") == "interrupt":
-                        # Пользователь перебил бота
-                        logger.info("⏸️ Interruption detected")
-                        # TODO: Отправить команду прерывания в Gemini
-
-                    elif data.get("type") == "stop":
-                        logger.info("🛑 Stop signal received")
-                        break
-
-                elif isinstance(message, bytes):
-                    # Аудио данные (binary)
-                    # Конвертируем в base64 для Gemini
-                    import base64
-                    audio_b64 = base64.b64encode(message).decode('utf-8')
-
-                    # Отправляем в Gemini Live API
-                    msg = {
-                        "realtime_input": {
-                            "media_chunks": [{
-                                "data": audio_b64,
-                                "mime_type": "audio/pcm"
-                            }]
-                        }
-                    }
+                self.live.touch()
+                if isinstance(message, bytes):
+                    # Аудио данные (binary) - base64 один раз на пачку
+                    await self.relay.client_audio(message)
+                    continue
+
+                # JSON команды (например, stop, interrupt)
+                data = json.loads(message)
 
-                    await self.gemini_ws.send(json.dumps(msg))
-                    logger.debug(f"🎤 → Gemini: {len(message)} bytes")
+                if data.get("type") == "interrupt":
+                    # Пользователь перебил бота: неотправленный ответ не нужен
+                    dropped = self.relay.interrupt()
+                    logger.info(f"⏸️ Interruption detected (сброшено {dropped} байт)")
+
+                elif data.get("type") == "end_turn":
+                    await self.relay.end_of_speech()
+                    self.live.mark_request()
+
+                elif data.get("type") == "stop":
+                    logger.info("🛑 Stop signal received")
+                    break
 
         except websockets.exceptions.ConnectionClosed:
             logger.info("📱 Client disconnected")
@@ -205,14 +205,12 @@ class GeminiLiveProxy:
     async def bridge_gemini_to_client(self):
         """
         Поток: Gemini → Telegram Mini App
-        Передаём аудио ответы от Gemini пользователю
+        Передаём аудио ответы от Gemini пользователю (буфер джиттера, audio_relay)
         """
         try:
             async for message in self.gemini_ws:
-                # Логируем RAW сообщение для отладки
-                logger.debug(f"📩 Gemini RAW: {message[:500]}...")
-
-                data = json.loads(message)
+                # Аудио декодируется из base64 и уходит в буфер джиттера
+                data = self.relay.server_message(message)
 
                 # Setup confirmation
                 if "setupComplete" in data:
@@ -229,29 +227,17 @@ class GeminiLiveProxy:
                         parts = server_content["modelTurn"].get("parts", [])
 
                         for part in parts:
-                            # Аудио данные
-                            if "inlineData" in part:
-                                audio_b64 = part["inlineData"]["data"]
-
-                                # Декодируем из base64
-                                import base64
-                                audio_bytes = base64.b64decode(audio_b64)
-
-                                # Отправляем бинарные данные клиенту
-                                await self.client_ws.send(audio_bytes)
-                                logger.debug(f"🔊 → Client: {len(audio_bytes)} bytes")
-
                             # Текстовый ответ (для дебага/транскрипции)
                             if "text" in part:
                                 text = part["text"]
                                 logger.info(f"💬 Gemini says: {text[:100]}...")
 
-                                # Отправляем транскрипцию клиенту
-                                await self.client_ws.send(json.dumps({
+                                # Транскрипция - клиенту вслед за своим аудио
+                                self.relay.client_event({
                                     "type": "transcript",
                                     "text": text,
                                     "role": "bot"
-                                }))
+                                })
 
                             # Function call (для обработки на бэкенде)
                             if "functionCall" in part:
@@ -270,12 +256,12 @@ class GeminiLiveProxy:
                                         }]
                                     }
                                 }
-                                await self.gemini_ws.send(json.dumps(response_msg))
+                                await self.send_upstream(json.dumps(response_msg))
 
-                    # Turn complete
+                    # Turn complete - после того, как клиент получит всё аудио ответа
                     if "turnComplete" in server_content:
                         logger.debug("✅ Turn complete")
-                        await self.client_ws.send(json.dumps({"type": "turn_complete"}))
+                        self.relay.client_event({"type": "turn_complete"})
 
                 # Ошибки
                 if "error" in data:
@@ -321,6 +307,20 @@ class GeminiLiveProxy:
 
         return {"error": "Unknown function"}
 
+    async def send_upstream(self, message: str) -> bool:
+        """Сообщение в Gemini через очередь сессии (False - Gemini не успевает)"""
+        return await self.live.send(self.gemini_ws.send, message, nbytes=len(message))
+
+    async def stop(self):
+        """Закрыть оба соединения (менеджер сессий: простой, вытеснение, ошибка)"""
+        for ws in (self.gemini_ws, self.client_ws):
+            if ws is not None:
+                try:
+                    await ws.close()
+                except Exception as e:
+                    logger.debug(f"Закрытие соединения: {e}")
+        self.is_connected = False
+
     async def start_bridge(self, client_ws):
         """Запуск двустороннего моста"""
         self.client_ws = client_ws
@@ -334,12 +334,26 @@ class GeminiLiveProxy:
             }))
             return
 
-        # Запускаем оба потока одновременно
+        self.relay = AudioRelay(
+            send_upstream=self.send_upstream,
+            send_audio=self.client_ws.send,
+            send_text=self.client_ws.send,
+            on_audio=self.live.received
+        )
+
+        # Запускаем оба потока одновременно; сессия заканчивается с любым из них
         try:
-            await asyncio.gather(
-                self.bridge_client_to_gemini(),
-                self.bridge_gemini_to_client()
-            )
+            async with self.relay:
+                bridges = [
+                    asyncio.create_task(self.bridge_client_to_gemini()),
+                    asyncio.create_task(self.bridge_gemini_to_client())
+                ]
+                try:
+                    await asyncio.wait(bridges, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for task in bridges:
+                        task.cancel()
+                    await asyncio.gather(*bridges, return_exceptions=True)
         finally:
             # Закрываем соединение с Gemini
             if self.gemini_ws:
@@ -380,9 +394,16 @@ async def websocket_handler(websocket):
         await websocket.close()
         return
 
-    # Создаём прокси для этого пользователя
+    # Создаём прокси для этого пользователя (прежнее подключение закрывается)
     proxy = GeminiLiveProxy(api_key)
-    active_sessions[user_id] = websocket
+    proxy.live = await LIVE_SESSIONS.open((BACKEND, user_id), BACKEND, lambda: proxy)
+    if proxy.live is None:
+        await websocket.send(json.dumps({
+            "type": "error",
+            "message": "Server busy: too many voice sessions"
+        }))
+        await websocket.close()
+        return
 
     try:
         # Запускаем мост между клиентом и Gemini
@@ -390,10 +411,11 @@ async def websocket_handler(websocket):
     except Exception as e:
         logger.error(f"❌ Error in session {user_id}: {e}")
     finally:
-        # Удаляем из активных сессий
-        if user_id in active_sessions:
-            del active_sessions[user_id]
+        # Удаляем из активных сессий (если её уже не заменило новое подключение)
+        await LIVE_SESSIONS.release(proxy.live, "disconnected")
         logger.info(f"📱 Client disconnected: {user_id}")
+        logger.info(f"📊 Аудио: {get_relay_stats()}")
+        logger.info(f"📊 Голосовые сессии: {LIVE_SESSIONS.get_stats()}")
 
 
 async def main():
@@ -408,8 +430,12 @@ async def main():
     logger.info(f"🎤 Ready for real-time streaming!")
 
     # Запускаем сервер
-    async with websockets.serve(websocket_handler, host, port):
-        await asyncio.Future()  # Работает вечно
+    LIVE_SESSIONS.start()
+    try:
+        async with websockets.serve(websocket_handler, host, port):
+            await asyncio.Future()  # Работает вечно
+    finally:
+        await LIVE_SESSIONS.stop()
 
 
 if __name__ == "__main__":
@@ -1,23 +1,216 @@
 """
 Клиент для работы с xAI Grok API без зависимости от OpenAI
+
+Клиент держит долгоживущий пул соединений (keep-alive, HTTP/2 если установлен h2),
+поэтому TLS handshake не повторяется на каждый запрос к Grok.
+System-промпт отправляется байт в байт одинаковым с заголовком x-grok-conv-id,
+чтобы xAI переиспользовал кэш префикса (учёт - prompt_cache.PROMPT_CACHE_STATS).
 """
 import httpx
 import os
+import json
+import time
+import asyncio
 import logging
+from collections import deque
 from typing import List, Dict, Any, Optional
 
+from prompt_cache import PROMPT_CACHE_STATS, stable_messages, xai_cache_headers
+
 logger = logging.getLogger(__name__)
 
+# HTTP/2 требует пакет h2 (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Настройки пула соединений (можно переопределить через переменные окружения)
+XAI_BASE_URL = os.getenv("XAI_BASE_URL", "https://api.x.ai/v1")
+XAI_MAX_CONNECTIONS = int(os.getenv("XAI_MAX_CONNECTIONS", "50"))
+XAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("XAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+XAI_KEEPALIVE_EXPIRY = float(os.getenv("XAI_KEEPALIVE_EXPIRY", "60"))
+XAI_HTTP2 = os.getenv("XAI_HTTP2", "true").lower() == "true"
+
+
 class XAIClient:
-    """Клиент для xAI Grok API"""
+    """Клиент для xAI Grok API с постоянным пулом соединений"""
 
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        max_connections: int = XAI_MAX_CONNECTIONS,
+        max_keepalive_connections: int = XAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = XAI_KEEPALIVE_EXPIRY,
+        http2: bool = XAI_HTTP2,
+        timeout: float = 120
+    ):
         self.api_key = api_key
-        self.base_url = "https://api.x.ai/v1"
+        self.base_url = (base_url or XAI_BASE_URL).rstrip("/")
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.timeout = timeout
+
+        # Пулы создаются лениво: синхронный (для run_in_executor) и асинхронный
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop = None
+        # Закрытие пулов прежних event loop (ссылки - чтобы задачи не собрал GC)
+        self._closing: set = set()
+
+        # Метрики задержки по запросам
+        self.metrics = {
+            "requests": 0,
+            "errors": 0,
+            "total_latency_ms": 0.0,
+            "last_latency_ms": 0.0
+        }
+        self._latencies = deque(maxlen=500)
+
+    # ========================================
+    # ЖИЗНЕННЫЙ ЦИКЛ ПУЛА
+    # ========================================
+
+    def _get_client(self) -> httpx.Client:
+        """Синхронный клиент с пулом соединений"""
+        if self._client is None:
+            self._client = httpx.Client(
+                headers=self.headers,
+                limits=self.limits,
+                http2=self.http2,
+                timeout=self.timeout
+            )
+        return self._client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Асинхронный клиент с пулом соединений (привязан к текущему event loop)"""
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            # Пул asyncio нельзя переиспользовать в другом event loop - прежний закрывается
+            if self._async_client is not None:
+                task = asyncio.ensure_future(self._aclose_stale(self._async_client))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+            self._async_client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=self.limits,
+                http2=self.http2,
+                timeout=self.timeout
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    @staticmethod
+    async def _aclose_stale(client: httpx.AsyncClient):
+        """Закрыть пул прежнего event loop (его сокеты могут быть уже закрыты вместе с loop)"""
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug(f"Пул прежнего event loop закрыт с ошибкой: {e}")
+
+    async def start(self):
+        """Создать асинхронный пул при старте бота"""
+        self._get_async_client()
+        logger.info(
+            f"✅ xAI пул соединений готов (HTTP/{'2' if self.http2 else '1.1'}, "
+            f"max={self.limits.max_connections}, keep-alive={self.limits.max_keepalive_connections})"
+        )
+
+    async def aclose(self):
+        """Закрыть оба пула при остановке бота"""
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+            self._async_loop = None
+        self.close()
+
+    def close(self):
+        """Закрыть синхронный пул"""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    # ========================================
+    # МЕТРИКИ
+    # ========================================
+
+    def _record_latency(self, started: float, error: bool = False):
+        """Записать задержку запроса"""
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.metrics["requests"] += 1
+        self.metrics["total_latency_ms"] += latency_ms
+        self.metrics["last_latency_ms"] = latency_ms
+        if error:
+            self.metrics["errors"] += 1
+        self._latencies.append(latency_ms)
+
+    def get_metrics(self) -> dict:
+        """Статистика запросов: количество, ошибки, задержка (средняя, p50, p95)"""
+        latencies = sorted(self._latencies)
+        requests = self.metrics["requests"]
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        return {
+            "requests": requests,
+            "errors": self.metrics["errors"],
+            "avg_latency_ms": round(self.metrics["total_latency_ms"] / requests, 1) if requests else 0.0,
+            "last_latency_ms": round(self.metrics["last_latency_ms"], 1),
+            "p50_latency_ms": round(percentile(0.5), 1),
+            "p95_latency_ms": round(percentile(0.95), 1),
+            "http2": self.http2
+        }
+
+    # ========================================
+    # ЗАПРОСЫ
+    # ========================================
+
+    def _build_payload(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        search_parameters: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Сформировать тело запроса chat/completions"""
+        payload = {
+            "model": model,
+            "messages": stable_messages(messages),
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+
+        # Добавляем tools если переданы
+        if search_parameters:
+            payload["search_parameters"] = search_parameters
+
+        return payload
+
+    @staticmethod
+    def _raise_http_error(e: httpx.HTTPStatusError):
+        """Преобразовать HTTP ошибку xAI в понятное пользователю сообщение"""
+        if e.response.status_code == 429:
+            raise Exception("⚠️ Превышен лимит запросов к xAI API. Попробуйте через минуту.")
+        elif e.response.status_code == 401:
+            raise Exception("❌ Неверный API ключ xAI. Проверьте XAI_API_KEY в настройках.")
+        else:
+            raise Exception(f"⚠️ Ошибка xAI API: {e.response.status_code}")
 
     def chat_completions_create(
         self,
@@ -43,35 +236,28 @@ class XAIClient:
             Ответ от API в формате словаря
         """
         url = f"{self.base_url}/chat/completions"
+        payload = self._build_payload(model, messages, max_tokens, temperature, search_parameters)
 
-        payload = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-
-        # Добавляем tools если переданы
-        if search_parameters:
-            payload["search_parameters"] = search_parameters
-
+        started = time.perf_counter()
         try:
-            with httpx.Client(timeout=timeout) as client:
-                response = client.post(url, json=payload, headers=self.headers)
-                response.raise_for_status()
-                return response.json()
+            response = self._get_client().post(
+                url, json=payload, headers=xai_cache_headers(payload["messages"]), timeout=timeout
+            )
+            response.raise_for_status()
+            result = response.json()
+            self._record_latency(started)
+            PROMPT_CACHE_STATS.record_xai(model, result.get("usage"), self.metrics["last_latency_ms"])
+            return result
         except httpx.TimeoutException:
+            self._record_latency(started, error=True)
             logger.error(f"xAI API timeout after {timeout}s")
             raise Exception("⚠️ Превышено время ожидания ответа от AI. Попробуйте еще раз.")
         except httpx.HTTPStatusError as e:
+            self._record_latency(started, error=True)
             logger.error(f"xAI API HTTP error: {e.response.status_code} - {e.response.text}")
-            if e.response.status_code == 429:
-                raise Exception("⚠️ Превышен лимит запросов к xAI API. Попробуйте через минуту.")
-            elif e.response.status_code == 401:
-                raise Exception("❌ Неверный API ключ xAI. Проверьте XAI_API_KEY в настройках.")
-            else:
-                raise Exception(f"⚠️ Ошибка xAI API: {e.response.status_code}")
+            self._raise_http_error(e)
         except Exception as e:
+            self._record_latency(started, error=True)
             logger.error(f"Unexpected xAI API error: {e}")
             raise Exception("❌ Неожиданная ошибка при обращении к xAI API.")
 
@@ -88,35 +274,28 @@ class XAIClient:
         Асинхронная версия chat_completions_create
         """
         url = f"{self.base_url}/chat/completions"
+        payload = self._build_payload(model, messages, max_tokens, temperature, search_parameters)
 
-        payload = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature
-        }
-
-        # Добавляем tools если переданы
-        if search_parameters:
-            payload["search_parameters"] = search_parameters
-
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.post(url, json=payload, headers=self.headers)
-                response.raise_for_status()
-                return response.json()
+            response = await self._get_async_client().post(
+                url, json=payload, headers=xai_cache_headers(payload["messages"]), timeout=timeout
+            )
+            response.raise_for_status()
+            result = response.json()
+            self._record_latency(started)
+            PROMPT_CACHE_STATS.record_xai(model, result.get("usage"), self.metrics["last_latency_ms"])
+            return result
         except httpx.TimeoutException:
+            self._record_latency(started, error=True)
             logger.error(f"xAI API timeout after {timeout}s")
             raise Exception("⚠️ Превышено время ожидания ответа от AI. Попробуйте еще раз.")
         except httpx.HTTPStatusError as e:
+            self._record_latency(started, error=True)
             logger.error(f"xAI API HTTP error: {e.response.status_code} - {e.response.text}")
-            if e.response.status_code == 429:
-                raise Exception("⚠️ Превышен лимит запросов к xAI API. Попробуйте через минуту.")
-            elif e.response.status_code == 401:
-                raise Exception("❌ Неверный API ключ xAI. Проверьте XAI_API_KEY в настройках.")
-            else:
-                raise Exception(f"⚠️ Ошибка xAI API: {e.response.status_code}")
+            self._raise_http_error(e)
         except Exception as e:
+            self._record_latency(started, error=True)
             logger.error(f"Unexpected xAI API error: {e}")
             raise Exception("❌ Неожиданная ошибка при обращении к xAI API.")
 
@@ -126,7 +305,8 @@ class XAIClient:
         messages: List[Dict[str, str]],
         max_tokens: int = 1000,
         temperature: float = 0.7,
-        timeout: int = 120
+        timeout: int = 120,
+        search_parameters: Optional[Dict[str, Any]] = None
     ):
         """
         Streaming версия chat completions (асинхронный генератор)
@@ -136,55 +316,82 @@ class XAIClient:
         """
         url = f"{self.base_url}/chat/completions"
 
-        payload = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "stream": True
-        }
+        payload = self._build_payload(model, messages, max_tokens, temperature, search_parameters)
+        payload["stream"] = True
+        # Последний чанк несёт usage (в т.ч. cached_tokens)
+        payload["stream_options"] = {"include_usage": True}
 
+        started = time.perf_counter()
+        first_token_ms = None
+        usage = None
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                async with client.stream('POST', url, json=payload, headers=self.headers) as response:
-                    response.raise_for_status()
-
-                    async for line in response.aiter_lines():
-                        if line.startswith('data: '):
-                            data = line[6:]  # Убираем 'data: '
-
-                            if data == '[DONE]':
-                                break
-
-                            try:
-                                import json
-                                chunk = json.loads(data)
-
-                                # Извлекаем текст из чанка
-                                if 'choices' in chunk and len(chunk['choices']) > 0:
-                                    delta = chunk['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    if content:
-                                        yield content
-                            except json.JSONDecodeError:
-                                continue
+            client = self._get_async_client()
+            headers = xai_cache_headers(payload["messages"])
+            async with client.stream('POST', url, json=payload, headers=headers, timeout=timeout) as response:
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    if line.startswith('data: '):
+                        data = line[6:]  # Убираем 'data: '
+
+                        if data == '[DONE]':
+                            break
+
+                        try:
+                            chunk = json.loads(data)
+                            usage = chunk.get('usage') or usage
+
+                            # Извлекаем текст из чанка
+                            if 'choices' in chunk and len(chunk['choices']) > 0:
+                                delta = chunk['choices'][0].get('delta', {})
+                                content = delta.get('content', '')
+                                if content:
+                                    if first_token_ms is None:
+                                        first_token_ms = (time.perf_counter() - started) * 1000
+                                    yield content
+                        except json.JSONDecodeError:
+                            continue
+
+            self._record_latency(started)
+            # Для потока важна задержка до первого токена
+            PROMPT_CACHE_STATS.record_xai(model, usage, first_token_ms)
 
         except httpx.TimeoutException:
+            self._record_latency(started, error=True)
             logger.error(f"xAI API streaming timeout after {timeout}s")
             raise Exception("⚠️ Превышено время ожидания ответа от AI.")
         except httpx.HTTPStatusError as e:
+            self._record_latency(started, error=True)
             logger.error(f"xAI API streaming HTTP error: {e.response.status_code}")
-            if e.response.status_code == 429:
-                raise Exception("⚠️ Превышен лимит запросов к xAI API. Попробуйте через минуту.")
-            elif e.response.status_code == 401:
-                raise Exception("❌ Неверный API ключ xAI.")
-            else:
-                raise Exception(f"⚠️ Ошибка xAI API: {e.response.status_code}")
+            self._raise_http_error(e)
         except Exception as e:
+            self._record_latency(started, error=True)
             logger.error(f"Unexpected xAI streaming error: {e}")
             raise Exception("❌ Ошибка при получении ответа от AI.")
 
 
+# Общие клиенты по API ключу - один пул соединений на процесс
+_shared_clients: Dict[str, XAIClient] = {}
+
+
+def get_shared_xai_client(api_key: Optional[str] = None) -> Optional[XAIClient]:
+    """
+    Получить общий XAIClient (создаётся один раз на API ключ)
+
+    Args:
+        api_key: API ключ xAI (по умолчанию XAI_API_KEY из окружения)
+
+    Returns:
+        XAIClient или None, если ключ не задан
+    """
+    api_key = api_key or os.getenv("XAI_API_KEY")
+    if not api_key:
+        return None
+    if api_key not in _shared_clients:
+        _shared_clients[api_key] = XAIClient(api_key=api_key)
+    return _shared_clients[api_key]
+
+
 def call_xai_with_retry(client: XAIClient, model: str, messages: List[Dict[str, str]],
                         max_tokens: int = 1000, temperature: float = 0.7,
                         max_retries: int = 3, search_parameters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
@@ -203,8 +410,6 @@ def call_xai_with_retry(client: XAIClient, model: str, messages: List[Dict[str,
     Returns:
         Ответ от API
     """
-    import time
-
     for attempt in range(max_retries):
         try:
             return client.chat_completions_create(
@@ -227,3 +432,35 @@ def call_xai_with_retry(client: XAIClient, model: str, messages: List[Dict[str,
                 raise
 
     raise Exception("⚠️ xAI API временно недоступен после нескольких попыток.")
+
+
+async def call_xai_with_retry_async(client: XAIClient, model: str, messages: List[Dict[str, str]],
+                                    max_tokens: int = 1000, temperature: float = 0.7,
+                                    max_retries: int = 3, search_parameters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Асинхронный вызов xAI API с retry logic и exponential backoff
+
+    В отличие от call_xai_with_retry не блокирует поток: ожидание между
+    попытками идёт через asyncio.sleep, запрос - через асинхронный пул.
+    """
+    for attempt in range(max_retries):
+        try:
+            return await client.chat_completions_create_async(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                search_parameters=search_parameters
+            )
+        except Exception as e:
+            error_message = str(e)
+
+            # Если это rate limit, пробуем еще раз
+            if "лимит" in error_message.lower() and attempt < max_retries - 1:
+                wait_time = 2 ** attempt  # 1s, 2s, 4s
+                logger.warning(f"xAI API rate limit hit (attempt {attempt + 1}/{max_retries}), waiting {wait_time}s")
+                await asyncio.sleep(wait_time)
+            else:
+                raise
+
+    raise Exception("⚠️ xAI API временно недоступен после нескольких попыток.")